@@ -23,10 +23,23 @@ approximate frequency at which values will be sampled.  A sample is considered
 to have been taken at the time when the monitor function *returns*, not when
 it is called.
 
-The approximate average duration of calls to the monitor function is taken into
-account, so that samples are obtained on as close to interval_ms boundaries as
-can be.  A poll interval of 0 will cause the monitor function to be called in a
-tight loop with no delays.
+All the monitors of a test are run by a single scheduler thread.  Monitor
+functions are called on interval_ms boundaries from the start of the phase, so
+slow samples do not make later ones drift; if a call overruns one or more
+boundaries, those samples are skipped.  A poll interval of 0 will cause the
+monitor function to be called in a tight loop with no delays (other monitors
+are still sampled when due).  Monitors sharing a plug are sampled as a batch:
+when one is due, the others due within a few milliseconds are sampled right
+after it, so eg a meter is queried for all its measurements at once.  Samples
+are written to the measurement in batches, at most every 100 milliseconds, and
+when the phase ends.
+
+For monitors sampling at high rates, eg at kHz, high_rate=True buffers numeric
+samples in preallocated arrays and commits them in blocks, optionally averaging
+every `downsample` samples.  The running test state (eg in the station server)
+then carries a summary of the samples instead of all of them: the min, max and
+mean over at most `live_buckets` periods of the phase.  The test record keeps
+the committed samples.
 
 Example:
 
@@ -43,10 +56,15 @@ def MyPhase(test):
 # second while MyPhase was executing.
 """
 
+import array
 import functools
+import heapq
 import inspect
+import itertools
+import math
+import threading
 import time
-from typing import Any, Callable, Dict, Optional, Text
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Text, Tuple
 
 import openhtf
 from openhtf import plugs
@@ -56,84 +74,482 @@ from openhtf.core import test_state as core_test_state
 from openhtf.util import threads
 from openhtf.util import units as uom
 
+# Samples are buffered and written to their measurement (notifying the test
+# state once) at most this often.
+_COMMIT_INTERVAL_S = 0.1
+# How long to wait for the scheduler to stop, or for a sample of a monitor
+# being stopped to finish, before killing a blocked sample.
+_STOP_TIMEOUT_S = 1.0
+# Monitors sharing a plug with a monitor being sampled are sampled with it if
+# they are due within this time (or half their interval, if shorter).
+_BATCH_WINDOW_S = 0.01
+# Defaults of the high-rate mode, in samples and buckets.
+_DEFAULT_BUFFER_SIZE = 4096
+_DEFAULT_LIVE_BUCKETS = 100
 
-class _MonitorThread(threads.KillableThread):
-  """Background thread that runs a monitor."""
 
-  daemon = True
+class _Monitor(object):
+  """A monitor running during a phase, and its buffered samples."""
 
   def __init__(self, measurement_name: Text,
                monitor_desc: phase_descriptor.PhaseDescriptor,
                extra_kwargs: Dict[Any, Any],
                test_state: core_test_state.TestState, interval_ms: int):
-    super(_MonitorThread,
-          self).__init__(name='%s_MonitorThread' % measurement_name)
     self.measurement_name = measurement_name
-    self.monitor_desc = monitor_desc
     self.test_state = test_state
-    self.interval_ms = interval_ms
-    self.extra_kwargs = extra_kwargs
-
-  def get_value(self) -> Any:
-    argspec = inspect.getfullargspec(self.monitor_desc.func)
-    argspec_args = argspec.args
-    argspec_keywords = argspec.varkw
-    if argspec_keywords:
+    self.interval_s = interval_ms / 1000.0
+    self.start_time = time.monotonic()
+    self.sample_count = 0
+    self.sampling = False
+    self.plug_types = frozenset(plug.cls for plug in monitor_desc.plugs)
+    self._phase = monitor_desc.with_args(
+        **self._monitor_kwargs(monitor_desc, extra_kwargs))
+    self._lock = threading.Lock()
+    self._pending = []  # type: List[Tuple[float, Any]]
+    self._last_commit_time = self.start_time
+
+  @staticmethod
+  def _monitor_kwargs(monitor_desc: phase_descriptor.PhaseDescriptor,
+                      extra_kwargs: Dict[Any, Any]) -> Dict[Any, Any]:
+    argspec = inspect.getfullargspec(monitor_desc.func)
+    if argspec.varkw:
       # Monitor phase takes **kwargs, so just pass everything in.
-      kwargs = self.extra_kwargs
-    else:
-      # Only pass in args that the monitor phase takes.
-      kwargs = {
-          arg: val for arg, val in self.extra_kwargs if arg in argspec_args
-      }
-    return self.monitor_desc.with_args(**kwargs)(self.test_state)
+      return extra_kwargs
+    # Only pass in args that the monitor phase takes.
+    return {
+        arg: val for arg, val in extra_kwargs.items() if arg in argspec.args
+    }
 
-  def _thread_proc(self):
-    measurement = getattr(self.test_state.test_api.measurements,
-                          self.measurement_name)
-    start_time = time.time()
+  def deadline(self) -> float:
+    """Returns the time of the next sample, on interval boundaries."""
+    return self.start_time + self.sample_count * self.interval_s
+
+  def sample(self) -> None:
+    """Takes a sample and schedules the next one."""
+    value = self._phase(self.test_state)
+    post_time = time.monotonic()
+    self._add_sample((post_time - self.start_time) * 1000, value)
+    if not self.interval_s:
+      return
+    # Schedule against absolute deadlines so that the time taken by samples
+    # does not accumulate, skipping the deadlines that already passed.
+    next_sample = int((post_time - self.start_time) / self.interval_s) + 1
+    skipped = next_sample - self.sample_count - 1
+    if skipped > 0:
+      self.test_state.state_logger.warning(
+          'Monitor for "%s" skipping %s sample(s).', self.measurement_name,
+          skipped)
+    self.sample_count = max(next_sample, self.sample_count + 1)
+
+  def _add_sample(self, timestamp_ms: float, value: Any) -> None:
+    with self._lock:
+      self._pending.append((timestamp_ms, value))
+
+  def commit(self, force: bool = False) -> None:
+    """Writes the buffered samples to the measurement, notifying once."""
+    with self._lock:
+      now = time.monotonic()
+      if not self._pending or (
+          not force and now - self._last_commit_time < _COMMIT_INTERVAL_S):
+        return
+      pending, self._pending = self._pending, []
+      self._last_commit_time = now
+      measured_value = self._get_measured_value(len(pending))
+      if measured_value is None:
+        return
+      self._set_values(measured_value, pending)
+      if measured_value.notify_value_set:
+        measured_value.notify_value_set()
+
+  def close(self) -> None:
+    """Commits the remaining samples once the monitor is no longer sampled."""
+    self.commit(force=True)
+
+  def _get_measured_value(
+      self, sample_count: int) -> Optional[measurements.DimensionedMeasuredValue]:
+    try:
+      return getattr(self.test_state.test_api.measurements,
+                     self.measurement_name)
+    except measurements.NotAMeasurementError:
+      self.test_state.state_logger.exception(
+          'Dropping %s sample(s) of monitor for "%s".', sample_count,
+          self.measurement_name)
+      return None
+
+  @staticmethod
+  def _set_values(measured_value: measurements.DimensionedMeasuredValue,
+                  samples: Iterable[Tuple[float, Any]]) -> None:
+    """Sets the values of samples without notifying the test state."""
+    notify_value_set = measured_value.notify_value_set
+    measured_value.notify_value_set = None
+    try:
+      for timestamp_ms, value in samples:
+        measured_value[timestamp_ms] = value
+    finally:
+      measured_value.notify_value_set = notify_value_set
+
+
+class _LiveSummary(object):
+  """Min, max and mean of the samples of a monitor over time buckets.
+
+  Each committed block of samples adds a bucket; once there are more than
+  max_buckets, adjacent buckets are merged so the summary keeps covering the
+  whole phase at a coarser resolution.
+  """
+
+  def __init__(self, max_buckets: int):
+    self.max_buckets = max_buckets
+    # Each bucket is [start_ms, end_ms, count, min, max, sum].
+    self._buckets = []  # type: List[List[float]]
+
+  def add_block(self, timestamps: Sequence[float],
+                values: Sequence[float]) -> None:
+    self._buckets.append([
+        timestamps[0], timestamps[-1],
+        len(values),
+        min(values),
+        max(values),
+        math.fsum(values)
+    ])
+    if len(self._buckets) > self.max_buckets:
+      merged = []
+      for idx in range(0, len(self._buckets) - 1, 2):
+        first, second = self._buckets[idx], self._buckets[idx + 1]
+        merged.append([
+            first[0], second[1], first[2] + second[2],
+            min(first[3], second[3]),
+            max(first[4], second[4]), first[5] + second[5]
+        ])
+      if len(self._buckets) % 2:
+        merged.append(self._buckets[-1])
+      self._buckets = merged
+
+  def as_base_types(self) -> List[Dict[Text, Any]]:
+    return [{
+        'start_ms': start_ms,
+        'end_ms': end_ms,
+        'count': count,
+        'min': minimum,
+        'max': maximum,
+        'mean': total / count,
+    } for start_ms, end_ms, count, minimum, maximum, total in self._buckets]
+
+
+class _HighRateMonitor(_Monitor):
+  """A monitor buffering numeric samples in preallocated arrays.
+
+  Samples are committed to the measurement in blocks, when the buffer is full
+  or every commit interval, optionally averaging every `downsample` samples.
+  The running test state only carries a _LiveSummary of the samples.
+  """
+
+  def __init__(self, measurement_name: Text,
+               monitor_desc: phase_descriptor.PhaseDescriptor,
+               extra_kwargs: Dict[Any, Any],
+               test_state: core_test_state.TestState, interval_ms: int,
+               buffer_size: int, downsample: int, live_buckets: int):
+    super(_HighRateMonitor, self).__init__(measurement_name, monitor_desc,
+                                           extra_kwargs, test_state,
+                                           interval_ms)
+    self.downsample = downsample
+    self._phase_state = test_state.running_phase_state
+    self._timestamps = array.array('d', bytes(8 * buffer_size))
+    self._values = array.array('d', bytes(8 * buffer_size))
+    self._size = 0
+    self._summary = _LiveSummary(live_buckets)
+    # Samples of an incomplete downsampling group: last timestamp, count, sum.
+    self._group = [0.0, 0, 0.0]
+
+  def _add_sample(self, timestamp_ms: float, value: Any) -> None:
+    with self._lock:
+      # Raises TypeError for values that are not numbers.
+      self._values[self._size] = value
+      self._timestamps[self._size] = timestamp_ms
+      self._size += 1
+      full = self._size == len(self._values)
+    if full:
+      self.commit(force=True)
+
+  def commit(self, force: bool = False) -> None:
+    with self._lock:
+      now = time.monotonic()
+      if not self._size or (
+          not force and now - self._last_commit_time < _COMMIT_INTERVAL_S):
+        return
+      timestamps = self._timestamps[:self._size]
+      values = self._values[:self._size]
+      self._size = 0
+      self._last_commit_time = now
+      self._summary.add_block(timestamps, values)
+      self._phase_state.set_live_summary(self.measurement_name,
+                                         self._summary.as_base_types())
+      measured_value = self._get_measured_value(len(values))
+      if measured_value is None:
+        return
+      self._set_values(measured_value, self._downsampled(timestamps, values))
+      if measured_value.notify_value_set:
+        measured_value.notify_value_set()
+
+  def close(self) -> None:
+    self.commit(force=True)
+    with self._lock:
+      timestamp_ms, count, total = self._group
+      if not count:
+        return
+      self._group = [0.0, 0, 0.0]
+      measured_value = self._get_measured_value(count)
+      if measured_value is not None:
+        self._set_values(measured_value, [(timestamp_ms, total / count)])
 
-    # Special case tight-loop monitoring.
-    if not self.interval_ms:
+  def _downsampled(self, timestamps: Sequence[float],
+                   values: Sequence[float]) -> Iterable[Tuple[float, float]]:
+    """Returns the samples to record, averaging groups of samples."""
+    if self.downsample == 1:
+      return zip(timestamps, values)
+    samples = []
+    _, count, total = self._group
+    for timestamp_ms, value in zip(timestamps, values):
+      count += 1
+      total += value
+      if count == self.downsample:
+        samples.append((timestamp_ms, total / count))
+        count, total = 0, 0.0
+    self._group = [timestamps[-1], count, total]
+    return samples
+
+
+class _MonitorScheduler(threads.KillableThread):
+  """Background thread sampling all the monitors of a test.
+
+  Monitors are kept in a heap ordered by the absolute time of their next
+  sample, so a single thread serves any number of monitors (and monitors
+  sharing a plug are never sampled concurrently).
+  """
+
+  daemon = True
+
+  def __init__(self):
+    super(_MonitorScheduler, self).__init__(name='MonitorScheduler')
+    self._condition = threading.Condition()
+    self._deadlines = []  # type: List[Tuple[float, int, _Monitor]]
+    self._monitors = set()
+    self._sequence = itertools.count()
+    self._stopping = False
+
+  def add(self, monitor: _Monitor) -> None:
+    with self._condition:
+      self._monitors.add(monitor)
+      heapq.heappush(self._deadlines,
+                     (monitor.deadline(), next(self._sequence), monitor))
+      self._condition.notify()
+
+  def remove(self, monitor: _Monitor) -> bool:
+    """Stops sampling monitor; returns whether other monitors are left."""
+    with self._condition:
+      self._monitors.discard(monitor)
+      if not self._monitors:
+        self._stopping = True
+        self._condition.notify()
+        return False
+      return True
+
+  def abandon(self) -> List[_Monitor]:
+    """Stops scheduling samples and returns the monitors left."""
+    with self._condition:
+      monitors_left = list(self._monitors)
+      self._monitors.clear()
+      # Monitors batched after a blocked one won't be sampled by this thread.
+      for monitor in monitors_left:
+        monitor.sampling = False
+      self._stopping = True
+      self._condition.notify()
+      return monitors_left
+
+  def wait_for_sample(self, monitor: _Monitor, timeout_s: float) -> bool:
+    """Waits for a sample of monitor in progress; returns False on timeout."""
+    with self._condition:
+      return self._condition.wait_for(lambda: not monitor.sampling, timeout_s)
+
+  def stop(self) -> None:
+    self.join(_STOP_TIMEOUT_S)
+    if self.is_alive():
+      # A monitor function is blocking, interrupt it.  This only takes effect
+      # once the function runs Python code again, so don't wait for it.
+      self.kill()
+
+  def _next_due_batches(self) -> List[List[_Monitor]]:
+    """Waits for the next deadline and returns the batches of due monitors."""
+    with self._condition:
       while True:
-        measurement[(time.time() - start_time) * 1000] = self.get_value()
-
-    # Helper to take sample, return sample number and sample duration.
-    def _take_sample():
-      pre_time, value, post_time = time.time(), self.get_value(), time.time()
-      measurement[(post_time - start_time) * 1000] = value
-      return (int((post_time - start_time) * 1000 / self.interval_ms),
-              (post_time - pre_time) * 1000)
-
-    # Track the last sample number, and an approximation of the mean time
-    # it takes to sample (so we can account for it in how long we sleep).
-    last_sample, mean_sample_ms = _take_sample()
+        if self._stopping:
+          return []
+        if self._deadlines:
+          delay = self._deadlines[0][0] - time.monotonic()
+          if delay <= 0:
+            break
+          self._condition.wait(delay)
+        else:
+          self._condition.wait()
+      now = time.monotonic()
+      due = []
+      while self._deadlines and self._deadlines[0][0] <= now:
+        monitor = heapq.heappop(self._deadlines)[2]
+        if monitor in self._monitors:
+          due.append(monitor)
+      self._add_monitors_sharing_plugs(due, now)
+      for monitor in due:
+        monitor.sampling = True
+    batches = []  # type: List[List[_Monitor]]
+    for monitor in due:
+      for batch in batches:
+        if any(monitor.plug_types & other.plug_types for other in batch):
+          batch.append(monitor)
+          break
+      else:
+        batches.append([monitor])
+    return batches
+
+  def _add_monitors_sharing_plugs(self, due: List[_Monitor],
+                                  now: float) -> None:
+    """Moves the monitors sharing a plug with due ones, and due soon, to due."""
+    plug_types = frozenset().union(*(monitor.plug_types for monitor in due))
+    if not plug_types:
+      return
+    kept = []
+    for entry in self._deadlines:
+      deadline, _, monitor = entry
+      if (monitor in self._monitors and monitor.plug_types & plug_types and
+          deadline - now <= min(_BATCH_WINDOW_S, monitor.interval_s / 2)):
+        due.append(monitor)
+      else:
+        kept.append(entry)
+    if len(kept) != len(self._deadlines):
+      heapq.heapify(kept)
+      self._deadlines = kept
+
+  def _sample(self, monitor: _Monitor) -> None:
+    try:
+      monitor.sample()
+    except Exception:  # pylint: disable=broad-except
+      monitor.test_state.state_logger.exception(
+          'Monitor for "%s" raised, no longer sampling it.',
+          monitor.measurement_name)
+      with self._condition:
+        self._monitors.discard(monitor)
+    finally:
+      with self._condition:
+        monitor.sampling = False
+        if monitor in self._monitors:
+          heapq.heappush(self._deadlines,
+                         (monitor.deadline(), next(self._sequence), monitor))
+        self._condition.notify_all()
+
+  def _commit(self, monitor: _Monitor) -> None:
+    try:
+      monitor.commit()
+    except Exception:  # pylint: disable=broad-except
+      monitor.test_state.state_logger.exception(
+          'Unable to record samples of monitor for "%s", no longer sampling '
+          'it.', monitor.measurement_name)
+      with self._condition:
+        self._monitors.discard(monitor)
+
+  def _thread_proc(self):
     while True:
-      # Find what sample number (float) we would be on if we sampled now.
-      current_time = time.time()
-      new_sample = ((((current_time - start_time) * 1000) + mean_sample_ms) /
-                    self.interval_ms)
-      if new_sample < last_sample + 1:
-        time.sleep(start_time - current_time +
-                   ((last_sample + 1) * self.interval_ms / 1000.0) -
-                   (mean_sample_ms / 1000.0))
+      batches = self._next_due_batches()
+      if not batches:
+        if self._stopping:
+          return
         continue
-      elif new_sample > last_sample + 2:
-        self.test_state.state_logger.warning(
-            'Monitor for "%s" skipping %s sample(s).', self.measurement_name,
-            new_sample - last_sample - 1)
-      last_sample, cur_sample_ms = _take_sample()
-      # Approximate 10-element sliding window average.
-      mean_sample_ms = ((9 * mean_sample_ms) + cur_sample_ms) / 10.0
+      for batch in batches:
+        for monitor in batch:
+          self._sample(monitor)
+        for monitor in batch:
+          self._commit(monitor)
+
+
+# Scheduler of each test running monitors, keyed by id of the test state; the
+# entry is removed when the last monitor stops.
+_SCHEDULERS = {}  # type: Dict[int, _MonitorScheduler]
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+def _start_monitor(test_state: core_test_state.TestState,
+                   monitor: _Monitor) -> None:
+  with _SCHEDULERS_LOCK:
+    scheduler = _SCHEDULERS.get(id(test_state))
+    if scheduler is None:
+      scheduler = _SCHEDULERS[id(test_state)] = _MonitorScheduler()
+      scheduler.start()
+    scheduler.add(monitor)
+
+
+def _replace_scheduler(test_state: core_test_state.TestState,
+                       scheduler: _MonitorScheduler) -> None:
+  """Moves the monitors of a blocked scheduler to a new one, and kills it."""
+  with _SCHEDULERS_LOCK:
+    if _SCHEDULERS.get(id(test_state)) is scheduler:
+      monitors_left = scheduler.abandon()
+      if monitors_left:
+        new_scheduler = _SCHEDULERS[id(test_state)] = _MonitorScheduler()
+        for monitor in monitors_left:
+          new_scheduler.add(monitor)
+        new_scheduler.start()
+      else:
+        del _SCHEDULERS[id(test_state)]
+  scheduler.kill()
+
+
+def _stop_monitor(test_state: core_test_state.TestState,
+                  monitor: _Monitor) -> None:
+  with _SCHEDULERS_LOCK:
+    scheduler = _SCHEDULERS.get(id(test_state))
+    # The scheduler is gone if it stopped with the other monitors, after this
+    # one raised.
+    others_left = scheduler is not None and scheduler.remove(monitor)
+    if scheduler is not None and not others_left:
+      del _SCHEDULERS[id(test_state)]
+  if others_left:
+    if not scheduler.wait_for_sample(monitor, _STOP_TIMEOUT_S):
+      test_state.state_logger.warning(
+          'Monitor for "%s" is blocking, interrupting it.',
+          monitor.measurement_name)
+      _replace_scheduler(test_state, scheduler)
+  elif scheduler is not None:
+    scheduler.stop()
+  monitor.close()
 
 
 def monitors(
     measurement_name: Text,
     monitor_func: phase_descriptor.PhaseT,
     units: Optional[uom.UnitDescriptor] = None,
-    poll_interval_ms: int = 1000
+    poll_interval_ms: int = 1000,
+    high_rate: bool = False,
+    buffer_size: int = _DEFAULT_BUFFER_SIZE,
+    downsample: int = 1,
+    live_buckets: int = _DEFAULT_LIVE_BUCKETS,
 ) -> Callable[[phase_descriptor.PhaseT], phase_descriptor.PhaseDescriptor]:
-  """Returns a decorator that wraps a phase with a monitor."""
+  """Returns a decorator that wraps a phase with a monitor.
+
+  Args:
+    measurement_name: Name of the measurement recording the samples.
+    monitor_func: Phase function returning a sample.
+    units: Units of the samples.
+    poll_interval_ms: Interval between samples.
+    high_rate: Whether to use the high-rate mode, for monitors sampling
+      numbers at high frequencies: samples are buffered in preallocated arrays
+      and the running test state only carries the min, max and mean of the
+      samples over at most live_buckets periods of the phase.
+    buffer_size: Number of samples buffered in high-rate mode before they are
+      committed to the measurement.
+    downsample: In high-rate mode, the number of consecutive samples averaged
+      into each value of the measurement; 1 keeps the full resolution.
+    live_buckets: Maximum number of buckets of the summary in high-rate mode.
+  """
+  if high_rate and (buffer_size < 1 or downsample < 1 or live_buckets < 1):
+    raise ValueError(
+        'buffer_size, downsample and live_buckets must be positive.')
   monitor_desc = openhtf.PhaseDescriptor.wrap_or_copy(monitor_func)
 
   def wrapper(
@@ -154,16 +570,22 @@ def monitors(
             units).with_dimensions(uom.MILLISECOND))
     @functools.wraps(phase_desc.func)
     def monitored_phase_func(test_state, *args, **kwargs):
-      # Start monitor thread, it will run monitor_desc periodically.
-      monitor_thread = _MonitorThread(measurement_name, monitor_desc,
-                                      phase_desc.extra_kwargs, test_state,
-                                      poll_interval_ms)
-      monitor_thread.start()
+      # Register the monitor with the test's scheduler, which will run
+      # monitor_desc periodically.
+      if high_rate:
+        monitor = _HighRateMonitor(measurement_name, monitor_desc,
+                                   phase_desc.extra_kwargs, test_state,
+                                   poll_interval_ms, buffer_size, downsample,
+                                   live_buckets)
+      else:
+        monitor = _Monitor(measurement_name, monitor_desc,
+                           phase_desc.extra_kwargs, test_state,
+                           poll_interval_ms)
+      _start_monitor(test_state, monitor)
       try:
         return phase_desc(test_state, *args, **kwargs)
       finally:
-        monitor_thread.kill()
-        monitor_thread.join()
+        _stop_monitor(test_state, monitor)
 
     return monitored_phase_func
 
@@ -554,9 +554,12 @@ class TestApi(object):
       self,
       filename: Text,
       name: Optional[Text] = None,
-      mimetype: test_state.MimetypeT = test_state.INFER_MIMETYPE) -> None:
+      mimetype: test_state.MimetypeT = test_state.INFER_MIMETYPE,
+      sha1: Optional[Text] = None) -> None:
     """Store the contents of the given filename as an attachment.
 
+    The file is copied without being loaded into memory.
+
     Args:
       filename: The file to read data from to attach.
       name: If provided, override the attachment name, otherwise it will default
@@ -566,6 +569,8 @@ class TestApi(object):
             and second (i.e. as a fallback), from the attachment name.
           * None: The type will be left unspecified.
           * A string: The type will be set to the specified value.
+      sha1: SHA-1 hex digest of the file contents, if already known (eg
+        computed while the file was written); saves hashing the file.
 
     Raises:
       DuplicateAttachmentError: Raised if there is already an attachment with
@@ -573,7 +578,7 @@ class TestApi(object):
       IOError: Raised if the given filename couldn't be opened.
     """
     self._running_phase_state.attach_from_file(
-        filename, name=name, mimetype=mimetype)
+        filename, name=name, mimetype=mimetype, sha1=sha1)
 
   def get_measurement(
       self, measurement_name: Text
@@ -18,8 +18,10 @@ import hashlib
 import inspect
 import logging
 import os
+import shutil
 import tempfile
-from typing import Any, Dict, List, Optional, Text, TYPE_CHECKING, Union
+from typing import (Any, BinaryIO, Dict, List, Optional, Text, Tuple,
+                    TYPE_CHECKING, Union)
 
 import attr
 
@@ -44,6 +46,9 @@ CONF.declare(
 
 _LOG = logging.getLogger(__name__)
 
+# Size of the chunks in which files are hashed when attached.
+_HASH_CHUNK_SIZE = 1 << 20
+
 
 @attr.s(slots=True, frozen=True)
 class OutcomeDetails(object):
@@ -80,10 +85,36 @@ class Attachment(object):
   _filename = attr.ib(type=Text)
   size = attr.ib(type=int)
 
-  def __init__(self, contents: Union[Text, bytes], mimetype: Text):
+  def __init__(self,
+               contents: Union[Text, bytes, None],
+               mimetype: Text,
+               source_filename: Optional[Text] = None,
+               sha1: Optional[Text] = None):
+    """Saves the attachment data to a temporary file.
+
+    Args:
+      contents: The data to attach, or None to attach a copy of source_filename
+        instead, without loading it into memory.
+      mimetype: MIME type of the data.
+      source_filename: The file to attach a copy of, if contents is None.
+      sha1: SHA-1 hex digest of the file contents, if already known; otherwise
+        the file is hashed while it is copied.  Only used with source_filename.
+
+    Raises:
+      ValueError: Raised unless exactly one of contents and source_filename is
+        given.
+    """
+    self._filename = None
+    if (contents is None) == (source_filename is None):
+      raise ValueError('Exactly one of contents and source_filename is needed.')
+    self.mimetype = mimetype
+    if source_filename is not None:
+      self._filename, self.sha1 = self._copy_to_temp_file(
+          source_filename, sha1)
+      self.size = os.path.getsize(self._filename)
+      return
     if isinstance(contents, str):
       contents = contents.encode()
-    self.mimetype = mimetype
     self.sha1 = hashlib.sha1(contents).hexdigest()
     self.size = len(contents)
     self._filename = self._create_temp_file(contents)
@@ -91,6 +122,29 @@ class Attachment(object):
   def __del__(self):
     self.close()
 
+  def _copy_to_temp_file(self, filename: Text,
+                         sha1: Optional[Text]) -> Tuple[Text, Text]:
+    """Copies a file to a temporary one, returns its name and the SHA-1."""
+    with tempfile.NamedTemporaryFile(
+        'w+b', dir=CONF.attachments_directory, delete=False) as tf:
+      try:
+        if sha1 is None:
+          sha1_hash = hashlib.sha1()
+          with open(filename, 'rb') as source:
+            for chunk in iter(lambda: source.read(_HASH_CHUNK_SIZE), b''):
+              sha1_hash.update(chunk)
+              tf.write(chunk)
+          sha1 = sha1_hash.hexdigest()
+        else:
+          tf.close()
+          # Copied by the kernel where possible.
+          shutil.copyfile(filename, tf.name)
+      except BaseException:
+        tf.close()
+        os.remove(tf.name)
+        raise
+      return tf.name, sha1
+
   def _create_temp_file(self, contents: bytes) -> Text:
     with tempfile.NamedTemporaryFile(
         'w+b', dir=CONF.attachments_directory, delete=False) as tf:
@@ -102,6 +156,10 @@ class Attachment(object):
     with open(self._filename, 'rb') as contents:
       return contents.read()
 
+  def open_data(self) -> BinaryIO:
+    """Opens the data for reading, without loading it all in memory."""
+    return open(self._filename, 'rb')
+
   def close(self):
     if not self._filename:
       return
@@ -116,7 +174,8 @@ class Attachment(object):
     }
 
   def __copy__(self) -> 'Attachment':
-    return Attachment(self.data, self.mimetype)
+    return Attachment(
+        None, self.mimetype, source_filename=self._filename, sha1=self.sha1)
 
   def __deepcopy__(self, memo) -> 'Attachment':
     del memo  # Unused.
@@ -181,7 +240,10 @@ class TestRecord(object):
   diagnosers = attr.ib(
       type=List['diagnoses_lib.BaseTestDiagnoser'], factory=list)
   diagnoses = attr.ib(type=List['diagnoses_lib.Diagnosis'], factory=list)
-  log_records = attr.ib(type=List[logs.LogRecord], factory=list)
+  log_records = attr.ib(
+      type=logs.LogRecordStore,
+      factory=logs.LogRecordStore,
+      converter=logs.LogRecordStore.from_records)
   marginal = attr.ib(type=Optional[bool], default=None)
 
   # Cache fields to reduce repeated base type conversions.
@@ -192,7 +254,6 @@ class TestRecord(object):
   _cached_checkpoints = attr.ib(type=List[Dict[Text, Any]], factory=list)
   _cached_diagnosers = attr.ib(type=List[Dict[Text, Any]], factory=list)
   _cached_diagnoses = attr.ib(type=List[Dict[Text, Any]], factory=list)
-  _cached_log_records = attr.ib(type=List[Dict[Text, Any]], factory=list)
   _cached_config_from_metadata = attr.ib(type=Dict[Text, Any], factory=dict)
 
   def __attrs_post_init__(self) -> None:
@@ -241,10 +302,21 @@ class TestRecord(object):
 
   def add_log_record(self, log_record: logs.LogRecord) -> None:
     self.log_records.append(log_record)
-    self._cached_log_records.append(log_record._asdict())
 
-  def as_base_types(self) -> Dict[Text, Any]:
-    """Convert to a dict representation composed exclusively of base types."""
+  def as_base_types(self,
+                    recent_log_records_only: bool = False,
+                    include_log_records: bool = True) -> Dict[Text, Any]:
+    """Convert to a dict representation composed exclusively of base types.
+
+    Args:
+      recent_log_records_only: Only include the log records kept in memory,
+        rather than reading back those a log store spilled to disk.
+      include_log_records: If False, the log records are left out, and not
+        converted at all.
+
+    Returns:
+      The record as a dict.
+    """
     metadata = data.convert_to_base_types(
         self.metadata, ignore_keys=('config',))
     metadata['config'] = self._cached_config_from_metadata
@@ -261,8 +333,11 @@ class TestRecord(object):
         'branches': self._cached_branches,
         'diagnosers': self._cached_diagnosers,
         'diagnoses': self._cached_diagnoses,
-        'log_records': self._cached_log_records,
     }
+    if include_log_records:
+      ret['log_records'] = (
+          self.log_records.recent_as_base_types()
+          if recent_log_records_only else self.log_records.as_base_types())
     ret.update(self._cached_record)
     return ret
 
@@ -68,6 +68,31 @@ CONF.declare(
     'station_id',
     'The name of this test station',
     default_value=socket.gethostname())
+CONF.declare(
+    'max_log_records_per_test',
+    default_value=None,
+    description='If set, only the most recent log records of a test are kept '
+    'in its record; older ones are dropped.')
+CONF.declare(
+    'log_records_memory_window',
+    default_value=None,
+    description='If set, only this many of the most recent log records of a '
+    'test are kept in memory and older ones are spilled to disk.')
+CONF.declare(
+    'log_records_spill_directory',
+    default_value=None,
+    description='Directory of the files holding spilled log records; '
+    'defaults to the system temporary directory.')
+CONF.declare(
+    'live_log_records',
+    default_value=1000,
+    description='Number of the most recent log records of a test included in '
+    'live updates of its state; the station server pages through the others.')
+CONF.declare(
+    'log_notify_interval_s',
+    default_value=logs.DEFAULT_NOTIFY_INTERVAL_S,
+    description='Min wait time between successive test state updates caused '
+    'by log records.')
 
 
 class _Infer(enum.Enum):
@@ -146,9 +171,11 @@ class TestState(util.SubscribableStateMixin):
         start_time_millis=0,
         # Copy metadata so we don't modify test_desc.
         metadata=copy.deepcopy(test_desc.metadata),
-        diagnosers=test_options.diagnosers)
+        diagnosers=test_options.diagnosers,
+        log_records=self._create_log_record_store())
     logs.initialize_record_handler(execution_uid, self.test_record,
-                                   self.notify_update)
+                                   self.notify_update,
+                                   float(CONF.log_notify_interval_s))
     self.state_logger = logs.get_record_logger_for(execution_uid)
     self.plug_manager = plugs.PlugManager(test_desc.plug_types,
                                           self.state_logger)
@@ -161,6 +188,19 @@ class TestState(util.SubscribableStateMixin):
     self.execution_uid = execution_uid
     self.test_options = test_options
 
+  @staticmethod
+  def _create_log_record_store() -> logs.LogRecordStore:
+    recent_records = (None if CONF.live_log_records is None else
+                      int(CONF.live_log_records))
+    if CONF.log_records_memory_window:
+      return logs.SpillingLogRecordStore(
+          memory_records=int(CONF.log_records_memory_window),
+          directory=CONF.log_records_spill_directory,
+          recent_records=recent_records)
+    return logs.LogRecordStore(
+        max_records=CONF.max_log_records_per_test,
+        recent_records=recent_records)
+
   def close(self) -> None:
     """Close and remove any global registrations.
 
@@ -306,7 +346,8 @@ class TestState(util.SubscribableStateMixin):
       running_phase_state = self.running_phase_state.as_base_types()
     return {
         'status': data.convert_to_base_types(self._status),
-        'test_record': self.test_record.as_base_types(),
+        'test_record': self.test_record.as_base_types(
+            recent_log_records_only=True),
         'plugs': self.plug_manager.as_base_types(),
         'running_phase_state': running_phase_state,
     }
@@ -572,6 +613,8 @@ class PhaseState(object):
     hit_repeat_limit: bool, True when the phase repeat limit was hit.
     _cached: A cached representation of the running test state that; updated in
       place to save allocation time.
+    _live_summaries: Summaries published in the cached representation in place
+      of the values of some measurements, see set_live_summary.
     attachments: Convenience accessor for phase_record.attachments.
     result: Convenience getter/setter for phase_record.result.
     marginal: Convenience getter/setter for phase_record.marginal.
@@ -587,6 +630,7 @@ class PhaseState(object):
   hit_repeat_limit = attr.ib(type=bool, default=False)
   _cached = attr.ib(type=Dict[Text, Any], factory=dict)
   _update_measurements = attr.ib(type=Set[Text], factory=set)
+  _live_summaries = attr.ib(type=Dict[Text, Any], factory=dict)
 
   def __attrs_post_init__(self):
     for m in self.measurements.values():
@@ -651,9 +695,33 @@ class PhaseState(object):
     # Update the dictionaries previously returned for the measurements that
     # have been updated.
     for m in cur_update_measurements:
-      self.measurements[m].as_base_types()
+      measurement_dict = self.measurements[m].as_base_types()
+      if m in self._live_summaries:
+        measurement_dict = {
+            k: v for k, v in measurement_dict.items() if k != 'measured_value'
+        }
+        measurement_dict['live_summary'] = self._live_summaries[m]
+      self._cached['measurements'][m] = measurement_dict
     return self._cached
 
+  def set_live_summary(self, measurement_name: Text, summary: Any) -> None:
+    """Publishes a summary of a measurement instead of its values.
+
+    Used for measurements receiving too many values to send them all with each
+    update of the running test state; the phase record is unaffected.  The
+    summary is published with the next notification of the measurement.
+
+    Args:
+      measurement_name: Name of the measurement.
+      summary: Base types representation of the summary, or None to publish the
+        values of the measurement again.
+    """
+    if summary is None:
+      self._live_summaries.pop(measurement_name, None)
+    else:
+      self._live_summaries[measurement_name] = summary
+    self._update_measurements.add(measurement_name)
+
   @property
   def result(self) -> Optional[phase_executor.PhaseExecutionOutcome]:
     return self.phase_record.result
@@ -695,25 +763,19 @@ class PhaseState(object):
       DuplicateAttachmentError: Raised if there is already an attachment with
         the given name.
     """
-    if name in self.phase_record.attachments:
-      raise DuplicateAttachmentError('Duplicate attachment for %s' % name)
-
-    if mimetype is INFER_MIMETYPE:
-      mimetype = mimetypes.guess_type(name)[0]
-    elif mimetype is not None and not mimetypes.guess_extension(mimetype):
-      self.logger.warning('Unrecognized MIME type: "%s" for attachment "%s"',
-                          mimetype, name)
-
+    mimetype = self._attachment_mimetype(name, mimetype)
     attach_record = test_record.Attachment(binary_data, mimetype)  # pyrefly: ignore[bad-argument-type]
-    self.phase_record.attachments[name] = attach_record
-    self._cached['attachments'][name] = attach_record._asdict()
+    self._add_attachment(name, attach_record)
 
   def attach_from_file(self,
                        filename: Text,
                        name: Optional[Text] = None,
-                       mimetype: MimetypeT = INFER_MIMETYPE) -> None:
+                       mimetype: MimetypeT = INFER_MIMETYPE,
+                       sha1: Optional[Text] = None) -> None:
     """Store the contents of the given filename as an attachment.
 
+    The file is copied without being loaded into memory.
+
     Args:
       filename: The file to read data from to attach.
       name: If provided, override the attachment name, otherwise it will default
@@ -723,6 +785,7 @@ class PhaseState(object):
             and second (i.e. as a fallback), from the attachment name.
           * None: The type will be left unspecified.
           * A string: The type will be set to the specified value.
+      sha1: SHA-1 hex digest of the file contents, if already known.
 
     Raises:
       DuplicateAttachmentError: Raised if there is already an attachment with
@@ -731,11 +794,29 @@ class PhaseState(object):
     """
     if mimetype is INFER_MIMETYPE:
       mimetype = mimetypes.guess_type(filename)[0] or mimetype
-    with open(filename, 'rb') as f:
-      self.attach(
-          name if name is not None else os.path.basename(filename),
-          f.read(),
-          mimetype=mimetype)
+    name = name if name is not None else os.path.basename(filename)
+    mimetype = self._attachment_mimetype(name, mimetype)
+    attach_record = test_record.Attachment(
+        None, mimetype, source_filename=filename, sha1=sha1)  # pyrefly: ignore[bad-argument-type]
+    self._add_attachment(name, attach_record)
+
+  def _attachment_mimetype(self, name: Text,
+                           mimetype: MimetypeT) -> Optional[Text]:
+    """Checks that name is unused and returns the MIME type to attach with."""
+    if name in self.phase_record.attachments:
+      raise DuplicateAttachmentError('Duplicate attachment for %s' % name)
+
+    if mimetype is INFER_MIMETYPE:
+      mimetype = mimetypes.guess_type(name)[0]
+    elif mimetype is not None and not mimetypes.guess_extension(mimetype):
+      self.logger.warning('Unrecognized MIME type: "%s" for attachment "%s"',
+                          mimetype, name)
+    return mimetype
+
+  def _add_attachment(self, name: Text,
+                      attach_record: test_record.Attachment) -> None:
+    self.phase_record.attachments[name] = attach_record
+    self._cached['attachments'][name] = attach_record._asdict()
 
   def add_diagnosis(self, diagnosis: diagnoses_lib.Diagnosis) -> None:
     if diagnosis.is_failure:
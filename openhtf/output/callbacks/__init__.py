@@ -22,34 +22,23 @@ examples.
 from collections.abc import Iterable
 import contextlib
 import pickle
-import shutil
-import tempfile
 import typing
 from typing import BinaryIO, Callable, Iterator, Optional, Text, Union
 
 from openhtf import util
 from openhtf.core import test_record
+from openhtf.util import atomic_write
 from openhtf.util import data
 
 SerializedTestRecord = Union[Text, bytes, Iterator[Union[Text, bytes]]]
 
 
-# TODO(wallacbe): Switch to util
-class Atomic(object):
-  """Class that does atomic write in a contextual manner."""
+class Atomic(atomic_write.AtomicFileWriter):
+  """Class that does atomic write in a contextual manner.
 
-  def __init__(self, filename: Text):
-    self.filename = filename
-    self.temp = tempfile.NamedTemporaryFile(delete=False)
-
-  def write(self, write_data: Union[Text, bytes]) -> int:
-    if isinstance(write_data, str):
-      write_data = write_data.encode()
-    return self.temp.write(write_data)
-
-  def close(self) -> None:
-    self.temp.close()
-    shutil.move(self.temp.name, self.filename)
+  The file is written next to its destination and fsync'ed before being renamed
+  into place, see atomic_write.AtomicFileWriter.
+  """
 
 
 class CloseAttachments(object):
@@ -76,12 +65,18 @@ class OutputToFile(object):
       filename pattern with placeholders to be replaced by test run metadata
       values.  Exclusive with output_file.
     output_file: A file object.  Exclusive with filename_pattern.
+    fsync_batch: Optional atomic_write.FsyncBatch used to group the fsyncs of
+      the files written through Atomic.  Call its sync() method to make sure
+      all the records output so far are on disk.
   """
 
-  def __init__(self, filename_pattern_or_file: Union[Text, Callable[..., Text],
-                                                     BinaryIO]):
+  def __init__(self,
+               filename_pattern_or_file: Union[Text, Callable[..., Text],
+                                               BinaryIO],
+               fsync_batch: Optional[atomic_write.FsyncBatch] = None):
     self.filename_pattern: Optional[Union[Text, Callable[..., Text]]] = None
     self.output_file: Optional[BinaryIO] = None
+    self.fsync_batch = fsync_batch
     if (isinstance(filename_pattern_or_file, str) or
         callable(filename_pattern_or_file)):
       self.filename_pattern = filename_pattern_or_file  # pytype: disable=annotation-type-mismatch
@@ -118,8 +113,15 @@ class OutputToFile(object):
     if self.filename_pattern:
       filename = self.create_file_name(test_rec)
       output_file = self.open_file(filename)
+      if isinstance(output_file, Atomic) and self.fsync_batch is not None:
+        output_file.fsync_batch = self.fsync_batch
       try:
         yield output_file
+      except BaseException:
+        # Leave any previous file in place rather than a partial record.
+        if isinstance(output_file, Atomic):
+          output_file.abort()
+        raise
       finally:
         output_file.close()
     elif self.output_file:
@@ -21,6 +21,18 @@ from typing import Any, BinaryIO, Callable, Dict, Iterator, Text, Union
 from openhtf.core import test_record
 from openhtf.output import callbacks
 from openhtf.util import data
+from openhtf.util import logs
+
+
+class _StreamedLogRecords(object):
+  """Stands in for log records that are read from their store when encoded.
+
+  stream_json() writes the records one at a time, so records spilled to disk
+  are streamed rather than loaded all at once.
+  """
+
+  def __init__(self, log_records: logs.LogRecordStore):
+    self.log_records = log_records
 
 
 class TestRecordEncoder(json.JSONEncoder):
@@ -30,12 +42,15 @@ class TestRecordEncoder(json.JSONEncoder):
       dct = obj._asdict()
       dct['data'] = base64.standard_b64encode(obj.data).decode('utf-8')
       return dct
+    if isinstance(obj, _StreamedLogRecords):
+      return obj.log_records.as_base_types()
     return super(TestRecordEncoder, self).default(obj)
 
 
 def convert_test_record_to_json(
     test_rec: test_record.TestRecord,
-    inline_attachments: bool = True, allow_nan: bool = False
+    inline_attachments: bool = True, allow_nan: bool = False,
+    stream_log_records: bool = False
     ) -> Dict[Text, Any]:
   """Convert the test record to a JSON object.
 
@@ -46,11 +61,18 @@ def convert_test_record_to_json(
       True (the default), then attachments are base64 encoded to allow for
       binary data that's not supported by JSON directly.
     allow_nan: If False, out of range float values will raise ValueError.
+    stream_log_records: Whether log records should be read from their store
+      while encoding rather than now.  The result should then be encoded with
+      stream_json().
 
   Returns:
     The test record encoded as JSON objects.
   """
-  as_dict = data.convert_to_base_types(test_rec, json_safe=(not allow_nan))
+  if stream_log_records:
+    as_dict = test_rec.as_base_types(include_log_records=False)
+    as_dict['log_records'] = _StreamedLogRecords(test_rec.log_records)
+  else:
+    as_dict = data.convert_to_base_types(test_rec, json_safe=(not allow_nan))
   if inline_attachments:
     for phase, original_phase in zip(as_dict['phases'], test_rec.phases):
       for name, attachment in original_phase.attachments.items():
@@ -63,6 +85,9 @@ def stream_json(
 ) -> Iterator[Text]:
   """Convert the JSON object encoded test record into a stream of strings.
 
+  Log records to be streamed (see convert_test_record_to_json) are written as
+  the last key of the test record, one record at a time.
+
   Args:
     encoded_test_rec: The JSON converted test record.
     allow_nan: If False, out of range float values will raise ValueError.
@@ -72,12 +97,60 @@ def stream_json(
     Iterable of JSON strings.
   """
   json_encoder = TestRecordEncoder(allow_nan=allow_nan, **kwargs)
+  log_records = encoded_test_rec.get('log_records')
+  if isinstance(log_records, _StreamedLogRecords):
+    return _stream_json_with_log_records(json_encoder, encoded_test_rec,
+                                         log_records.log_records)
 
   # The iterencode return type in typeshed for PY2 is wrong; not worried about
   # fixing it as we are dropping PY2 support soon.
   return json_encoder.iterencode(encoded_test_rec)  # pytype: disable=bad-return-type
 
 
+def _stream_json_with_log_records(
+    json_encoder: json.JSONEncoder, encoded_test_rec: Dict[Text, Any],
+    log_records: logs.LogRecordStore) -> Iterator[Text]:
+  """Encodes the test record, then appends its log records one by one."""
+  chunks = json_encoder.iterencode(
+      {k: v for k, v in encoded_test_rec.items() if k != 'log_records'})
+  # Hold back the last chunk, which closes the test record object, with the
+  # whitespace before it.
+  last_chunk = None
+  whitespace = []
+  for chunk in chunks:
+    if not chunk.strip():
+      whitespace.append(chunk)
+      continue
+    if last_chunk is not None:
+      yield last_chunk
+    last_chunk = ''.join(whitespace) + chunk
+    whitespace = []
+  yield last_chunk.rstrip()[:-1].rstrip()
+
+  indent = json_encoder.indent
+  if indent is None:
+    newline = inner_newline = ''
+  else:
+    if not isinstance(indent, str):
+      indent = ' ' * indent
+    newline = '\n' + indent
+    inner_newline = newline + indent
+  yield '%s%s%s%s[' % (json_encoder.item_separator, newline,
+                       json_encoder.encode('log_records'),
+                       json_encoder.key_separator)
+  separator = inner_newline
+  has_records = False
+  for record_dict in log_records.iter_base_types():
+    # Strings can't span lines in JSON, so this only indents the structure.
+    yield separator + json_encoder.encode(record_dict).replace(
+        '\n', inner_newline)
+    separator = json_encoder.item_separator + inner_newline
+    has_records = True
+  if has_records:
+    yield newline
+  yield ']\n}' if indent is not None else ']}'
+
+
 class OutputToJSON(callbacks.OutputToFile):
   """Return an output callback that writes JSON Test Records.
 
@@ -116,6 +189,6 @@ class OutputToJSON(callbacks.OutputToFile):
                             ) -> Iterator[Text]:
     encoded = convert_test_record_to_json(
         test_rec, inline_attachments=self.inline_attachments,
-        allow_nan=self.allow_nan)
+        allow_nan=self.allow_nan, stream_log_records=True)
     return stream_json(encoded, allow_nan=self.allow_nan,
                        **self._json_kwargs)
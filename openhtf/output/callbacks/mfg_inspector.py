@@ -14,11 +14,14 @@
 
 """Output and/or upload a TestRun or MfgEvent proto for mfg-inspector.com."""
 
+import copy
 import functools
 import io
 import logging
+import pickle
+import sys
 import time
-from typing import Any, Dict, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Union
 import uuid
 import zlib
 
@@ -26,6 +29,8 @@ from google.auth import credentials as credentials_lib
 from google.auth import exceptions as google_auth_exceptions
 from google.auth.transport import requests
 from google.oauth2 import service_account
+from openhtf.core import measurements
+from openhtf.core import test_record
 from openhtf.output import callbacks
 from openhtf.output.proto import test_runs_converter
 from requests import exceptions as requests_exceptions
@@ -50,6 +55,129 @@ class InvalidTestRunError(Exception):
   """Raised if test run is invalid."""
 
 
+class _AttachmentSnapshot(object):
+  """In-memory stand-in for a test_record.Attachment.
+
+  Attachments own a temporary file that is removed when they are garbage
+  collected, so they must not be pickled into another process.  This copies the
+  fields the converters read instead.
+  """
+
+  __slots__ = ('mimetype', 'sha1', 'size', 'data')
+
+  def __init__(self, attachment: test_record.Attachment):
+    self.mimetype = attachment.mimetype
+    self.sha1 = attachment.sha1
+    self.size = attachment.size
+    self.data = attachment.data
+
+  def _asdict(self) -> Dict[str, Any]:
+    return {
+        'mimetype': self.mimetype,
+        'sha1': self.sha1,
+    }
+
+
+class _ValidatorSnapshot(object):
+  """Picklable stand-in for a validator that cannot be pickled (eg a lambda)."""
+
+  __slots__ = ('_description',)
+
+  def __init__(self, validator: Callable[[Any], bool]):
+    self._description = str(validator)
+
+  def __str__(self) -> str:
+    return self._description
+
+
+def _is_picklable(obj: Any) -> bool:
+  try:
+    pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+  except Exception:  # pylint: disable=broad-except
+    return False
+  return True
+
+
+def _snapshot_validators(
+    validators: List[Callable[[Any], bool]]) -> List[Callable[[Any], bool]]:
+  return [v if _is_picklable(v) else _ValidatorSnapshot(v) for v in validators]
+
+
+def _snapshot_measurement(
+    measurement: measurements.Measurement) -> measurements.Measurement:
+  """Returns a copy of the measurement without callbacks or transforms."""
+  measured_value = copy.copy(measurement.measured_value)
+  measured_value.transform_fn = None
+  if isinstance(measured_value, measurements.DimensionedMeasuredValue):
+    measured_value.notify_value_set = None
+  snapshot = copy.copy(measurement)
+  # Bypass the property setters, which would reset the measured value.
+  snapshot._transform_fn = None  # pylint: disable=protected-access
+  snapshot._measured_value = measured_value  # pylint: disable=protected-access
+  snapshot._notification_cb = None  # pylint: disable=protected-access
+  snapshot.validators = _snapshot_validators(measurement.validators)
+  snapshot.conditional_validators = []
+  return snapshot
+
+
+def _snapshot_phase(phase: test_record.PhaseRecord) -> test_record.PhaseRecord:
+  """Returns a copy of the phase record holding only picklable data."""
+  snapshot = copy.copy(phase)
+  snapshot.measurements = {
+      name: _snapshot_measurement(measurement)
+      for name, measurement in (phase.measurements or {}).items()
+  }
+  snapshot.attachments = {
+      name: _AttachmentSnapshot(attachment)
+      for name, attachment in phase.attachments.items()
+  }
+  # These reference phase descriptors, diagnosers and exception tracebacks.
+  # Their base type representations are already cached on the TestRecord.
+  snapshot.options = None
+  snapshot.diagnosers = []
+  snapshot.result = None
+  return snapshot
+
+
+def snapshot_test_record(
+    record: test_record.TestRecord) -> test_record.TestRecord:
+  """Creates a compact, picklable copy of a TestRecord for conversion.
+
+  The snapshot keeps everything the bundled converters read (basic fields,
+  metadata, log records, measurement values and validators, attachment data and
+  the cached base type representation used for the JSON copy of the record) and
+  drops references to live test objects, such as phase descriptors, diagnosers,
+  notification callbacks and tracebacks.  Validators that cannot be pickled are
+  replaced by their string representation.
+
+  Converting the snapshot does not mutate the original record.
+
+  Args:
+    record: The TestRecord to snapshot.
+
+  Returns:
+    A TestRecord that can be sent to another process.
+  """
+  snapshot = copy.copy(record)
+  snapshot.phases = [_snapshot_phase(phase) for phase in record.phases]
+  snapshot.diagnosers = []
+  snapshot.branches = []
+  snapshot.checkpoints = []
+  snapshot.metadata = dict(record.metadata)
+  return snapshot
+
+
+def _convert_snapshot(
+    converter: Callable[[test_record.TestRecord], Any],
+    snapshot: test_record.TestRecord,
+    argv: List[str],
+) -> Any:
+  """Worker entry point converting a record snapshot to a proto."""
+  # Converters record the command line of the test, not of the worker.
+  sys.argv = argv
+  return converter(snapshot)
+
+
 def _send_mfg_inspector_request(
     envelope_data: bytes,
     authorized_session: requests.AuthorizedSession,
@@ -281,6 +409,16 @@ class MfgInspector(object):
   attempt to upload the protobuf to mfg-inspector. In the event of a network,
   outage the result of the test run is available on disk and a separate process
   can retry the upload when the network is available.
+
+  Conversion of large records is CPU heavy and competes for the GIL with the
+  next test on the station.  Passing an executor to set_converter, eg:
+    interface.set_converter(
+        mfg_event_converter.mfg_event_from_test_record,
+        executor=concurrent.futures.ProcessPoolExecutor(max_workers=1))
+  runs the conversion in a worker process instead.  The
+  worker receives a picklable snapshot of the record (see snapshot_test_record),
+  so the converter must be picklable (eg a module level function) and the
+  original record is not mutated by the conversion.
   """
 
   TOKEN_URI = 'https://accounts.google.com/o/oauth2/token'
@@ -300,6 +438,9 @@ class MfgInspector(object):
   # saving to disk via save_to_disk.
   _default_filename_pattern = None
 
+  # Optional executor that conversion is offloaded to.
+  _executor = None
+
   def __init__(self,
                user=None,
                keydata=None,
@@ -390,7 +531,12 @@ class MfgInspector(object):
             'Must set _converter on subclass or via set_converter before'
             ' calling save_to_disk.'
         )
-      self._cached_proto = self._converter(test_record_obj)
+      if self._executor is None:
+        self._cached_proto = self._converter(test_record_obj)
+      else:
+        self._cached_proto = self._executor.submit(
+            _convert_snapshot, self._converter,
+            snapshot_test_record(test_record_obj), list(sys.argv)).result()
       for param in self.PARAMS:
         self._cached_params[param] = getattr(test_record_obj, param)
     return self._cached_proto
@@ -468,12 +614,15 @@ class MfgInspector(object):
 
     return upload_callback
 
-  def set_converter(self, converter):
+  def set_converter(self, converter, executor=None):
     """Set converter callable to convert an OpenHTF TestRecord to a proto.
 
     Args:
       converter: a callable that accepts an OpenHTF TestRecord and returns a
         manufacturing-inspector compatible protobuf.
+      executor: Optional concurrent.futures.Executor to run the conversion in.
+        With a ProcessPoolExecutor the converter must be picklable and is
+        called with a snapshot of the record.
 
     Returns:
       Self to make this call chainable.
@@ -481,6 +630,7 @@ class MfgInspector(object):
     assert callable(converter), 'Converter must be callable.'
 
     self._converter = converter
+    self._executor = executor
 
     return self
 
@@ -19,18 +19,45 @@ and the reverse.
 
 A decision had to be made on how to handle phases, measurements and attachments
 with non-unique names.  Approach taken is to append a _X to the names.
+
+Multi-dim measurements are converted to MULTIDIM_JSON attachments by default.
+For very large measurements a packed binary encoding can be requested instead.
+The packed attachment has the MULTIDIM_PACKED_MIMETYPE mimetype (uploaded as
+BINARY) and the following layout:
+
+  MULTIDIM_PACKED_MAGIC
+  uint32 little-endian length of the header
+  header: UTF-8 JSON object with the same 'outcome', 'name' and 'dimensions'
+    fields as MULTIDIM_JSON, the number of points in 'num_points' (null if the
+    measurement was not set) and a 'columns' list.  There is one column per
+    dimension followed by one for the value, each described by its 'type'
+    (int64, float64 or json), the list of 'codecs' applied in order (delta,
+    zlib) and its encoded 'size' in bytes.
+  the encoded columns, back to back.
+
+Numeric columns are stored as little-endian typed arrays; anything else (eg
+string coordinates) falls back to a JSON list.
+
+The MfgEvent also embeds a JSON copy of the whole record so that it can be
+recovered with test_record_from_mfg_event.  See RecordJsonMode for options to
+slim it down or replace it with a reference.
 """
 
+import array
 import collections
 import dataclasses
 import datetime
+import enum
+import hashlib
 import itertools
 import json
 import logging
 import numbers
 import os
+import struct
 import sys
-from typing import Mapping, Optional, Tuple
+from typing import Any, Dict, List, Mapping, MutableMapping, Optional, Sequence, Tuple
+import zlib
 
 from openhtf.core import measurements
 from openhtf.core import test_record as htf_test_record
@@ -43,6 +70,11 @@ from openhtf.util import units
 from openhtf.util import validators
 
 TEST_RECORD_ATTACHMENT_NAME = 'OpenHTF_record.json'
+CONFIG_ATTACHMENT_NAME = 'config'
+
+# Keys of the JSON document embedded in RecordJsonMode.REFERENCE.
+RECORD_JSON_SHA1_KEY = 'record_json_sha1'
+RECORD_JSON_SIZE_KEY = 'record_json_size'
 
 #  To be lazy loaded by _LazyLoadUnitsByCode when needed.
 UNITS_BY_CODE = {}
@@ -66,12 +98,37 @@ TEST_RUN_STATUS_NAME_TO_MEASUREMENT_OUTCOME = {
     'SKIPPED': measurements.Outcome.SKIPPED,
 }
 
+MULTIDIM_PACKED_MIMETYPE = 'application/x-openhtf-multidim-packed'
+MULTIDIM_PACKED_MAGIC = b'OHTFMDP1'
+_PACKED_HEADER_LENGTH = struct.Struct('<I')
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+_FLOAT64_EXACT_INT_MIN = -(1 << 53)
+_FLOAT64_EXACT_INT_MAX = 1 << 53
+_ARRAY_TYPECODES = {'int64': 'q', 'float64': 'd'}
+
 _GIBI_BYTE_TO_BASE = 1 << 30
 MAX_TOTAL_ATTACHMENT_BYTES = int(0.9 * _GIBI_BYTE_TO_BASE)
 
 _LOGGER = logging.getLogger(__name__)
 
 
+class RecordJsonMode(enum.Enum):
+  """How the JSON copy of the test record is embedded in the MfgEvent.
+
+  FULL: The whole record, including log records and the config dump.
+  SLIM: The record without log records and metadata['config'].  Both are
+    already carried by the MfgEvent (test_logs and the config attachment) and
+    are restored from there by test_record_from_mfg_event.
+  REFERENCE: Only the SHA-1 and size of the full record JSON.  The full JSON is
+    stored in a caller provided mapping, keyed by the SHA-1, which must be
+    passed to test_record_from_mfg_event to restore the record.
+  """
+  FULL = 'FULL'
+  SLIM = 'SLIM'
+  REFERENCE = 'REFERENCE'
+
+
 @dataclasses.dataclass(eq=True, frozen=True)  # Ensures __hash__ is generated.
 class AttachmentCacheKey:
   name: str
@@ -107,6 +164,9 @@ def _lazy_load_units_by_code():
 def mfg_event_from_test_record(
     record: htf_test_record.TestRecord,
     attachment_cache: Optional[AttachmentCacheT] = None,
+    packed_multidim: bool = False,
+    record_json_mode: RecordJsonMode = RecordJsonMode.FULL,
+    record_json_store: Optional[MutableMapping[str, bytes]] = None,
 ) -> mfg_event_pb2.MfgEvent:
   """Convert an OpenHTF TestRecord to an MfgEvent proto.
 
@@ -128,14 +188,24 @@ def mfg_event_from_test_record(
     record: An OpenHTF TestRecord.
     attachment_cache: Provides a lookup to get EventAttachment protos for
       already uploaded (or converted) attachments.
+    packed_multidim: If True, multi-dim measurements are attached using the
+      packed binary encoding instead of MULTIDIM_JSON.
+    record_json_mode: How the JSON copy of the record is embedded, see
+      RecordJsonMode.
+    record_json_store: Mapping the full record JSON is saved to, keyed by its
+      SHA-1, required when using RecordJsonMode.REFERENCE.
 
   Returns:
     An MfgEvent proto representing the given test record.
+
+  Raises:
+    ValueError: If RecordJsonMode.REFERENCE is used without a
+      record_json_store.
   """
   mfg_event = mfg_event_pb2.MfgEvent()
 
   _populate_basic_data(mfg_event, record)
-  _attach_record_as_json(mfg_event, record)
+  _attach_record_as_json(mfg_event, record, record_json_mode, record_json_store)
   _attach_argv(mfg_event)
   _attach_config(mfg_event, record)
 
@@ -144,7 +214,7 @@ def mfg_event_from_test_record(
       mfg_event.test_status == test_runs_pb2.PASS):
     for assembly_event in record.metadata['assembly_events']:
       mfg_event.assembly_events.add().CopyFrom(assembly_event)
-  convert_multidim_measurements(record.phases)
+  convert_multidim_measurements(record.phases, packed=packed_multidim)
   phase_copier = PhaseCopier(phase_uniquizer(record.phases), attachment_cache)
   phase_copier.copy_measurements(mfg_event)
   if not phase_copier.copy_attachments(mfg_event):
@@ -213,34 +283,56 @@ def _populate_basic_data(mfg_event: mfg_event_pb2.MfgEvent,
     test_log.lineno = log_record.lineno
 
 
-def _attach_record_as_json(mfg_event, record):
+def _attach_record_as_json(mfg_event,
+                           record,
+                           mode=RecordJsonMode.FULL,
+                           record_json_store=None):
   """Attach a copy of the record as JSON so we have an un-mangled copy."""
+  if mode is RecordJsonMode.REFERENCE and record_json_store is None:
+    raise ValueError(
+        'RecordJsonMode.REFERENCE requires a record_json_store to save the '
+        'full record JSON to.')
   attachment = mfg_event.attachment.add()
   attachment.name = TEST_RECORD_ATTACHMENT_NAME
-  test_record_dict = htf_data.convert_to_base_types(record)
-  attachment.value_binary = _convert_object_to_json(test_record_dict)
+  if mode is RecordJsonMode.SLIM:
+    # Skip converting the log records, as_base_types returns a new metadata
+    # dict so popping the config from it does not affect the record's caches.
+    test_record_dict = record.as_base_types(include_log_records=False)
+    test_record_dict['metadata'].pop('config', None)
+  else:
+    test_record_dict = htf_data.convert_to_base_types(record)
+  record_json = _convert_object_to_json(test_record_dict)
+  if mode is RecordJsonMode.REFERENCE:
+    sha1 = hashlib.sha1(record_json).hexdigest()
+    record_json_store[sha1] = record_json
+    record_json = _convert_object_to_json({
+        RECORD_JSON_SHA1_KEY: sha1,
+        RECORD_JSON_SIZE_KEY: len(record_json),
+    })
+  attachment.value_binary = record_json
   attachment.type = test_runs_pb2.TEXT_UTF8
 
 
-def _convert_object_to_json(obj):  # pylint: disable=missing-function-docstring
+def _unsupported_type_handler(o):
+  # For bytes, JSONEncoder will fallback to this function to convert to str.
+  if isinstance(o, bytes):
+    return o.decode(encoding='utf-8', errors='replace')
+  elif isinstance(o, (datetime.date, datetime.datetime)):
+    return o.isoformat()
+  else:
+    raise TypeError(repr(o) + ' is not JSON serializable')
+
+
+def _convert_object_to_json(obj, **json_kwargs):  # pylint: disable=missing-function-docstring
   # Since there will be parts of this that may have unicode, either as
   # measurement or in the logs, we have to be careful and convert everything
   # to unicode, merge, then encode to UTF-8 to put it into the proto.
-
-  def unsupported_type_handler(o):
-    # For bytes, JSONEncoder will fallback to this function to convert to str.
-    if isinstance(o, bytes):
-      return o.decode(encoding='utf-8', errors='replace')
-    elif isinstance(o, (datetime.date, datetime.datetime)):
-      return o.isoformat()
-    else:
-      raise TypeError(repr(o) + ' is not JSON serializable')
-
+  json_kwargs.setdefault('sort_keys', True)
+  json_kwargs.setdefault('indent', 2)
   json_encoder = json.JSONEncoder(
-      sort_keys=True,
-      indent=2,
       ensure_ascii=False,
-      default=unsupported_type_handler)
+      default=_unsupported_type_handler,
+      **json_kwargs)
   return json_encoder.encode(obj).encode('utf-8', errors='replace')
 
 
@@ -249,7 +341,7 @@ def _attach_config(mfg_event, record):
   if 'config' not in record.metadata:
     return
   attachment = mfg_event.attachment.add()
-  attachment.name = 'config'
+  attachment.name = CONFIG_ATTACHMENT_NAME
   attachment.value_binary = _convert_object_to_json(record.metadata['config'])
   attachment.type = test_runs_pb2.TEXT_UTF8
 
@@ -321,9 +413,8 @@ def phase_uniquizer(all_phases):
   return all_phases
 
 
-def multidim_measurement_to_attachment(name, measurement):
-  """Convert a multi-dim measurement to an `openhtf.test_record.Attachment`."""
-
+def _multidim_dimensions(measurement):
+  """Returns the attachment 'dimensions' of a multi-dim measurement."""
   dimensions = list(measurement.dimensions)
   if measurement.units:
     dimensions.append(
@@ -340,6 +431,24 @@ def multidim_measurement_to_attachment(name, measurement):
         'uom_code': d.code,
         'name': d.name,
     })
+  return dims
+
+
+def multidim_measurement_to_attachment(name, measurement, packed=False,
+                                       compress=True):
+  """Convert a multi-dim measurement to an `openhtf.test_record.Attachment`.
+
+  Args:
+    name: The name to store in the attachment.
+    measurement: The multi-dim `openhtf.Measurement` to convert.
+    packed: If True, use the packed binary encoding (see module docstring)
+      instead of MULTIDIM_JSON.
+    compress: Whether to delta/zlib compress the columns of a packed encoding.
+
+  Returns:
+    An `openhtf.test_record.Attachment`.
+  """
+  dims = _multidim_dimensions(measurement)
   # Refer to the module docstring for the expected schema.
   dimensioned_measured_value = measurement.measured_value
   value = (
@@ -347,6 +456,9 @@ def multidim_measurement_to_attachment(name, measurement):
       if dimensioned_measured_value.is_value_set else None)
   outcome_str = _measurement_outcome_to_test_run_status_name(
       measurement.outcome, measurement.marginal)
+  if packed:
+    data = _pack_multidim(outcome_str, name, dims, value, compress)
+    return htf_test_record.Attachment(data, MULTIDIM_PACKED_MIMETYPE)
   data = _convert_object_to_json({
       'outcome': outcome_str,
       'name': name,
@@ -358,8 +470,130 @@ def multidim_measurement_to_attachment(name, measurement):
   return attachment
 
 
-def convert_multidim_measurements(all_phases):
-  """Converts each multidim measurements into attachments for all phases.."""
+def _packed_column_type(column: Sequence[Any]) -> str:
+  """Returns the narrowest packed column type that holds every item."""
+  # Columns of builtin types are checked without per-item isinstance calls,
+  # which dominate the encoding time for large measurements.
+  item_types = set(map(type, column))
+  if item_types <= {int, float}:
+    if item_types == {int}:
+      if _INT64_MIN <= min(column) and max(column) <= _INT64_MAX:
+        return 'int64'
+      return 'json'
+    if int in item_types and not (
+        _FLOAT64_EXACT_INT_MIN <= min(column) and
+        max(column) <= _FLOAT64_EXACT_INT_MAX):
+      return 'json'
+    return 'float64'
+  if all(
+      isinstance(item, numbers.Integral) and not isinstance(item, bool) and
+      _INT64_MIN <= item <= _INT64_MAX for item in column):
+    return 'int64'
+  if all(
+      isinstance(item, numbers.Real) and not isinstance(item, bool)
+      for item in column):
+    return 'float64'
+  return 'json'
+
+
+def _encode_packed_column(column: Sequence[Any],
+                          compress: bool) -> Tuple[dict, bytes]:
+  """Encodes a column, returning its header description and its data."""
+  column_type = _packed_column_type(column)
+  codecs = []
+  if column_type == 'json':
+    data = _convert_object_to_json(
+        list(column), sort_keys=False, indent=None, separators=(',', ':'))
+  else:
+    if column_type == 'int64' and compress and column:
+      deltas = [column[0]]
+      deltas.extend(b - a for a, b in zip(column, column[1:]))
+      if all(_INT64_MIN <= delta <= _INT64_MAX for delta in deltas):
+        column = deltas
+        codecs.append('delta')
+    typed = array.array(_ARRAY_TYPECODES[column_type], column)
+    if sys.byteorder != 'little':
+      typed.byteswap()
+    data = typed.tobytes()
+  if compress:
+    data = zlib.compress(data)
+    codecs.append('zlib')
+  return {'type': column_type, 'codecs': codecs, 'size': len(data)}, data
+
+
+def _decode_packed_column(description: dict, data: bytes) -> List[Any]:
+  """Reverses _encode_packed_column."""
+  codecs = description['codecs']
+  if 'zlib' in codecs:
+    data = zlib.decompress(data)
+  if description['type'] == 'json':
+    return json.loads(data)
+  typed = array.array(_ARRAY_TYPECODES[description['type']])
+  typed.frombytes(data)
+  if sys.byteorder != 'little':
+    typed.byteswap()
+  column = typed.tolist()
+  if 'delta' in codecs:
+    column = list(itertools.accumulate(column))
+  return column
+
+
+def _pack_multidim(outcome_str, name, dims, value, compress):
+  """Encodes multi-dim attachment fields using the packed encoding."""
+  column_descriptions = []
+  column_data = []
+  if value is not None:
+    for column in zip(*value):
+      description, data = _encode_packed_column(column, compress)
+      column_descriptions.append(description)
+      column_data.append(data)
+  header = _convert_object_to_json({
+      'outcome': outcome_str,
+      'name': name,
+      'dimensions': dims,
+      'num_points': None if value is None else len(value),
+      'columns': column_descriptions,
+  }, indent=None)
+  return b''.join([MULTIDIM_PACKED_MAGIC,
+                   _PACKED_HEADER_LENGTH.pack(len(header)), header] +
+                  column_data)
+
+
+def is_packed_multidim(data: bytes) -> bool:
+  """Returns True if the attachment data uses the packed multi-dim encoding."""
+  return data[:len(MULTIDIM_PACKED_MAGIC)] == MULTIDIM_PACKED_MAGIC
+
+
+def _unpack_multidim(data):
+  """Decodes packed multi-dim data to the MULTIDIM_JSON dict representation."""
+  offset = len(MULTIDIM_PACKED_MAGIC)
+  header_length, = _PACKED_HEADER_LENGTH.unpack_from(data, offset)
+  offset += _PACKED_HEADER_LENGTH.size
+  header = json.loads(data[offset:offset + header_length])
+  offset += header_length
+  columns = []
+  for description in header.pop('columns'):
+    end = offset + description['size']
+    columns.append(_decode_packed_column(description, data[offset:end]))
+    offset = end
+  num_points = header.pop('num_points')
+  if num_points is None:
+    header['value'] = None
+  else:
+    header['value'] = [list(row) for row in zip(*columns)]
+  return header
+
+
+def convert_multidim_measurements(all_phases, packed=False):
+  """Converts each multidim measurements into attachments for all phases.
+
+  Args:
+    all_phases: The phase records to convert; these are modified in place.
+    packed: If True, use the packed binary encoding for the attachments.
+
+  Returns:
+    The phases now modified.
+  """
   # Combine actual attachments with attachments we make from multi-dim
   # measurements.
   attachment_names = list(itertools.chain.from_iterable(
@@ -376,7 +610,8 @@ def convert_multidim_measurements(all_phases):
       if measurement.dimensions:
         old_name = name
         name = attachment_name_maker.make_unique('multidim_%s' % name)
-        attachment = multidim_measurement_to_attachment(name, measurement)
+        attachment = multidim_measurement_to_attachment(
+            name, measurement, packed=packed)
         phase.attachments[name] = attachment
         phase.measurements.pop(old_name)
   return all_phases
@@ -530,13 +765,63 @@ class PhaseCopier(object):
       attachment.type = test_runs_pb2.BINARY
 
 
-def test_record_from_mfg_event(mfg_event):
-  """Extract the original test_record saved as an attachment on a mfg_event."""
-  for attachment in mfg_event.attachment:
-    if attachment.name == TEST_RECORD_ATTACHMENT_NAME:
-      return json.loads(attachment.value_binary)
+def test_record_from_mfg_event(
+    mfg_event: mfg_event_pb2.MfgEvent,
+    record_json_store: Optional[Mapping[str, bytes]] = None,
+) -> Dict[str, Any]:
+  """Extract the original test_record saved as an attachment on a mfg_event.
 
-  raise ValueError('Could not find test record JSON in the given MfgEvent.')
+  Args:
+    mfg_event: The MfgEvent to extract the record from.
+    record_json_store: The mapping the full record JSON was saved to, required
+      if the MfgEvent was created with RecordJsonMode.REFERENCE.
+
+  Returns:
+    The test record as a dict of base types.
+
+  Raises:
+    ValueError: If the record JSON cannot be found.
+  """
+  attachments = {
+      attachment.name: attachment for attachment in mfg_event.attachment
+  }
+  if TEST_RECORD_ATTACHMENT_NAME not in attachments:
+    raise ValueError('Could not find test record JSON in the given MfgEvent.')
+  record = json.loads(attachments[TEST_RECORD_ATTACHMENT_NAME].value_binary)
+
+  if RECORD_JSON_SHA1_KEY in record:
+    sha1 = record[RECORD_JSON_SHA1_KEY]
+    if record_json_store is None or sha1 not in record_json_store:
+      raise ValueError(
+          'The MfgEvent references test record JSON %s which is not in the '
+          'given record_json_store.' % sha1)
+    return json.loads(record_json_store[sha1])
+
+  # Restore the fields dropped by RecordJsonMode.SLIM.
+  if 'log_records' not in record:
+    record['log_records'] = [
+        _log_record_from_test_log(test_log) for test_log in mfg_event.test_logs
+    ]
+  metadata = record.get('metadata')
+  if (metadata is not None and 'config' not in metadata and
+      CONFIG_ATTACHMENT_NAME in attachments):
+    metadata['config'] = json.loads(
+        attachments[CONFIG_ATTACHMENT_NAME].value_binary)
+  return record
+
+
+def _log_record_from_test_log(test_log):
+  """Returns the base type representation of a logs.LogRecord."""
+  # The Level enum values match the python logging levels.
+  return {
+      'level': (test_log.levelno
+                if test_log.HasField('levelno') else test_log.level),
+      'logger_name': test_log.logger_name,
+      'source': test_log.log_source,
+      'lineno': test_log.lineno,
+      'timestamp_millis': test_log.timestamp_millis,
+      'message': test_log.log_message,
+  }
 
 
 def attachment_to_multidim_measurement(attachment, name=None):
@@ -545,6 +830,8 @@ def attachment_to_multidim_measurement(attachment, name=None):
   This is a best effort attempt to reverse, as some data is lost in converting
   from a multidim to an attachment.
 
+  Both the MULTIDIM_JSON and the packed binary encodings are supported.
+
   Args:
     attachment: an `openhtf.test_record.Attachment` from a multi-dim.
     name: an optional name for the measurement.  If not provided will use the
@@ -553,7 +840,11 @@ def attachment_to_multidim_measurement(attachment, name=None):
   Returns:
     An multi-dim `openhtf.Measurement`.
   """
-  data = json.loads(attachment.data)
+  raw_data = attachment.data
+  if is_packed_multidim(raw_data):
+    data = _unpack_multidim(raw_data)
+  else:
+    data = json.loads(raw_data)
 
   name = name or data.get('name')
   # attachment_dimn are a list of dicts with keys 'uom_suffix' and 'uom_code'
@@ -597,13 +888,14 @@ def attachment_to_multidim_measurement(attachment, name=None):
     units_ = None
     dimensions = dims
 
-  # created dimensioned_measured_value and populate with values.
+  # created dimensioned_measured_value and populate with values.  The values
+  # are inserted in bulk, so the base type cache is rebuilt lazily if needed.
   measured_value = measurements.DimensionedMeasuredValue(
-      name=name, num_dimensions=len(dimensions))
-  for row in attachment_values:
-    coordinates = tuple(row[:-1])
-    val = row[-1]
-    measured_value[coordinates] = val
+      name=name,
+      num_dimensions=len(dimensions),
+      value_dict=collections.OrderedDict(
+          (tuple(row[:-1]), row[-1]) for row in attachment_values or ()),
+      cached_basetype_values=None)  # pyrefly: ignore[unexpected-keyword]
 
   measurement = measurements.Measurement(
       name=name,
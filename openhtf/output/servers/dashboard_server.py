@@ -14,6 +14,11 @@
 
 """Serves a list of stations found via multicast.
 
+Stations announce themselves with multicast heartbeats, and as soon as their
+info changes.  The dashboard keeps track of when each station is due for its
+next heartbeat, and marks it UNREACHABLE when it misses a few of them or
+announces it is going offline.
+
 Run with:
     python -m openhtf.output.servers.dashboard_server
 """
@@ -22,6 +27,7 @@ import argparse
 import collections
 import json
 import logging
+import math
 import socket
 import threading
 import time
@@ -32,13 +38,22 @@ from openhtf.output.servers import web_gui_server
 from openhtf.output.web_gui import web_launcher
 from openhtf.util import data
 from openhtf.util import multicast
-import sockjs.tornado
 import tornado.web
 
 _LOG = logging.getLogger(__name__)
 
 DASHBOARD_SERVER_TYPE = 'dashboard'
 
+# Heartbeats a station may miss before it is considered UNREACHABLE.
+MISSED_HEARTBEATS = 3
+# Seconds a station may stay UNREACHABLE before it is removed from the list.
+UNREACHABLE_TTL_S = 3600
+# Seconds to wait for responses to discovery queries.
+_QUERY_TIMEOUT_S = 2
+# Seconds between discovery queries, for the stations that don't announce
+# themselves.
+DEFAULT_QUERY_INTERVAL_S = 10
+
 
 class StationInfo(  # pylint: disable=missing-class-docstring
     collections.namedtuple('StationInfo', [
@@ -77,7 +92,7 @@ def _discover(**kwargs):
 class StationListHandler(tornado.web.RequestHandler):
   """GET endpoint for the list of available stations.
 
-  Sends the same message provided by DashboardPubSub.
+  Sends the map of all the stations, as in DashboardPubSub snapshots.
   """
 
   def get(self):  # pyrefly: ignore[bad-override]
@@ -85,38 +100,135 @@ class StationListHandler(tornado.web.RequestHandler):
 
 
 class DashboardPubSub(pub_sub.PubSub):
-  """WebSocket endpoint for the list of available stations."""
+  """WebSocket endpoint for the list of available stations.
+
+  Subscribers connecting with the deltas=1 query argument first receive a
+  snapshot of all the stations:
+
+    {'type': 'snapshot', 'sequence': 12, 'stations': {host_port: station}}
+
+  then only the stations added, changed or removed since the previous message:
+
+    {'type': 'delta', 'sequence': 13, 'added': {host_port: station},
+     'changed': {host_port: station}, 'removed': [host_port]}
+
+  The sequence number is incremented for each delta, a snapshot has the
+  sequence number of the last delta it includes.  Subscribers that fell behind
+  get a new snapshot instead of the deltas they missed.
+
+  Other subscribers, eg web GUIs built before deltas, receive the map of all the
+  stations, {host_port: station}, whenever any of them changes.
+  """
   _lock = threading.Lock()  # Required by pub_sub.PubSub.  # pyrefly: ignore[bad-override]
   subscribers = set()  # Required by pub_sub.PubSub.  # pyrefly: ignore[bad-override]
-  last_message = None
+  sequence = 0
   station_map = {}
   station_map_lock = threading.Lock()
-
-  def on_subscribe(self, unused_info):
+  # Stations as last published, in base types, and the host:ports of the
+  # stations that may have changed since.
+  _published_stations = {}
+  _dirty_host_ports = set()
+  # Map of host:port to the time.monotonic() the station became UNREACHABLE.
+  _unreachable_since = {}
+
+  def __init__(self, session):
+    super(DashboardPubSub, self).__init__(session)
+    self.deltas = False
+
+  def on_subscribe(self, info):
     """Called by the base class when a client connects."""
-    if self.last_message is not None:
-      self.send(self.last_message)
+    self.deltas = info.get_argument('deltas') == '1'
+    self._send_snapshot()
+
+  def on_messages_dropped(self):
+    """Called by the base class when deltas were dropped for a slow client."""
+    self._send_snapshot()
+
+  def _send_snapshot(self):
+    with self.station_map_lock:
+      if not self.deltas:
+        self.send(dict(self._published_stations))
+        return
+      self.send({
+          'type': 'snapshot',
+          'sequence': self.sequence,
+          'stations': dict(self._published_stations),
+      })
+
+  @classmethod
+  def _set_station(cls, host_port, station_info):
+    """Sets a station in the station map, with station_map_lock held."""
+    if cls.station_map.get(host_port) == station_info:
+      return
+    cls.station_map[host_port] = station_info
+    cls._dirty_host_ports.add(host_port)
+    if station_info.status != 'UNREACHABLE':
+      cls._unreachable_since.pop(host_port, None)
+    elif host_port not in cls._unreachable_since:
+      cls._unreachable_since[host_port] = time.monotonic()
 
   @classmethod
-  def update_stations(cls, station_info_list):
-    """Called by the station discovery loop to update the station map."""
+  def update_station(cls, station_info):
+    """Add or update a single station in the station map."""
+    host_port = '%s:%s' % (station_info.host, station_info.port)
     with cls.station_map_lock:
+      cls._set_station(host_port, station_info)
 
-      # By default, assume old stations are unreachable.
-      for host_port, station_info in cls.station_map.items():
-        cls.station_map[host_port] = station_info._replace(status='UNREACHABLE')
+  @classmethod
+  def remove_stations(cls, host_ports):
+    """Remove the given host:ports from the station map."""
+    with cls.station_map_lock:
+      for host_port in host_ports:
+        cls._unreachable_since.pop(host_port, None)
+        if cls.station_map.pop(host_port, None) is not None:
+          cls._dirty_host_ports.add(host_port)
 
-      for station_info in station_info_list:
-        host_port = '%s:%s' % (station_info.host, station_info.port)
-        cls.station_map[host_port] = station_info
+  @classmethod
+  def remove_unreachable_stations(cls, ttl_s=UNREACHABLE_TTL_S):
+    """Remove the stations that have been UNREACHABLE for more than ttl_s."""
+    deadline = time.monotonic() - ttl_s
+    with cls.station_map_lock:
+      host_ports = [
+          host_port for host_port, since in cls._unreachable_since.items()
+          if since <= deadline
+      ]
+    cls.remove_stations(host_ports)
 
   @classmethod
   def publish_if_new(cls):
-    """If the station map has changed, publish the new information."""
-    message = cls.make_message()
-    if message != cls.last_message:
-      super(DashboardPubSub, cls).publish(message)
-      cls.last_message = message
+    """If any station has changed, publish a delta of the changes."""
+    with cls.station_map_lock:
+      delta = {'added': {}, 'changed': {}, 'removed': []}
+      for host_port in sorted(cls._dirty_host_ports):
+        published = cls._published_stations.get(host_port)
+        station_info = cls.station_map.get(host_port)
+        if station_info is None:
+          if published is not None:
+            delta['removed'].append(host_port)
+            del cls._published_stations[host_port]
+          continue
+        station = data.convert_to_base_types(station_info)
+        if published is None:
+          delta['added'][host_port] = station
+        elif station != published:
+          delta['changed'][host_port] = station
+        else:
+          continue
+        cls._published_stations[host_port] = station
+      cls._dirty_host_ports.clear()
+
+      if delta['added'] or delta['changed'] or delta['removed']:
+        cls.sequence += 1
+        delta.update(type='delta', sequence=cls.sequence)
+        # Publish with the lock held, so that snapshots sent to new subscribers
+        # and deltas are sent in sequence.
+        super(DashboardPubSub, cls).publish(
+            delta, client_filter=lambda client: client.deltas)
+        # Only the latest map matters to subscribers without deltas.
+        super(DashboardPubSub, cls).publish(
+            dict(cls._published_stations),
+            client_filter=lambda client: not client.deltas,
+            coalesce_key='stations')
 
   @classmethod
   def make_message(cls):
@@ -124,13 +236,190 @@ class DashboardPubSub(pub_sub.PubSub):
       return data.convert_to_base_types(cls.station_map)
 
 
+class StationDiscovery(threading.Thread):
+  """Keeps a liveness table of the stations announcing themselves.
+
+  Each station is considered reachable until it misses MISSED_HEARTBEATS of its
+  heartbeats, or announces it is going offline.  Stations are also queried for
+  on start, and then every query_interval_s, from a separate thread, to find the
+  stations that don't announce themselves.  The update callback is called with
+  the StationInfo of a station as soon as it is announced or becomes
+  UNREACHABLE.
+  """
+  daemon = True
+
+  def __init__(self,
+               update_callback,
+               query_interval_s=DEFAULT_QUERY_INTERVAL_S,
+               **multicast_kwargs):
+    """Constructor.
+
+    Args:
+      update_callback: Function called with the StationInfo of a station when
+        it is announced, or marked UNREACHABLE.  Calls are serialized.
+      query_interval_s: Seconds between discovery queries, 0 to only query on
+        start, in which case the stations only found by the query never
+        expire.
+      **multicast_kwargs: The multicast address, port, ttl and local_only, see
+        multicast.send.
+    """
+    super(StationDiscovery, self).__init__(name=type(self).__name__)
+    self._update_callback = update_callback
+    self._query_interval_s = query_interval_s
+    self._multicast_kwargs = multicast_kwargs
+    self._listener = multicast.MulticastListener(
+        self._handle_message,
+        pass_sender=True,
+        **{
+            attr: value
+            for attr, value in multicast_kwargs.items()
+            if attr in ('address', 'port', 'ttl')
+        })
+    self._query_thread = threading.Thread(
+        target=self._query_loop, name='%sQuery' % type(self).__name__)
+    self._query_thread.daemon = True
+    # Serializes the calls to the update callback, and is acquired before
+    # _condition so the callback is called in the order of the updates, but
+    # without holding _condition.
+    self._callback_lock = threading.Lock()
+    self._condition = threading.Condition()
+    # Map of host:port to the StationInfo, expiration time and whether the
+    # expiration comes from the heartbeats of the stations considered
+    # reachable.
+    self._live_stations = {}
+    # Whether _live_stations changed since the expirations were last checked.
+    self._changed = False
+    self._stopped = False
+
+  def stop(self, timeout_s=None):
+    with self._condition:
+      self._stopped = True
+      self._condition.notify_all()
+    self._listener.stop(timeout_s=0)
+    self.join(timeout_s)
+
+  def update(self, station_info, ttl_s, heartbeat=True):
+    """Update a station, which is considered reachable for ttl_s if ONLINE.
+
+    Args:
+      station_info: The StationInfo of the station.
+      ttl_s: Seconds the station is considered reachable for if ONLINE.
+      heartbeat: False if the station was found by a query, in which case the
+        expiration derived from its heartbeats is kept if it has one, as the
+        query's TTL is much longer.
+    """
+    host_port = '%s:%s' % (station_info.host, station_info.port)
+    with self._callback_lock:
+      with self._condition:
+        if station_info.status == 'ONLINE':
+          previous = self._live_stations.get(host_port)
+          if not heartbeat and previous is not None and previous[2]:
+            self._live_stations[host_port] = (station_info,) + previous[1:]
+          else:
+            self._live_stations[host_port] = (station_info,
+                                              time.monotonic() + ttl_s,
+                                              heartbeat)
+        else:
+          self._live_stations.pop(host_port, None)
+        # The next expiration may have changed.
+        self._changed = True
+        self._condition.notify_all()
+      self._update_callback(station_info)
+
+  def expire(self, now):
+    """Mark the stations that expired at time now UNREACHABLE.
+
+    Args:
+      now: The current time.monotonic().
+
+    Returns:
+      The time the next station expires at, or None if none is reachable.
+    """
+    with self._callback_lock:
+      with self._condition:
+        expired = []
+        for host_port, (station_info, expiration, _) in list(
+            self._live_stations.items()):
+          if expiration <= now:
+            del self._live_stations[host_port]
+            expired.append(station_info._replace(status='UNREACHABLE'))
+        next_expiration = min(
+            (expiration for _, expiration, _ in self._live_stations.values()),
+            default=None)
+      for station_info in expired:
+        self._update_callback(station_info)
+    return next_expiration
+
+  def _handle_message(self, message, host):
+    """Called by the multicast listener with each message received."""
+    if not message.startswith(station_server.MULTICAST_ANNOUNCEMENT):
+      return
+    try:
+      result = json.loads(message[len(station_server.MULTICAST_ANNOUNCEMENT):])
+      station_info = StationInfo(result['cell'], host, result['port'],
+                                 result['station_id'],
+                                 'ONLINE' if result['online'] else 'UNREACHABLE',
+                                 result.get('test_description'),
+                                 result['test_name'])
+      ttl_s = MISSED_HEARTBEATS * float(result['heartbeat_interval_s'])
+    except (ValueError, KeyError, TypeError):
+      _LOG.warning('Received bad multicast announcement from %s: %s', host,
+                   message)
+      return
+    self.update(station_info, ttl_s)
+
+  def _query(self):
+    """Query for the stations, including those that don't announce themselves."""
+    # Consider the stations reachable until a few queries went unanswered, or
+    # forever if they won't be queried again.
+    ttl_s = float('inf')
+    if self._query_interval_s:
+      ttl_s = MISSED_HEARTBEATS * max(self._query_interval_s, _QUERY_TIMEOUT_S)
+    for station_info in _discover(
+        timeout_s=_QUERY_TIMEOUT_S, **self._multicast_kwargs):
+      self.update(station_info, ttl_s, heartbeat=False)
+
+  def _query_loop(self):
+    """Queries for the stations every query_interval_s until stopped."""
+    while True:
+      self._query()
+      with self._condition:
+        if not self._query_interval_s:
+          return
+        self._condition.wait_for(lambda: self._stopped, self._query_interval_s)
+        if self._stopped:
+          return
+
+  def run(self):
+    self._listener.start()
+    self._query_thread.start()
+    while True:
+      next_expiration = self.expire(time.monotonic())
+      with self._condition:
+        if self._stopped:
+          return
+        if not self._changed:
+          # Woken up early when a station is updated, its expiration may be
+          # the next one.
+          timeout_s = None
+          if next_expiration is not None and not math.isinf(next_expiration):
+            timeout_s = max(0, next_expiration - time.monotonic())
+          self._condition.wait(timeout_s)
+        self._changed = False
+
+
 class DashboardServer(web_gui_server.WebGuiServer):
   """Serves a list of known stations and an Angular frontend."""
 
   def __init__(self, port):
-    dash_router = sockjs.tornado.SockJSRouter(DashboardPubSub, '/sub/dashboard')
+    dash_router = pub_sub.SockJSRouter(DashboardPubSub, '/sub/dashboard')
     routes = dash_router.urls + [
         ('/station_list', StationListHandler),
+        ('/subscribers', pub_sub.ClientStatsHandler, {
+            'pub_subs': {
+                'dashboard': DashboardPubSub
+            }
+        }),
     ]
     super(DashboardServer, self).__init__(routes, port)
 
@@ -160,8 +449,14 @@ def main():
   parser.add_argument(
       '--discovery-interval-s',
       type=int,
-      default=1,
-      help='Seconds between station discovery attempts.')
+      default=DEFAULT_QUERY_INTERVAL_S,
+      help=('Seconds between queries for stations that do not announce '
+            'themselves, 0 to only query on start.'))
+  parser.add_argument(
+      '--unreachable-ttl-s',
+      type=int,
+      default=UNREACHABLE_TTL_S,
+      help='Seconds after which UNREACHABLE stations are removed from the list.')
   parser.add_argument(
       '--launch-web-gui',
       default=True,
@@ -207,14 +502,23 @@ def main():
         if getattr(args, 'station_discovery_%s' % attr) is not None
     }
 
+    def on_station_update(station_info):
+      DashboardPubSub.update_station(station_info)
+      DashboardPubSub.publish_if_new()
+
     _LOG.info('Starting station discovery.')
+    discovery = StationDiscovery(on_station_update, args.discovery_interval_s,
+                                 **multicast_kwargs)
+    discovery.start()
 
     # Exit on CTRL+C.
-    while True:
-      stations = _discover(**multicast_kwargs)
-      DashboardPubSub.update_stations(list(stations))
-      DashboardPubSub.publish_if_new()
-      time.sleep(args.discovery_interval_s)
+    try:
+      while discovery.is_alive():
+        discovery.join(1)
+        DashboardPubSub.remove_unreachable_stations(args.unreachable_ttl_s)
+        DashboardPubSub.publish_if_new()
+    finally:
+      discovery.stop(timeout_s=1)
 
 
 if __name__ == '__main__':
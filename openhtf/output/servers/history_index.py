@@ -0,0 +1,427 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""SQLite-backed index of the MfgEvent history served by the station server.
+
+The station server history folder holds one serialized MfgEvent per test run,
+ideally named 'mfg_event_{dut_id}_{start_time_millis}.pb'.  Listing, stat'ing
+and parsing every file on each request does not scale to stations that have
+produced hundreds of thousands of records, so this module keeps a persistent
+index of the records next to them.
+
+The index is populated in two ways:
+  * sync() indexes files already in the folder (eg written by a previous
+    version or another process) and drops rows for files that were removed.
+    sync_if_changed() only does so if files were added to or removed from the
+    folder since the last sync, so it can be called before each query.
+  * HistoryIndex instances are output callbacks.  Add one after the callback
+    that writes the MfgEvent to the history folder, using the same filename
+    pattern, and each new record is indexed without parsing it back from disk.
+
+Decoded MfgEvents are kept in a small LRU cache so that opening a record and
+then its attachments only parses the file once.
+"""
+
+import collections
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Text, Tuple, Union
+
+from openhtf import util
+from openhtf.core import test_record
+from openhtf.output.proto import mfg_event_converter
+from openhtf.output.proto import mfg_event_pb2
+from openhtf.output.proto import test_runs_converter
+from openhtf.output.proto import test_runs_pb2
+from openhtf.util import data
+
+_LOG = logging.getLogger(__name__)
+
+DEFAULT_FILENAME_PATTERN = 'mfg_event_{dut_id}_{start_time_millis}.pb'
+DEFAULT_INDEX_FILENAME = '.openhtf_history_index.sqlite3'
+DEFAULT_CACHE_SIZE = 16
+# Files can be added to the history folder without changing its mtime within
+# the timestamp granularity of some filesystems, so folders modified more
+# recently than this are synced regardless.
+_MTIME_GRANULARITY_NS = 2 * 10**9
+
+_HISTORY_FILE_EXTENSION = '.pb'
+_HISTORY_FILENAME_RE = re.compile(r'mfg_event_(.+)_(\d+)\.pb$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+  id INTEGER PRIMARY KEY,
+  file_name TEXT NOT NULL UNIQUE,
+  dut_id TEXT,
+  station_id TEXT,
+  start_time_millis INTEGER,
+  end_time_millis INTEGER,
+  outcome TEXT
+);
+CREATE INDEX IF NOT EXISTS records_dut_id ON records (dut_id);
+CREATE INDEX IF NOT EXISTS records_start_time_millis
+  ON records (start_time_millis);
+CREATE INDEX IF NOT EXISTS records_outcome ON records (outcome);
+CREATE TABLE IF NOT EXISTS phases (
+  record_id INTEGER NOT NULL REFERENCES records (id) ON DELETE CASCADE,
+  name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phases_name ON phases (name, record_id);
+CREATE TABLE IF NOT EXISTS measurements (
+  record_id INTEGER NOT NULL REFERENCES records (id) ON DELETE CASCADE,
+  name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS measurements_name ON measurements (name, record_id);
+"""
+
+_RECORD_COLUMNS = ('file_name', 'dut_id', 'station_id', 'start_time_millis',
+                   'end_time_millis', 'outcome')
+
+
+class HistoryItemNotFoundError(Exception):
+  """Raised when a history file or attachment cannot be found."""
+
+
+class _HistoryEntry(object):
+  """A decoded history file."""
+
+  __slots__ = ('mtime', 'mfg_event', '_record')
+
+  def __init__(self, mtime: float, mfg_event: mfg_event_pb2.MfgEvent):
+    self.mtime = mtime
+    self.mfg_event = mfg_event
+    self._record = None
+
+  @property
+  def record(self) -> Dict[Text, Any]:
+    if self._record is None:
+      self._record = mfg_event_converter.test_record_from_mfg_event(
+          self.mfg_event)
+    return self._record
+
+
+def _outcome_from_test_record(record: test_record.TestRecord) -> Optional[Text]:
+  """Returns the MfgEvent status name for a TestRecord's outcome."""
+  if record.marginal:
+    return test_runs_pb2.Status.Name(test_runs_pb2.MARGINAL_PASS)
+  if record.outcome not in test_runs_converter.OUTCOME_MAP:
+    return None
+  return test_runs_pb2.Status.Name(
+      test_runs_converter.OUTCOME_MAP[record.outcome])
+
+
+class HistoryIndex(object):
+  """Persistent, queryable index of the MfgEvent files in a history folder.
+
+  Instances are thread safe; the station server queries them from the Tornado
+  thread while output callbacks add records from the test thread.
+  """
+
+  def __init__(self,
+               history_path: Union[Text, os.PathLike],
+               filename_pattern: Union[Text, Callable[..., Text]] = (
+                   DEFAULT_FILENAME_PATTERN),
+               index_path: Optional[Union[Text, os.PathLike]] = None,
+               cache_size: int = DEFAULT_CACHE_SIZE):
+    """Opens (or creates) the index for the given history folder.
+
+    Args:
+      history_path: Folder holding the serialized MfgEvents.
+      filename_pattern: Pattern (or callable returning one) used to name the
+        history files, formatted with the test record like
+        callbacks.OutputToFile.  Used when indexing from the output callback.
+      index_path: Path of the SQLite database; defaults to a hidden file in the
+        history folder.
+      cache_size: Number of decoded MfgEvents to keep in memory.
+    """
+    self.history_path = os.fspath(history_path)
+    self.filename_pattern = filename_pattern
+    self.index_path = os.fspath(index_path) if index_path else os.path.join(
+        self.history_path, DEFAULT_INDEX_FILENAME)
+    self._cache_size = cache_size
+    self._cache = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self._sync_lock = threading.Lock()
+    # Modification time of the history folder when it was last synced.
+    self._synced_mtime_ns = None
+    self._connection = sqlite3.connect(
+        self.index_path, check_same_thread=False, isolation_level=None)
+    self._connection.execute('PRAGMA foreign_keys = ON')
+    self._connection.execute('PRAGMA journal_mode = WAL')
+    self._connection.executescript(_SCHEMA)
+
+  @property
+  def synced(self) -> bool:
+    """True once the index was synced with the history folder."""
+    return self._synced_mtime_ns is not None
+
+  def close(self) -> None:
+    with self._lock:
+      self._connection.close()
+      self._cache.clear()
+
+  def __call__(self, record: test_record.TestRecord) -> None:
+    """Output callback indexing a record saved with filename_pattern."""
+    # Ignore keys for the filename to not convert larger data structures.
+    record_dict = data.convert_to_base_types(
+        record, ignore_keys=('code_info', 'phases', 'log_records'))
+    file_name = os.path.basename(
+        util.format_string(self.filename_pattern, record_dict))
+    self.index_test_record(file_name, record)
+
+  def index_test_record(self, file_name: Text,
+                        record: test_record.TestRecord) -> None:
+    """Adds or replaces the index entry of file_name from a TestRecord."""
+    measurement_names = []
+    for phase in record.phases:
+      measurement_names.extend(phase.measurements or ())
+    self._insert(
+        (file_name, record.dut_id, record.station_id, record.start_time_millis,
+         record.end_time_millis, _outcome_from_test_record(record)),
+        [phase.name for phase in record.phases], measurement_names)
+
+  def index_mfg_event(self, file_name: Text,
+                      mfg_event: mfg_event_pb2.MfgEvent) -> None:
+    """Adds or replaces the index entry of file_name from its MfgEvent."""
+    measurement_names = [
+        measurement.name for measurement in mfg_event.measurement
+    ]
+    # Multi-dim measurements are only stored as attachments.
+    measurement_names.extend(
+        attachment.name[len('multidim_'):]
+        for attachment in mfg_event.attachment
+        if attachment.name.startswith('multidim_'))
+    outcome = (
+        test_runs_pb2.Status.Name(mfg_event.test_status)
+        if mfg_event.HasField('test_status') else None)
+    self._insert(
+        (file_name, mfg_event.dut_serial or None, mfg_event.tester_name or None,
+         mfg_event.start_time_ms, mfg_event.end_time_ms, outcome),
+        [phase.name for phase in mfg_event.phases], measurement_names)
+
+  def _insert(self, row: Tuple[Any, ...], phase_names: Iterable[Text],
+              measurement_names: Iterable[Text]) -> None:
+    with self._lock:
+      with self._transaction():
+        # Deleting cascades to the phase and measurement rows.
+        self._connection.execute('DELETE FROM records WHERE file_name = ?',
+                                 (row[0],))
+        record_id = self._connection.execute(
+            'INSERT INTO records (%s) VALUES (?, ?, ?, ?, ?, ?)' %
+            ', '.join(_RECORD_COLUMNS), row).lastrowid
+        self._connection.executemany(
+            'INSERT INTO phases (record_id, name) VALUES (?, ?)',
+            ((record_id, name) for name in set(phase_names)))
+        self._connection.executemany(
+            'INSERT INTO measurements (record_id, name) VALUES (?, ?)',
+            ((record_id, name) for name in set(measurement_names)))
+      self._cache.pop(row[0], None)
+
+  def _transaction(self):
+    # The connection is in autocommit mode; the context manager of a
+    # connection commits or rolls back an explicitly started transaction.
+    self._connection.execute('BEGIN')
+    return self._connection
+
+  def sync(self) -> None:
+    """Brings the index up to date with the files in the history folder.
+
+    Files that are not indexed yet are parsed and added, and rows of files that
+    no longer exist are removed.  Files that cannot be parsed are indexed by
+    the DUT ID and start time in their name only.
+    """
+    with self._sync_lock:
+      # Files added while scanning change the mtime again, so that the next
+      # sync_if_changed() picks them up.
+      mtime_ns = os.stat(self.history_path).st_mtime_ns
+      self._sync()
+      self._synced_mtime_ns = mtime_ns
+
+  def sync_if_changed(self) -> None:
+    """Calls sync() if files were added or removed since the last sync."""
+    mtime_ns = os.stat(self.history_path).st_mtime_ns
+    if (mtime_ns != self._synced_mtime_ns or
+        time.time_ns() - mtime_ns < _MTIME_GRANULARITY_NS):
+      self.sync()
+
+  def _sync(self) -> None:
+    on_disk = set()
+    for entry in os.scandir(self.history_path):
+      if entry.name.endswith(_HISTORY_FILE_EXTENSION) and entry.is_file():
+        on_disk.add(entry.name)
+
+    with self._lock:
+      indexed = {
+          row[0] for row in self._connection.execute(
+              'SELECT file_name FROM records')
+      }
+      removed = indexed - on_disk
+      if removed:
+        with self._transaction():
+          self._connection.executemany(
+              'DELETE FROM records WHERE file_name = ?',
+              ((file_name,) for file_name in removed))
+
+    for file_name in sorted(on_disk - indexed):
+      try:
+        mfg_event = self._read_mfg_event(file_name)
+      except Exception:  # pylint: disable=broad-except
+        _LOG.warning('Unable to parse history file %s.', file_name,
+                     exc_info=True)
+        match = _HISTORY_FILENAME_RE.match(file_name)
+        if match is None:
+          row = (file_name, None, None, None, None, None)
+        else:
+          row = (file_name, match.group(1), None, int(match.group(2)), None,
+                 None)
+        self._insert(row, (), ())
+      else:
+        self.index_mfg_event(file_name, mfg_event)
+
+  def query(self,
+            dut_ids: Iterable[Text] = (),
+            start_times_millis: Iterable[int] = (),
+            min_start_time_millis: Optional[int] = None,
+            max_start_time_millis: Optional[int] = None,
+            outcomes: Iterable[Text] = (),
+            phase_names: Iterable[Text] = (),
+            measurement_names: Iterable[Text] = (),
+            limit: Optional[int] = None,
+            offset: int = 0) -> List[Dict[Text, Any]]:
+    """Returns indexed records, most recent first.
+
+    Each iterable filter matches records having any of the given values; an
+    empty iterable does not filter.
+
+    Args:
+      dut_ids: DUT IDs to match.
+      start_times_millis: Exact start times to match.
+      min_start_time_millis: Inclusive lower bound of the start time.
+      max_start_time_millis: Inclusive upper bound of the start time.
+      outcomes: MfgEvent status names to match, eg PASS or MARGINAL_PASS.
+      phase_names: Match records with any phase of these names.
+      measurement_names: Match records with any measurement of these names.
+      limit: Maximum number of records to return.
+      offset: Number of records to skip, for pagination.
+
+    Returns:
+      A list of dicts with file_name, dut_id, station_id, start_time_millis,
+      end_time_millis and outcome keys.
+    """
+    clauses = []
+    params = []
+
+    def add_in_clause(column, values):
+      values = list(values)
+      if values:
+        clauses.append('%s IN (%s)' % (column, ', '.join('?' * len(values))))
+        params.extend(values)
+
+    add_in_clause('dut_id', dut_ids)
+    add_in_clause('start_time_millis', start_times_millis)
+    add_in_clause('outcome', outcomes)
+    if min_start_time_millis is not None:
+      clauses.append('start_time_millis >= ?')
+      params.append(min_start_time_millis)
+    if max_start_time_millis is not None:
+      clauses.append('start_time_millis <= ?')
+      params.append(max_start_time_millis)
+    for table, names in (('phases', phase_names),
+                         ('measurements', measurement_names)):
+      names = list(names)
+      if names:
+        clauses.append(
+            'id IN (SELECT record_id FROM %s WHERE name IN (%s))' %
+            (table, ', '.join('?' * len(names))))
+        params.extend(names)
+
+    query = 'SELECT %s FROM records' % ', '.join(_RECORD_COLUMNS)
+    if clauses:
+      query += ' WHERE ' + ' AND '.join(clauses)
+    query += ' ORDER BY start_time_millis DESC, id DESC LIMIT ? OFFSET ?'
+    params.extend((-1 if limit is None else limit, offset))
+
+    with self._lock:
+      rows = self._connection.execute(query, params).fetchall()
+    return [dict(zip(_RECORD_COLUMNS, row)) for row in rows]
+
+  def _history_file_path(self, file_name: Text) -> Text:
+    if os.path.basename(file_name) != file_name:
+      raise HistoryItemNotFoundError('Invalid history file name %s' % file_name)
+    return os.path.join(self.history_path, file_name)
+
+  def _read_mfg_event(self, file_name: Text) -> mfg_event_pb2.MfgEvent:
+    mfg_event = mfg_event_pb2.MfgEvent()
+    with open(self._history_file_path(file_name), 'rb') as history_file:
+      mfg_event.ParseFromString(history_file.read())
+    return mfg_event
+
+  def _get_entry(self, file_name: Text) -> _HistoryEntry:
+    """Returns the decoded history file, from the LRU cache if up to date."""
+    try:
+      mtime = os.stat(self._history_file_path(file_name)).st_mtime
+    except OSError as e:
+      raise HistoryItemNotFoundError(
+          'Unknown history file %s' % file_name) from e
+
+    with self._lock:
+      entry = self._cache.get(file_name)
+      if entry is not None and entry.mtime == mtime:
+        self._cache.move_to_end(file_name)
+        return entry
+
+    entry = _HistoryEntry(mtime, self._read_mfg_event(file_name))
+    with self._lock:
+      self._cache[file_name] = entry
+      while len(self._cache) > self._cache_size:
+        self._cache.popitem(last=False)
+    return entry
+
+  def get_record(self, file_name: Text) -> Dict[Text, Any]:
+    """Returns the test record of a history file as a dict of base types."""
+    return self._get_entry(file_name).record
+
+  def get_attachment(
+      self,
+      file_name: Text,
+      attachment_name: Text,
+      sha1: Optional[Text] = None) -> mfg_event_pb2.EventAttachment:
+    """Returns an attachment of a history file.
+
+    Args:
+      file_name: Name of the history file.
+      attachment_name: Name of the attachment.
+      sha1: Optional SHA-1 of the attachment data, used to find the attachment
+        if the name does not match (names are made unique in MfgEvents).
+
+    Returns:
+      The EventAttachment proto.
+
+    Raises:
+      HistoryItemNotFoundError: If the file or attachment cannot be found.
+    """
+    mfg_event = self._get_entry(file_name).mfg_event
+    for attachment in mfg_event.attachment:
+      if attachment.name == attachment_name:
+        return attachment
+    if sha1:
+      for attachment in mfg_event.attachment:
+        if hashlib.sha1(attachment.value_binary).hexdigest() == sha1:
+          return attachment
+    raise HistoryItemNotFoundError('Unknown attachment %s' % attachment_name)
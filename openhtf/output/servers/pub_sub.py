@@ -11,18 +11,135 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Generic pub/sub implementation using SockJS connections."""
+"""Generic pub/sub implementation using SockJS connections.
 
+Published messages are JSON-encoded once, then queued in a bounded outbox for
+each subscriber, which is flushed from the IOLoop the subscriber's connection
+runs on once its transport is done writing the previous messages.  Messages
+published with a coalesce_key replace any message with the same key still in
+the outbox, so a slow subscriber skips the intermediate states.  If an outbox
+overflows anyway, its messages are dropped and the subscriber is resynchronized,
+see PubSub.on_messages_dropped.
+
+Messages can be compressed.  Serve PubSubs with the SockJSRouter below, so the
+websocket transport negotiates permessage-deflate with clients that support it.
+Clients using a fallback transport, e.g. XHR streaming, can instead connect
+with the compression=deflate query argument to receive messages of at least
+DEFLATE_MIN_BYTES as:
+
+  {"encoding": "deflate", "data": "<base64 of the zlib-compressed JSON>"}
+
+Each message is compressed at most once, however many clients receive it.
+
+The statistics of each subscriber, eg to find slow ones, can be served with the
+ClientStatsHandler below.
+"""
+
+import base64
+import collections
 import logging
+import threading
+import zlib
 
 from openhtf import util as htf_util
 import sockjs.tornado
+from sockjs.tornado import proto
+from sockjs.tornado.transports import websocket
+import tornado.ioloop
+import tornado.web
 
 _LOG = logging.getLogger(__name__)
 
+# Seconds to wait before checking again whether a subscriber's transport is done
+# writing.
+_WRITE_POLL_S = 0.05
+# zlib compression level of the messages, as for tornado's gzip responses.
+COMPRESSION_LEVEL = 6
+# Smaller messages aren't worth compressing for the fallback transports.
+DEFLATE_MIN_BYTES = 1024
+
+
+def deflate_message(encoded_message):
+  """Returns the JSON-encoded message compressed for fallback transports.
+
+  Args:
+    encoded_message: The JSON-encoded message.
+
+  Returns:
+    The JSON-encoded {'encoding': 'deflate', 'data': ...} wrapper of the
+    message, or the message itself if it is smaller than DEFLATE_MIN_BYTES.
+  """
+  if len(encoded_message) < DEFLATE_MIN_BYTES:
+    return encoded_message
+  data = zlib.compress(encoded_message.encode('utf-8'), COMPRESSION_LEVEL)
+  return proto.json_encode({
+      'encoding': 'deflate',
+      'data': base64.b64encode(data).decode('ascii'),
+  })
+
+
+class _LazyDeflatedMessage(object):
+  """Compresses a JSON-encoded message when first needed, then reuses it."""
+
+  def __init__(self, encoded_message):
+    self._encoded_message = encoded_message
+    self._deflated_message = None
+    self._lock = threading.Lock()
+
+  def get(self):
+    with self._lock:
+      if self._deflated_message is None:
+        self._deflated_message = deflate_message(self._encoded_message)
+      return self._deflated_message
+
+
+class CompressedWebSocketTransport(websocket.WebSocketTransport):
+  """SockJS websocket transport negotiating permessage-deflate."""
+
+  def get_compression_options(self):
+    return {'compression_level': COMPRESSION_LEVEL}
+
+
+class SockJSRouter(sockjs.tornado.SockJSRouter):
+  """SockJSRouter whose websocket transport supports compression."""
+
+  @property
+  def urls(self):
+    return [(url, CompressedWebSocketTransport
+             if handler is websocket.WebSocketTransport else handler, kwargs)
+            for url, handler, kwargs in super(SockJSRouter, self).urls]
+
 
 class PubSub(sockjs.tornado.SockJSConnection):
-  """Generic pub/sub based on SockJS connections."""
+  """Generic pub/sub based on SockJS connections.
+
+  Attributes:
+    max_outbox_messages: Messages that can be queued for a subscriber before
+      they are dropped.
+    remote_ip: IP address of the subscriber.
+    deflate: True if messages are compressed for the subscriber, see
+      deflate_message().
+    messages_sent: Number of messages sent to the subscriber.
+    messages_coalesced: Number of messages replaced by a newer one before they
+      were sent.
+    messages_dropped: Number of messages dropped because the outbox overflowed.
+  """
+  max_outbox_messages = 64
+
+  def __init__(self, session):
+    super(PubSub, self).__init__(session)
+    self.remote_ip = None
+    self.deflate = False
+    self.messages_sent = 0
+    self.messages_coalesced = 0
+    self.messages_dropped = 0
+    self._io_loop = None
+    # Map of coalesce key to (message, JSON-encoded message,
+    # _LazyDeflatedMessage), see _enqueue.
+    self._outbox = collections.OrderedDict()
+    self._outbox_lock = threading.Lock()
+    self._flush_scheduled = False
+    self._dropped = False
 
   @htf_util.classproperty
   def _lock(cls):  # pylint: disable=no-self-argument
@@ -39,22 +156,111 @@ class PubSub(sockjs.tornado.SockJSConnection):
         'Instead, subclass it and override the subscribers attribute.')
 
   @classmethod
-  def publish(cls, message, client_filter=None):
+  def publish(cls, message, client_filter=None, coalesce_key=None):
     """Publish messages to subscribers.
 
+    This is safe to call from any thread, the messages are sent from the IOLoop.
+
     Args:
       message: The message to publish.
       client_filter: A filter function to call passing in each client. Only
         clients for whom the function returns True will have the message sent to
         them.
+      coalesce_key: Optional hashable key of a message superseding any other
+        message with the same key that was not sent yet, such as the full state
+        of a test.
     """
+    encoded_message = proto.json_encode(message)
+    deflated_message = _LazyDeflatedMessage(encoded_message)
+    with cls._lock:  # pylint: disable=not-context-manager
+      clients = [
+          client for client in cls.subscribers  # pylint: disable=not-an-iterable
+          if (not client_filter) or client_filter(client)
+      ]
+    for client in clients:
+      client._enqueue(message, encoded_message, deflated_message,  # pylint: disable=protected-access
+                      coalesce_key)
+
+  @classmethod
+  def client_stats(cls):
+    """Returns a list of dicts of statistics about each subscriber."""
     with cls._lock:  # pylint: disable=not-context-manager
-      for client in cls.subscribers:  # pylint: disable=not-an-iterable
-        if (not client_filter) or client_filter(client):
-          client.send(message)
+      clients = list(cls.subscribers)  # pylint: disable=not-an-iterable
+    return [{
+        'remote_ip': client.remote_ip,
+        'deflate': client.deflate,
+        'queued': len(client._outbox),  # pylint: disable=protected-access
+        'sent': client.messages_sent,
+        'coalesced': client.messages_coalesced,
+        'dropped': client.messages_dropped,
+    } for client in clients]
+
+  def _enqueue(self, message, encoded_message, deflated_message, coalesce_key):
+    """Queue a message in the outbox and make sure it will be flushed."""
+    with self._outbox_lock:
+      if coalesce_key is None:
+        coalesce_key = object()
+      elif self._outbox.pop(coalesce_key, None) is not None:
+        self.messages_coalesced += 1
+      self._outbox[coalesce_key] = (message, encoded_message, deflated_message)
+      if len(self._outbox) > self.max_outbox_messages:
+        _LOG.warning('Subscriber %s fell behind, dropping %s messages.',
+                     self.remote_ip, len(self._outbox))
+        self.messages_dropped += len(self._outbox)
+        self._outbox.clear()
+        self._dropped = True
+      if self._flush_scheduled:
+        return
+      self._flush_scheduled = True
+    self._io_loop.add_callback(self._flush)
+
+  def _is_writing(self):
+    """Returns True if the transport still has messages to send."""
+    handler = self.session.handler
+    stream = getattr(getattr(handler, 'ws_connection', None), 'stream', None)
+    if stream is not None:
+      return stream.writing()
+    # Polling transports queue messages in the session until the next poll.
+    return bool(self.session.send_queue)
+
+  def _flush(self):
+    """Send the messages in the outbox, called from the IOLoop."""
+    if self.is_closed:
+      return
+    if self._is_writing():
+      self._io_loop.call_later(_WRITE_POLL_S, self._flush)
+      return
+    with self._outbox_lock:
+      messages = list(self._outbox.values())
+      self._outbox.clear()
+      dropped, self._dropped = self._dropped, False
+      self._flush_scheduled = False
+    if dropped:
+      self.on_messages_dropped()
+    for message, encoded_message, deflated_message in messages:
+      if not self.session.send_expects_json:
+        self.session.send_message(message)
+      elif self.deflate:
+        self.session.send_jsonified(deflated_message.get())
+      else:
+        self.session.send_jsonified(encoded_message)
+    self.messages_sent += len(messages)
+
+  def send(self, message, binary=False):
+    """Send a message to this client right away, from the IOLoop."""
+    if self.deflate and not binary and not self.is_closed:
+      self.session.send_jsonified(deflate_message(proto.json_encode(message)))
+    else:
+      super(PubSub, self).send(message, binary=binary)
 
   def on_open(self, info):
     _LOG.debug('New subscriber from %s.', info.ip)
+    self.remote_ip = info.ip
+    # The websocket transport is compressed with permessage-deflate instead.
+    self.deflate = (
+        info.get_argument('compression') == 'deflate' and
+        not isinstance(self.session.handler, websocket.WebSocketTransport))
+    self._io_loop = tornado.ioloop.IOLoop.current()
     with self._lock:  # pylint: disable=not-context-manager
       self.subscribers.add(self)
     self.on_subscribe(info)
@@ -70,3 +276,29 @@ class PubSub(sockjs.tornado.SockJSConnection):
 
   def on_unsubscribe(self):
     """Called when clients unsubscribe. Subclasses can override."""
+
+  def on_messages_dropped(self):
+    """Called from the IOLoop after messages were dropped for falling behind.
+
+    By default the connection is closed, so that the client reconnects and gets
+    the latest state from on_subscribe().  Subclasses which can send the latest
+    state to the client directly can override this, messages published after
+    the drop are sent right after.
+    """
+    self.close()
+
+
+class ClientStatsHandler(tornado.web.RequestHandler):
+  """GET endpoint for the client_stats() of PubSubs.
+
+  Sends a map of the name of each PubSub to the statistics of its subscribers.
+  """
+
+  def initialize(self, pub_subs):  # pyrefly: ignore[bad-override]
+    self.pub_subs = pub_subs
+
+  def get(self):  # pyrefly: ignore[bad-override]
+    self.write({
+        name: pub_sub_class.client_stats()
+        for name, pub_sub_class in self.pub_subs.items()
+    })
@@ -20,8 +20,9 @@ aggregate info from multiple station servers with a single frontend.
 """
 
 import asyncio
+import collections
 import contextlib
-import itertools
+import hashlib
 import json
 import logging
 import os
@@ -33,6 +34,7 @@ import types
 from typing import Optional, Union
 
 import openhtf
+from openhtf.output.servers import history_index as htf_history_index
 from openhtf.output.servers import pub_sub
 from openhtf.output.servers import web_gui_server
 from openhtf.util import configuration
@@ -41,12 +43,15 @@ from openhtf.util import functions
 from openhtf.util import multicast
 from openhtf.util import timeouts
 import sockjs.tornado
+import tornado.escape
 
 CONF = configuration.CONF
 
 STATION_SERVER_TYPE = 'station'
 
 MULTICAST_QUERY = 'OPENHTF_DISCOVERY'
+# Prefix of the JSON announcements stations multicast to dashboards.
+MULTICAST_ANNOUNCEMENT = 'OPENHTF_ANNOUNCEMENT'
 TEST_STATUS_COMPLETED = 'COMPLETED'
 
 _LOG = logging.getLogger(__name__)
@@ -57,6 +62,13 @@ _DEFAULT_FRONTEND_THROTTLE_S = 0.15
 _WAIT_FOR_ANY_EVENT_POLL_S = 0.05
 _WAIT_FOR_EXECUTING_TEST_POLL_S = 0.1
 
+# Number of tests whose data is cached for the REST endpoints.
+_MAX_CACHED_TESTS = 4
+# Size of the chunks attachments are streamed in.
+_ATTACHMENT_CHUNK_SIZE = 64 * 1024
+# A Range header requesting a single range of bytes.
+_BYTE_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
 CONF.declare(
     'frontend_throttle_s',
     default_value=_DEFAULT_FRONTEND_THROTTLE_S,
@@ -72,6 +84,11 @@ CONF.declare(
 CONF.declare('station_discovery_address')
 CONF.declare('station_discovery_port')
 CONF.declare('station_discovery_ttl')
+CONF.declare(
+    'station_heartbeat_interval_s',
+    default_value=1.0,
+    description=('Seconds between the multicast heartbeats announcing the '
+                 'station to dashboards.'))
 
 
 def _get_executing_test():
@@ -108,6 +125,37 @@ def _get_executing_test():
   return test, test_state
 
 
+def _parse_byte_range(range_header, size):
+  """Returns the [start, end) bytes requested by a Range header.
+
+  Only a single range is supported; other Range headers, or invalid ones, are
+  ignored as allowed by RFC 7233 and the whole content is sent.
+
+  Args:
+    range_header: The Range header of the request, or None.
+    size: The size of the content.
+
+  Returns:
+    A (start, end) tuple, or None if the range can't be satisfied.
+  """
+  match = _BYTE_RANGE_RE.match((range_header or '').strip())
+  if not match or match.groups() == ('', ''):
+    return 0, size
+  first, last = match.groups()
+  if not first:
+    # A suffix range, of the last bytes.
+    start, end = max(size - int(last), 0), size
+    if start == end:
+      return None
+    return start, end
+  start = int(first)
+  if last and int(last) < start:
+    return 0, size
+  if start >= size:
+    return None
+  return start, size if not last else min(int(last) + 1, size)
+
+
 def _test_state_from_record(test_record_dict, execution_uid=None):
   """Convert a test record dict to a test state dict.
 
@@ -278,7 +326,8 @@ class StationPubSub(pub_sub.PubSub):
 
   @classmethod
   def publish_test_record(cls, test_record):
-    test_record_dict = data.convert_to_base_types(test_record)
+    # Log records spilled to disk are served by LogRecordsHandler instead.
+    test_record_dict = test_record.as_base_types(recent_log_records_only=True)
     test_state_dict = _test_state_from_record(test_record_dict,
                                               cls._last_execution_uid)
     cls._publish_test_state(test_state_dict, 'record')
@@ -295,7 +344,10 @@ class StationPubSub(pub_sub.PubSub):
         'test_uid': test_state_dict['execution_uid'],
         'type': message_type,
     }
-    super(StationPubSub, cls).publish(message)
+    # Each message has the full state of the test, a client that fell behind
+    # only needs the latest one.
+    super(StationPubSub, cls).publish(
+        message, coalesce_key=test_state_dict['execution_uid'])
     cls._last_execution_uid = test_state_dict['execution_uid']
     cls._last_message = message
 
@@ -312,10 +364,53 @@ class StationPubSub(pub_sub.PubSub):
     if self._last_message is not None and test is not None:
       self.send(self._last_message)
 
+  def on_messages_dropped(self):
+    """Send the latest test state to clients that fell behind."""
+    if self._last_message is not None:
+      self.send(self._last_message)
+
+
+class _TestCache(object):
+  """Data about a test execution served by the REST endpoints.
+
+  The phase descriptors don't change during an execution, so they are encoded
+  only once.  Phase records are indexed by descriptor ID as they are added.
+  """
+
+  def __init__(self, test):
+    phase_descriptors = [
+        dict(id=id(phase), **data.convert_to_base_types(phase))
+        for phase in test.descriptor.phase_sequence.all_phases()
+    ]
+    # Wrap value in a dict because writing a list directly is prohibited.
+    self.phases_json = tornado.escape.json_encode({'data': phase_descriptors})
+    self.phases_etag = '"%s"' % hashlib.sha1(
+        self.phases_json.encode('utf-8')).hexdigest()
+    self._phase_index = {}
+    self._indexed_phases = 0
+
+  def find_phase(self, test_state, phase_descriptor_id):
+    """Returns the first phase record with the descriptor ID, or None."""
+    phase_records = test_state.test_record.phases
+    for phase in phase_records[self._indexed_phases:]:
+      self._phase_index.setdefault(str(phase.descriptor_id), phase)
+    self._indexed_phases = len(phase_records)
+
+    if phase_descriptor_id in self._phase_index:
+      return self._phase_index[phase_descriptor_id]
+    running_phase = test_state.running_phase_state
+    if (running_phase is not None and
+        str(running_phase.phase_record.descriptor_id) == phase_descriptor_id):
+      return running_phase.phase_record
+    return None
+
 
 class BaseTestHandler(web_gui_server.CorsRequestHandler):
   """Base class for HTTP endpoints that get test data."""
 
+  # Map of test UID to _TestCache of the most recently requested tests.
+  _test_caches = collections.OrderedDict()
+
   def get_test(self, test_uid):
     """Get the specified test. Write 404 and return None if it is not found."""
     test, test_state = _get_executing_test()
@@ -327,27 +422,43 @@ class BaseTestHandler(web_gui_server.CorsRequestHandler):
 
     return test, test_state
 
+  def get_test_cache(self, test):
+    """Get the _TestCache of the test, created on first use."""
+    test_uid = str(test.uid)
+    test_cache = self._test_caches.pop(test_uid, None)
+    if test_cache is None:
+      test_cache = _TestCache(test)
+      while len(self._test_caches) >= _MAX_CACHED_TESTS:
+        self._test_caches.popitem(last=False)
+    self._test_caches[test_uid] = test_cache
+    return test_cache
+
+  def check_etag(self, etag):
+    """Set the ETag, and respond 304 and return True if the client has it."""
+    self.set_header('Etag', etag)
+    self.set_header('Cache-Control', 'no-cache')
+    if self.check_etag_header():
+      self.set_status(304)
+      return True
+    return False
+
 
 class AttachmentsHandler(BaseTestHandler):
-  """GET endpoint for a file attached to a test."""
+  """GET endpoint for a file attached to a test.
 
-  def get(self, test_uid, phase_descriptor_id, attachment_name):  # pyrefly: ignore[bad-override]
-    _, test_state = self.get_test(test_uid)
+  The attachment is streamed from its file, and HTTP Range requests for a part
+  of it are supported.
+  """
+
+  async def get(self, test_uid, phase_descriptor_id, attachment_name):  # pyrefly: ignore[bad-override]
+    test, test_state = self.get_test(test_uid)
 
     if test_state is None:
       return
 
     # Find the phase matching `phase_descriptor_id`.
-    running_phase = test_state.running_phase_state
-    phase_records = itertools.chain(
-        test_state.test_record.phases,
-        [running_phase.phase_record] if running_phase is not None else [])
-
-    matched_phase = None
-    for phase in phase_records:
-      if str(phase.descriptor_id) == phase_descriptor_id:
-        matched_phase = phase
-        break
+    matched_phase = self.get_test_cache(test).find_phase(test_state,
+                                                         phase_descriptor_id)
 
     if matched_phase is None:
       self.write('Unknown phase descriptor %s' % phase_descriptor_id)
@@ -362,12 +473,42 @@ class AttachmentsHandler(BaseTestHandler):
       self.set_status(404)
       return
 
+    if self.check_etag('"%s"' % attachment.sha1):
+      return
+
+    size = attachment.size
+    self.set_header('Accept-Ranges', 'bytes')
+    request_range = _parse_byte_range(self.request.headers.get('Range'), size)
+    if request_range is None:
+      self.set_status(416)
+      self.set_header('Content-Range', 'bytes */%s' % size)
+      return
+    start, end = request_range
+    if end - start != size:
+      self.set_status(206)
+      self.set_header('Content-Range',
+                      'bytes %s-%s/%s' % (start, end - 1, size))
+
     self.set_header('Content-Type', attachment.mimetype)
-    self.write(attachment.data)
+    self.set_header('Content-Length', end - start)
+    with attachment.open_data() as attachment_file:
+      attachment_file.seek(start)
+      remaining = end - start
+      while remaining > 0:
+        chunk = attachment_file.read(min(_ATTACHMENT_CHUNK_SIZE, remaining))
+        if not chunk:
+          break
+        remaining -= len(chunk)
+        self.write(chunk)
+        await self.flush()
 
 
 class PhasesHandler(BaseTestHandler):
-  """GET endpoint for phase descriptors for a test, i.e. the full phase list."""
+  """GET endpoint for phase descriptors for a test, i.e. the full phase list.
+
+  The response is cached for each test, and has an ETag so that clients polling
+  it get a 304 response once they have it.
+  """
 
   def get(self, test_uid):  # pyrefly: ignore[bad-override]
     test, _ = self.get_test(test_uid)
@@ -375,13 +516,48 @@ class PhasesHandler(BaseTestHandler):
     if test is None:
       return
 
-    phase_descriptors = [
-        dict(id=id(phase), **data.convert_to_base_types(phase))
-        for phase in test.descriptor.phase_sequence.all_phases()
-    ]
+    test_cache = self.get_test_cache(test)
+    if self.check_etag(test_cache.phases_etag):
+      return
+    self.set_header('Content-Type', 'application/json; charset=UTF-8')
+    self.write(test_cache.phases_json)
 
-    # Wrap value in a dict because writing a list directly is prohibited.
-    self.write({'data': phase_descriptors})
+
+class LogRecordsHandler(BaseTestHandler):
+  """GET endpoint for a page of the log records of a test.
+
+  Test state updates only include the log records a test keeps in memory; this
+  endpoint also serves those spilled to disk.  Query parameters offset
+  (default 0) and limit (default 1000) select the page; the response includes
+  the total number of records.
+  """
+
+  def get(self, test_uid):  # pyrefly: ignore[bad-override]
+    _, test_state = self.get_test(test_uid)
+
+    if test_state is None:
+      return
+
+    try:
+      offset = int(self.get_argument('offset', '0'))
+      limit = int(self.get_argument('limit', '1000'))
+    except ValueError:
+      self.write('Malformed offset or limit.')
+      self.set_status(400)
+      return
+    if offset < 0 or limit < 0:
+      self.write('Malformed offset or limit.')
+      self.set_status(400)
+      return
+
+    log_records = test_state.test_record.log_records
+    self.write({
+        'data': [
+            log_record._asdict()
+            for log_record in log_records.page(offset, limit)
+        ],
+        'total': len(log_records),
+    })
 
 
 class PlugsHandler(BaseTestHandler):
@@ -431,9 +607,19 @@ class PlugsHandler(BaseTestHandler):
 class BaseHistoryHandler(web_gui_server.CorsRequestHandler):
 
   history_path = None
+  history_index = None
 
-  def initialize(self, history_path):  # pyrefly: ignore[bad-override]
+  def initialize(self, history_path, history_index=None):  # pyrefly: ignore[bad-override]
     self.history_path = history_path
+    self.history_index = history_index
+
+  def check_history_index(self):
+    """Write 500 and return False if there is no history index."""
+    if self.history_index is None:
+      self.write('History index is not enabled.')
+      self.set_status(500)
+      return False
+    return True
 
 
 class HistoryListHandler(BaseHistoryHandler):
@@ -446,10 +632,18 @@ class HistoryListHandler(BaseHistoryHandler):
       'mfg_event_{dut_id}_{start_time_millis}.pb'
 
   The requester can filter the returned history items by passing DUT ID and/or
-  start time as query parameters.
+  start time as query parameters.  Once the history index has been synced with
+  the folder, the items are served from it, most recent first, and may also be
+  filtered by minStartTimeMillis, maxStartTimeMillis, outcome, phaseName and
+  measurementName and paginated with limit and offset.  Files added to the
+  folder since the last query are indexed first.
   """
 
   def get(self):  # pyrefly: ignore[bad-override]
+    if self.history_index is not None and self.history_index.synced:
+      self._get_from_index()
+      return
+
     filter_dut_id = self.get_arguments('dutId')
     filter_start_time_millis = self.get_arguments('startTimeMillis')
 
@@ -488,15 +682,54 @@ class HistoryListHandler(BaseHistoryHandler):
     # Wrap value in a dict because writing a list directly is prohibited.
     self.write({'data': history_items})
 
+  def _get_int_argument(self, name, default=None):
+    value = self.get_argument(name, None)
+    return default if value is None else int(value)
+
+  def _get_from_index(self):
+    """Responds with the history items matching the query from the index."""
+    self.history_index.sync_if_changed()
+    try:
+      history_items = self.history_index.query(
+          dut_ids=self.get_arguments('dutId'),
+          start_times_millis=[
+              int(value) for value in self.get_arguments('startTimeMillis')
+          ],
+          min_start_time_millis=self._get_int_argument('minStartTimeMillis'),
+          max_start_time_millis=self._get_int_argument('maxStartTimeMillis'),
+          outcomes=self.get_arguments('outcome'),
+          phase_names=self.get_arguments('phaseName'),
+          measurement_names=self.get_arguments('measurementName'),
+          limit=self._get_int_argument('limit'),
+          offset=self._get_int_argument('offset', 0))
+    except ValueError:
+      self.write('Malformed history query.')
+      self.set_status(400)
+      return
+
+    # Wrap value in a dict because writing a list directly is prohibited.
+    self.write({'data': history_items})
+
 
 class HistoryItemHandler(BaseHistoryHandler):
   """GET endpoint for a test record from the history."""
 
   def get(self, file_name):  # pyrefly: ignore[bad-override]
-    # TODO(kenadia): Implement the history item handler. The implementation
-    # depends on the format used to store test records on disk.
-    self.write('Not implemented.')
-    self.set_status(500)
+    if not self.check_history_index():
+      return
+
+    try:
+      test_record_dict = self.history_index.get_record(file_name)
+    except htf_history_index.HistoryItemNotFoundError as e:
+      self.write(str(e))
+      self.set_status(404)
+      return
+    except ValueError as e:
+      self.write('Unable to read history file %s: %s' % (file_name, e))
+      self.set_status(500)
+      return
+
+    self.write(_test_state_from_record(test_record_dict))
 
 
 class HistoryAttachmentsHandler(BaseHistoryHandler):
@@ -509,51 +742,124 @@ class HistoryAttachmentsHandler(BaseHistoryHandler):
   """
 
   def get(self, file_name, attachment_name):  # pyrefly: ignore[bad-override]
-    # TODO(kenadia): Implement the history item handler. The implementation
-    # depends on the format used to store test records on disk.
-    self.write('Not implemented.')
-    self.set_status(500)
+    if not self.check_history_index():
+      return
+
+    try:
+      attachment = self.history_index.get_attachment(
+          file_name, attachment_name, self.get_argument('sha1', None))
+    except htf_history_index.HistoryItemNotFoundError as e:
+      self.write(str(e))
+      self.set_status(404)
+      return
+
+    # The MfgEvent only keeps the attachment type, not the original mimetype.
+    self.set_header('Content-Type', 'application/octet-stream')
+    self.write(attachment.value_binary)
+
+
+def _multicast_kwargs():
+  """Returns the configured multicast address, port and ttl."""
+  # These have default values in openhtf.util.multicast.py.
+  return {
+      attr: CONF['station_discovery_%s' % attr]
+      for attr in ('address', 'port', 'ttl')
+      if 'station_discovery_%s' % attr in CONF
+  }
+
+
+def _station_info(station_server_port):
+  """Returns the info about the station sent to dashboards."""
+  _, test_state = _get_executing_test()
+
+  if test_state:
+    cell = test_state.test_record.metadata.get('cell')
+    test_description = test_state.test_record.metadata.get('test_description')
+    test_name = test_state.test_record.metadata.get('test_name')
+  else:
+    cell = None
+    test_description = None
+    test_name = None
+
+  return {
+      'cell': cell,
+      'port': station_server_port,
+      'station_id': CONF.station_id,  # From openhtf.core.test_state.
+      'test_description': test_description,
+      'test_name': test_name,
+  }
 
 
 class StationMulticast(multicast.MulticastListener):
   """Announce the existence of a station server to any searching dashboards."""
 
   def __init__(self, station_server_port):
-    # These have default values in openhtf.util.multicast.py.
-    kwargs = {
-        attr: CONF['station_discovery_%s' % attr]
-        for attr in ('address', 'port', 'ttl')
-        if 'station_discovery_%s' % attr in CONF
-    }
-    super(StationMulticast, self).__init__(self._make_message, **kwargs)
+    super(StationMulticast, self).__init__(self._make_message,
+                                           **_multicast_kwargs())
     self.station_server_port = station_server_port
 
   def _make_message(self, message):
     if message != MULTICAST_QUERY:
-      if message == 'OPENHTF_PING':
-        # Don't log for the old multicast string.
+      if (message == 'OPENHTF_PING' or
+          message.startswith(MULTICAST_ANNOUNCEMENT)):
+        # Don't log for the old multicast string, or other stations.
         return
       _LOG.debug('Got unexpected traffic on multicast socket: %s', message)
       return
 
-    _, test_state = _get_executing_test()
+    return json.dumps(_station_info(self.station_server_port))
 
-    if test_state:
-      cell = test_state.test_record.metadata.get('cell')
-      test_description = test_state.test_record.metadata.get('test_description')
-      test_name = test_state.test_record.metadata.get('test_name')
-    else:
-      cell = None
-      test_description = None
-      test_name = None
-
-    return json.dumps({
-        'cell': cell,
-        'port': self.station_server_port,
-        'station_id': CONF.station_id,  # From openhtf.core.test_state.
-        'test_description': test_description,
-        'test_name': test_name,
-    })
+
+class StationAnnouncer(threading.Thread):
+  """Announce the station server to dashboards listening for announcements.
+
+  Announcements are multicast every heartbeat interval, and as soon as the
+  station info changes after notify() is called, e.g. when a test starts.  A
+  last announcement with 'online' set to False is sent when stopped.  Each
+  announcement is MULTICAST_ANNOUNCEMENT followed by the JSON station info, like
+  the responses to MULTICAST_QUERY, with the heartbeat interval added.
+  """
+  daemon = True
+
+  def __init__(self, station_server_port):
+    super(StationAnnouncer, self).__init__(name=type(self).__name__)
+    self.station_server_port = station_server_port
+    self.heartbeat_interval_s = float(CONF.station_heartbeat_interval_s)
+    self._sender = multicast.MulticastSender(**_multicast_kwargs())
+    self._changed = threading.Event()
+    self._stopped = threading.Event()
+
+  def notify(self):
+    """Check for changes in the station info, and announce them if any."""
+    self._changed.set()
+
+  def stop(self, timeout_s=None):
+    """Stop announcing, and announce that the station went offline."""
+    self._stopped.set()
+    self._changed.set()
+    if self.is_alive():
+      self.join(timeout_s)
+    self._announce(_station_info(self.station_server_port), online=False)
+    self._sender.close()
+
+  def _announce(self, station_info, online=True):
+    self._sender.send(MULTICAST_ANNOUNCEMENT + json.dumps(
+        dict(station_info,
+             heartbeat_interval_s=self.heartbeat_interval_s,
+             online=online)))
+
+  def run(self):
+    last_station_info = None
+    next_heartbeat_time = 0
+    while not self._stopped.is_set():
+      self._changed.clear()
+      station_info = _station_info(self.station_server_port)
+      now = time.monotonic()
+      if station_info != last_station_info or now >= next_heartbeat_time:
+        self._announce(station_info)
+        last_station_info = station_info
+        next_heartbeat_time = now + self.heartbeat_interval_s
+      self._changed.wait(max(0, next_heartbeat_time - time.monotonic()))
 
 
 class StationServer(web_gui_server.WebGuiServer):
@@ -575,6 +881,16 @@ class StationServer(web_gui_server.WebGuiServer):
       if server:
         test.add_output_callbacks(server.publish_final_state)
       test.execute()
+
+  When a history_path is given, the history endpoints are served from a
+  history_index.HistoryIndex of that folder.  Files already in the folder are
+  indexed in the background when the server starts, until then the history is
+  listed from the folder.  Files added later are indexed when the history is
+  next listed; adding the index as an output callback after the one saving
+  MfgEvents indexes them without parsing them back:
+
+    test.add_output_callbacks(
+        save_mfg_event_to_history_path, server.history_index)
   """
 
   def __init__(
@@ -593,38 +909,48 @@ class StationServer(web_gui_server.WebGuiServer):
     # Bind port early so that the correct port number can be used in the routes.
     sockets, port = web_gui_server.bind_port(int(CONF.station_server_port))
 
-    # Set up the station watcher.
-    station_watcher = StationWatcher(StationPubSub.publish_update)
+    # Set up the station watcher, changes in the test may change the station
+    # info announced.
+    self.station_announcer = StationAnnouncer(port)
+    station_watcher = StationWatcher(self._on_update)
     station_watcher.start()
 
     # Set up the SockJS endpoints.
     dashboard_class = DashboardPubSub.for_port(port)
-    dash_router = sockjs.tornado.SockJSRouter(dashboard_class, '/sub/dashboard')
-    station_router = sockjs.tornado.SockJSRouter(StationPubSub, '/sub/station')
+    dash_router = pub_sub.SockJSRouter(dashboard_class, '/sub/dashboard')
+    station_router = pub_sub.SockJSRouter(StationPubSub, '/sub/station')
     routes = dash_router.urls + station_router.urls
 
     # Set up the other endpoints.
     routes.extend((
         (r'/tests/(?P<test_uid>[\w\d:]+)/phases', PhasesHandler),
+        (r'/tests/(?P<test_uid>[\w\d:]+)/logs', LogRecordsHandler),
         (r'/tests/(?P<test_uid>[\w\d:]+)/plugs/(?P<plug_name>.+)',
          PlugsHandler),
         (r'/tests/(?P<test_uid>[\w\d:]+)/phases/(?P<phase_descriptor_id>\d+)/'
          'attachments/(?P<attachment_name>.+)', AttachmentsHandler),
+        (r'/subscribers', pub_sub.ClientStatsHandler, {
+            'pub_subs': {
+                'dashboard': dashboard_class,
+                'station': StationPubSub,
+            }
+        }),
     ))
 
     # Optionally enable history from disk.
+    self.history_index = None
     if history_path is not None:
+      self.history_index = htf_history_index.HistoryIndex(history_path)
+      history_kwargs = {
+          'history_path': history_path,
+          'history_index': self.history_index,
+      }
       routes.extend((
-          (r'/history', HistoryListHandler, {
-              'history_path': history_path
-          }),
-          (r'/history/(?P<file_name>[^/]+)', HistoryItemHandler, {
-              'history_path': history_path
-          }),
+          (r'/history', HistoryListHandler, history_kwargs),
+          (r'/history/(?P<file_name>[^/]+)', HistoryItemHandler,
+           history_kwargs),
           (r'/history/(?P<file_name>[^/]+)/attachments/(?P<attachment_name>.+)',
-           HistoryAttachmentsHandler, {
-               'history_path': history_path
-           }),
+           HistoryAttachmentsHandler, history_kwargs),
       ))
 
     super(StationServer, self).__init__(routes, port, sockets=sockets)
@@ -639,21 +965,39 @@ class StationServer(web_gui_server.WebGuiServer):
     _LOG.info('Announcing station server via multicast on %s:%s',
               self.station_multicast.address, self.station_multicast.port)
     self.station_multicast.start()
+    self.station_announcer.start()
+    if self.history_index is not None:
+      threading.Thread(
+          target=self._sync_history_index,
+          name='HistoryIndexSync',
+          daemon=True).start()
     _LOG.info('Starting station server at:\n'  # pylint: disable=logging-format-interpolation
               '  Local: http://localhost:{port}\n'
               '  Remote: http://{host}:{port}'.format(
                   host=socket.gethostname(), port=self.port))
     super(StationServer, self).run()
 
+  def _sync_history_index(self) -> None:
+    try:
+      self.history_index.sync()  # pyrefly: ignore[missing-attribute]
+    except Exception:  # pylint: disable=broad-except
+      _LOG.exception('Unable to index the station history.')
+
   def stop(self) -> None:
     _LOG.info('Stopping station server.')
     super(StationServer, self).stop()
     _LOG.info('Stopping multicast.')
     self.station_multicast.stop(timeout_s=0)
+    self.station_announcer.stop(timeout_s=1)
+
+  def _on_update(self, test_state_dict) -> None:
+    StationPubSub.publish_update(test_state_dict)
+    self.station_announcer.notify()
 
   def publish_final_state(self, test_record: openhtf.TestRecord) -> None:
     """Test output callback publishing a final state from the test record."""
     StationPubSub.publish_test_record(test_record)
+    self.station_announcer.notify()
 
 
 @contextlib.contextmanager
@@ -108,7 +108,7 @@ describe('subscription', () => {
          expect(subscription.isSubscribing).toBe(false);
          expect(subscription.hasError).toBe(false);
          expect(sockJsSpy.calls.count()).toBe(1);
-         expect(sockJsSpy).toHaveBeenCalledWith('/mock/url');
+         expect(sockJsSpy).toHaveBeenCalledWith('/mock/url?compression=deflate');
        }));
 
     it('while subscribing, should do nothing on refresh', fakeAsync(() => {
@@ -145,6 +145,25 @@ describe('subscription', () => {
          expect(responses2[1]['message']).toEqual('mock-message-1');
        }));
 
+    it('should inflate deflated messages in order', async () => {
+      const responses: Array<{}> = [];
+      subscription.messages.subscribe((message: SockJsMessage) => {
+        responses.push(message.data);
+      });
+      const stream = new Blob([JSON.stringify({'message': 'deflated'})])
+                         .stream()
+                         .pipeThrough(new CompressionStream('deflate'));
+      const bytes = new Uint8Array(await new Response(stream).arrayBuffer());
+      const data = btoa(String.fromCharCode(...bytes));
+
+      connectSuccessfully();
+      receiveMessage({'encoding': 'deflate', data});
+      receiveMessage({'message': 'plain'});
+      expect(responses.length).toEqual(0);
+      await new Promise(resolve => setTimeout(resolve, 100));
+      expect(responses).toEqual([{'message': 'deflated'}, {'message': 'plain'}]);
+    });
+
     it('should unsubscribe and resubscribe', fakeAsync(() => {
          connectSuccessfully();
          subscription.unsubscribe();
@@ -21,6 +21,10 @@
  * be configured to reconnect automatically. This makes Subscription useful as a
  * base class for our websocket-based services. However, it means that
  * Subscription must maintain a non-trivial amount of state information.
+ *
+ * Where the browser can inflate them, the server is asked to deflate the
+ * messages sent over SockJS fallback transports; websockets use
+ * permessage-deflate instead, negotiated by the browser.
  */
 
 enum SubscriptionState {
@@ -35,6 +39,35 @@ import { Subject } from 'rxjs';
 
 import { SockJsMessage, SockJsObject, SockJsService } from './sock-js.service';
 
+// Message deflated by the server, see openhtf/output/servers/pub_sub.py.
+interface DeflatedMessage {
+  encoding: 'deflate';
+  data: string;  // Base64 of the zlib-compressed JSON message.
+}
+
+function isDeflated(data: unknown): data is DeflatedMessage {
+  return typeof data === 'object' && data !== null &&
+      (data as DeflatedMessage).encoding === 'deflate';
+}
+
+async function inflateMessage(message: SockJsMessage): Promise<SockJsMessage> {
+  const data: unknown = message.data;
+  if (!isDeflated(data)) {
+    return message;
+  }
+  const bytes = Uint8Array.from(atob(data.data), c => c.charCodeAt(0));
+  const stream = new Blob([bytes]).stream().pipeThrough(
+      new DecompressionStream('deflate'));
+  return {data: JSON.parse(await new Response(stream).text())};
+}
+
+function withCompression(url: string) {
+  if (typeof DecompressionStream === 'undefined') {
+    return url;
+  }
+  return `${url}${url.includes('?') ? '&' : '?'}compression=deflate`;
+}
+
 export class Subscription {
   readonly messages = new Subject<SockJsMessage>();
   retryTimeMs: number|null = null;  // Available when state is `waiting`.
@@ -42,6 +75,8 @@ export class Subscription {
   private currentRetryMs: number|null = null;  // retryMs with backoff.
   private retryTimeoutId: any = null;  // Timer from setTimeout().
   private sock: SockJsObject|null = null;
+  // Messages waiting for a deflated message before them to be inflated.
+  private pendingMessages: Promise<void>|null = null;
   private state = SubscriptionState.unsubscribed;
 
   // Params used by subscribeWithSavedParams().
@@ -113,7 +148,7 @@ export class Subscription {
 
   private subscribeWithSavedParams() {
     console.debug(`Attempting to subscribe to ${this.url}.`);
-    const sock = new this.sockJsService.sockJs(this.url);
+    const sock = new this.sockJsService.sockJs(withCompression(this.url));
     sock.onopen = () => {
       if (this.sock !== sock) {
         return;
@@ -154,7 +189,29 @@ export class Subscription {
       if (this.sock !== sock) {
         return;
       }
-      this.messages.next(message);
+      if (this.pendingMessages === null && !isDeflated(message.data)) {
+        this.messages.next(message);
+        return;
+      }
+      // Inflating is asynchronous, later messages wait to keep their order.
+      const pending: Promise<void> =
+          (this.pendingMessages || Promise.resolve())
+              .then(() => inflateMessage(message))
+              .then(inflated => {
+                if (this.sock === sock) {
+                  this.messages.next(inflated);
+                }
+              })
+              .catch(error => {
+                console.error(`Unable to inflate message from ${this.url}.`,
+                              error);
+              })
+              .then(() => {
+                if (this.pendingMessages === pending) {
+                  this.pendingMessages = null;
+                }
+              });
+      this.pendingMessages = pending;
     };
     this.sock = sock;
     this.state = SubscriptionState.subscribing;
@@ -67,7 +67,8 @@ describe('dashboard service', () => {
 
     dashboardService.subscribe();
 
-    expect(mockSockJsService.sockJs).toHaveBeenCalledWith('/sub/dashboard');
+    expect(mockSockJsService.sockJs)
+        .toHaveBeenCalledWith('/sub/dashboard?deltas=1&compression=deflate');
     expect(dashboardService.isSubscribing).toBe(true);
     expect(dashboardService.hasError).toBe(false);
   });
@@ -80,7 +81,7 @@ describe('dashboard service', () => {
        const message = {};
        addStationToMessage(message, '12000', 'ONLINE');
        addStationToMessage(message, '12001', 'UNREACHABLE');
-       receiveMockMessage(message);
+       receiveMockMessage({type: 'snapshot', sequence: 3, stations: message});
        tick();
 
        expect(dashboardService.isSubscribing).toBe(false);
@@ -96,4 +97,42 @@ describe('dashboard service', () => {
        expect(stations['localhost:12001'].status)
            .toEqual(StationStatus.unreachable);
      }));
+
+  it('should apply deltas after the snapshot', fakeAsync(() => {
+       const stations: StationMap = dashboardService.stations;
+       dashboardService.subscribe();
+
+       connectSuccessfully();
+       const snapshot = {};
+       addStationToMessage(snapshot, '12000', 'ONLINE');
+       addStationToMessage(snapshot, '12001', 'ONLINE');
+       const early = {};
+       addStationToMessage(early, '12002', 'ONLINE');
+       // Deltas before the snapshot are included in it.
+       receiveMockMessage(
+           {type: 'delta', sequence: 3, added: early, changed: {}, removed: []});
+       receiveMockMessage({type: 'snapshot', sequence: 3, stations: snapshot});
+       tick();
+       expect(Object.keys(stations).sort()).toEqual([
+         'localhost:12000', 'localhost:12001'
+       ]);
+
+       const changed = {};
+       addStationToMessage(changed, '12000', 'UNREACHABLE');
+       const added = {};
+       addStationToMessage(added, '12003', 'ONLINE');
+       receiveMockMessage({
+         type: 'delta',
+         sequence: 4,
+         added,
+         changed,
+         removed: ['localhost:12001'],
+       });
+       tick();
+       expect(Object.keys(stations).sort()).toEqual([
+         'localhost:12000', 'localhost:12003'
+       ]);
+       expect(stations['localhost:12000'].status)
+           .toEqual(StationStatus.unreachable);
+     }));
 });
@@ -25,7 +25,8 @@ import { SockJsMessage, SockJsService } from '../../shared/sock-js.service';
 import { Subscription } from '../../shared/subscription';
 import { devHost, urlHost } from '../../shared/util';
 
-const dashboardUrl = `${devHost}/sub/dashboard`;
+// Ask for snapshots and deltas rather than the whole station map each time.
+const dashboardUrl = `${devHost}/sub/dashboard?deltas=1`;
 
 const dashboardStatusMap = {
   'UNREACHABLE': StationStatus.unreachable,
@@ -45,10 +46,26 @@ interface RawStation {
   test_name: string|null;
 }
 
-interface DashboardApiResponse {
+interface RawStationMap {
   [hostPort: string]: RawStation;
 }
 
+interface DashboardSnapshot {
+  type: 'snapshot';
+  sequence: number;
+  stations: RawStationMap;
+}
+
+interface DashboardDelta {
+  type: 'delta';
+  sequence: number;
+  added: RawStationMap;
+  changed: RawStationMap;
+  removed: string[];
+}
+
+type DashboardApiResponse = DashboardSnapshot|DashboardDelta;
+
 /**
  * Parsed response type.
  */
@@ -60,13 +77,26 @@ export interface StationMap { [hostPort: string]: Station; }
 @Injectable()
 export class DashboardService extends Subscription {
   readonly stations: StationMap = {};
+  // Sequence number of the last message applied, null until the first
+  // snapshot, which the server sends on each connection.
+  private sequence: number|null = null;
 
   constructor(sockJsService: SockJsService) {
     super(sockJsService);
     this.messages.subscribe((message: SockJsMessage) => {
       const response = DashboardService.validateResponse(message.data);
-      const newStations = DashboardService.parseResponse(response);
-      this.applyResponse(newStations);
+      if (response.type === 'snapshot') {
+        this.sequence = response.sequence;
+        const newStations = DashboardService.parseResponse(response.stations);
+        this.applyResponse(newStations, Object.keys(this.stations));
+      } else if (
+          this.sequence !== null && response.sequence > this.sequence) {
+        // Deltas sent before our snapshot are already included in it.
+        this.sequence = response.sequence;
+        const newStations = DashboardService.parseResponse(
+            Object.assign({}, response.added, response.changed));
+        this.applyResponse(newStations, response.removed);
+      }
     });
   }
 
@@ -85,13 +115,13 @@ export class DashboardService extends Subscription {
   }
 
   /**
-   * Step 2: Transform a response object into a map of station objects.
+   * Step 2: Transform the stations of a response into station objects.
    *
    * See StationService.ensureTestList for more information about the decision
    * to separate the API format from the structure of the models used in the
    * frontend.
    */
-  private static parseResponse(response: DashboardApiResponse) {
+  private static parseResponse(response: RawStationMap) {
     const newStations: StationMap = {};
 
     for (const hostPort of Object.keys(response)) {
@@ -114,8 +144,11 @@ export class DashboardService extends Subscription {
 
   /**
    * Step 3: Update our data store with new station information.
+   *
+   * Stations in newStations are added or updated, then the stations in
+   * removedHostPorts that are not in newStations are removed.
    */
-  private applyResponse(newStations: StationMap) {
+  private applyResponse(newStations: StationMap, removedHostPorts: string[]) {
     for (const hostPort of Object.keys(newStations)) {
       const newStation = newStations[hostPort];
       if (hostPort in this.stations) {
@@ -135,7 +168,7 @@ export class DashboardService extends Subscription {
     }
 
     // Remove stations no longer reported by the server.
-    for (const hostPort of Object.keys(this.stations)) {
+    for (const hostPort of removedHostPorts) {
       if (!(hostPort in newStations)) {
         delete this.stations[hostPort];
       }
@@ -13,14 +13,18 @@
 # limitations under the License.
 """OpenHTF plug for serial port.
 
-Allows for writing out to a serial port.
+Allows for collecting the data received on a serial port into a file.
 """
 
+import contextlib
+import hashlib
 import logging
 import threading
-from typing import Optional
+import time
+from typing import Optional, Text
 
 from openhtf.core import base_plugs
+from openhtf.core import test_state
 from openhtf.util import configuration
 
 CONF = configuration.CONF
@@ -44,6 +48,10 @@ CONF.declare(
     description='Baud rate for serial data collection.',
     default_value=115200)
 
+# Size of the buffer of the destination file, so that the many small chunks read
+# at high baud rates are written out together.
+_WRITE_BUFFER_SIZE = 1 << 16
+
 
 class SerialCollectionPlug(base_plugs.BasePlug):
   """Plug that collects data from a serial port.
@@ -54,6 +62,12 @@ class SerialCollectionPlug(base_plugs.BasePlug):
   polling thread, data collection stops and an error message is logged.
   Otherwise, data collection stops and the serial port is closed when
   stop_collection() is called.
+
+  The thread reads everything the driver has buffered in one call and writes
+  the raw bytes, so no data is lost to decoding errors and the collection keeps
+  up with high baud rates.  The reception time of each chunk can optionally be
+  written to a separate file, and attach_capture() attaches the collected data
+  to the test record.
   """
   # Serial library can raise these exceptions
   SERIAL_EXCEPTIONS = (serial.SerialException, ValueError)
@@ -73,19 +87,49 @@ class SerialCollectionPlug(base_plugs.BasePlug):
     self._serial.port = serial_collection_port
     self._collect = False
     self._collection_thread = None
+    self._dest = None
+    self._bytes_collected = 0
+    self._sha1 = None
+
+  def start_collection(self, dest: Text,
+                       timestamps_dest: Optional[Text] = None) -> None:
+    """Starts collecting the data received into a file.
 
-  def start_collection(self, dest):
+    Args:
+      dest: File to write the received bytes to.
+      timestamps_dest: Optional file to write the host time of reception of
+        each chunk of data to, as lines of "<offset in dest>,<time.time()>".
+    """
 
     def _poll():
+      sha1 = hashlib.sha1()
       try:
-        with open(dest, 'w+') as outfile:
+        with contextlib.ExitStack() as stack:
+          outfile = stack.enter_context(
+              open(dest, 'wb', buffering=_WRITE_BUFFER_SIZE))
+          timestamps_file = None
+          if timestamps_dest is not None:
+            timestamps_file = stack.enter_context(open(timestamps_dest, 'w'))
           while self._collect:
-            data = self._serial.readline().decode()  # pyrefly: ignore[missing-attribute]
+            # Wait (up to the timeout) for the first byte when there's nothing
+            # buffered, otherwise take all the buffered bytes at once.
+            data = self._serial.read(self._serial.in_waiting or 1)  # pyrefly: ignore[missing-attribute]
+            if not data:
+              continue
+            if timestamps_file is not None:
+              timestamps_file.write('%d,%f\n' %
+                                    (self._bytes_collected, time.time()))
             outfile.write(data)
+            sha1.update(data)
+            self._bytes_collected += len(data)
       except self.SERIAL_EXCEPTIONS:
         self.logger.error(
             'Serial port error. Stopping data collection.', exc_info=True)
+      self._sha1 = sha1.hexdigest()
 
+    self._dest = dest
+    self._bytes_collected = 0
+    self._sha1 = None
     self._collect = True
     self._collection_thread = threading.Thread(target=_poll)
     self._collection_thread.daemon = True
@@ -100,6 +144,11 @@ class SerialCollectionPlug(base_plugs.BasePlug):
       return self._collection_thread.is_alive()
     return False
 
+  @property
+  def bytes_collected(self) -> int:
+    """Number of bytes collected since collection was last started."""
+    return self._bytes_collected
+
   def stop_collection(self):
     if not self.is_collecting:
       self.logger.warning('Data collection was not running, cannot be stopped.')
@@ -107,3 +156,28 @@ class SerialCollectionPlug(base_plugs.BasePlug):
     self._collect = False
     self._collection_thread.join()  # pyrefly: ignore[missing-attribute]
     self._serial.close()  # pyrefly: ignore[missing-attribute]
+
+  def attach_capture(
+      self,
+      test_api,
+      name: Optional[Text] = None,
+      mimetype: test_state.MimetypeT = test_state.INFER_MIMETYPE) -> None:
+    """Attaches the collected data to the running phase.
+
+    Collection is stopped if it is running.  The file is copied without being
+    read into memory, using the SHA-1 computed during collection.
+
+    Args:
+      test_api: TestApi of the running phase.
+      name: Attachment name, defaults to the name of the destination file.
+      mimetype: MIME type of the attachment, see TestApi.attach_from_file.
+
+    Raises:
+      ValueError: If collection was never started.
+    """
+    if self._dest is None:
+      raise ValueError('Serial data collection was never started.')
+    if self.is_collecting:
+      self.stop_collection()
+    test_api.attach_from_file(
+        self._dest, name=name, mimetype=mimetype, sha1=self._sha1)
@@ -33,6 +33,11 @@ class, subclass, and protocol.
 import io
 import logging
 import os.path
+import posixpath
+import queue
+import stat
+import sys
+import threading
 
 from openhtf.plugs.usb import adb_protocol
 from openhtf.plugs.usb import filesync_service
@@ -78,6 +83,8 @@ class AdbDevice(object):
   Attributes:
     filesync_service: Direct access to this device's FilesyncService.
     shell_service: Direct access to this device's ShellService.
+    asyncio_shell_service: This device's AsyncioShellService, for running shell
+      commands from an asyncio event loop.
   """
 
   def __init__(self, adb_connection):
@@ -86,6 +93,8 @@ class AdbDevice(object):
         adb_connection)
     self.shell_service = shell_service.ShellService.using_connection(
         adb_connection)
+    self.asyncio_shell_service = (
+        shell_service.AsyncioShellService.using_connection(adb_connection))
 
   def __str__(self):
     return '<%s: %s(%s) @%s>' % (
@@ -142,8 +151,8 @@ class AdbDevice(object):
     """
     mtime = 0
     if isinstance(source_file, str):
-      mtime = os.path.getmtime(source_file)
-      source_file = open(source_file)
+      mtime = int(os.path.getmtime(source_file))
+      source_file = open(source_file, 'rb')
 
     self.filesync_service.send(
         source_file,
@@ -164,9 +173,9 @@ class AdbDevice(object):
     """
     should_return_data = dest_file is None
     if isinstance(dest_file, str):
-      dest_file = open(dest_file, 'w')
+      dest_file = open(dest_file, 'wb')
     elif dest_file is None:
-      dest_file = io.StringIO()
+      dest_file = io.BytesIO()
     self.filesync_service.recv(device_filename, dest_file,
                                timeouts.PolledTimeout.from_millis(timeout_ms))
     if should_return_data:
@@ -177,6 +186,87 @@ class AdbDevice(object):
     return self.filesync_service.list(
         device_path, timeouts.PolledTimeout.from_millis(timeout_ms))
 
+  def sync_directory(self,
+                     local_dir,
+                     device_dir,
+                     concurrency=1,
+                     timeout_ms=None):
+    """Push the files under local_dir that are missing or differ on the device.
+
+    Each local file is compared against the stat of the corresponding device
+    file, and only pushed if the sizes or modification times differ.  Pushed
+    files get the local modification time, so they match on the next sync.
+
+    Arguments:
+      local_dir: Local directory to push, recursively.
+      device_dir: Directory on the device to push to.
+      concurrency: Number of sync streams to stat and push files over
+        concurrently.
+      timeout_ms: Expected timeout for the entire sync.
+
+    Returns:
+      Sorted list of the device filenames that were pushed.
+    """
+    timeout = timeouts.PolledTimeout.from_millis(timeout_ms)
+    files = queue.Queue()
+    for dirpath, _, filenames in os.walk(local_dir):
+      for filename in filenames:
+        local_path = os.path.join(dirpath, filename)
+        relpath = os.path.relpath(local_path, local_dir)
+        files.put((local_path,
+                   posixpath.join(device_dir, *relpath.split(os.sep))))
+
+    pushed = []
+    exc_info = []
+
+    def sync_files(service):
+      while not exc_info:
+        try:
+          local_path, device_path = files.get_nowait()
+        except queue.Empty:
+          return
+        try:
+          if self._sync_file(service, local_path, device_path, timeout):
+            pushed.append(device_path)
+        except Exception:  # pylint: disable=broad-except
+          exc_info.append(sys.exc_info())
+
+    services = [self.filesync_service] + [
+        filesync_service.FilesyncService.using_connection(
+            self._adb_connection, timeout)
+        for _ in range(min(concurrency, files.qsize()) - 1)
+    ]
+    threads = [
+        threading.Thread(target=sync_files, args=(service,))
+        for service in services[1:]
+    ]
+    try:
+      for thread in threads:
+        thread.start()
+      sync_files(services[0])
+      for thread in threads:
+        thread.join()
+    finally:
+      for service in services[1:]:
+        service.close()
+
+    if exc_info:
+      raise exc_info[0][1].with_traceback(exc_info[0][2])
+    return sorted(pushed)
+
+  @staticmethod
+  def _sync_file(service, local_path, device_path, timeout):
+    """Push local_path to device_path if it differs, return True if pushed."""
+    local_stat = os.stat(local_path)
+    mtime = int(local_stat.st_mtime)
+    device_stat = service.stat(device_path, timeout)
+    if (stat.S_ISREG(device_stat.mode) and
+        device_stat.size == local_stat.st_size and device_stat.mtime == mtime):
+      return False
+    with open(local_path, 'rb') as src_file:
+      service.send(src_file, device_path, mtime=mtime, timeout=timeout)
+    return True
+
   def command(self, command, raw=False, timeout_ms=None):
     """Run command on the device, returning the output."""
     return self.shell_service.command(
@@ -215,7 +305,7 @@ class AdbDevice(object):
     try:
       message = stream.read(timeout_ms=timeout)
       # Some commands report success messages, ignore them.
-      if any([m in message for m in success_msgs]):
+      if any([m.encode() in message for m in success_msgs]):
         return
     except usb_exceptions.CommonUsbError:
       if destination.startswith('reboot:'):
@@ -164,13 +164,32 @@ class AdbTransportAdapter(object):
           _LOG.warning('Timed out between AdbMessage header and data, reading '
                        'data anyway with 10ms timeout')
           timeout = timeouts.PolledTimeout.from_millis(10)
-        data = self._transport.read(raw_message.data_length,
-                                    timeout.remaining_ms)
+        data = self._read_data(raw_message.data_length, timeout)
       else:
-        data = ''
+        data = b''
 
       return raw_message.to_adb_message(data)
 
+  def _read_data(self, length, timeout):
+    """Read a message payload of the given length directly into a bytearray.
+
+    A payload may arrive in more than one USB transfer, so keep reading into
+    the remaining part of the buffer until it is full.  If the transport stops
+    returning data early, the short payload is returned and will fail the
+    integrity check in RawAdbMessage.to_adb_message().
+    """
+    data = bytearray(length)
+    offset = 0
+    with memoryview(data) as view:
+      while offset < length:
+        count = self._transport.read_into(view[offset:], timeout.remaining_ms)
+        if not count:
+          break
+        offset += count
+    if offset < length:
+      del data[offset:]
+    return data
+
   def read_until(self, expected_commands, timeout):
     """Read AdbMessages from this transport until we get an expected command.
 
@@ -236,10 +255,11 @@ class AdbMessage(object):
   etc).  The arg0 and arg1 attributes have different meanings depending on
   the command (see adb_protocol.py for more info).
 
-  This class stores the 'data' associated with a message, but some messages
-  have no data (data will default to '').  Additionally, reading/writing
-  messages to the wire results in two reads/writes because the data is actually
-  sent in a second USB transaction.  This may have implications to transport
+  This class stores the 'data' associated with a message as a bytes-like
+  object (str data is encoded as UTF-8), but some messages have no data (data
+  will default to b'').  Additionally, reading/writing messages to the wire
+  results in two reads/writes because the data is actually sent in a second USB
+  transaction.  This may have implications to transport
   layers that aren't direct libusb reads/writes to a local device (ie, over
   a network).
 
@@ -250,19 +270,22 @@ class AdbMessage(object):
   Attributes: header command arg0 arg1 data magic
   """
 
-  PRINTABLE_DATA = set(string.printable) - set(string.whitespace)
+  PRINTABLE_DATA = set(string.printable.encode()) - set(
+      string.whitespace.encode())
   CMD_TO_WIRE, WIRE_TO_CMD = make_wire_commands('SYNC', 'CNXN', 'AUTH', 'OPEN',
                                                 'OKAY', 'CLSE', 'WRTE')
   # An ADB message is 6 words in little-endian.
   HEADER_STRUCT_FORMAT = '<6I'
 
-  def __init__(self, command, arg0=0, arg1=0, data=''):
+  def __init__(self, command, arg0=0, arg1=0, data=b''):
     if command not in self.CMD_TO_WIRE:
       raise usb_exceptions.AdbProtocolError('Unrecognized ADB command: %s' %
                                             command)
     self._command = self.CMD_TO_WIRE[command]
     self.arg0 = arg0
     self.arg1 = arg1
+    if isinstance(data, str):
+      data = data.encode('utf-8')
     self.data = data
     self.magic = self._command ^ 0xFFFFFFFF
 
@@ -280,8 +303,8 @@ class AdbMessage(object):
   def __str__(self):
     return '<%s: %s(%s, %s): %s (%s bytes)>' % (
         type(self).__name__, self.command, self.arg0, self.arg1, ''.join(
-            char if char in self.PRINTABLE_DATA else '.'
-            for char in self.data[:64]), len(self.data))
+            chr(byte) if byte in self.PRINTABLE_DATA else '.'
+            for byte in bytes(self.data[:64])), len(self.data))
 
   __repr__ = __str__
 
@@ -290,6 +313,7 @@ class AdbMessage(object):
     """Returns the sum of all the data bytes.
 
     The "crc32" used by ADB is actually just a sum of all the bytes, but we
-    name this data_crc32 to be consistent with ADB.
+    name this data_crc32 to be consistent with ADB.  Summing the bytes-like
+    data directly only touches cached small ints, with no per-byte list.
     """
-    return sum([ord(x) for x in self.data]) & 0xFFFFFFFF
+    return sum(self.data) & 0xFFFFFFFF
@@ -27,7 +27,12 @@ AdbStream.
 
 Multiple AdbStreams can be opened at once and used by multiple threads, and a
 single AdbStream can have multiple threads reading from or writing to it, but
-the latter is not recommended.
+the latter is not recommended.  Each AdbConnection has a reader thread that
+reads all incoming messages and queues them for their stream, waking only the
+threads waiting on that stream.  Streams may instead be opened with
+open_async_stream() from an asyncio event loop, in which case the reader thread
+hands their messages to the loop, so a single loop can serve many streams
+without a thread per stream.
 
 This implementation of the ADB stack looks something like:
 
@@ -72,13 +77,20 @@ Example usage of a connection and stream:
   # Read data from a 'shell:ls' destination stream and print the output.
   for line in connection.streaming_command('shell', 'ls'):
     print line
+
+  # The same, from a coroutine.
+  stream = await connection.open_async_stream('shell:ls')
+  async for data in stream:
+    print(data)
 """
 
-import collections
+import asyncio
+from concurrent import futures
 import enum
 import itertools
 import logging
 import queue
+import struct
 import sys
 import threading
 
@@ -99,17 +111,31 @@ ARG_PARSER.add_argument(
 
 _LOG = logging.getLogger(__name__)
 
-# Maximum amount of data in an ADB packet, we would like to raise this, but the
-# remote end ignores it (ugh), we only send it to comply with the protocol.
-MAX_ADB_DATA = 4096
+# Maximum amount of data in an ADB packet that we offer in our CNXN message, the
+# connection uses the smaller of this and the maximum offered by the device.
+MAX_ADB_DATA = 256 * 1024
+# Maximum amount of data in an ADB packet accepted by legacy devices.
+MAX_ADB_DATA_V1 = 4096
 # ADB protocol version.
 ADB_VERSION = 0x01000000
 # The local banner that we send to the remote device.
 ADB_BANNER = 'googlex_adb'
+# Banner feature advertised by devices that support delayed ACKs, where each
+# stream grants the other end a budget of bytes it may write before waiting for
+# an OKAY, instead of allowing only one WRTE in flight.
+DELAYED_ACK_FEATURE = 'delayed_ack'
+# Bytes the device may write to one of our streams before we ACK them, when
+# using delayed ACKs.  Bytes are ACK'd as they are read from the stream.
+DELAYED_ACK_WINDOW = 32 * MAX_ADB_DATA
+# With delayed ACKs, OKAY messages carry the number of bytes they ACK.
+DELAYED_ACK_STRUCT_FORMAT = '<I'
 # One greater than the maximum value for an ADB stream id.  There is a hard
 # limit at 2**32, because it's an unsigned int, but we start seeing memory
 # problems and the like way sooner, so lower this to catch leaking stream ids.
 STREAM_ID_LIMIT = (2**16)
+# Timeout of each read of the AdbConnection reader thread, after which it checks
+# whether the connection was closed, and of the messages it sends to ACK.
+READER_TIMEOUT_MS = 1000
 
 
 class AuthSigner(object):
@@ -165,7 +191,8 @@ class AdbStream(object):
     """Write data to this stream.
 
     Args:
-      data: Data to write.
+      data: Data to write, a bytes-like object or a str, which is encoded as
+        UTF-8.
       timeout_ms: Timeout to use for the write/Ack transaction, in milliseconds
         (or as a PolledTimeout object).
 
@@ -175,11 +202,14 @@ class AdbStream(object):
         before the write completes.
     """
     timeout = timeouts.PolledTimeout.from_millis(timeout_ms)
-    # Break the data up into our transport's maxdata sized WRTE messages.
-    while data:
-      self._transport.write(data[:self._transport.adb_connection.maxdata],
-                            timeout)
-      data = data[self._transport.adb_connection.maxdata:]
+    if isinstance(data, str):
+      data = data.encode('utf-8')
+    # Break the data up into our transport's maxdata sized WRTE messages,
+    # slicing a memoryview so the chunks don't copy the data.
+    maxdata = self._transport.adb_connection.maxdata
+    view = memoryview(data).cast('B')
+    for offset in range(0, len(view), maxdata):
+      self._transport.write(view[offset:offset + maxdata], timeout)
 
   def read(self, length=0, timeout_ms=None):
     """Reads data from the remote end of this stream.
@@ -230,6 +260,173 @@ class AdbStream(object):
     self._transport.close(timeout_ms)
 
 
+class _LoopMessageQueue(object):
+  """Message queue of a stream read from an asyncio event loop.
+
+  The AdbConnection reader thread put()s messages, which are handed to the loop
+  to be consumed by get() coroutines.
+  """
+
+  def __init__(self, loop):
+    self._loop = loop
+    self._queue = asyncio.Queue()
+
+  def put(self, message):
+    try:
+      self._loop.call_soon_threadsafe(self._queue.put_nowait, message)
+    except RuntimeError:
+      # The loop was closed, nobody is left to read the message.
+      pass
+
+  async def get(self):
+    return await self._queue.get()
+
+
+class AsyncAdbStream(object):
+  """An open ADB stream used from an asyncio event loop.
+
+  This is the asyncio counterpart of AdbStream, returned by
+  AdbConnection.open_async_stream().  Its methods are coroutines to be awaited
+  from the loop the stream was opened on, and iterating over it with async for
+  yields the data read until the stream is closed.  Messages are written from
+  the connection's writer thread, so the loop isn't blocked while the device is
+  slow to accept them.
+  """
+
+  def __init__(self, destination, transport, message_queue):
+    """Create a new asyncio ADB stream.
+
+    Args:
+      destination: String identifier for the destination of this stream.
+      transport: AdbStreamTransport of the opened stream.
+      message_queue: _LoopMessageQueue the messages of the stream are put on.
+    """
+    self._destination = destination
+    self._transport = transport
+    self._queue = message_queue
+    self._writer = transport.adb_connection._writer  # pylint: disable=protected-access
+    self._message_handled = asyncio.Condition()
+    self._write_lock = asyncio.Lock()
+    # Set once no more messages will be handled, with the error if any.
+    self._done = False
+    self._error = None
+    self._handler = asyncio.ensure_future(self._handle_messages())
+
+  def __str__(self):
+    return '<%s: (%s, %s->%s)>' % (type(self).__name__, self._destination,
+                                   self._transport.local_id,
+                                   self._transport.remote_id)
+
+  __repr__ = __str__
+
+  def is_closed(self):
+    """Return True if the stream is closed."""
+    return self._transport.is_closed()
+
+  async def _handle_messages(self):
+    """Handle the messages of this stream as they are read, until closed."""
+    while not self._done:
+      message = await self._queue.get()
+      async with self._message_handled:
+        if message is None:
+          self._error = self._transport.adb_connection._reader_error  # pylint: disable=protected-access
+          self._done = True
+        else:
+          try:
+            self._transport._handle_message(message)  # pylint: disable=protected-access
+          except usb_exceptions.AdbProtocolError as exception:
+            self._error = exception
+            self._done = True
+        self._message_handled.notify_all()
+
+  async def _write(self, func, *args):
+    """Call func, which writes to the transport, from the writer thread."""
+    return await asyncio.get_running_loop().run_in_executor(
+        self._writer, func, *args)
+
+  async def _wait_until_true(self, predicate, timeout_ms):
+    """Wait for messages to be handled until predicate() or no more will be."""
+    timeout = timeouts.PolledTimeout.from_millis(timeout_ms)
+    async with self._message_handled:
+      try:
+        await asyncio.wait_for(
+            self._message_handled.wait_for(
+                lambda: predicate() or self._done or self.is_closed()),
+            timeout.remaining)
+      except asyncio.TimeoutError:
+        raise usb_exceptions.AdbTimeoutError('%s timed out reading messages.' %
+                                             self)
+    if self._error is not None and not predicate():
+      raise self._error
+
+  async def write(self, data, timeout_ms=None):
+    """Write data to this stream, see AdbStream.write()."""
+    if isinstance(data, str):
+      data = data.encode('utf-8')
+    transport = self._transport
+    maxdata = transport.adb_connection.maxdata
+    view = memoryview(data).cast('B')
+    async with self._write_lock:
+      for offset in range(0, len(view), maxdata):
+        if self.is_closed():
+          raise usb_exceptions.AdbStreamClosedError(
+              'Cannot write() to closed %s' % self)
+        chunk = view[offset:offset + maxdata]
+        timeout = timeouts.PolledTimeout.from_millis(timeout_ms)
+        # pylint: disable=protected-access
+        if transport.adb_connection.delayed_ack:
+          await self._wait_until_true(lambda: transport._send_budget > 0,
+                                      timeout_ms)
+          if self.is_closed():
+            raise usb_exceptions.AdbStreamClosedError(
+                'Cannot write() to closed %s' % self)
+          with transport._send_budget_lock:
+            transport._send_budget -= len(chunk)
+          await self._write(transport._send_command, 'WRTE', timeout, chunk)
+        else:
+          transport._expecting_okay = True
+          await self._write(transport._send_command, 'WRTE', timeout, chunk)
+          await self._wait_until_true(lambda: not transport._expecting_okay,
+                                      timeout_ms)
+        # pylint: enable=protected-access
+
+  async def read(self, length=0, timeout_ms=None):
+    """Read data from this stream, see AdbStream.read()."""
+    transport = self._transport
+    timeout = timeouts.PolledTimeout.from_millis(timeout_ms)
+    data = bytearray()
+    while True:
+      # pylint: disable=protected-access
+      await self._wait_until_true(lambda: transport._read_buffer, timeout)
+      if not transport._read_buffer:
+        raise usb_exceptions.AdbStreamClosedError(
+            'Attempt to read from closed %s' % self)
+      taken, okay_data = transport._take(length - len(data))
+      if okay_data is not None and not self.is_closed():
+        await self._write(transport._send_command, 'OKAY', timeout, okay_data)
+      # pylint: enable=protected-access
+      data += taken
+      if len(data) >= length:
+        return bytes(data)
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self):
+    try:
+      return await self.read()
+    except usb_exceptions.AdbStreamClosedError:
+      raise StopAsyncIteration
+
+  def close(self, timeout_ms=100):
+    """Close the stream, the CLSE message is sent from the writer thread."""
+    try:
+      self._writer.submit(self._transport.close, timeout_ms)
+    except RuntimeError:
+      # The connection was closed, and the stream with it.
+      pass
+
+
 class AdbStreamTransport(object):  # pylint: disable=too-many-instance-attributes
   """This class encapsulates the transport aspect of an ADB stream.
 
@@ -259,12 +456,23 @@ class AdbStreamTransport(object):  # pylint: disable=too-many-instance-attribute
     # When we read the first OKAY, remote_id and closed will get updated.
     self.remote_id = None
     self.closed_state = self.ClosedState.PENDING
-    # Read buffer, deque of string containing data read for this stream.
-    self._read_buffer = collections.deque()
-    self._buffer_size = 0  # Total bytes in _read_buffer.
+    # Read buffer of data read for this stream.  Data is appended to the end
+    # and consumed from the front, both of which are amortized O(1) for a
+    # bytearray.
+    self._read_buffer = bytearray()
     self._read_buffer_lock = threading.Lock()
+    # Whether the remote end waits for an OKAY to the WRTE whose data is in the
+    # read buffer, or with delayed ACKs, the bytes consumed from it that were
+    # not ACK'd yet.  WRTEs are ACK'd once their data is consumed, so the remote
+    # end can't write faster than the stream is read.
+    self._ack_pending = False
+    self._unacked_bytes = 0
     # Lock to protect against multiple simultaneous in-flight writes.
     self._write_lock = threading.Lock()
+    # With delayed ACKs, the number of bytes we may still write before the
+    # remote end ACKs some of them.
+    self._send_budget = 0
+    self._send_budget_lock = threading.Lock()
     # Some locking/events to protect against race conditions reading messages.
     self._expecting_okay = True
     self._message_received = threading.Condition()
@@ -286,7 +494,7 @@ class AdbStreamTransport(object):  # pylint: disable=too-many-instance-attribute
       raise usb_exceptions.AdbProtocolError('%s remote-id change to %s' %
                                             (self, remote_id))
 
-  def _send_command(self, command, timeout, data=''):
+  def _send_command(self, command, timeout, data=b''):
     """Send the given command/data over this transport.
 
     We do a couple sanity checks in here to be sure we can format a valid
@@ -318,10 +526,13 @@ class AdbStreamTransport(object):  # pylint: disable=too-many-instance-attribute
 
     For each message type, this means:
       OKAY: Check id's and make sure we are expecting an OKAY.  Clear the
-        self._expecting_okay flag so any pending write()'s know.
+        self._expecting_okay flag so any pending write()'s know.  With delayed
+        ACKs, OKAYs are always expected and add the bytes they ACK to our
+        send budget.
       CLSE: Set our internal state to closed.
       WRTE: Add the data read to our internal read buffer.  Note we don't
         return the actual data because it may not be this thread that needs it.
+        The WRTE is ACK'd once the data is consumed, see _consume().
 
     Args:
       message: Message that was read.
@@ -332,7 +543,11 @@ class AdbStreamTransport(object):  # pylint: disable=too-many-instance-attribute
     """
     if message.command == 'OKAY':
       self._set_or_check_remote_id(message.arg0)
-      if not self._expecting_okay:
+      if self.adb_connection.delayed_ack:
+        acked_bytes = self._unpack_acked_bytes(message)
+        with self._send_budget_lock:
+          self._send_budget += acked_bytes
+      elif not self._expecting_okay:
         raise usb_exceptions.AdbProtocolError(
             '%s received unexpected OKAY: %s' % (self, message))
       self._expecting_okay = False
@@ -343,8 +558,63 @@ class AdbStreamTransport(object):  # pylint: disable=too-many-instance-attribute
           '%s received WRTE before OKAY/CLSE: %s' % (self, message))
     else:
       with self._read_buffer_lock:
-        self._read_buffer.append(message.data)
-        self._buffer_size += len(message.data)
+        self._read_buffer += message.data
+        self._ack_pending = True
+
+  def _consume(self, length, timeout):
+    """Take data from the read buffer and ACK the WRTE it came from if done.
+
+    Args:
+      length: Maximum number of bytes to take, or 0 to take all of them.
+      timeout: timeouts.PolledTimeout to use for sending the OKAY.
+
+    Returns:
+      The bytes taken from the read buffer.
+    """
+    data, okay_data = self._take(length)
+    if okay_data is not None and not self.is_closed():
+      self._send_command('OKAY', timeout, okay_data)
+    return data
+
+  def _take(self, length):
+    """Take data from the read buffer, see _consume().
+
+    With delayed ACKs, the bytes taken are granted back to the remote end once
+    the read buffer is empty, or at least maxdata of them were taken.
+
+    Args:
+      length: Maximum number of bytes to take, or 0 to take all of them.
+
+    Returns:
+      Tuple of the bytes taken, and the data of the OKAY to send for them or
+    None if no OKAY is due yet.
+    """
+    with self._read_buffer_lock:
+      if not length or length > len(self._read_buffer):
+        length = len(self._read_buffer)
+      data = bytes(self._read_buffer[:length])
+      del self._read_buffer[:length]
+      okay_data = None
+      if self.adb_connection.delayed_ack:
+        self._unacked_bytes += length
+        if self._unacked_bytes and (
+            not self._read_buffer or
+            self._unacked_bytes >= self.adb_connection.maxdata):
+          okay_data = struct.pack(DELAYED_ACK_STRUCT_FORMAT,
+                                  self._unacked_bytes)
+          self._unacked_bytes = 0
+      elif self._ack_pending and not self._read_buffer:
+        okay_data = b''
+        self._ack_pending = False
+    return data, okay_data
+
+  def _unpack_acked_bytes(self, message):
+    """Return the number of bytes ACK'd by a delayed ACK OKAY message."""
+    try:
+      return struct.unpack(DELAYED_ACK_STRUCT_FORMAT, message.data)[0]
+    except struct.error:
+      raise usb_exceptions.AdbProtocolError(
+          '%s received OKAY without ACK\'d bytes: %s' % (self, message))
 
   def _read_messages_until_true(self, predicate, timeout):
     """Read a message from this stream and handle it.
@@ -439,20 +709,18 @@ class AdbStreamTransport(object):  # pylint: disable=too-many-instance-attribute
     """Return true if the transport layer is closed."""
     return self.closed_state == self.ClosedState.CLOSED
 
-  def enqueue_message(self, message, timeout):
+  def enqueue_message(self, message):
     """Add the given message to this transport's queue.
 
-    This method also handles ACKing any WRTE messages.
+    WRTE messages are not ACK'd here, but once the stream consumes them, so a
+    stream that isn't read holds the remote end back instead of queueing all
+    it writes.
 
     Args:
       message: The AdbMessage to enqueue.
-      timeout: The timeout to use for the operation.  Specifically, WRTE
-        messages cause an OKAY to be sent; timeout is used for that send.
     """
-    # Ack WRTE messages immediately, handle our OPEN ack if it gets enqueued.
-    if message.command == 'WRTE':
-      self._send_command('OKAY', timeout=timeout)
-    elif message.command == 'OKAY':
+    # Handle our OPEN ack if it gets enqueued.
+    if message.command == 'OKAY':
       self._set_or_check_remote_id(message.arg0)
     self.message_queue.put(message)
 
@@ -468,9 +736,22 @@ class AdbStreamTransport(object):  # pylint: disable=too-many-instance-attribute
       raise usb_exceptions.AdbProtocolError(
           'Previous WRTE failed, %s in unknown state' % self)
 
-    # Make sure we only have one WRTE in flight at a time, because ADB doesn't
-    # identify which WRTE it is ACK'ing when it sends the OKAY message back.
     with self._write_lock:
+      if self.adb_connection.delayed_ack:
+        # Pipeline WRTEs as long as the remote end has budget left, only waiting
+        # for OKAYs once it's used up.
+        self._read_messages_until_true(
+            lambda: self._send_budget > 0 or self.is_closed(), timeout)
+        if self.is_closed():
+          raise usb_exceptions.AdbStreamClosedError(
+              'Cannot write() to closed %s' % self)
+        with self._send_budget_lock:
+          self._send_budget -= len(data)
+        self._send_command('WRTE', timeout, data)
+        return
+
+      # Make sure we only have one WRTE in flight at a time, because ADB doesn't
+      # identify which WRTE it is ACK'ing when it sends the OKAY message back.
       self._expecting_okay = True
       self._send_command('WRTE', timeout, data)
       self._read_messages_until_true(lambda: not self._expecting_okay, timeout)
@@ -486,18 +767,13 @@ class AdbStreamTransport(object):  # pylint: disable=too-many-instance-attribute
     Returns:
       The bytes read from this stream.
     """
-    self._read_messages_until_true(
-        lambda: self._buffer_size and self._buffer_size >= length, timeout)
-
-    with self._read_buffer_lock:
-      data, push_back = ''.join(self._read_buffer), ''
-      if length:
-        data, push_back = data[:length], data[length:]
-      self._read_buffer.clear()
-      self._buffer_size = len(push_back)
-      if push_back:
-        self._read_buffer.appendleft(push_back)
-    return data
+    data = bytearray()
+    while True:
+      # Consume the data as it comes, the remote end waits for it to be ACK'd.
+      self._read_messages_until_true(lambda: self._read_buffer, timeout)
+      data += self._consume(length - len(data), timeout)
+      if len(data) >= length:
+        return bytes(data)
 
   def close(self, timeout_ms):
     """Close this stream, future reads/writes will fail."""
@@ -532,6 +808,9 @@ class AdbConnection(object):
   Attributes:
     transport: Underlying transport for this AdbConnection, usually USB.
     maxdata: Max data payload size supported by this AdbConnection.
+    features: Set of features advertised in the remote banner.
+    delayed_ack: True if streams use delayed ACKs instead of allowing only one
+      WRTE in flight.
     systemtype: System type, according to ADB's protocol.txt, one of 'device',
       'recovery', etc.
     serial: The 'serial number', as reported by ADB in the remote banner.
@@ -545,31 +824,59 @@ class AdbConnection(object):
   AUTH_SIGNATURE = 2
   AUTH_RSAPUBLICKEY = 3
 
-  def __init__(self, transport, maxdata, remote_banner):
+  def __init__(self, transport, maxdata, remote_banner, delayed_ack=False):
     """Create an ADB connection to a device.
 
     Args:
       transport: AdbTransportAdapter to use for reading/writing AdbMessages
       maxdata: Max data size the remote endpoint will accept.
       remote_banner: Banner received from the remote endpoint.
+      delayed_ack: If True, use delayed ACKs if the remote endpoint supports
+        them, this must match what we advertised in our CNXN message.
     """
+    if not isinstance(remote_banner, str):
+      remote_banner = bytes(remote_banner).rstrip(b'\0').decode(
+          'utf-8', 'replace')
     try:
       self.systemtype, self.serial, self.banner = remote_banner.split(':', 2)
     except ValueError:
       raise usb_exceptions.AdbProtocolError('Received malformed banner %s' %
                                             remote_banner)
+    self.features = frozenset()
+    for prop in self.banner.split(';'):
+      key, _, value = prop.partition('=')
+      if key == 'features':
+        self.features = frozenset(value.split(','))
+    self.delayed_ack = delayed_ack and DELAYED_ACK_FEATURE in self.features
     self.transport = transport
     self.maxdata = maxdata
     self._last_id_used = 0
-    self._reader_lock = threading.Lock()
     self._open_lock = threading.Lock()
     # Maps local_id: AdbStreamTransport object for the relevant stream.
     self._stream_transport_map = {}
     self._stream_transport_map_lock = threading.RLock()
+    # Thread reading messages from the transport for all the streams, started
+    # when the first stream is opened.
+    self._reader_thread = None
+    self._closing = False
+    # Exception that stopped the reader thread, if any.
+    self._reader_error = None
+    # Thread writing the messages of asyncio streams, started when the first
+    # one is opened.
+    self._writer = None
+
+  def _make_stream_transport(self, msg_queue=None):
+    """Create an AdbStreamTransport with a newly allocated local_id.
+
+    Args:
+      msg_queue: Queue to put the messages for the stream on, a new queue.Queue
+        by default.
 
-  def _make_stream_transport(self):
-    """Create an AdbStreamTransport with a newly allocated local_id."""
-    msg_queue = queue.Queue()
+    Returns:
+      The new AdbStreamTransport.
+    """
+    if msg_queue is None:
+      msg_queue = queue.Queue()
     with self._stream_transport_map_lock:
       # Start one past the last id we used, and grab the first available one.
       # This mimics the ADB behavior of 'increment an unsigned and let it
@@ -593,59 +900,78 @@ class AdbConnection(object):
       # pylint: disable=undefined-loop-variable
       stream_transport = AdbStreamTransport(self, local_id, msg_queue)
       self._stream_transport_map[local_id] = stream_transport
+      if self._closing or self._reader_error:
+        # Nothing will ever be read for this stream.
+        msg_queue.put(None)
+      elif self._reader_thread is None:
+        self._reader_thread = threading.Thread(
+            target=self._read_messages, name='AdbReader-%s' % self.serial)
+        self._reader_thread.daemon = True
+        self._reader_thread.start()
     return stream_transport
 
-  def _handle_message_for_stream(self, stream_transport, message, timeout):
-    """Handle an incoming message, check if it's for the given stream.
+  def _read_messages(self):
+    """Reads messages and queues them for their stream until closed."""
+    while not self._closing:
+      try:
+        self._dispatch_message(
+            self.transport.read_message(
+                timeouts.PolledTimeout.from_millis(READER_TIMEOUT_MS)))
+      except usb_exceptions.UsbReadFailedError as exception:
+        if not exception.is_timeout():
+          self._stop_reading(exception)
+          return
+      except Exception as exception:  # pylint: disable=broad-except
+        self._stop_reading(exception)
+        return
+
+  def _stop_reading(self, exception):
+    """Records the exception stopping the reader and wakes all the streams."""
+    if not self._closing:
+      _LOG.error('%s failed to read messages: %s', self, exception)
+      self._reader_error = exception
+    with self._stream_transport_map_lock:
+      for stream_transport in self._stream_transport_map.values():
+        stream_transport.message_queue.put(None)
 
-    If the message is not for the stream, then add it to the appropriate
-    message queue.
+  def _dispatch_message(self, message):
+    """Queues an incoming message for the stream it is intended for.
 
-    Args:
-      stream_transport: AdbStreamTransport currently waiting on a message.
-      message: Message to check and handle.
-      timeout: Timeout to use for the operation, should be an instance of
-        timeouts.PolledTimeout.
+    The stream is closed on CLSE messages, WRTE messages are ACK'd by their
+    stream once they are read.
 
-    Returns:
-      The message read if it was for this stream, None otherwise.
+    Args:
+      message: The AdbMessage read.
 
     Raises:
       AdbProtocolError: If we receive an unexpected message type.
     """
     if message.command not in ('OKAY', 'CLSE', 'WRTE'):
       raise usb_exceptions.AdbProtocolError(
-          '%s received unexpected message: %s' % self, message)
-
-    if message.arg1 == stream_transport.local_id:
-      # Ack writes immediately.
-      if message.command == 'WRTE':
-        # Make sure we don't get a WRTE before an OKAY/CLSE message.
-        if not stream_transport.remote_id:
-          raise usb_exceptions.AdbProtocolError(
-              '%s received WRTE before OKAY/CLSE: %s' %
-              (stream_transport, message))
-        self.transport.write_message(
-            adb_message.AdbMessage('OKAY', stream_transport.local_id,
-                                   stream_transport.remote_id), timeout)
-      elif message.command == 'CLSE':
-        self.close_stream_transport(stream_transport, timeout)
-      return message
-    else:
-      # Message was not for this stream, add it to the right stream's queue.
-      with self._stream_transport_map_lock:
-        dest_transport = self._stream_transport_map.get(message.arg1)
-
-      if dest_transport:
-        if message.command == 'CLSE':
-          self.close_stream_transport(dest_transport, timeout)
-        dest_transport.enqueue_message(message, timeout)
-      else:
-        _LOG.warning('Received message for unknown local-id: %s', message)
+          '%s received unexpected message: %s' % (self, message))
+
+    with self._stream_transport_map_lock:
+      stream_transport = self._stream_transport_map.get(message.arg1)
+    if not stream_transport:
+      _LOG.warning('Received message for unknown local-id: %s', message)
+      return
+
+    stream_transport.enqueue_message(message)
+    if message.command == 'CLSE':
+      self.close_stream_transport(
+          stream_transport,
+          timeouts.PolledTimeout.from_millis(READER_TIMEOUT_MS))
 
   def close(self):
     """Close the connection."""
+    self._closing = True
+    if self._writer is not None:
+      self._writer.shutdown(wait=False)
     self.transport.close()
+    self._stop_reading(None)
+    if (self._reader_thread is not None and
+        self._reader_thread is not threading.current_thread()):
+      self._reader_thread.join(READER_TIMEOUT_MS / 1000.0)
 
   def open_stream(self, destination, timeout_ms=None):
     """Opens a new stream to a destination service on the device.
@@ -675,12 +1001,63 @@ class AdbConnection(object):
         adb_message.AdbMessage(
             command='OPEN',
             arg0=stream_transport.local_id,
-            arg1=0,
+            arg1=DELAYED_ACK_WINDOW if self.delayed_ack else 0,
             data=destination + '\0'), timeout)
     if not stream_transport.ensure_opened(timeout):
       return None
     return AdbStream(destination, stream_transport)
 
+  async def open_async_stream(self, destination, timeout_ms=None):
+    """Opens a new stream to be used from the running asyncio event loop.
+
+    Messages for the stream are handed from the reader thread of this
+    connection to the loop, rather than queued for threads blocking on them,
+    and written from a writer thread shared by the asyncio streams.
+
+    Args:
+      destination: The service:command string, see ADB documentation.
+      timeout_ms: Timeout in milliseconds for the Open to succeed.
+
+    Raises:
+      AdbProtocolError: Wrong local_id sent to us, or we didn't get a ready
+        response.
+      AdbTimeoutError: If the device didn't respond before timeout_ms.
+
+    Returns:
+      An AsyncAdbStream to read/write data to the specified service endpoint,
+      or None if the requested service couldn't be opened.
+    """
+    timeout = timeouts.PolledTimeout.from_millis(timeout_ms)
+    loop = asyncio.get_running_loop()
+    msg_queue = _LoopMessageQueue(loop)
+    stream_transport = self._make_stream_transport(msg_queue)
+    with self._stream_transport_map_lock:
+      if self._writer is None:
+        self._writer = futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='AdbWriter-%s' % self.serial)
+    await loop.run_in_executor(
+        self._writer, self.transport.write_message,
+        adb_message.AdbMessage(
+            command='OPEN',
+            arg0=stream_transport.local_id,
+            arg1=DELAYED_ACK_WINDOW if self.delayed_ack else 0,
+            data=destination + '\0'), timeout)
+    try:
+      message = await asyncio.wait_for(msg_queue.get(), timeout.remaining)
+    except asyncio.TimeoutError:
+      stream_transport.close(0)
+      raise usb_exceptions.AdbTimeoutError('Open timed out for %s' %
+                                           stream_transport)
+    if message is None:
+      if self._reader_error is not None:
+        raise self._reader_error
+      raise usb_exceptions.AdbStreamClosedError(
+          'Connection closed while opening %s' % stream_transport)
+    stream_transport._handle_message(message, handle_wrte=False)  # pylint: disable=protected-access
+    if not stream_transport.is_open():
+      return None
+    return AsyncAdbStream(destination, stream_transport, msg_queue)
+
   def close_stream_transport(self, stream_transport, timeout):
     """Remove the given stream transport's id from our map of id's.
 
@@ -700,6 +1077,8 @@ class AdbConnection(object):
     with self._stream_transport_map_lock:
       if stream_transport.local_id in self._stream_transport_map:
         del self._stream_transport_map[stream_transport.local_id]
+        # Wake up any reader of the stream once its messages are consumed.
+        stream_transport.message_queue.put(None)
         # If we never got a remote_id, there's no CLSE message to send.
         if stream_transport.remote_id:
           self.transport.write_message(
@@ -736,38 +1115,26 @@ class AdbConnection(object):
   def read_for_stream(self, stream_transport, timeout_ms=None):
     """Attempt to read a packet for the given stream transport.
 
-    Will read packets from self.transport until one intended for the given
-    AdbStream is found.  If another thread is already reading packets, this will
-    block until that thread reads a packet for this stream, or timeout expires.
-    Note that this method always returns None, but if a packet was read for the
-    given stream, it will have been added to that stream's message queue.
-
-    This is somewhat tricky to do - first we check if there's a message already
-    in our queue.  If not, then we try to use our AdbConnection to read a
-    message for this stream.
-
-    If some other thread is already doing reads, then read_for_stream() will sit
-    in a tight loop, with a short delay, checking our message queue for a
-    message from the other thread.
+    Messages are read by the reader thread of this AdbConnection and queued for
+    their stream, so this only waits for a message to be queued for the given
+    stream.
 
     Note that we must pass the queue in from the AdbStream, rather than looking
     it up in the AdbConnection's map, because the AdbConnection may have
     removed the queue from its map (while it still had messages in it).  The
     AdbStream itself maintains a reference to the queue to avoid dropping those
-    messages.
+    messages.  Once a stream is closed, None is queued after its last message.
 
     The AdbMessage read is guaranteed to be one of 'OKAY', 'WRTE', or 'CLSE'.
-    If it was a WRTE message, then it will have been automatically ACK'd with an
-    OKAY message, if it was a CLSE message it will have been ACK'd with a
-    corresponding CLSE message, and this AdbStream will be marked as closed.
+    If it was a WRTE message, it is up to the stream to ACK it with an OKAY
+    message once consumed, if it was a CLSE message it will have been ACK'd with
+    a corresponding CLSE message, and this AdbStream will be marked as closed.
 
     Args:
       stream_transport: The AdbStreamTransport for the stream that is reading an
         AdbMessage from this AdbConnection.
-      timeout_ms: If provided, timeout, in milliseconds, to use.  Note this
-        timeout applies to this entire call, not for each individual Read, since
-        there may be multiple reads if messages for other streams are read. This
-        argument may be a timeouts.PolledTimeout.
+      timeout_ms: If provided, timeout, in milliseconds, to use.  This argument
+        may be a timeouts.PolledTimeout.
 
     Returns:
       AdbMessage that was read, guaranteed to be one of 'OKAY', 'CLSE', or
@@ -777,59 +1144,32 @@ class AdbConnection(object):
       AdbTimeoutError: If we don't get a packet for this stream before
         timeout expires.
       AdbStreamClosedError: If the given stream has been closed.
+      Exception: The exception that stopped the reader thread, if the
+        connection failed.
     """
     timeout = timeouts.PolledTimeout.from_millis(timeout_ms)
-    # Bail when the timeout expires, or when we no longer have the given stream
-    # in our map (it may have been closed, we don't want to leave a thread
-    # hanging in this loop when that happens).
-    while (not timeout.has_expired() and
-           stream_transport.local_id in self._stream_transport_map):
-      try:
-        # Block for up to 10ms to rate-limit how fast we spin.
-        return stream_transport.message_queue.get(True, .01)
-      except queue.Empty:
-        pass
-
-      # If someone else has the Lock, just keep checking our queue.
-      if not self._reader_lock.acquire(False):
-        continue
-
-      try:
-        # Now that we've acquired the Lock, we have to check the queue again,
-        # just in case someone had the Lock but hadn't yet added our message
-        # to the queue when we checked the first time.  Now that we have the
-        # Lock ourselves, we're sure there are no potentially in-flight reads.
-        try:
-          return stream_transport.message_queue.get_nowait()
-        except queue.Empty:
-          pass
-
-        while not timeout.has_expired():
-          msg = self._handle_message_for_stream(
-              stream_transport, self.transport.read_message(timeout), timeout)
-          if msg:
-            return msg
-      finally:
-        self._reader_lock.release()
-
-    if timeout.has_expired():
+    try:
+      message = stream_transport.message_queue.get(True, timeout.remaining)
+    except queue.Empty:
       raise usb_exceptions.AdbTimeoutError('Read timed out for %s' %
                                            stream_transport)
 
-    # The stream is no longer in the map, so it's closed, but check for any
-    # queued messages.
-    try:
-      return stream_transport.message_queue.get_nowait()
-    except queue.Empty:
+    if message is None:
+      # Leave the marker for any later read.
+      stream_transport.message_queue.put(None)
+      if self._reader_error is not None:
+        raise self._reader_error
       raise usb_exceptions.AdbStreamClosedError(
           'Attempt to read from closed or unknown %s' % stream_transport)
+    return message
 
   @classmethod
   def connect(cls,
               transport,
               rsa_keys=None,
               timeout_ms=1000,
-              auth_timeout_ms=100):
+              auth_timeout_ms=100,
+              delayed_ack=True):
     """Establish a new connection to a device, connected via transport.
 
     Args:
@@ -852,6 +1192,9 @@ class AdbConnection(object):
         quickly; while in interactive settings it should be high to allow users
         to accept the dialog. We default to automation here, so it's low by
         default.  This argument may be a PolledTimeout object.
+      delayed_ack: If True, advertise support for delayed ACKs and use them if
+        the device supports them too, otherwise only allow one WRTE in flight
+        per stream, as legacy devices do.
 
     Returns:
       An instance of AdbConnection that is connected to the device.
@@ -872,11 +1215,16 @@ class AdbConnection(object):
             command='CNXN',
             arg0=ADB_VERSION,
             arg1=MAX_ADB_DATA,
-            data='host::%s\0' % ADB_BANNER), timeout)
+            data='host::%s;features=%s\0' %
+            (ADB_BANNER, DELAYED_ACK_FEATURE if delayed_ack else '')), timeout)
+
+    def make_connection(msg):
+      return cls(adb_transport, min(msg.arg1, MAX_ADB_DATA), msg.data,
+                 delayed_ack)
 
     msg = adb_transport.read_until(('AUTH', 'CNXN'), timeout)
     if msg.command == 'CNXN':
-      return cls(adb_transport, msg.arg1, msg.data)
+      return make_connection(msg)
 
     # We got an AUTH response, so we have to try to authenticate.
     if not rsa_keys:
@@ -898,7 +1246,7 @@ class AdbConnection(object):
 
       msg = adb_transport.read_until(('AUTH', 'CNXN'), timeout)
       if msg.command == 'CNXN':
-        return cls(adb_transport, msg.arg1, msg.data)
+        return make_connection(msg)
 
     # None of the keys worked, so send a public key.
     adb_transport.write_message(
@@ -918,4 +1266,4 @@ class AdbConnection(object):
       raise
 
     # The read didn't time-out, so we got a CNXN response.
-    return cls(adb_transport, msg.arg1, msg.data)
+    return make_connection(msg)
@@ -0,0 +1,317 @@
+# Copyright 2026 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Run fastboot and ADB operations on many USB devices at once.
+
+The USB plugs talk to a single device each.  A DevicePool instead holds USB
+handles to several devices, such as the boards of a gang-programming fixture,
+and runs a sequence of steps on all of them in parallel, one thread per device.
+The results and timing of every step on every device are returned as
+DeviceResults, which can be recorded in a dimensioned measurement:
+
+  from openhtf.plugs.usb import device_pool
+
+  @htf.measures(device_pool.results_measurement('flash_results'))
+  def flash_boards(test):
+    with device_pool.DevicePool.open(
+        SERIALS, interface_class=fastboot_device.CLASS,
+        interface_subclass=fastboot_device.SUBCLASS,
+        interface_protocol=fastboot_device.PROTOCOL) as pool:
+      results = pool.flash({'boot': 'boot.img', 'system': 'system.img'})
+    device_pool.record_results(test.measurements.flash_results, results)
+
+Writes to the devices go through a TransferArbiter shared by the pool, which
+allows a limited number of bulk transfers at a time and grants them in the order
+they were requested, so every device gets its turn between the chunks of the
+others instead of some devices hogging the bus.  Reads are not arbitrated, since
+they mostly wait on the device rather than use the bus.
+"""
+
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+from openhtf.core import measurements
+from openhtf.plugs.usb import fastboot_protocol
+from openhtf.util import units
+
+_LOG = logging.getLogger(__name__)
+
+# Bulk transfers allowed at once across all the devices of a pool.
+DEFAULT_MAX_CONCURRENT_TRANSFERS = 4
+# Dimensions of the measurement results are recorded in.
+RESULTS_DIMENSIONS = ('serial', 'step', 'outcome')
+
+
+class DeviceResult(
+    collections.namedtuple('DeviceResult', [
+        'serial',
+        'step',
+        'passed',
+        'elapsed_s',
+        'error',
+    ])):
+  """Result of one step on one device of a DevicePool.
+
+  Attributes:
+    serial: Serial number of the device.
+    step: Name of the step.
+    passed: True if the step succeeded.
+    elapsed_s: Time the step took, in seconds.
+    error: The exception raised by the step, or None.
+  """
+
+
+class TransferArbiter(object):
+  """Grants up to max_concurrent transfers at a time, first come first served."""
+
+  def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT_TRANSFERS):
+    if max_concurrent < 1:
+      raise ValueError('max_concurrent must be positive, got %s' %
+                       max_concurrent)
+    self._max_concurrent = max_concurrent
+    self._active = 0
+    self._waiting = collections.deque()
+    self._condition = threading.Condition()
+
+  @contextlib.contextmanager
+  def transfer(self):
+    """Context manager that waits for its turn to transfer."""
+    ticket = object()
+    with self._condition:
+      self._waiting.append(ticket)
+      self._condition.wait_for(lambda: (  # pylint: disable=g-long-lambda
+          self._waiting[0] is ticket and
+          self._active < self._max_concurrent))
+      self._waiting.popleft()
+      self._active += 1
+      # The next ticket may be able to go too.
+      self._condition.notify_all()
+    try:
+      yield
+    finally:
+      with self._condition:
+        self._active -= 1
+        self._condition.notify_all()
+
+
+class ArbitratedUsbHandle(object):
+  """UsbHandle wrapper whose writes wait for their turn with an arbiter."""
+
+  def __init__(self, handle, arbiter):
+    self._handle = handle
+    self._arbiter = arbiter
+
+  def __getattr__(self, attr):
+    return getattr(self._handle, attr)
+
+  def __str__(self):
+    return str(self._handle)
+
+  def write(self, data, timeout_ms=None):
+    with self._arbiter.transfer():
+      return self._handle.write(data, timeout_ms)
+
+
+class DevicePool(object):
+  """Runs steps on several USB devices in parallel.
+
+  Attributes:
+    handles: OrderedDict of serial number to the device's UsbHandle, wrapped
+      so its writes share the bus fairly with the others.
+  """
+
+  def __init__(self,
+               handles,
+               max_concurrent_transfers=DEFAULT_MAX_CONCURRENT_TRANSFERS):
+    """Create a pool of the given devices.
+
+    Args:
+      handles: Dict of serial number to an open UsbHandle for the device, the
+        pool takes ownership of the handles.
+      max_concurrent_transfers: Number of bulk transfers allowed at once across
+        all the devices.
+    """
+    arbiter = TransferArbiter(max_concurrent_transfers)
+    self.handles = collections.OrderedDict(
+        (serial, ArbitratedUsbHandle(handle, arbiter))
+        for serial, handle in sorted(handles.items()))
+
+  @classmethod
+  def open(cls,
+           serial_numbers,
+           max_concurrent_transfers=DEFAULT_MAX_CONCURRENT_TRANSFERS,
+           **kwargs):
+    """Open a pool of the locally connected devices with the given serials.
+
+    Args:
+      serial_numbers: Serial numbers of the devices to open.
+      max_concurrent_transfers: See __init__.
+      **kwargs: Arguments to pass to LibUsbHandle.open(), such as the interface
+        class, subclass and protocol.
+
+    Returns:
+      A DevicePool of the opened devices.
+    """
+    # Only needed here, and needs libusb.
+    from openhtf.plugs.usb import local_usb  # pylint: disable=g-import-not-at-top
+    handles = {}
+    try:
+      for serial in serial_numbers:
+        handles[serial] = local_usb.LibUsbHandle.open(
+            serial_number=serial, **kwargs)
+    except Exception:
+      for handle in handles.values():
+        handle.close()
+      raise
+    return cls(handles, max_concurrent_transfers)
+
+  def close(self):
+    """Close all the devices' handles."""
+    for handle in self.handles.values():
+      handle.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, exc_tb):
+    self.close()
+
+  def run(self, steps):
+    """Run the steps on every device, in parallel across devices.
+
+    Each device runs the steps in order, stopping at the first one that fails.
+
+    Args:
+      steps: List of (name, function) tuples, where function is called with the
+        serial number and UsbHandle of a device.  The step fails if function
+        raises or returns False.
+
+    Returns:
+      List of DeviceResults for the steps that were run, ordered by serial
+    number and then step.
+    """
+    results = collections.OrderedDict(
+        (serial, []) for serial in self.handles)
+
+    def run_steps(serial, handle):
+      for name, function in steps:
+        start_time = time.monotonic()
+        error = None
+        try:
+          passed = function(serial, handle) is not False
+        except Exception as exception:  # pylint: disable=broad-except
+          _LOG.exception('Step %s failed on device %s.', name, serial)
+          passed, error = False, exception
+        results[serial].append(
+            DeviceResult(serial, name, passed,
+                         time.monotonic() - start_time, error))
+        if not passed:
+          return
+
+    threads = [
+        threading.Thread(
+            target=run_steps,
+            args=(serial, handle),
+            name='DevicePool-%s' % serial)
+        for serial, handle in self.handles.items()
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return [result for device_results in results.values()
+            for result in device_results]
+
+  def flash(self,
+            images,
+            verify=None,
+            max_download_size=None,
+            info_cb=fastboot_protocol.DEFAULT_MESSAGE_CALLBACK,
+            timeout_ms=None):
+    """Download and flash images to every device in fastboot, then verify them.
+
+    Each source is opened once and shared by the devices, file-like objects
+    that can't be memory-mapped (eg pipes) are read into memory first.
+
+    Args:
+      images: Dict or list of (partition, source) pairs to flash in order, see
+        FastbootCommands.flash_from_file for the supported sources.
+      verify: Optional function called with the serial number and
+        FastbootCommands of each device once flashed, which fails the device
+        if it raises or returns False.
+      max_download_size: See FastbootCommands.flash_from_file.
+      info_cb: See FastbootCommands.flash_from_file.
+      timeout_ms: See FastbootCommands.flash_from_file.
+
+    Returns:
+      List of DeviceResults, see run(), with a 'flash:<partition>' step for each
+    image and a 'verify' step if verify was given.
+    """
+    if isinstance(images, dict):
+      images = list(images.items())
+
+    def flash_step(partition, source):
+
+      def step(_, handle):
+        fastboot_protocol.FastbootCommands(handle).flash_from_file(
+            partition,
+            source,
+            info_cb=info_cb,
+            timeout_ms=timeout_ms,
+            max_download_size=max_download_size)
+
+      return 'flash:%s' % partition, step
+
+    with contextlib.ExitStack() as stack:
+      steps = []
+      for partition, source in images:
+        # A memoryview of the whole image, which every device can read.
+        data, _ = stack.enter_context(fastboot_protocol.open_source(source))
+        steps.append(flash_step(partition, data))
+      if verify:
+        steps.append(('verify', lambda serial, handle: verify(
+            serial, fastboot_protocol.FastbootCommands(handle))))
+      return self.run(steps)
+
+
+def _all_steps_passed(value):
+  """Validator for results_measurement()."""
+  return all(outcome == 'PASS' for _, _, outcome, _ in value)
+
+
+def results_measurement(name, docstring=None):
+  """Return a measurement to record DevicePool results in.
+
+  The measurement has serial, step and outcome ('PASS' or 'FAIL') dimensions,
+  with the time each step took as the value, and fails unless every step passed.
+
+  Args:
+    name: Name of the measurement.
+    docstring: Optional docstring of the measurement.
+
+  Returns:
+    A Measurement to pass to htf.measures.
+  """
+  return measurements.Measurement(
+      name, docstring=docstring).with_dimensions(*RESULTS_DIMENSIONS).with_units(
+          units.SECOND).with_validator(_all_steps_passed)
+
+
+def record_results(measured_value, results):
+  """Record DeviceResults in a measurement from results_measurement()."""
+  for result in results:
+    measured_value[result.serial, result.step,
+                   'PASS' if result.passed else 'FAIL'] = result.elapsed_s
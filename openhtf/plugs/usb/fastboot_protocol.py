@@ -11,13 +11,21 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""A libusb1-based fastboot implementation."""
+"""A libusb1-based fastboot implementation.
+
+Images are downloaded straight from memory-mapped files where possible, so
+they are never copied into memory.  Raw images larger than the device's
+max-download-size are flashed as several Android sparse images, each of which
+covers a range of the image's blocks and marks the others as DONT_CARE, the
+same way the fastboot tool splits them.
+"""
 
 import binascii
 import collections
+import contextlib
 import io
 import logging
-import os
+import mmap
 import struct
 
 from . import usb_exceptions
@@ -38,6 +46,18 @@ _LOG = logging.getLogger(__name__)
 
 DEFAULT_MESSAGE_CALLBACK = lambda m: _LOG.info('Got %s from device', m)
 
+# Android sparse image format, see libsparse/sparse_format.h in the Android
+# source.
+SPARSE_HEADER_MAGIC = 0xED26FF3A
+SPARSE_BLOCK_SIZE = 4096
+# magic, major/minor version, file/chunk header sizes, block size, total blocks,
+# total chunks and image checksum.
+SPARSE_HEADER_FORMAT = '<I4H4I'
+# Chunk type, reserved, chunk size in blocks and total size in bytes.
+SPARSE_CHUNK_HEADER_FORMAT = '<2H2I'
+SPARSE_CHUNK_TYPE_RAW = 0xCAC1
+SPARSE_CHUNK_TYPE_DONT_CARE = 0xCAC3
+
 
 class FastbootMessage(
     collections.namedtuple('FastbootMessage', [
@@ -73,7 +93,8 @@ class FastbootProtocol(object):
     """
     if arg is not None:
       command = '%s:%s' % (command, arg)
-    self._write(io.StringIO(command), len(command))
+    command = command.encode('utf-8')
+    self._write(command, len(command))
 
   def handle_simple_responses(self,
                               timeout_ms=None,
@@ -99,7 +120,8 @@ class FastbootProtocol(object):
     """Handles the protocol for sending data to the device.
 
     Arguments:
-      source_file: File-object to read from for the device.
+      source_file: File-object to read from for the device, or a bytes-like
+        object or list of bytes-like objects to send without copying them.
       source_len: Amount of data, in bytes, to send to the device.
       info_cb: Optional callback for text sent from the bootloader.
       progress_callback: Callback that takes the current and the total progress
@@ -149,6 +171,8 @@ class FastbootProtocol(object):
     """
     while True:
       response = self.usb.read(64, timeout_ms=timeout_ms)
+      if not isinstance(response, str):
+        response = bytes(response).decode('utf-8', 'replace')
       header = response[:4]
       remaining = response[4:]
 
@@ -185,13 +209,174 @@ class FastbootProtocol(object):
     if progress_callback:
       progress = self._handle_progress(length, progress_callback)  # pylint: disable=assignment-from-no-return
       next(progress)
-    while length:
-      tmp = data.read(FASTBOOT_DOWNLOAD_CHUNK_SIZE_KB * 1024)
-      length -= len(tmp)
-      self.usb.write(tmp)
+    for chunk in _iter_chunks(data, length,
+                              FASTBOOT_DOWNLOAD_CHUNK_SIZE_KB * 1024):
+      self.usb.write(chunk)
 
       if progress_callback:
-        progress.send(len(tmp))  # pyrefly: ignore[unbound-name]
+        progress.send(len(chunk))  # pyrefly: ignore[unbound-name]
+
+
+def _iter_chunks(data, length, chunk_size):
+  """Yield length bytes of data in chunks of at most chunk_size bytes.
+
+  Args:
+    data: A file-like object, which is read into a reused buffer, or a
+      bytes-like object or list of bytes-like objects, which are sliced.
+    length: Number of bytes to yield.
+    chunk_size: Maximum size of each chunk.
+
+  Yields:
+    memoryviews that are only valid until the next chunk is requested.
+
+  Raises:
+    FastbootTransferError: If data is shorter than length.
+  """
+  if hasattr(data, 'readinto'):
+    buf = memoryview(bytearray(min(chunk_size, length)))
+    while length:
+      count = data.readinto(buf[:min(chunk_size, length)])
+      if not count:
+        break
+      length -= count
+      yield buf[:count]
+  elif hasattr(data, 'read'):
+    while length:
+      chunk = data.read(min(chunk_size, length))
+      if not chunk:
+        break
+      length -= len(chunk)
+      yield memoryview(chunk)
+  else:
+    for buf in data if isinstance(data, list) else [data]:
+      view = memoryview(buf).cast('B')[:length]
+      for offset in range(0, len(view), chunk_size):
+        yield view[offset:offset + chunk_size]
+      length -= len(view)
+  if length:
+    raise usb_exceptions.FastbootTransferError(
+        'Source ended %s bytes before the expected length' % length)
+
+
+@contextlib.contextmanager
+def open_source(source_file, source_len=0):
+  """Yields (memoryview, length) of source_file to download it without copying.
+
+  Filenames and regular files are memory-mapped, and bytes-like objects are used
+  directly.  File-like objects which can't be mapped (pipes, sockets, in-memory
+  streams...) are read into memory, since the device needs to know the length
+  up front; the only exception is when source_len is given, in which case the
+  file-like object itself is yielded instead of a memoryview and read as it is
+  sent.
+
+  Args:
+    source_file: A filename, bytes-like object or file-like object.
+    source_len: Optional length of source_file, from its current position.
+
+  Yields:
+    Tuple of the data to pass to FastbootProtocol._write and its length.  The
+    memoryview is only valid until the context exits.
+  """
+  if isinstance(source_file, str):
+    with open(source_file, 'rb') as opened_file:
+      with open_source(opened_file, source_len) as source:
+        yield source
+    return
+
+  if isinstance(source_file, (bytes, bytearray, memoryview, mmap.mmap)):
+    view = memoryview(source_file).cast('B')
+    if source_len:
+      view = view[:source_len]
+    yield view, len(view)
+    return
+
+  try:
+    offset = source_file.tell()
+    mapped = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+  except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+    # Not a regular file (or an empty one), so it can't be mapped.
+    mapped = None
+
+  if mapped is None:
+    if source_len:
+      yield source_file, source_len
+    else:
+      data = source_file.read()
+      if isinstance(data, str):
+        data = data.encode('utf-8')
+      yield memoryview(data).cast('B'), len(data)
+    return
+
+  try:
+    view = memoryview(mapped)[offset:]
+    if source_len:
+      view = view[:source_len]
+    yield view, len(view)
+  finally:
+    view.release()
+    try:
+      mapped.close()
+    except BufferError:
+      # A chunk of the map is still referenced, e.g. by a traceback, so it is
+      # closed when that is collected instead.
+      pass
+
+
+def _split_sparse(view, max_size, block_size=SPARSE_BLOCK_SIZE):
+  """Split a raw image into sparse images of at most max_size bytes.
+
+  Each sparse image covers all of the image's blocks: one RAW chunk of its own
+  blocks, and DONT_CARE chunks for the blocks before and after them, so
+  flashing them one after the other writes the whole image.  The last block is
+  padded with zeros if the image isn't a multiple of the block size.
+
+  Args:
+    view: memoryview of the raw image.
+    max_size: Maximum size of each sparse image, in bytes.
+    block_size: Block size of the sparse images.
+
+  Returns:
+    List of sparse images, as (buffers, length) tuples where buffers is a list
+  of bytes-like objects (slices of view for the RAW data).
+
+  Raises:
+    FastbootTransferError: If max_size is too small for any data.
+  """
+  header_size = struct.calcsize(SPARSE_HEADER_FORMAT)
+  chunk_header_size = struct.calcsize(SPARSE_CHUNK_HEADER_FORMAT)
+  blocks_per_image = (max_size - header_size - 3 * chunk_header_size) // (
+      block_size)
+  if blocks_per_image < 1:
+    raise usb_exceptions.FastbootTransferError(
+        'max-download-size of %s bytes is too small for sparse images' %
+        max_size)
+  total_blocks = -(-len(view) // block_size)
+
+  def dont_care(blocks):
+    return struct.pack(SPARSE_CHUNK_HEADER_FORMAT, SPARSE_CHUNK_TYPE_DONT_CARE,
+                       0, blocks, chunk_header_size)
+
+  images = []
+  for start in range(0, total_blocks, blocks_per_image):
+    blocks = min(blocks_per_image, total_blocks - start)
+    after = total_blocks - start - blocks
+    raw = view[start * block_size:(start + blocks) * block_size]
+    chunks = [dont_care(start)] if start else []
+    chunks.append(
+        struct.pack(SPARSE_CHUNK_HEADER_FORMAT, SPARSE_CHUNK_TYPE_RAW, 0,
+                    blocks, chunk_header_size + blocks * block_size))
+    chunks.append(raw)
+    if len(raw) < blocks * block_size:
+      chunks.append(bytes(blocks * block_size - len(raw)))
+    if after:
+      chunks.append(dont_care(after))
+    buffers = [
+        struct.pack(SPARSE_HEADER_FORMAT, SPARSE_HEADER_MAGIC, 1, 0,
+                    header_size, chunk_header_size, block_size, total_blocks,
+                    1 + bool(start) + bool(after), 0)
+    ] + chunks
+    images.append((buffers, sum(len(buf) for buf in buffers)))
+  return images
 
 
 class FastbootCommands(object):
@@ -228,31 +413,52 @@ class FastbootCommands(object):
                       source_len=0,
                       info_cb=DEFAULT_MESSAGE_CALLBACK,
                       progress_callback=None,
-                      timeout_ms=None):
+                      timeout_ms=None,
+                      max_download_size=None):
     """Flashes a partition from the file on disk.
 
+    Raw images larger than max_download_size are split into sparse images that
+    are downloaded and flashed one after the other.
+
     Args:
       partition: Partition name to flash to.
-      source_file: Filename to download to the device.
-      source_len: Optional length of source_file, uses os.stat if not provided.
+      source_file: Filename to download to the device, see Download for other
+        types of sources.
+      source_len: Optional length of source_file, uses its size if not
+        provided.
       info_cb: See Download.
-      progress_callback: See Download.
+      progress_callback: See Download, called for each downloaded image.
       timeout_ms: The amount of time to wait on okay after flashing.
+      max_download_size: Maximum size in bytes of a single download, if None
+        the device's max-download-size variable is used, and if 0 or not
+        reported by the device, images are never split.
 
     Returns:
       Download and flash responses, normally nothing.
+
+    Raises:
+      FastbootTransferError: If a sparse image is larger than
+        max_download_size, since it can't be split.
     """
-    if source_len == 0:
-      # Fall back to stat.
-      source_len = os.stat(source_file).st_size
-    download_response = self.download(
-        source_file,
-        source_len=source_len,
-        info_cb=info_cb,
-        progress_callback=progress_callback)
-    flash_response = self.flash(
-        partition, info_cb=info_cb, timeout_ms=timeout_ms)
-    return download_response + flash_response
+    with open_source(source_file, source_len) as (data, length):
+      if max_download_size is None:
+        max_download_size = self.get_max_download_size(info_cb=info_cb)
+      if (not max_download_size or length <= max_download_size or
+          not isinstance(data, memoryview)):
+        images = [(data, length)]
+      elif struct.unpack_from('<I', data)[0] == SPARSE_HEADER_MAGIC:
+        raise usb_exceptions.FastbootTransferError(
+            'Sparse image of %s bytes is larger than max-download-size (%s)' %
+            (length, max_download_size))
+      else:
+        images = _split_sparse(data, max_download_size)
+
+      response = ''
+      for image, image_len in images:
+        response += self._download(image, image_len, info_cb, progress_callback)
+        response += self.flash(
+            partition, info_cb=info_cb, timeout_ms=timeout_ms)
+      return response
 
   # pylint: enable=too-many-arguments
 
@@ -263,10 +469,15 @@ class FastbootCommands(object):
                progress_callback=None):
     """Downloads a file to the device.
 
+    Filenames, regular files and bytes-like objects are sent straight from
+    memory-mapped files or the objects themselves, without copying them.
+
     Args:
-      source_file: A filename or file-like object to download to the device.
+      source_file: A filename, bytes-like object or file-like object to download
+        to the device.
       source_len: Optional length of source_file. If source_file is a file-like
-        object and source_len is not provided, source_file is read into memory.
+        object that can't be memory-mapped and source_len is not provided,
+        source_file is read into memory.
       info_cb: Optional callback accepting FastbootMessage for text sent from
         the bootloader.
       progress_callback: Optional callback called with the percent of the
@@ -276,19 +487,14 @@ class FastbootCommands(object):
     Returns:
       Response to a download request, normally nothing.
     """
-    if isinstance(source_file, str):
-      source_len = os.stat(source_file).st_size
-      source_file = open(source_file)
+    with open_source(source_file, source_len) as (data, length):
+      return self._download(data, length, info_cb, progress_callback)
 
-    if source_len == 0:
-      # Fall back to storing it all in memory :(
-      data = source_file.read()
-      source_file = io.StringIO(data)
-      source_len = len(data)
-
-    self._protocol.send_command('download', '%08x' % source_len)
+  def _download(self, data, length, info_cb, progress_callback):
+    """Downloads length bytes of data, see FastbootProtocol._write."""
+    self._protocol.send_command('download', '%08x' % length)
     return self._protocol.handle_data_sending(
-        source_file, source_len, info_cb, progress_callback=progress_callback)
+        data, length, info_cb, progress_callback=progress_callback)
 
   def flash(self, partition, timeout_ms=None, info_cb=DEFAULT_MESSAGE_CALLBACK):
     """Flashes the last downloaded file to the given partition.
@@ -320,6 +526,13 @@ class FastbootCommands(object):
     """
     return self._simple_command('getvar', arg=var, info_cb=info_cb)
 
+  def get_max_download_size(self, info_cb=DEFAULT_MESSAGE_CALLBACK):
+    """Returns the device's max-download-size in bytes, or 0 if unknown."""
+    try:
+      return int(self.get_var('max-download-size', info_cb=info_cb), 0)
+    except (usb_exceptions.FastbootRemoteFailureError, ValueError):
+      return 0
+
   def oem(self, command, timeout_ms=None, info_cb=DEFAULT_MESSAGE_CALLBACK):
     """Executes an OEM command on the device.
 
@@ -106,9 +106,11 @@ Message Format:
 # pytype: skip-file
 
 import collections
+import queue
 import stat
 import struct
 import sys
+import threading
 import time
 
 from openhtf.plugs.usb import adb_message
@@ -119,6 +121,9 @@ from openhtf.plugs.usb import usb_exceptions
 DEFAULT_PUSH_MODE = stat.S_IFREG | stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO
 # Maximum size of a filesync DATA packet.
 MAX_PUSH_DATA_BYTES = 64 * 1024
+# Number of DATA packets read ahead from the source file of a push, or waiting
+# to be written to the destination file of a pull, while others are in flight.
+PIPELINE_DEPTH = 8
 
 
 class DeviceFileStat(
@@ -131,6 +136,100 @@ class DeviceFileStat(
   pass
 
 
+class _Pipeline(object):
+  """Runs a function on each item put in a bounded queue in another thread.
+
+  This lets local file IO overlap with the ADB transfer, with at most depth
+  items waiting.  An exception raised by the function is re-raised by the next
+  put() or by join(), after which further items are dropped.
+  """
+
+  _DONE = object()
+
+  def __init__(self, function, depth=PIPELINE_DEPTH):
+    self._function = function
+    self._queue = queue.Queue(maxsize=depth)
+    self._exc_info = None
+    self._thread = threading.Thread(target=self._thread_proc)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _thread_proc(self):
+    while True:
+      item = self._queue.get()
+      if item is self._DONE:
+        return
+      if self._exc_info is None:
+        try:
+          self._function(item)
+        except Exception:  # pylint: disable=broad-except
+          self._exc_info = sys.exc_info()
+
+  def _raise_if_failed(self):
+    if self._exc_info is not None:
+      raise self._exc_info[1].with_traceback(self._exc_info[2])
+
+  def put(self, item):
+    """Queue item, blocking while the queue is full."""
+    self._raise_if_failed()
+    self._queue.put(item)
+
+  def join(self):
+    """Wait until all the queued items are handled."""
+    self._queue.put(self._DONE)
+    self._thread.join()
+    self._raise_if_failed()
+
+
+def _read_ahead(src_file, chunk_size=MAX_PUSH_DATA_BYTES,
+                depth=PIPELINE_DEPTH):
+  """Yield chunks of src_file, read by another thread while they are sent.
+
+  Args:
+    src_file: File-like object to read from.
+    chunk_size: Maximum size of each chunk.
+    depth: Maximum number of chunks read ahead.
+
+  Yields:
+    Chunks of data read from src_file until EOF.
+
+  Raises:
+    Any exception raised by src_file.read().
+  """
+  chunks = queue.Queue(maxsize=depth)
+  stop = threading.Event()
+
+  def read_chunks():
+    try:
+      while not stop.is_set():
+        data = src_file.read(chunk_size)
+        chunks.put(data)
+        if not data:
+          return
+    except Exception as exception:  # pylint: disable=broad-except
+      chunks.put(exception)
+
+  reader = threading.Thread(target=read_chunks)
+  reader.daemon = True
+  reader.start()
+  try:
+    while True:
+      data = chunks.get()
+      if isinstance(data, Exception):
+        raise data
+      if not data:
+        return
+      yield data
+  finally:
+    # Unblock the reader if we stopped early.
+    stop.set()
+    while reader.is_alive():
+      try:
+        chunks.get(timeout=.1)
+      except queue.Empty:
+        pass
+
+
 def _make_message_type(name, attributes, has_data=True):
   """Make a message type for the AdbTransport subclasses."""
 
@@ -202,11 +301,19 @@ class FilesyncService(object):
             for dent_msg in transport.read_until_done('DENT', timeout))
 
   def recv(self, filename, dest_file, timeout=None):
-    """Retrieve a file from the device into the file-like dest_file."""
+    """Retrieve a file from the device into the file-like dest_file.
+
+    Data is written to dest_file by another thread, so reading the next DATA
+    packet from the device doesn't wait for the previous one to be written.
+    """
     transport = DataFilesyncTransport(self.stream)
     transport.write_data('RECV', filename, timeout)
-    for data_msg in transport.read_until_done('DATA', timeout):
-      dest_file.write(data_msg.data)
+    writer = _Pipeline(dest_file.write)
+    try:
+      for data_msg in transport.read_until_done('DATA', timeout):
+        writer.put(data_msg.data)
+    finally:
+      writer.join()
 
   def _check_for_fail_message(self, transport, exc_info, timeout):  # pylint: disable=no-self-use
     """Check for a 'FAIL' message from transport.
@@ -241,6 +348,9 @@ class FilesyncService(object):
            timeout=None):
     """Push a file-like object to the device.
 
+    The source file is read by another thread, so the next DATA packet is
+    ready to be sent as soon as the previous one has been written.
+
     Args:
       src_file: File-like object for reading from
       filename: Filename to push to on the device
@@ -256,10 +366,7 @@ class FilesyncService(object):
     transport.write_data('SEND', '%s,%s' % (filename, st_mode), timeout)
 
     try:
-      while True:
-        data = src_file.read(MAX_PUSH_DATA_BYTES)
-        if not data:
-          break
+      for data in _read_ahead(src_file):
         transport.write_data('DATA', data, timeout)
 
       mtime = mtime or int(time.time())
@@ -394,15 +501,19 @@ class AbstractFilesyncTransport(object):
       timeout: timeouts.PolledTimeout to use for the operation.
     """
     replace_dict = {'command': self.CMD_TO_WIRE[msg.command]}
+    data = b''
     if msg.has_data:
       # Swap out data for the data length for the wire.
       data = msg[-1]
+      if isinstance(data, str):
+        data = data.encode('utf-8')
       replace_dict[msg._fields[-1]] = len(data)
 
+    # Send the header and the data in a single write, so they share AdbMessages
+    # instead of waiting for separate acknowledgements.
     self.stream.write(
-        struct.pack(msg.struct_format, *msg._replace(**replace_dict)), timeout)
-    if msg.has_data:
-      self.stream.write(data, timeout)
+        struct.pack(msg.struct_format, *msg._replace(**replace_dict)) + data,
+        timeout)
 
   # pylint: enable=protected-access
 
@@ -18,9 +18,18 @@ with locally attached USB devices.  In order to fit the UsbHandle interface,
 much of the complexity of the libusb1 interface is abstracted away.  This class
 should never raise libusb1 errors directly - if it does it is a bug, please fix
 it and wrap the error in an appropriate exception from usb_exceptions.py.
+
+Enumerating the USB bus is slow when many devices are connected, since reading
+each device's serial number takes a control transfer.  Devices are instead
+looked up in a DeviceIndex shared by all handles, which enumerates the bus once
+and is refreshed when devices are plugged or unplugged (as reported by libusb
+hotplug events where supported), or when a lookup misses.
 """
 
+import collections
 import logging
+import threading
+import time
 
 from openhtf.plugs.usb import usb_exceptions
 from openhtf.plugs.usb import usb_handle
@@ -38,11 +47,168 @@ except ImportError:
 
 _LOG = logging.getLogger(__name__)
 
+# Without hotplug support, the device index is refreshed when older than this.
+DEVICE_INDEX_MAX_AGE_S = 5.0
+
+
+def _device_to_sysfs_path(device):
+  """Convert device to corresponding sysfs path."""
+  return '%s-%s' % (device.getBusNumber(), '.'.join(
+      [str(item) for item in device.GetPortNumberList()]))
+
+
+class _IndexedDevice(
+    collections.namedtuple('_IndexedDevice', [
+        'device',
+        'serial_number',
+        'port_path',
+        'settings',
+    ])):
+  """A device in the DeviceIndex, with its settings as they were enumerated."""
+
+
+class DeviceIndex(object):
+  """Index of the devices on the USB bus by serial number and port path.
+
+  The bus is enumerated lazily, on the first lookup after the index became
+  stale.  With libusb hotplug support, the index goes stale when a device is
+  plugged or unplugged, otherwise when it is older than DEVICE_INDEX_MAX_AGE_S.
+  A lookup of a serial number or port path that is not in the index also
+  refreshes it, unless it was just refreshed.
+  """
+
+  def __init__(self, context=None):
+    """Create an index of the devices seen by the given usb1.USBContext."""
+    self._context = context or usb1.USBContext()
+    self._lock = threading.Lock()
+    self._devices = []
+    self._by_serial = {}
+    self._by_port_path = {}
+    self._refresh_time = None
+    self._stale = True
+    try:
+      self._context.hotplugRegisterCallback(
+          self._on_hotplug,
+          events=(libusb1.LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED |
+                  libusb1.LIBUSB_HOTPLUG_EVENT_DEVICE_LEFT),
+          flags=0)
+      self._hotplug = True
+    except libusb1.USBError:
+      _LOG.debug('libusb hotplug is not supported, polling for devices.')
+      self._hotplug = False
+
+  def _on_hotplug(self, context, device, event):
+    """Called by libusb when a device was plugged or unplugged."""
+    del context, device, event  # Unused.
+    self._stale = True
+    return False  # Keep the callback registered.
+
+  def invalidate(self):
+    """Refresh the index on the next lookup."""
+    self._stale = True
+
+  def _refresh_if_stale(self):
+    """Enumerate the bus if devices may have changed, return True if so."""
+    if self._hotplug:
+      # Dispatch the pending hotplug events to _on_hotplug, without blocking.
+      self._context.handleEventsTimeout(tv=0)
+    elif (self._refresh_time is not None and
+          time.monotonic() - self._refresh_time > DEVICE_INDEX_MAX_AGE_S):
+      self._stale = True
+    if not self._stale:
+      return False
+    self._refresh()
+    return True
+
+  def _refresh(self):
+    """Enumerate the bus and rebuild the index."""
+    self._stale = False
+    self._refresh_time = time.monotonic()
+    try:
+      devices = self._context.getDeviceList(skip_on_error=True)
+    except libusb1.USBError as exception:
+      self._stale = True
+      raise usb_exceptions.LibusbWrappingError(exception,
+                                               'Failed to enumerate devices')
+
+    self._devices = []
+    self._by_serial = collections.defaultdict(list)
+    self._by_port_path = collections.defaultdict(list)
+    for device in devices:
+      try:
+        indexed = _IndexedDevice(device, device.getSerialNumber(),
+                                 _device_to_sysfs_path(device),
+                                 list(device.iterSettings()))
+      except libusb1.USBError as exception:
+        if (exception.value !=
+            libusb1.libusb_error.forward_dict['LIBUSB_ERROR_ACCESS']):
+          self._stale = True
+          raise usb_exceptions.LibusbWrappingError(
+              exception, 'Failed to enumerate device %s', device)
+        continue
+      self._devices.append(indexed)
+      self._by_serial[indexed.serial_number].append(indexed)
+      self._by_port_path[indexed.port_path].append(indexed)
+
+  def find(self, serial_number=None, port_path=None):
+    """Return the indexed devices with the given serial number and port path.
+
+    Args:
+      serial_number: USB serial number to match, or None to match any.
+      port_path: USB port path to match, like X-X.X.X, or None to match any.
+
+    Returns:
+      List of _IndexedDevices.
+
+    Raises:
+      LibusbWrappingError: If the bus had to be enumerated, and that failed.
+    """
+    with self._lock:
+      refreshed = self._refresh_if_stale()
+      devices = self._lookup(serial_number, port_path)
+      if (not devices and not refreshed and
+          (serial_number is not None or port_path is not None)):
+        # The device may have been plugged since, and we missed the event.
+        self._refresh()
+        devices = self._lookup(serial_number, port_path)
+      return devices
+
+  def _lookup(self, serial_number, port_path):
+    """Look up devices in the index as it is."""
+    if serial_number is not None:
+      devices = self._by_serial.get(serial_number, [])
+    elif port_path is not None:
+      devices = self._by_port_path.get(port_path, [])
+    else:
+      return list(self._devices)
+    return [
+        device for device in devices
+        if port_path is None or device.port_path == port_path
+    ]
+
+
+_DEVICE_INDEX = None
+_DEVICE_INDEX_LOCK = threading.Lock()
+
+
+def get_device_index():
+  """Return the DeviceIndex shared by all LibUsbHandles, creating it if needed."""
+  global _DEVICE_INDEX
+  with _DEVICE_INDEX_LOCK:
+    if _DEVICE_INDEX is None:
+      _DEVICE_INDEX = DeviceIndex()
+    return _DEVICE_INDEX
+
 
 class LibUsbHandle(usb_handle.UsbHandle):
   """Subclass of UsbHandle that opens locally connected devices with libusb."""
 
-  def __init__(self, device, setting, name=None, default_timeout_ms=None):
+  def __init__(self,
+               device,
+               setting,
+               name=None,
+               default_timeout_ms=None,
+               serial_number=None):
     """Initialize a local libusb-based USB Handle.
 
     Arguments:
@@ -50,6 +216,8 @@ class LibUsbHandle(usb_handle.UsbHandle):
       setting: libusb setting with the endpoints to use for data reads/writes.
       name: Name for the device, used for log messages only.
       default_timeout_ms: Default timeout, in milliseconds, for reads/writes.
+      serial_number: Serial number of the device if already known, otherwise
+        it is read from the device.
 
     Raises:
       InvalidEndpointsError: If the setting provided does not have exactly one
@@ -58,7 +226,7 @@ class LibUsbHandle(usb_handle.UsbHandle):
       IOError: If the device has been disconnected.
     """
     super(LibUsbHandle, self).__init__(
-        device.getSerialNumber(),
+        serial_number or device.getSerialNumber(),
         name=name,
         default_timeout_ms=default_timeout_ms)
     self._setting = setting
@@ -110,16 +278,10 @@ class LibUsbHandle(usb_handle.UsbHandle):
   def is_closed(self):
     return self._handle is None
 
-  @staticmethod
-  def _device_to_sysfs_path(device):
-    """Convert device to corresponding sysfs path."""
-    return '%s-%s' % (device.getBusNumber(), '.'.join(
-        [str(item) for item in device.GetPortNumberList()]))
-
   @property
   def port_path(self):
     """A string of the physical port of this device, like 'X-X.X.X'."""
-    return self._device_to_sysfs_path(self._device)
+    return _device_to_sysfs_path(self._device)
 
   @property
   def _checked_handle(self):
@@ -198,7 +360,8 @@ class LibUsbHandle(usb_handle.UsbHandle):
     """Find and yield locally connected devices that match.
 
     Note that devices are opened (and interfaces claimd) as they are yielded.
-    Any devices yielded must be Close()'d.
+    Any devices yielded must be Close()'d.  Devices are looked up in the shared
+    DeviceIndex rather than enumerated for every call.
 
     Args:
       name: Name to give *all* returned handles, used for logging only.
@@ -216,41 +379,31 @@ class LibUsbHandle(usb_handle.UsbHandle):
     Raises:
       LibusbWrappingError: When a libusb call errors during open.
     """
-    ctx = usb1.USBContext()
-    try:
-      devices = ctx.getDeviceList(skip_on_error=True)
-    except libusb1.USBError as exception:
-      raise usb_exceptions.LibusbWrappingError(
-          exception, 'Open(name=%s, class=%s, subclass=%s, protocol=%s, '
-          'serial=%s, port=%s) failed', name, interface_class,
-          interface_subclass, interface_protocol, serial_number, port_path)
-
-    for device in devices:
-      try:
-        if (serial_number is not None and
-            device.getSerialNumber() != serial_number):
+    index = get_device_index()
+    for device in index.find(serial_number=serial_number, port_path=port_path):
+      for setting in device.settings:
+        if (interface_class is not None and
+            setting.getClass() != interface_class):
           continue
-
-        if (port_path is not None and
-            cls._device_to_sysfs_path(device) != port_path):
+        if (interface_subclass is not None and
+            setting.getSubClass() != interface_subclass):
+          continue
+        if (interface_protocol is not None and
+            setting.getProtocol() != interface_protocol):
           continue
 
-        for setting in device.iterSettings():
-          if (interface_class is not None and
-              setting.getClass() != interface_class):
-            continue
-          if (interface_subclass is not None and
-              setting.getSubClass() != interface_subclass):
-            continue
-          if (interface_protocol is not None and
-              setting.getProtocol() != interface_protocol):
-            continue
-
-          yield cls(
-              device, setting, name=name, default_timeout_ms=default_timeout_ms)
-      except libusb1.USBError as exception:
-        if (exception.value !=
-            libusb1.libusb_error.forward_dict['LIBUSB_ERROR_ACCESS']):
-          raise
-
-  # pylint: disable=too-many-arguments
+        try:
+          handle = cls(
+              device.device,
+              setting,
+              name=name,
+              default_timeout_ms=default_timeout_ms,
+              serial_number=device.serial_number)
+        except libusb1.USBError as exception:
+          # The device may be gone, find out next time.
+          index.invalidate()
+          if (exception.value !=
+              libusb1.libusb_error.forward_dict['LIBUSB_ERROR_ACCESS']):
+            raise
+          continue
+        yield handle
@@ -36,7 +36,7 @@ Some examples of how to use this service:
 
   # Run a simple command.
   output = shell.command('echo foo')
-  # output == 'foo\r\n'
+  # output == b'foo\r\n'
 
   # Run a command that outputs binary data, like recording a minute of audio.
   output = shell.RawCommand('arecord -Dhw:CARD=0,DEV=0 -c 2 -d 60')
@@ -55,17 +55,32 @@ Some examples of how to use this service:
   baz = shell.command('echo baz')
 
   # Run a command in the background while we do some other stuff, save the
-  # output to a StringIO buffer so we can access it later.  Use a context to
+  # output to a BytesIO buffer so we can access it later.  Use a context to
   # automatically wait for the asynchronous command to finish.
-  output = cStringIO.StringIO()
+  output = io.BytesIO()
   with shell.AsyncRawCommand(
       'arecord -Dhw:CARD=0,DEV=0 -c 2 -d 60', stdout=output):
     # Do some stuff, play some sounds on some fixture speakers, for example.
     pass
   # Execution won't get here until the arecord command completes, and
   # output.getvalue() now contains the output of the arecord command.
+
+AsyncioShellService provides the same commands as coroutines, for running many
+commands at once from a single asyncio event loop rather than a thread (or two)
+per command:
+
+  shell = shell_service.AsyncioShellService(adb_cnxn)
+
+  # Run commands concurrently.
+  props, dump = await asyncio.gather(
+      shell.run('getprop'), shell.run('dumpsys battery'))
+
+  # Process the output of a command as it is received.
+  async for data in shell.stream('logcat'):
+    ...
 """
 
+import asyncio
 import io
 import threading
 import time
@@ -109,7 +124,7 @@ class AsyncCommandHandle(object):
     """
     self.stream = stream
     self.stdin = stdin
-    self.stdout = stdout or io.StringIO()
+    self.stdout = stdout or io.BytesIO()
     self.force_closed_or_timeout = False
 
     self.reader_thread = threading.Thread(
@@ -170,11 +185,11 @@ class AsyncCommandHandle(object):
       timeout_ms: Timeout, in milliseconds, to wait.
 
     Returns:
-      Output of the command if it complete and self.stdout is a StringIO
+      Output of the command if it complete and self.stdout is a BytesIO
     object or was passed in as None.  Returns True if the command completed but
-    stdout was provided (and was not a StringIO object).  Returns None if the
+    stdout was provided (and was not a BytesIO object).  Returns None if the
     timeout expired before the command completed.  Be careful to check the
-    return value explicitly for None, as the output may be ''.
+    return value explicitly for None, as the output may be b''.
     """
     closed = timeouts.loop_until_timeout_or_true(
         timeouts.PolledTimeout.from_millis(timeout_ms), self.stream.is_closed,
@@ -219,7 +234,7 @@ class ShellService(object):
 
   def command(self, command, raw=False, timeout_ms=None):
     """Run the given command and return the output."""
-    return ''.join(self.streaming_command(command, raw, timeout_ms))
+    return b''.join(self.streaming_command(command, raw, timeout_ms))
 
   def streaming_command(self, command, raw=False, timeout_ms=None):
     """Run the given command and yield the output as we receive it."""
@@ -279,3 +294,83 @@ class ShellService(object):
   def using_connection(cls, adb_connection):
     """Factory method to match the interface of FilesyncService."""
     return cls(adb_connection)
+
+
+class AsyncioShellService(object):
+  """Class providing an asyncio interface to ADB's :shell service.
+
+  Commands are run on streams opened with AdbConnection.open_async_stream(), so
+  all the commands run from an event loop are served by that loop.
+  """
+
+  def __init__(self, adb_connection):
+    self.adb_connection = adb_connection
+
+  async def _open(self, command, raw, timeout_ms):
+    """Open a stream running the given command."""
+    if raw:
+      command = ShellService._to_raw_command(command)  # pylint: disable=protected-access
+    stream = await self.adb_connection.open_async_stream(
+        'shell:%s' % command, timeout_ms)
+    if not stream:
+      raise usb_exceptions.AdbStreamUnavailableError(
+          '%s does not support service: shell' % self)
+    return stream
+
+  async def run(self, command, stdin=None, raw=False, timeout_ms=None):
+    """Run the given command and return its output.
+
+    Args:
+      command: The command to run, will be run with /bin/sh -c 'command' on the
+        device.
+      stdin: Optional data to write to the command's stdin.
+      raw: If True, run the command as per ShellService.RawCommand.
+      timeout_ms: Timeout for the command, in milliseconds.
+
+    Returns:
+      The output of the command, as bytes.
+
+    Raises:
+      AdbStreamUnavailableError: If the remote devices doesn't support the
+        shell: service.
+      AdbTimeoutError: If the command didn't complete before timeout_ms.
+    """
+    timeout = timeouts.PolledTimeout.from_millis(timeout_ms)
+    stream = await self._open(command, raw, timeout)
+    try:
+      if stdin is not None:
+        if raw:
+          # Same as ShellService.async_command, let the ioctl happen first.
+          await asyncio.sleep(.1)
+        await stream.write(stdin, timeout)
+      output = []
+      while True:
+        try:
+          output.append(await stream.read(timeout_ms=timeout))
+        except usb_exceptions.AdbStreamClosedError:
+          return b''.join(output)
+    finally:
+      stream.close()
+
+  async def stream(self, command, raw=False, timeout_ms=None):
+    """Run the given command and yield its output as it is received.
+
+    Use with async for, see run() for the arguments.  The command is closed if
+    iteration stops before it completes.
+    """
+    timeout = timeouts.PolledTimeout.from_millis(timeout_ms)
+    stream = await self._open(command, raw, timeout)
+    try:
+      while True:
+        try:
+          data = await stream.read(timeout_ms=timeout)
+        except usb_exceptions.AdbStreamClosedError:
+          return
+        yield data
+    finally:
+      stream.close()
+
+  @classmethod
+  def using_connection(cls, adb_connection):
+    """Factory method to match the interface of FilesyncService."""
+    return cls(adb_connection)
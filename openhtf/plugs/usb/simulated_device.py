@@ -0,0 +1,451 @@
+# Copyright 2026 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Simulated USB devices that speak the ADB and fastboot protocols.
+
+Unlike StubUsbHandle, which replays scripted reads and checks expected writes,
+the handles here are to devices that respond to whatever the host sends, enough
+to push, pull, run shell commands and download/flash images.  They simulate the
+USB link too: each transfer occupies the link for its size divided by the link
+bandwidth, and the device responds latency_s after receiving a transfer.  This
+makes them suitable for measuring the throughput and latency of the protocol
+implementations without hardware.
+
+  device = simulated_device.SimulatedAdbDevice(
+      latency_s=.0005, bandwidth=40e6, files={'/data/file': (0o100644, b'', 0)})
+  adb = adb_device.AdbDevice.connect(device)
+  data = adb.pull('/data/file')
+
+  bootloader = simulated_device.SimulatedFastbootDevice(bandwidth=40e6)
+  fastboot_protocol.FastbootCommands(bootloader).flash_from_file(
+      'boot', b'image')
+  assert bootloader.partitions['boot'] == b'image'
+"""
+
+import abc
+import collections
+import struct
+import threading
+import time
+
+from openhtf.plugs.usb import adb_message
+from openhtf.plugs.usb import adb_protocol
+from openhtf.plugs.usb import filesync_service
+from openhtf.plugs.usb import usb_exceptions
+from openhtf.plugs.usb import usb_handle
+from openhtf.util import timeouts
+
+import usb1  # pytype: disable=import-error
+
+_SYNC_CMD_TO_WIRE = filesync_service.AbstractFilesyncTransport.CMD_TO_WIRE
+_SYNC_WIRE_TO_CMD = filesync_service.AbstractFilesyncTransport.WIRE_TO_CMD
+# Marks the end of a stream's output, after which the device closes it.
+_CLOSE = object()
+
+
+class SimulatedUsbHandle(usb_handle.UsbHandle):
+  """UsbHandle to a simulated device over a link with latency and bandwidth.
+
+  Writes block until they were sent over the link, then the device handles them
+  synchronously in handle_write().  The device queues its responses with
+  respond(), and reads return them once they were sent back, latency_s later.
+  Transfers in both directions share the link bandwidth.
+
+  Attributes:
+    latency_s: Round trip time between the host and the device, on top of the
+      time to send transfers, in seconds.
+    bandwidth: Bandwidth of the link in bytes per second, or None for no limit.
+    transfers: Number of transfers, in either direction.
+  """
+
+  def __init__(self,
+               serial_number='SimulatedSerial',
+               latency_s=0.0,
+               bandwidth=None,
+               default_timeout_ms=None):
+    super(SimulatedUsbHandle, self).__init__(
+        serial_number,
+        type(self).__name__,
+        default_timeout_ms=default_timeout_ms)
+    self.latency_s = latency_s
+    self.bandwidth = bandwidth
+    self.transfers = 0
+    self._closed = False
+    self._link_lock = threading.Lock()
+    self._link_free_time = 0.0
+    self._device_lock = threading.Lock()
+    self._responses = collections.deque()
+    self._responses_added = threading.Condition()
+
+  def _send_over_link(self, length, delay_s=0.0):
+    """Reserve the link for a transfer, return the time it was sent."""
+    with self._link_lock:
+      self.transfers += 1
+      sent_time = max(time.monotonic() + delay_s, self._link_free_time)
+      if self.bandwidth:
+        sent_time += length / self.bandwidth
+      self._link_free_time = sent_time
+    return sent_time
+
+  @staticmethod
+  def _sleep_until(wakeup_time):
+    delay = wakeup_time - time.monotonic()
+    if delay > 0:
+      time.sleep(delay)
+
+  @abc.abstractmethod
+  def handle_write(self, data):
+    """Handle data written by the host, called with a lock held."""
+
+  def respond(self, data):
+    """Send data to the host in a single transfer."""
+    arrival_time = self._send_over_link(len(data), self.latency_s)
+    with self._responses_added:
+      self._responses.append([arrival_time, bytearray(data)])
+      self._responses_added.notify_all()
+
+  @usb_handle.requires_open_handle
+  def write(self, data, timeout_ms=None):
+    data = bytes(data)
+    self._sleep_until(self._send_over_link(len(data)))
+    with self._device_lock:
+      self.handle_write(data)
+
+  @usb_handle.requires_open_handle
+  def read(self, length, timeout_ms=None):
+    timeout = timeouts.PolledTimeout.from_millis(
+        self._timeout_or_default(timeout_ms))
+    with self._responses_added:
+      if not self._responses_added.wait_for(
+          lambda: self._responses or self._closed, timeout.remaining):
+        raise usb_exceptions.UsbReadFailedError(
+            usb1.USBErrorTimeout(), '%s read timed out', self)
+      if self._closed:
+        raise usb_exceptions.HandleClosedError()
+      arrival_time, data = self._responses[0]
+      # Like a USB transfer, a short read leaves the rest for the next one.
+      if len(data) <= length:
+        self._responses.popleft()
+      else:
+        data, self._responses[0][1] = data[:length], data[length:]
+    self._sleep_until(arrival_time)
+    return bytes(data)
+
+  def close(self):
+    with self._responses_added:
+      self._closed = True
+      self._responses_added.notify_all()
+
+  def is_closed(self):
+    return self._closed
+
+
+class _SimulatedStream(object):
+  """State of an ADB stream opened on a SimulatedAdbDevice."""
+
+  def __init__(self, host_id, device_id, service):
+    self.host_id = host_id
+    self.device_id = device_id
+    self.service = service
+    # Output not sent yet, as chunks of at most maxdata bytes or _CLOSE.
+    self.pending = collections.deque()
+    # With delayed ACKs, bytes we may send before the host ACKs some,
+    # otherwise whether a WRTE is waiting for its OKAY.
+    self.send_budget = 0
+    self.awaiting_okay = False
+    self.sync_request = bytearray()
+    self.sync_sending = None
+
+
+class SimulatedAdbDevice(SimulatedUsbHandle):
+  """Simulated device serving the ADB shell: and sync: services.
+
+  Attributes:
+    files: Dict of device filename to (mode, data, mtime) tuples, the file
+      system of the sync: service.
+    messages_received: Number of ADB messages received from the host.
+  """
+
+  def __init__(self,
+               files=None,
+               shell=None,
+               delayed_ack=True,
+               maxdata=adb_protocol.MAX_ADB_DATA,
+               **kwargs):
+    """Create a simulated ADB device.
+
+    Args:
+      files: Initial files, see the files attribute.
+      shell: Function called with each shell command, returning its output as
+        bytes.  By default, 'echo' commands output their arguments and other
+        commands output nothing.
+      delayed_ack: Whether the device supports delayed ACKs.
+      maxdata: Maximum ADB message payload the device accepts.
+      **kwargs: See SimulatedUsbHandle.
+    """
+    super(SimulatedAdbDevice, self).__init__(**kwargs)
+    self.files = {} if files is None else files
+    self.messages_received = 0
+    self._shell = shell or self._echo
+    self._supports_delayed_ack = delayed_ack
+    self._delayed_ack = False
+    self._maxdata = maxdata
+    self._host_data = bytearray()
+    self._streams = {}
+    self._last_device_id = 0
+
+  @staticmethod
+  def _echo(command):
+    program, _, args = command.partition(' ')
+    return (args + '\r\n').encode('utf-8') if program == 'echo' else b''
+
+  def _send(self, command, arg0, arg1, data=b''):
+    message = adb_message.AdbMessage(command, arg0, arg1, data)
+    self.respond(message.header)
+    if data:
+      self.respond(message.data)
+
+  def handle_write(self, data):
+    # Messages may be split across writes (header and data) or not.
+    self._host_data += data
+    header_size = struct.calcsize(adb_message.AdbMessage.HEADER_STRUCT_FORMAT)
+    while len(self._host_data) >= header_size:
+      wire_cmd, arg0, arg1, data_length, _, _ = struct.unpack(
+          adb_message.AdbMessage.HEADER_STRUCT_FORMAT,
+          self._host_data[:header_size])
+      if len(self._host_data) < header_size + data_length:
+        return
+      data = bytes(self._host_data[header_size:header_size + data_length])
+      del self._host_data[:header_size + data_length]
+      self.messages_received += 1
+      self._handle_message(adb_message.AdbMessage.WIRE_TO_CMD[wire_cmd], arg0,
+                           arg1, data)
+
+  def _handle_message(self, command, arg0, arg1, data):
+    """Handle a message from the host."""
+    if command == 'CNXN':
+      _, _, host_banner = data.rstrip(b'\0').decode().partition('::')
+      host_features = set()
+      for prop in host_banner.split(';'):
+        key, _, value = prop.partition('=')
+        if key == 'features':
+          host_features = set(value.split(','))
+      self._delayed_ack = (
+          self._supports_delayed_ack and
+          adb_protocol.DELAYED_ACK_FEATURE in host_features)
+      self._maxdata = min(self._maxdata, arg1)
+      self._send(
+          'CNXN', adb_protocol.ADB_VERSION, self._maxdata,
+          'device:%s:features=%s\0' %
+          (self.serial_number,
+           adb_protocol.DELAYED_ACK_FEATURE if self._delayed_ack else ''))
+    elif command == 'OPEN':
+      self._open(arg0, arg1, data.rstrip(b'\0').decode())
+    elif command == 'WRTE':
+      stream = self._streams.get(arg0)
+      if stream:
+        self._ack(stream, len(data))
+        if stream.service == 'sync':
+          stream.sync_request += data
+          self._handle_sync_requests(stream)
+          self._send_pending(stream)
+    elif command == 'OKAY':
+      stream = self._streams.get(arg0)
+      if stream:
+        if self._delayed_ack:
+          stream.send_budget += struct.unpack(
+              adb_protocol.DELAYED_ACK_STRUCT_FORMAT, data)[0]
+        stream.awaiting_okay = False
+        self._send_pending(stream)
+    elif command == 'CLSE':
+      self._streams.pop(arg0, None)
+
+  def _ack(self, stream, length):
+    """ACK data received on the stream."""
+    data = b''
+    if self._delayed_ack:
+      data = struct.pack(adb_protocol.DELAYED_ACK_STRUCT_FORMAT, length)
+    self._send('OKAY', stream.device_id, stream.host_id, data)
+
+  def _open(self, host_id, host_window, destination):
+    """Open a stream to the given service."""
+    service, _, args = destination.partition(':')
+    if service not in ('shell', 'sync'):
+      self._send('CLSE', 0, host_id)
+      return
+    self._last_device_id += 1
+    stream = _SimulatedStream(host_id, self._last_device_id, service)
+    self._streams[host_id] = stream
+    if self._delayed_ack:
+      stream.send_budget = host_window
+    self._ack(stream, adb_protocol.DELAYED_ACK_WINDOW)
+    if service == 'shell':
+      self._queue_output(stream, self._shell(args))
+      stream.pending.append(_CLOSE)
+      self._send_pending(stream)
+
+  def _queue_output(self, stream, data):
+    """Queue data to send on the stream."""
+    for offset in range(0, len(data), self._maxdata):
+      stream.pending.append(data[offset:offset + self._maxdata])
+
+  def _send_pending(self, stream):
+    """Send as much of the stream's pending output as the host accepts."""
+    while stream.pending:
+      if stream.pending[0] is _CLOSE:
+        stream.pending.clear()
+        self._streams.pop(stream.host_id, None)
+        self._send('CLSE', stream.device_id, stream.host_id)
+        return
+      if self._delayed_ack:
+        if stream.send_budget <= 0:
+          return
+        stream.send_budget -= len(stream.pending[0])
+      elif stream.awaiting_okay:
+        return
+      stream.awaiting_okay = True
+      self._send('WRTE', stream.device_id, stream.host_id,
+                 stream.pending.popleft())
+
+  def _sync_respond(self, stream, command, *args):
+    """Queue a sync: response, the last of args may be its data."""
+    data = b''
+    if args and isinstance(args[-1], bytes):
+      data = args[-1]
+      args = args[:-1] + (len(data),)
+    self._queue_output(
+        stream,
+        struct.pack('<%dI' % (len(args) + 1), _SYNC_CMD_TO_WIRE[command], *args)
+        + data)
+
+  def _handle_sync_requests(self, stream):
+    """Handle the sync: requests completely received on the stream."""
+    request = stream.sync_request
+    while len(request) >= 8:
+      command, arg = struct.unpack('<2I', request[:8])
+      command = _SYNC_WIRE_TO_CMD[command]
+      if command == 'DONE':
+        # Ends a SEND, arg is the mtime.
+        del request[:8]
+        filename, mode, data = stream.sync_sending
+        self.files[filename] = (mode, bytes(data), arg)
+        stream.sync_sending = None
+        self._sync_respond(stream, 'OKAY', b'')
+        continue
+      if len(request) < 8 + arg:
+        return
+      data = bytes(request[8:8 + arg])
+      del request[:8 + arg]
+      if command == 'DATA':
+        stream.sync_sending[2].extend(data)
+      elif command == 'SEND':
+        filename, mode = data.decode().rsplit(',', 1)
+        stream.sync_sending = (filename, int(mode), bytearray())
+      elif command == 'STAT':
+        mode, file_data, mtime = self.files.get(data.decode(), (0, b'', 0))
+        self._sync_respond(stream, 'STAT', mode, len(file_data), mtime)
+      elif command == 'LIST':
+        directory = data.decode().rstrip('/') + '/'
+        for filename, (mode, file_data, mtime) in sorted(self.files.items()):
+          name = filename[len(directory):]
+          if filename.startswith(directory) and '/' not in name:
+            self._sync_respond(stream, 'DENT', mode, len(file_data), mtime,
+                               name.encode('utf-8'))
+        self._sync_respond(stream, 'DONE', 0, 0, 0, 0)
+      elif command == 'RECV':
+        if data.decode() not in self.files:
+          self._sync_respond(stream, 'FAIL', b'No such file or directory')
+          continue
+        _, file_data, _ = self.files[data.decode()]
+        for offset in range(0, len(file_data),
+                            filesync_service.MAX_PUSH_DATA_BYTES):
+          self._sync_respond(
+              stream, 'DATA',
+              file_data[offset:offset + filesync_service.MAX_PUSH_DATA_BYTES])
+        self._sync_respond(stream, 'DONE', b'')
+
+
+class SimulatedFastbootDevice(SimulatedUsbHandle):
+  """Simulated device in fastboot mode.
+
+  Attributes:
+    variables: Dict of the variables returned by getvar.
+    partitions: Dict of partition name to the data flashed to it.
+    commands: List of the commands received.
+  """
+
+  def __init__(self, variables=None, max_download_size=512 * 1024 * 1024,
+               **kwargs):
+    """Create a simulated fastboot device.
+
+    Args:
+      variables: Additional variables to return for getvar.
+      max_download_size: Largest download accepted, in bytes.
+      **kwargs: See SimulatedUsbHandle.
+    """
+    super(SimulatedFastbootDevice, self).__init__(**kwargs)
+    self.variables = {
+        'max-download-size': '0x%08x' % max_download_size,
+        'product': 'simulated',
+        'serialno': self.serial_number,
+    }
+    self.variables.update(variables or {})
+    self.partitions = {}
+    self.commands = []
+    self._max_download_size = max_download_size
+    self._download = None
+    self._download_remaining = 0
+
+  def handle_write(self, data):
+    if self._download_remaining:
+      self._download += data
+      self._download_remaining -= len(data)
+      if self._download_remaining <= 0:
+        self._download_remaining = 0
+        self.respond(b'OKAY')
+      return
+
+    command = data.decode('utf-8', 'replace')
+    self.commands.append(command)
+    name, _, arg = command.partition(':')
+    if name == 'getvar':
+      if arg in self.variables:
+        self.respond(b'OKAY' + self.variables[arg].encode('utf-8'))
+      else:
+        self.respond(b'FAILunknown variable')
+    elif name == 'download':
+      size = int(arg, 16)
+      if size > self._max_download_size:
+        self.respond(b'FAILdata too large')
+        return
+      self._download = bytearray()
+      self._download_remaining = size
+      self.respond(b'DATA%08x' % size)
+      if not size:
+        self.respond(b'OKAY')
+    elif name == 'flash':
+      if self._download is None:
+        self.respond(b'FAILno image downloaded')
+        return
+      self.partitions[arg] = bytes(self._download)
+      self.respond(b'OKAY')
+    elif name == 'erase':
+      self.partitions.pop(arg, None)
+      self.respond(b'OKAY')
+    elif name in ('continue', 'reboot', 'reboot-bootloader'):
+      self.respond(b'OKAY')
+    elif name.startswith('oem '):
+      self.respond(b'INFO' + name[4:].encode('utf-8'))
+      self.respond(b'OKAY')
+    else:
+      self.respond(b'FAILunknown command')
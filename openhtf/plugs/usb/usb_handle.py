@@ -161,6 +161,28 @@ class UsbHandle(abc.ABC):
       UsbReadFailedError: If there was an IO error during the read.
     """
 
+  def read_into(self, buffer, timeout_ms=None):
+    """Perform a USB Read into the given writable buffer.
+
+    The default implementation performs a read() of len(buffer) bytes and
+    copies the result into buffer; implementations that can read directly into
+    caller-provided memory should override this to avoid the copy.
+
+    Args:
+      buffer: Writable bytes-like object (bytearray or memoryview) to fill.
+      timeout_ms: Timeout for this read (in millis), if None, use default.
+
+    Returns:
+      Number of bytes read into the start of buffer.
+
+    Raises:
+      HandleClosedError: If this handle has been closed.
+      UsbReadFailedError: If there was an IO error during the read.
+    """
+    data = self.read(len(buffer), timeout_ms)
+    buffer[:len(data)] = data
+    return len(data)
+
   @abc.abstractmethod
   def write(self, data, timeout_ms=None):
     """Perform a USB Write on this interface.
@@ -15,12 +15,20 @@
 
 import binascii
 import string
+import threading
 
+from openhtf.plugs.usb import usb_exceptions
 from openhtf.plugs.usb import usb_handle
 
+import usb1  # pytype: disable=import-error
+
 
 class StubUsbHandle(usb_handle.UsbHandle):
-  """Stub handle used for testing."""
+  """Stub handle used for testing.
+
+  Reads block until the data expected to be read is added with expect_read(),
+  or until the read times out.
+  """
   PRINTABLE_DATA = set(string.printable) - set(string.whitespace)
 
   def __init__(self, ignore_writes=False):
@@ -29,10 +37,13 @@ class StubUsbHandle(usb_handle.UsbHandle):
     self.expected_write_data = None if ignore_writes else []
     self.expected_read_data = []
     self.closed = False
+    self._read_data_added = threading.Condition()
 
   @classmethod
   def _dotify(cls, data):
     """Add dots."""
+    if not isinstance(data, str):
+      data = bytes(data).decode('latin-1')
     return ''.join(char if char in cls.PRINTABLE_DATA else '.' for char in data)
 
   def write(self, data, dummy=None):
@@ -47,10 +58,18 @@ class StubUsbHandle(usb_handle.UsbHandle):
                        (self._dotify(expected_data), binascii.hexlify(data),
                         self._dotify(data)))
 
-  def read(self, length, dummy=None):
+  def read(self, length, timeout_ms=None):
     """Stub Read method."""
     assert not self.closed
-    data = self.expected_read_data.pop(0)
+    with self._read_data_added:
+      if not self._read_data_added.wait_for(
+          lambda: self.expected_read_data or self.closed,
+          None if timeout_ms is None else timeout_ms / 1000.0):
+        raise usb_exceptions.UsbReadFailedError(
+            usb1.USBErrorTimeout(), '%s read timed out', self)
+      if self.closed:
+        raise usb_exceptions.HandleClosedError()
+      data = self.expected_read_data.pop(0)
     if length < len(data):
       raise ValueError(
           'Overflow packet length. Read %d bytes, got %d bytes: %s' %
@@ -59,7 +78,9 @@ class StubUsbHandle(usb_handle.UsbHandle):
 
   def close(self):
     """Stub Close method."""
-    self.closed = True
+    with self._read_data_added:
+      self.closed = True
+      self._read_data_added.notify_all()
 
   def is_closed(self):
     """Stub is_closed method."""
@@ -73,4 +94,142 @@ class StubUsbHandle(usb_handle.UsbHandle):
 
   def expect_read(self, data):
     """Stub expect_read method."""
-    self.expected_read_data.append(data)
+    with self._read_data_added:
+      self.expected_read_data.append(data)
+      self._read_data_added.notify_all()
+
+
+class StubUsbEndpoint(object):
+  """Stub of a usb1 endpoint."""
+
+  def __init__(self, address):
+    self._address = address
+
+  def getAddress(self):  # pylint: disable=invalid-name
+    return self._address
+
+
+class StubUsbSetting(object):
+  """Stub of a usb1 interface setting with one bulk in and out endpoint."""
+
+  def __init__(self, interface_class, interface_subclass, interface_protocol,
+               number=0):
+    self._ids = (interface_class, interface_subclass, interface_protocol)
+    self._number = number
+
+  def getClass(self):  # pylint: disable=invalid-name
+    return self._ids[0]
+
+  def getSubClass(self):  # pylint: disable=invalid-name
+    return self._ids[1]
+
+  def getProtocol(self):  # pylint: disable=invalid-name
+    return self._ids[2]
+
+  def getNumber(self):  # pylint: disable=invalid-name
+    return self._number
+
+  def iterEndpoints(self):  # pylint: disable=invalid-name
+    return iter([StubUsbEndpoint(0x81), StubUsbEndpoint(0x01)])
+
+
+class StubUsbDeviceHandle(object):
+  """Stub of an open usb1 device handle, that ignores all calls."""
+
+  def __getattr__(self, attr):
+    return lambda *args, **kwargs: None
+
+  def kernelDriverActive(self, interface):  # pylint: disable=invalid-name
+    del interface  # Unused.
+    return False
+
+
+class StubUsbDevice(object):
+  """Stub of a usb1 device.
+
+  Attributes:
+    serial_number_reads: Number of times the serial number was read, which
+      takes a control transfer on a real device.
+  """
+
+  def __init__(self, serial_number, port_path, settings):
+    """Create a stub device.
+
+    Args:
+      serial_number: Serial number of the device.
+      port_path: Port path of the device, like 'X-X.X.X'.
+      settings: List of StubUsbSettings of the device.
+    """
+    self.serial_number_reads = 0
+    self._serial_number = serial_number
+    bus, _, ports = port_path.partition('-')
+    self._bus = int(bus)
+    self._ports = [int(port) for port in ports.split('.')]
+    self._settings = settings
+
+  def getSerialNumber(self):  # pylint: disable=invalid-name
+    self.serial_number_reads += 1
+    return self._serial_number
+
+  def getBusNumber(self):  # pylint: disable=invalid-name
+    return self._bus
+
+  def GetPortNumberList(self):  # pylint: disable=invalid-name
+    return self._ports
+
+  def iterSettings(self):  # pylint: disable=invalid-name
+    return iter(self._settings)
+
+  def open(self):
+    return StubUsbDeviceHandle()
+
+
+class StubUsbContext(object):
+  """Stub of a usb1 context with the given devices connected.
+
+  Attributes:
+    devices: List of the connected StubUsbDevices.
+    enumerations: Number of times the devices were enumerated.
+  """
+
+  def __init__(self, devices=(), hotplug=True):
+    """Create a stub context.
+
+    Args:
+      devices: StubUsbDevices connected initially.
+      hotplug: Whether hotplug events are supported.
+    """
+    self.devices = list(devices)
+    self.enumerations = 0
+    self._hotplug = hotplug
+    self._hotplug_callbacks = []
+    self._pending_events = []
+
+  def getDeviceList(self, skip_on_error=False):  # pylint: disable=invalid-name
+    del skip_on_error  # Unused.
+    self.enumerations += 1
+    return list(self.devices)
+
+  def hotplugRegisterCallback(self, callback, **kwargs):  # pylint: disable=invalid-name
+    del kwargs  # Unused.
+    if not self._hotplug:
+      raise usb1.USBErrorNotSupported()
+    self._hotplug_callbacks.append(callback)
+
+  def handleEventsTimeout(self, tv=0):  # pylint: disable=invalid-name
+    del tv  # Unused.
+    while self._pending_events:
+      device, event = self._pending_events.pop(0)
+      for callback in self._hotplug_callbacks:
+        callback(self, device, event)
+
+  def plug(self, device):
+    """Connect a device, reported on the next handled events."""
+    self.devices.append(device)
+    self._pending_events.append(
+        (device, usb1.HOTPLUG_EVENT_DEVICE_ARRIVED))
+
+  def unplug(self, device):
+    """Disconnect a device, reported on the next handled events."""
+    self.devices.remove(device)
+    self._pending_events.append((device, usb1.HOTPLUG_EVENT_DEVICE_LEFT))
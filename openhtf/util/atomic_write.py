@@ -11,35 +11,236 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Utilities for automic_write a new file."""
+"""Utilities for automic_write a new file.
+
+Files are written to a temporary file in the destination directory and renamed
+into place once complete, so readers never see a partially written file and the
+rename never degrades to a copy across filesystems.  Writes are buffered and
+handed to the OS with writev() where available.
+
+By default the file and its directory are fsync'ed by every writer.  An
+FsyncBatch can be shared between writers to group the directory syncs of
+several files, eg when many records are output in quick succession:
+
+  batch = atomic_write.FsyncBatch(max_pending=16)
+  with atomic_write.AtomicFileWriter(filename, fsync_batch=batch) as f:
+    f.write(data)
+  ...
+  batch.sync()
+
+The data of files written with a batch is always synced before they are renamed
+into place, so a crash never leaves an empty or truncated file behind; the
+renames themselves are only guaranteed to be on disk once the batch is synced.
+"""
 
 import contextlib
 import os
 import tempfile
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Text, Union
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+# Upper bound of the number of buffers passed to a single writev() call.
+try:
+  _IOV_MAX = max(os.sysconf('SC_IOV_MAX'), 16)
+except (AttributeError, ValueError, OSError):
+  _IOV_MAX = 1024
+
+
+def _write_all(fd: int, chunks: List[bytes]) -> None:
+  """Writes all chunks to fd, resuming after partial writes."""
+  if not hasattr(os, 'writev'):
+    data = memoryview(b''.join(chunks))
+    while data:
+      data = data[os.write(fd, data):]
+    return
+
+  views = [memoryview(chunk) for chunk in chunks if chunk]
+  start = 0
+  while start < len(views):
+    written = os.writev(fd, views[start:start + _IOV_MAX])
+    while start < len(views) and written >= len(views[start]):
+      written -= len(views[start])
+      start += 1
+    if written:
+      views[start] = views[start][written:]
+
+
+def _fsync_directory(path: Text) -> None:
+  """Persists a directory entry; a no-op where directories can't be opened."""
+  try:
+    fd = os.open(path, os.O_RDONLY)
+  except OSError:
+    return
+  try:
+    os.fsync(fd)
+  except OSError:
+    # Some filesystems (and Windows) don't support syncing directories.
+    pass
+  finally:
+    os.close(fd)
+
+
+class FsyncBatch(object):
+  """Groups the directory fsync calls of atomically written files.
+
+  Every file's data is synced before it is renamed into place; only the sync of
+  the directory entries created by the renames is deferred.  Each distinct
+  directory is synced once when sync() is called, when max_pending files are
+  waiting or when a file is added more than max_delay_s after the oldest
+  pending one.
+  """
+
+  def __init__(self, max_pending: int = 32, max_delay_s: float = 1.0):
+    self.max_pending = max_pending
+    self.max_delay_s = max_delay_s
+    self._lock = threading.Lock()
+    self._pending_count = 0
+    self._pending_directories = set()
+    self._oldest_pending_time = None
+
+  def add(self, filename: Text) -> None:
+    """Schedules the directory entry of filename to be synced."""
+    with self._lock:
+      if not self._pending_count:
+        self._oldest_pending_time = time.monotonic()
+      self._pending_count += 1
+      self._pending_directories.add(
+          os.path.dirname(os.path.abspath(filename)))
+      should_sync = (
+          self._pending_count >= self.max_pending or
+          time.monotonic() - self._oldest_pending_time >= self.max_delay_s)
+    if should_sync:
+      self.sync()
+
+  def sync(self) -> None:
+    """Syncs the directories of all pending files."""
+    with self._lock:
+      directories, self._pending_directories = self._pending_directories, set()
+      self._pending_count = 0
+    for directory in directories:
+      _fsync_directory(directory)
+
+
+class AtomicFileWriter(object):
+  """Binary file-like object atomically replacing a file when closed.
+
+  Strings written are UTF-8 encoded.  If abort() is called, or the writer is
+  used as a context manager and the block raises, the destination is left
+  untouched.
+  """
+
+  def __init__(self,
+               filename: Union[Text, os.PathLike],
+               fsync: bool = True,
+               fsync_batch: Optional[FsyncBatch] = None,
+               buffer_size: int = DEFAULT_BUFFER_SIZE):
+    """Creates the temporary file next to filename.
+
+    Args:
+      filename: Path of the file to write.
+      fsync: Whether to persist the file and its directory entry to disk.
+      fsync_batch: Optional FsyncBatch grouping the directory syncs with other
+        files; the file data is still synced when the writer is closed.
+      buffer_size: Number of bytes buffered before they are written out.
+    """
+    self.filename = os.fspath(filename)
+    self.fsync = fsync
+    self.fsync_batch = fsync_batch
+    self.buffer_size = buffer_size
+    directory, basename = os.path.split(os.path.abspath(self.filename))
+    self._fd, self.temp_name = tempfile.mkstemp(
+        prefix='.%s.' % basename, suffix='.tmp', dir=directory)
+    self._chunks = []
+    self._buffered_bytes = 0
+    self.closed = False
+
+  def write(self, write_data: Union[Text, bytes]) -> int:
+    if self.closed:
+      raise ValueError('I/O operation on closed file.')
+    if isinstance(write_data, str):
+      write_data = write_data.encode()
+    self._chunks.append(write_data)
+    self._buffered_bytes += len(write_data)
+    if self._buffered_bytes >= self.buffer_size:
+      self.flush()
+    return len(write_data)
+
+  def writelines(self, lines: Iterable[Union[Text, bytes]]) -> None:
+    for line in lines:
+      self.write(line)
+
+  def flush(self) -> None:
+    """Writes the buffered data to the temporary file."""
+    if self._chunks:
+      chunks, self._chunks = self._chunks, []
+      self._buffered_bytes = 0
+      _write_all(self._fd, chunks)
+
+  def close(self) -> None:
+    """Writes out the data and renames the temporary file into place."""
+    if self.closed:
+      return
+    try:
+      self.flush()
+      if self.fsync:
+        os.fsync(self._fd)
+    except BaseException:
+      self.abort()
+      raise
+    self.closed = True
+    os.close(self._fd)
+    try:
+      os.replace(self.temp_name, self.filename)
+    except BaseException:
+      self._remove_temp()
+      raise
+    if self.fsync:
+      if self.fsync_batch is not None:
+        self.fsync_batch.add(self.filename)
+      else:
+        _fsync_directory(os.path.dirname(os.path.abspath(self.filename)))
+
+  def abort(self) -> None:
+    """Discards the written data, leaving the destination untouched."""
+    if self.closed:
+      return
+    self.closed = True
+    self._chunks = []
+    os.close(self._fd)
+    self._remove_temp()
+
+  def _remove_temp(self) -> None:
+    try:
+      os.remove(self.temp_name)
+    except (IOError, OSError):
+      pass
+
+  def __enter__(self) -> 'AtomicFileWriter':
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback) -> None:
+    if exc_type is None:
+      self.close()
+    else:
+      self.abort()
 
 
 @contextlib.contextmanager
-def atomic_write(filename, filesync=False):
+def atomic_write(filename, filesync=False,
+                 fsync_batch=None) -> Iterator[AtomicFileWriter]:
   """Atomically write a file (using a temporary file).
 
   Args:
     filename: the file to be written
     filesync: flush the file to disk
+    fsync_batch: optional FsyncBatch used to group the flush with other files
 
   Yields:
     File object to write to.
   """
-
-  tmpf = tempfile.NamedTemporaryFile(delete=False)
-  try:
-    with open(tmpf.name, 'w') as curfile:
-      yield curfile
-      if filesync:
-        curfile.flush()
-        os.fsync(curfile.fileno())
-    os.rename(tmpf.name, filename)
-  finally:
-    try:
-      os.remove(tmpf.name)
-    except (IOError, OSError):
-      pass
+  with AtomicFileWriter(
+      filename, fsync=filesync, fsync_batch=fsync_batch) as curfile:
+    yield curfile
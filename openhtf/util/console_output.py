@@ -44,6 +44,9 @@ _LOG = logging.getLogger(__name__)
 # logging that uses a CliQuietFilter.
 CLI_QUIET = False
 
+# Maximum seconds printing waits for the CLI log records queued before it.
+CLI_FLUSH_TIMEOUT_S = 0.1
+
 ARG_PARSER = argv.module_parser()
 ARG_PARSER.add_argument(
     '--quiet',
@@ -66,6 +69,17 @@ def _printed_len(some_string):
       [x for x in ANSI_ESC_RE.sub('', some_string) if x in string.printable])
 
 
+def _flush_cli_logs():
+  """Lets the CLI log records queued so far be printed before our output.
+
+  Waits at most CLI_FLUSH_TIMEOUT_S, so a slow terminal only risks interleaving
+  the output with the logs rather than stalling the caller.
+  """
+  # The logs module depends on this one, so import it lazily.
+  from openhtf.util import logs  # pylint: disable=g-import-not-at-top
+  logs.flush_cli_logs(timeout_s=CLI_FLUSH_TIMEOUT_S)
+
+
 def _linesep_for_file(file):
   """Determine which line separator to use based on the file's mode."""
   if 'b' in file.mode:
@@ -94,6 +108,7 @@ def banner_print(msg, color='', width=80, file=sys.stdout, logger=_LOG):
     logger.debug(ANSI_ESC_RE.sub('', msg))
   if CLI_QUIET:
     return
+  _flush_cli_logs()
   lpad = int(math.ceil((width - _printed_len(msg) - 2) / 2.0)) * '='
   rpad = int(math.floor((width - _printed_len(msg) - 2) / 2.0)) * '='
   file.write('{sep}{color}{lpad} {msg} {rpad}{reset}{sep}{sep}'.format(
@@ -122,6 +137,7 @@ def bracket_print(msg, color='', width=8, file=sys.stdout, end_line=True):
   """
   if CLI_QUIET:
     return
+  _flush_cli_logs()
   lpad = int(math.ceil((width - 2 - _printed_len(msg)) / 2.0)) * ' '
   rpad = int(math.floor((width - 2 - _printed_len(msg)) / 2.0)) * ' '
   file.write('[{lpad}{bright}{color}{msg}{reset}{rpad}]'.format(
@@ -158,6 +174,7 @@ def cli_print(msg, color='', end=None, file=sys.stdout, logger=_LOG):
     logger.debug('-> %s', msg)
   if CLI_QUIET:
     return
+  _flush_cli_logs()
   if end is None:
     end = _linesep_for_file(file)
   file.write('{color}{msg}{reset}{end}'.format(
@@ -177,6 +194,7 @@ def error_print(msg, color=colorama.Fore.RED, file=sys.stderr):
   """
   if CLI_QUIET:
     return
+  _flush_cli_logs()
   file.write('{sep}{bright}{color}Error: {normal}{msg}{sep}{reset}'.format(
       sep=_linesep_for_file(file),
       bright=colorama.Style.BRIGHT,
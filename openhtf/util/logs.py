@@ -99,13 +99,24 @@ Additionally, the --quiet flag and CLI_QUIET variable from the console_output
 module will override the verbosity setting and suppress all CLI output.
 """
 
+import atexit
 import collections
+import copy
 import datetime
+import functools
+import itertools
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import re
 import sys
+import tempfile
 import textwrap
+import threading
+import time
+import weakref
 
 from openhtf.util import argv
 from openhtf.util import console_output
@@ -131,6 +142,16 @@ RECORD_LOGGER_RE = re.compile(r'%s\.(?P<test_uid>[^.]*)\.?' %
 SUBSYSTEM_LOGGER_RE = re.compile(
     r'%s\.[^.]*\.(?P<subsys>plug|phase)\.(?P<id>[^.]*)' % RECORD_LOGGER_PREFIX)
 
+# Minimum time between two update notifications caused by logs of a test.
+DEFAULT_NOTIFY_INTERVAL_S = 0.1
+
+# Maximum number of log records waiting to be printed to the CLI; records
+# logged while the queue is full are dropped and counted.
+CLI_LOG_QUEUE_SIZE = 10000
+
+# Queue of the records printed to the CLI, set by configure_logging().
+_cli_queue = None
+
 _LOG_ONCE_SEEN = set()
 
 
@@ -143,7 +164,273 @@ class LogRecord(
         'timestamp_millis',
         'message',
     ])):
-  pass
+  __slots__ = ()
+
+
+class LogRecordStore(object):
+  """Compact storage for the log records of a test.
+
+  Records are kept once, as LogRecord tuples whose logger names and sources are
+  interned, and only converted to dicts when requested.  If max_records is set,
+  the store is a ring buffer: the oldest records are dropped and counted in
+  dropped_count.  Live views of a test use recent_as_base_types(), which only
+  converts the recent_records most recent records.
+
+  Stores behave like read-only sequences that can be appended to.
+  """
+
+  __slots__ = ('max_records', 'recent_records', 'dropped_count', '_records',
+               '_lock', '__weakref__')
+
+  def __init__(self, records=(), max_records=None, recent_records=None):
+    self.max_records = max_records
+    self.recent_records = recent_records
+    self.dropped_count = 0
+    self._records = collections.deque(maxlen=max_records)
+    self._lock = threading.Lock()
+    self.extend(records)
+
+  @classmethod
+  def from_records(cls, records):
+    """Returns records if already a store, otherwise a store holding them."""
+    if isinstance(records, LogRecordStore):
+      return records
+    return cls(records)
+
+  @staticmethod
+  def _intern(log_record):
+    return log_record._replace(
+        logger_name=sys.intern(log_record.logger_name),
+        source=sys.intern(log_record.source))
+
+  def append(self, log_record):
+    log_record = self._intern(log_record)
+    with self._lock:
+      if len(self._records) == self.max_records:
+        self.dropped_count += 1
+      self._records.append(log_record)
+
+  def extend(self, log_records):
+    for log_record in log_records:
+      self.append(log_record)
+
+  def as_base_types(self):
+    """Returns the records as a list of dicts."""
+    return list(self.iter_base_types())
+
+  def recent_as_base_types(self):
+    """Returns the most recent records held in memory as a list of dicts.
+
+    This is what live views of a test should use: it only converts the last
+    recent_records records, and for stores that keep older records on disk it
+    avoids reading them back on every update.
+    """
+    with self._lock:
+      recent = self._recent_locked()
+    return [log_record._asdict() for log_record in recent]
+
+  def _recent_locked(self):
+    """Returns the in-memory records of the recent_records window."""
+    if (self.recent_records is None or
+        self.recent_records >= len(self._records)):
+      return list(self._records)
+    recent = list(
+        itertools.islice(reversed(self._records), self.recent_records))
+    recent.reverse()
+    return recent
+
+  def iter_base_types(self):
+    """Iterates over all the records as dicts."""
+    for log_record in self:
+      yield log_record._asdict()
+
+  def page(self, offset, limit=None):
+    """Returns up to limit records starting at index offset."""
+    records = list(self)
+    return records[offset:None if limit is None else offset + limit]
+
+  def __len__(self):
+    return len(self._records)
+
+  def __iter__(self):
+    with self._lock:
+      return iter(list(self._records))
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return list(self)[index]
+    return self._records[index]
+
+  def __eq__(self, other):
+    if isinstance(other, LogRecordStore):
+      return list(self) == list(other)
+    if isinstance(other, (list, tuple)):
+      return list(self) == list(other)
+    return NotImplemented
+
+  def __ne__(self, other):
+    equal = self.__eq__(other)
+    return equal if equal is NotImplemented else not equal
+
+  __hash__ = None
+
+  def __repr__(self):
+    return '%s(%d records, %d dropped)' % (type(self).__name__, len(self),
+                                           self.dropped_count)
+
+  def __getstate__(self):
+    return {
+        'records': list(self),
+        'max_records': self.max_records,
+        'recent_records': self.recent_records,
+        'dropped_count': self.dropped_count,
+    }
+
+  def __setstate__(self, state):
+    LogRecordStore.__init__(self, state['records'], state['max_records'],
+                            state.get('recent_records'))
+    self.dropped_count = state['dropped_count']
+
+
+class SpillingLogRecordStore(LogRecordStore):
+  """LogRecordStore keeping only the most recent records in memory.
+
+  Older records are appended to a segment file (one JSON list per line) in
+  directory, or the system temporary directory, which is deleted with the
+  store.  Iterating over the store, as output callbacks do, streams the records
+  back from disk; recent_as_base_types() only returns records of the in-memory
+  window and page() reads a slice of the records without loading the others.
+  """
+
+  __slots__ = ('memory_records', 'directory', 'spilled_count', '_segment_path',
+               '_segment_file', '_segment_index', '_pending_lines',
+               '_finalizer')
+
+  # Spilled lines are written in batches of this many records, and the offset
+  # of every _INDEX_INTERVAL'th record is kept to seek into the segment.
+  _SPILL_BATCH = 256
+  _INDEX_INTERVAL = 256
+
+  def __init__(self,
+               records=(),
+               memory_records=10000,
+               directory=None,
+               recent_records=None):
+    self.memory_records = memory_records
+    self.directory = directory
+    self.spilled_count = 0
+    self._segment_path = None
+    self._segment_file = None
+    self._segment_index = []
+    self._pending_lines = []
+    self._finalizer = None
+    super(SpillingLogRecordStore, self).__init__(records, memory_records,
+                                                 recent_records)
+
+  def append(self, log_record):
+    log_record = self._intern(log_record)
+    with self._lock:
+      if len(self._records) == self.memory_records:
+        self._spill_locked(self._records[0])
+      self._records.append(log_record)
+
+  def _spill_locked(self, log_record):
+    """Queues a record evicted from memory to be written to the segment."""
+    self._pending_lines.append(json.dumps(list(log_record)).encode() + b'\n')
+    self.spilled_count += 1
+    if len(self._pending_lines) >= self._SPILL_BATCH:
+      self._flush_locked()
+
+  def _flush_locked(self):
+    if not self._pending_lines:
+      return
+    if self._segment_file is None:
+      fd, self._segment_path = tempfile.mkstemp(
+          prefix='openhtf_logs_', suffix='.jsonl', dir=self.directory)
+      self._segment_file = os.fdopen(fd, 'ab')
+      self._finalizer = weakref.finalize(self, _close_segment,
+                                         self._segment_file, self._segment_path)
+    offset = self._segment_file.tell()
+    first_index = self.spilled_count - len(self._pending_lines)
+    for line in self._pending_lines:
+      if first_index % self._INDEX_INTERVAL == 0:
+        self._segment_index.append(offset)
+      offset += len(line)
+      first_index += 1
+    self._segment_file.writelines(self._pending_lines)
+    self._segment_file.flush()
+    self._pending_lines = []
+
+  def _snapshot(self):
+    """Returns the number of spilled records and the in-memory records."""
+    with self._lock:
+      self._flush_locked()
+      return self.spilled_count, list(self._records)
+
+  def _read_spilled(self, start, stop):
+    """Yields the spilled records in [start, stop) from the segment."""
+    if start >= stop:
+      return
+    with open(self._segment_path, 'rb') as segment:
+      segment.seek(self._segment_index[start // self._INDEX_INTERVAL])
+      for _ in range(start % self._INDEX_INTERVAL):
+        segment.readline()
+      for _ in range(stop - start):
+        yield LogRecord(*json.loads(segment.readline()))
+
+  def page(self, offset, limit=None):
+    spilled_count, recent = self._snapshot()
+    stop = spilled_count + len(recent)
+    if limit is not None:
+      stop = min(stop, offset + limit)
+    records = list(self._read_spilled(offset, min(stop, spilled_count)))
+    records.extend(
+        recent[max(offset - spilled_count, 0):max(stop - spilled_count, 0)])
+    return records
+
+  def close(self):
+    """Deletes the segment file; the store must not be used afterwards."""
+    if self._finalizer is not None:
+      self._finalizer()
+
+  def __len__(self):
+    return self.spilled_count + len(self._records)
+
+  def __iter__(self):
+    spilled_count, recent = self._snapshot()
+    return itertools.chain(self._read_spilled(0, spilled_count), recent)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return list(self)[index]
+    length = len(self)
+    if index < 0:
+      index += length
+    if not 0 <= index < length:
+      raise IndexError('LogRecordStore index out of range')
+    return self.page(index, 1)[0]
+
+  def __repr__(self):
+    return '%s(%d records, %d spilled)' % (type(self).__name__, len(self),
+                                           self.spilled_count)
+
+  def __getstate__(self):
+    state = super(SpillingLogRecordStore, self).__getstate__()
+    state['directory'] = self.directory
+    return state
+
+  def __setstate__(self, state):
+    SpillingLogRecordStore.__init__(self, state['records'],
+                                    state['max_records'], state['directory'],
+                                    state.get('recent_records'))
+
+
+def _close_segment(segment_file, segment_path):
+  segment_file.close()
+  try:
+    os.remove(segment_path)
+  except OSError:
+    pass
 
 
 class HtfTestLogger(logging.Logger):
@@ -172,7 +459,10 @@ def get_record_logger_for(test_uid):
   return record_logger
 
 
-def initialize_record_handler(test_uid, test_record, notify_update):
+def initialize_record_handler(test_uid,
+                              test_record,
+                              notify_update,
+                              notify_interval_s=DEFAULT_NOTIFY_INTERVAL_S):
   """Initialize the record handler for a test.
 
   For each running test, we attach a record handler to the top-level OpenHTF
@@ -183,9 +473,11 @@ def initialize_record_handler(test_uid, test_record, notify_update):
     test_uid: UID for the test run.
     test_record: The test record for the current test run.
     notify_update: Function that gets called when the test record is updated.
+    notify_interval_s: Minimum time between two calls to notify_update.
   """
   htf_logger = logging.getLogger(LOGGER_PREFIX)
-  htf_logger.addHandler(RecordHandler(test_uid, test_record, notify_update))
+  htf_logger.addHandler(
+      RecordHandler(test_uid, test_record, notify_update, notify_interval_s))
 
 
 def remove_record_handler(test_uid):
@@ -193,6 +485,7 @@ def remove_record_handler(test_uid):
   for handler in handlers:
     if isinstance(handler, RecordHandler) and handler.test_uid is test_uid:
       handlers.remove(handler)
+      handler.close()
       break
 
 
@@ -252,16 +545,89 @@ class TestUidFilter(logging.Filter):
 
 
 class RecordHandler(logging.Handler):
-  """A handler to save logs to an HTF TestRecord."""
+  """A handler to save logs to an HTF TestRecord.
 
-  def __init__(self, test_uid, test_record, notify_update):
+  Records are appended to the test record as they are emitted, but
+  notify_update is called at most once per notify_interval_s so that chatty
+  loggers don't wake up the watchers of the test state for every line.  A
+  pending notification is sent by the handler's notify thread when the interval
+  expires, or when the handler is flushed or closed.
+  """
+
+  def __init__(self,
+               test_uid,
+               test_record,
+               notify_update,
+               notify_interval_s=DEFAULT_NOTIFY_INTERVAL_S):
     super(RecordHandler, self).__init__()
     self.test_uid = test_uid
     self._test_record = test_record
     self._notify_update = notify_update
+    self._notify_interval_s = notify_interval_s
+    self._notify_condition = threading.Condition()
+    self._last_notify_time = None
+    self._notify_pending = False
+    self._notify_thread = None
+    self._closed = False
     self.addFilter(MAC_FILTER)
     self.addFilter(TestUidFilter(test_uid))
 
+  def _notify(self):
+    """Calls notify_update now, or has the notify thread call it later."""
+    with self._notify_condition:
+      if self._notify_pending:
+        return
+      now = time.monotonic()
+      if (self._last_notify_time is None or
+          now - self._last_notify_time >= self._notify_interval_s):
+        self._last_notify_time = now
+      else:
+        self._notify_pending = True
+        if self._notify_thread is None:
+          self._notify_thread = threading.Thread(
+              target=self._notify_thread_proc,
+              name='RecordHandlerNotify:%s' % self.test_uid,
+              daemon=True)
+          self._notify_thread.start()
+        self._notify_condition.notify()
+        return
+    self._notify_update()
+
+  def _notify_thread_proc(self):
+    """Sends the pending notifications at the end of their interval."""
+    while True:
+      with self._notify_condition:
+        while True:
+          if self._closed:
+            return
+          timeout_s = None
+          if self._notify_pending:
+            timeout_s = (
+                self._last_notify_time + self._notify_interval_s -
+                time.monotonic())
+            if timeout_s <= 0:
+              break
+          self._notify_condition.wait(timeout_s)
+        self._notify_pending = False
+        self._last_notify_time = time.monotonic()
+      self._notify_update()
+
+  def flush(self):
+    """Sends any pending update notification."""
+    with self._notify_condition:
+      if not self._notify_pending:
+        return
+      self._notify_pending = False
+      self._last_notify_time = time.monotonic()
+    self._notify_update()
+
+  def close(self):
+    self.flush()
+    with self._notify_condition:
+      self._closed = True
+      self._notify_condition.notify()
+    super(RecordHandler, self).close()
+
   def emit(self, record):
     """Save a logging.LogRecord to our test record.
 
@@ -283,11 +649,26 @@ class RecordHandler(logging.Handler):
           message,
       )
       self._test_record.add_log_record(log_record)
-      self._notify_update()
+      self._notify()
     except Exception:  # pylint: disable=broad-except
       self.handleError(record)
 
 
+@functools.lru_cache(maxsize=1024)
+def _terse_logger_name(logger_name):
+  """Returns the short name printed to the CLI for a logger."""
+  match = RECORD_LOGGER_RE.match(logger_name)
+  if not match:
+    return logger_name.split('.')[-1]
+  # Figure out which OpenHTF subsystem the record came from.
+  subsys_match = SUBSYSTEM_LOGGER_RE.match(logger_name)
+  if subsys_match:
+    return '<{subsys}: {id}>'.format(
+        subsys=subsys_match.group('subsys'), id=subsys_match.group('id'))
+  # Fall back to using the last five characters of the test UUID.
+  return '<test %s>' % match.group('test_uid')[-5:]
+
+
 class CliFormatter(logging.Formatter):
   """Formats log messages for printing to the CLI."""
 
@@ -297,19 +678,124 @@ class CliFormatter(logging.Formatter):
     localized_time = datetime.datetime.fromtimestamp(record.created)
     terse_time = localized_time.strftime(u'%H:%M:%S')
     terse_level = record.levelname[0]
-    terse_name = record.name.split('.')[-1]
-    match = RECORD_LOGGER_RE.match(record.name)
-    if match:
-      # Figure out which OpenHTF subsystem the record came from.
-      subsys_match = SUBSYSTEM_LOGGER_RE.match(record.name)
-      if subsys_match:
-        terse_name = '<{subsys}: {id}>'.format(
-            subsys=subsys_match.group('subsys'), id=subsys_match.group('id'))
-      else:
-        # Fall back to using the last five characters of the test UUID.
-        terse_name = '<test %s>' % match.group('test_uid')[-5:]
     return '{lvl} {time} {logger} - {msg}'.format(
-        lvl=terse_level, time=terse_time, logger=terse_name, msg=record.message)
+        lvl=terse_level,
+        time=terse_time,
+        logger=_terse_logger_name(record.name),
+        msg=record.message)
+
+
+class CliQueueHandler(logging.handlers.QueueHandler):
+  """Hands log records over to the thread printing them to the CLI.
+
+  Logging threads only merge the message with its arguments and enqueue the
+  record; formatting and terminal I/O happen on the QueueListener's thread.
+  When the bounded queue is full records are dropped rather than blocking the
+  caller, and a warning with the number of dropped records is printed once
+  there is room again.
+  """
+
+  def __init__(self, record_queue):
+    super(CliQueueHandler, self).__init__(record_queue)
+    self.dropped_count = 0
+    self._unreported_drops = 0
+    self._drops_lock = threading.Lock()
+
+  def prepare(self, record):
+    # Tracebacks are not printed by the CliFormatter, so drop them here rather
+    # than formatting them.
+    record = copy.copy(record)
+    record.msg = record.getMessage()
+    record.args = None
+    record.exc_info = None
+    record.exc_text = None
+    record.stack_info = None
+    return record
+
+  def enqueue(self, record):
+    with self._drops_lock:
+      try:
+        if self._unreported_drops:
+          self.queue.put_nowait(self._dropped_record(record))
+          self._unreported_drops = 0
+        self.queue.put_nowait(record)
+      except queue.Full:
+        self.dropped_count += 1
+        self._unreported_drops += 1
+
+  def _dropped_record(self, record):
+    return logging.makeLogRecord({
+        'name': __name__,
+        'levelno': logging.WARNING,
+        'levelname': logging.getLevelName(logging.WARNING),
+        'msg': 'Dropped %d log records printed to the CLI.' %
+               self._unreported_drops,
+        'created': record.created,
+    })
+
+
+class _CliFlushMarker(object):
+  """Queued by flush_cli_logs(), set once the records before it are printed."""
+
+  __slots__ = ('event',)
+
+  def __init__(self):
+    self.event = threading.Event()
+
+
+class CliQueueListener(logging.handlers.QueueListener):
+  """Prints the queued log records to the CLI, and signals flush markers."""
+
+  # Seconds stop() waits for room in the queue, then for the records to print.
+  stop_timeout_s = 1.0
+
+  def handle(self, record):
+    if isinstance(record, _CliFlushMarker):
+      record.event.set()
+      return
+    super(CliQueueListener, self).handle(record)
+
+  def enqueue_sentinel(self):
+    # The queue is bounded, wait for room rather than raising queue.Full.
+    self.queue.put(self._sentinel, timeout=self.stop_timeout_s)
+
+  def stop(self):
+    """Stops once the queued records are printed, or after stop_timeout_s.
+
+    The printing thread is a daemon, so it is given up on if the terminal can't
+    keep up rather than blocking the process exit.
+    """
+    if self._thread is None:
+      return
+    deadline = time.monotonic() + self.stop_timeout_s
+    try:
+      self.enqueue_sentinel()
+    except queue.Full:
+      pass
+    else:
+      self._thread.join(max(deadline - time.monotonic(), 0))
+    self._thread = None
+
+
+def flush_cli_logs(timeout_s=1.0):
+  """Waits for the log records queued so far to be printed to the CLI.
+
+  Call this before printing to the CLI directly, so that the output comes after
+  the logs emitted before.  Records logged by other threads in the meantime are
+  not waited for.
+
+  Args:
+    timeout_s: Maximum time to wait, in case the terminal is slow.
+  """
+  if _cli_queue is None:
+    return
+  deadline = time.monotonic() + timeout_s
+  marker = _CliFlushMarker()
+  try:
+    _cli_queue.put(marker, timeout=timeout_s)
+  except queue.Full:
+    return
+  marker.event.wait(max(deadline - time.monotonic(), 0))
 
 
 @functions.call_once
@@ -331,13 +817,21 @@ def configure_logging():
   else:
     logging_level = logging.DEBUG
 
-  # Configure a handler to print to the CLI.
+  # Configure a handler to print to the CLI from a dedicated thread, so that
+  # logging threads never wait on the terminal.
   cli_handler = logging.StreamHandler(stream=sys.stdout)
   cli_handler.setFormatter(CliFormatter())
-  cli_handler.setLevel(logging_level)
-  cli_handler.addFilter(MAC_FILTER)
-  htf_logger.addHandler(cli_handler)
+  global _cli_queue
+  cli_queue = _cli_queue = queue.Queue(maxsize=CLI_LOG_QUEUE_SIZE)
+  cli_queue_handler = CliQueueHandler(cli_queue)
+  cli_queue_handler.setLevel(logging_level)
+  cli_queue_handler.addFilter(MAC_FILTER)
+  htf_logger.addHandler(cli_queue_handler)
+  cli_listener = CliQueueListener(cli_queue, cli_handler)
+  cli_listener.start()
+  # Print the records still queued when the process exits.
+  atexit.register(cli_listener.stop)
 
   # Suppress CLI logging if the --quiet flag is used, or while CLI_QUIET is set
   # in the console_output module.
-  cli_handler.addFilter(console_output.CliQuietFilter())
+  cli_queue_handler.addFilter(console_output.CliQuietFilter())
@@ -15,7 +15,9 @@
 
 This module includes both a MulticastListener that listens on a multicast
 socket and invokes a callback function for each message received, and a send()
-function that is used to send one-shot messages to a multicast socket.
+function that is used to send one-shot messages to a multicast socket.  A
+MulticastSender sends one-way messages, such as periodic announcements, over a
+single long-lived socket.
 """
 
 import errno
@@ -62,7 +64,8 @@ class MulticastListener(threading.Thread):
                callback,
                address=DEFAULT_ADDRESS,
                port=DEFAULT_PORT,
-               ttl=DEFAULT_TTL):
+               ttl=DEFAULT_TTL,
+               pass_sender=False):
     """Constructor.
 
     Args:
@@ -73,12 +76,15 @@ class MulticastListener(threading.Thread):
       address: Multicast IP address component of the socket to listen on.
       port: Multicast UDP port component of the socket to listen on.
       ttl: TTL for multicast messages. 1 to keep traffic in-network.
+      pass_sender: If True, callback is also passed the IP address of the
+        sender, as a second argument.
     """
     super(MulticastListener, self).__init__()
     self.address = address
     self.port = port
     self.ttl = ttl
     self._callback = callback
+    self._pass_sender = pass_sender
     self._live = False
     self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
@@ -147,7 +153,10 @@ class MulticastListener(threading.Thread):
         data, address = self._sock.recvfrom(MAX_MESSAGE_BYTES)
         data = data.decode('utf-8')
         log_line = 'Received multicast message from %s: %s' % (address, data)
-        response = self._callback(data)
+        if self._pass_sender:
+          response = self._callback(data, address[0])
+        else:
+          response = self._callback(data)
         if response is not None:
           log_line += ', responding with %s bytes' % len(response)
           # Send replies out-of-band instead of with the same multicast socket
@@ -164,6 +173,54 @@ class MulticastListener(threading.Thread):
         _LOG.debug('Error receiving multicast message', exc_info=True)
 
 
+def _make_send_socket(ttl, local_only):
+  """Returns a UDP socket to send multicast messages with."""
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+  if local_only:
+    # Set outgoing interface to localhost to ensure no packets leave this host.
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                    struct.pack('!L', LOCALHOST_ADDRESS))
+  return sock
+
+
+class MulticastSender(object):
+  """Sends one-way messages to a multicast socket, without waiting for replies.
+
+  The same socket is used for every message, so that frequent messages such as
+  heartbeats don't each need a new socket.
+  """
+
+  def __init__(self,
+               address=DEFAULT_ADDRESS,
+               port=DEFAULT_PORT,
+               ttl=DEFAULT_TTL,
+               local_only=False):
+    """Constructor.
+
+    Args:
+      address: Multicast IP address component of the socket to send to.
+      port: Multicast UDP port component of the socket to send to.
+      ttl: TTL for multicast messages. 1 to keep traffic in-network.
+      local_only: if True, no packets will leave this host.
+    """
+    self.address = address
+    self.port = port
+    self._sock = _make_send_socket(ttl, local_only)
+
+  def send(self, message):
+    """Sends the string message, returns False if it could not be sent."""
+    try:
+      self._sock.sendto(message.encode('utf-8'), (self.address, self.port))
+    except socket.error:
+      _LOG.debug('Error sending multicast message', exc_info=True)
+      return False
+    return True
+
+  def close(self):
+    self._sock.close()
+
+
 def send(query,
          address=DEFAULT_ADDRESS,
          port=DEFAULT_PORT,
@@ -185,12 +242,7 @@ def send(query,
     Responses are tuples of (sender_address, message).
   """
   # Set up the socket as a UDP Multicast socket with the given timeout.
-  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-  sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
-  if local_only:
-    # Set outgoing interface to localhost to ensure no packets leave this host.
-    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
-                    struct.pack('!L', LOCALHOST_ADDRESS))
+  sock = _make_send_socket(ttl, local_only)
   sock.settimeout(timeout_s)
   sock.sendto(query.encode('utf-8'), (address, port))
 
@@ -13,10 +13,12 @@
 # limitations under the License.
 
 import queue
+import threading
 import time
 import unittest
 from unittest import mock
 
+import openhtf
 from openhtf import plugs
 from openhtf.core import base_plugs
 from openhtf.core import monitors
@@ -96,3 +98,217 @@ class TestMonitors(unittest.TestCase):
         first_meas[0], 100, msg='At time 0, there should be a call made.')
     self.assertEqual(
         2, first_meas[1], msg="And it should be the monitor func's return val")
+
+  def test_monitors_share_scheduler(self):
+    q1 = queue.Queue()
+    q2 = queue.Queue()
+
+    def monitor1(test):
+      del test  # Unused.
+      q1.put(1)
+      return 1
+
+    def monitor2(test):
+      del test  # Unused.
+      q2.put(2)
+      return 2
+
+    @monitors.monitors('meas1', monitor1, poll_interval_ms=10)
+    @monitors.monitors('meas2', monitor2, poll_interval_ms=10)
+    def phase(test):
+      del test  # Unused.
+      while q1.qsize() < 2 or q2.qsize() < 2:
+        time.sleep(0.01)
+      self.assertEqual(1, len(monitors._SCHEDULERS))
+      self.assertEqual(1, sum(thread.name == 'MonitorScheduler'
+                              for thread in threading.enumerate()))
+
+    phase(self.test_state)
+    self.assertEqual({}, monitors._SCHEDULERS)
+    set_names = {
+        name for name, _, _ in self.test_state.mock_calls
+        if name.endswith('__setitem__')
+    }
+    self.assertEqual(
+        {
+            'test_api.measurements.meas1.__setitem__',
+            'test_api.measurements.meas2.__setitem__'
+        }, set_names)
+
+  def test_samples_committed_in_batches(self):
+
+    def monitor_func(test):
+      del test  # Unused.
+      return 1
+
+    @monitors.monitors('meas', monitor_func, poll_interval_ms=0)
+    def phase(test):
+      del test  # Unused.
+      time.sleep(0.3)
+
+    measurement = self.test_state.test_api.measurements.meas
+    notify_value_set = measurement.notify_value_set
+    phase(self.test_state)
+    # Samples are taken in a tight loop, but the test state is notified at
+    # most every 100ms, plus once when the phase ends.
+    self.assertGreater(measurement.__setitem__.call_count, 10)
+    self.assertLessEqual(notify_value_set.call_count, 5)
+    self.assertIs(notify_value_set, measurement.notify_value_set)
+
+  def test_deadlines_do_not_drift(self):
+    sample_times = []
+
+    def monitor_func(test):
+      del test  # Unused.
+      sample_times.append(time.monotonic())
+      # Take a significant part of the interval.
+      time.sleep(0.015)
+      return 1
+
+    @monitors.monitors('meas', monitor_func, poll_interval_ms=20)
+    def phase(test):
+      del test  # Unused.
+      while len(sample_times) < 6:
+        time.sleep(0.01)
+
+    phase(self.test_state)
+    # Samples are started on 20ms boundaries from the first one rather than
+    # 20ms after the previous one returned.
+    self.assertLess(sample_times[5] - sample_times[0], 0.15)
+
+  def test_high_rate_mode(self):
+    samples = []
+
+    def monitor_func(test):
+      del test  # Unused.
+      samples.append(len(samples))
+      return samples[-1]
+
+    @monitors.monitors(
+        'meas',
+        monitor_func,
+        poll_interval_ms=0,
+        high_rate=True,
+        buffer_size=64,
+        downsample=4,
+        live_buckets=8)
+    def phase(test):
+      del test  # Unused.
+      while len(samples) < 1000:
+        time.sleep(0.01)
+
+    measurement = self.test_state.test_api.measurements.meas
+    phase(self.test_state)
+    recorded = [
+        call[1][1] for call in measurement.mock_calls
+        if call[0] == '__setitem__'
+    ]
+    # Every 4 samples are averaged, the last group may be incomplete.
+    self.assertEqual((len(samples) + 3) // 4, len(recorded))
+    self.assertEqual([1.5, 5.5, 9.5], recorded[:3])
+
+    set_live_summary = self.test_state.running_phase_state.set_live_summary
+    name, summary = set_live_summary.call_args[0]
+    self.assertEqual('meas', name)
+    self.assertLessEqual(len(summary), 8)
+    self.assertEqual(len(samples), sum(bucket['count'] for bucket in summary))
+    self.assertEqual(0, summary[0]['min'])
+    self.assertEqual(len(samples) - 1, summary[-1]['max'])
+
+  def test_monitors_sharing_a_plug_are_batched(self):
+    scheduler = monitors._MonitorScheduler()
+    now = time.monotonic()
+
+    def add_monitor(deadline_s, plug_types):
+      monitor = mock.Mock(
+          sampling=False, interval_s=1.0, plug_types=frozenset(plug_types))
+      monitor.deadline.return_value = now + deadline_s
+      scheduler.add(monitor)
+      return monitor
+
+    due = add_monitor(-1, [EmptyPlug])
+    sharing_soon = add_monitor(0.005, [EmptyPlug])
+    add_monitor(0.005, [])
+    add_monitor(1, [EmptyPlug])
+    self.assertEqual([[due, sharing_soon]], scheduler._next_due_batches())
+    self.assertEqual(2, len(scheduler._deadlines))
+
+  def test_blocked_monitor_does_not_block_phase(self):
+    sampling = threading.Event()
+    unblock = threading.Event()
+    self.addCleanup(unblock.set)
+    other_samples = queue.Queue()
+
+    def blocking_monitor(test):
+      del test  # Unused.
+      sampling.set()
+      unblock.wait()
+      return 1
+
+    def other_monitor(test):
+      del test  # Unused.
+      other_samples.put(1)
+      return 1
+
+    def make_monitor(name, func):
+      return monitors._Monitor(name, openhtf.PhaseDescriptor.wrap_or_copy(func),
+                               {}, self.test_state, 10)
+
+    other = make_monitor('other', other_monitor)
+    blocking = make_monitor('blocking', blocking_monitor)
+    monitors._start_monitor(self.test_state, other)
+    monitors._start_monitor(self.test_state, blocking)
+    self.assertTrue(sampling.wait(1))
+    with mock.patch.object(monitors, '_STOP_TIMEOUT_S', 0.1):
+      monitors._stop_monitor(self.test_state, blocking)
+
+    # The other monitor is still sampled, by a new scheduler.
+    while not other_samples.empty():
+      other_samples.get()
+    other_samples.get(timeout=1)
+    monitors._stop_monitor(self.test_state, other)
+    self.assertEqual({}, monitors._SCHEDULERS)
+
+  def test_commit_error_does_not_stop_other_monitors(self):
+    other_samples = queue.Queue()
+
+    def monitor_func(test):
+      del test  # Unused.
+      return 1
+
+    def other_monitor(test):
+      del test  # Unused.
+      other_samples.put(1)
+      return 1
+
+    @monitors.monitors('broken', monitor_func, poll_interval_ms=10)
+    @monitors.monitors('other', other_monitor, poll_interval_ms=10)
+    def phase(test):
+      del test  # Unused.
+      for _ in range(3):
+        other_samples.get(timeout=1)
+
+    self.test_state.test_api.measurements.broken.__setitem__.side_effect = (
+        ValueError('broken'))
+    with mock.patch.object(monitors, '_COMMIT_INTERVAL_S', 0):
+      phase(self.test_state)
+
+  def test_live_summary_merges_buckets(self):
+    summary = monitors._LiveSummary(max_buckets=2)
+    for start in range(0, 15, 5):
+      summary.add_block(range(start, start + 5), range(start, start + 5))
+    self.assertEqual([{
+        'start_ms': 0,
+        'end_ms': 9,
+        'count': 10,
+        'min': 0,
+        'max': 9,
+        'mean': 4.5,
+    }, {
+        'start_ms': 10,
+        'end_ms': 14,
+        'count': 5,
+        'min': 10,
+        'max': 14,
+        'mean': 12,
+    }], summary.as_base_types())
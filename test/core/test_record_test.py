@@ -14,7 +14,9 @@
 
 """Unit tests for test_record module."""
 
+import hashlib
 import sys
+import tempfile
 import unittest
 
 from openhtf.core import test_record
@@ -42,6 +44,22 @@ class TestRecordTest(unittest.TestCase):
     attachment = test_record.Attachment(data, 'text')
     self.assertEqual(attachment.size, expected_size)
 
+  def test_attachment_from_file(self):
+    expected_data = b'test attachment data' * 1000
+    with tempfile.NamedTemporaryFile() as f:
+      f.write(expected_data)
+      f.flush()
+      attachment = test_record.Attachment(None, 'text', source_filename=f.name)
+      known_sha1_attachment = test_record.Attachment(
+          None, 'text', source_filename=f.name, sha1='known')
+    self.assertEqual(expected_data, attachment.data)
+    self.assertEqual(len(expected_data), attachment.size)
+    self.assertEqual(hashlib.sha1(expected_data).hexdigest(), attachment.sha1)
+    self.assertEqual(expected_data, known_sha1_attachment.data)
+    self.assertEqual('known', known_sha1_attachment.sha1)
+    with self.assertRaises(ValueError):
+      test_record.Attachment(b'data', 'text', source_filename=f.name)
+
   def test_attachment_memory_safety(self):
     small_data = b' '  # Use non-empty so Attachment.size (ints) are equal size.
     empty_attachment = test_record.Attachment(small_data, 'text')
@@ -190,3 +190,31 @@ class PhaseStateTest(unittest.TestCase):
         phase_state.measurements['pass_meas'].outcome,
         measurements.Outcome.PASS,
     )
+
+  def test_phase_state_live_summary_replaces_measured_value(self):
+    phase_desc = phase_descriptor.PhaseDescriptor.wrap_or_copy(lambda: None)
+    phase_desc.measurements = [
+        measurements.Measurement('meas').with_dimensions('ms'),
+        measurements.Measurement('other'),
+    ]
+    phase_state = test_state.PhaseState.from_descriptor(
+        phase_desc=phase_desc,
+        test_state=_create_dummy_phase_state_for_measurement_testing()
+        .test_state,
+        logger=logging.Logger('TestLogger'),
+    )
+    phase_state.measurements['meas'].measured_value[1] = 2
+    phase_state.set_live_summary('meas', [{'mean': 2}])
+    live_measurements = phase_state.as_base_types()['measurements']
+    self.assertNotIn('measured_value', live_measurements['meas'])
+    self.assertEqual([{'mean': 2}], live_measurements['meas']['live_summary'])
+    self.assertNotIn('live_summary', live_measurements['other'])
+    # The measurement itself is unaffected.
+    self.assertEqual([(1, 2)],
+                     phase_state.measurements['meas'].as_base_types()
+                     ['measured_value'])
+
+    phase_state.set_live_summary('meas', None)
+    live_measurements = phase_state.as_base_types()['measurements']
+    self.assertEqual([(1, 2)], live_measurements['meas']['measured_value'])
+    self.assertNotIn('live_summary', live_measurements['meas'])
@@ -20,6 +20,9 @@ actually care for.
 
 import io
 import json
+import os
+import shutil
+import tempfile
 
 import openhtf as htf
 from openhtf import util
@@ -30,10 +33,12 @@ from openhtf.core import phase_descriptor
 from openhtf.core import phase_group
 from openhtf.core import test_record as htf_test_record
 from examples import all_the_things
+from openhtf.output import callbacks
 from openhtf.output.callbacks import console_summary
 from openhtf.output.callbacks import json_factory
 from openhtf.output.proto import mfg_event_converter
 from openhtf.output.proto import test_runs_converter
+from openhtf.util import logs
 from openhtf.util import test
 from openhtf.output.proto import test_runs_pb2
 from openhtf.output.proto import test_runs_pb2
@@ -67,6 +72,67 @@ class TestOutput(test.TestCase):
     json_output.seek(0)
     json.loads(json_output.read())
 
+  def test_json_streams_spilled_log_records(self):
+    log_records = [
+        logs.LogRecord(10, 'logger', 'source.py', idx, idx, 'message %d' % idx)
+        for idx in range(100)
+    ]
+    record = htf_test_record.TestRecord(
+        dut_id='dut',
+        station_id='station',
+        log_records=logs.SpillingLogRecordStore(
+            log_records, memory_records=10))
+    json_output = io.BytesIO()
+    json_factory.OutputToJSON(json_output)(record)
+    self.assertEqual([log_record._asdict() for log_record in log_records],
+                     json.loads(json_output.getvalue())['log_records'])
+
+  def test_stream_json_matches_json_dumps(self):
+    log_records = [
+        logs.LogRecord(10, 'logger', 'source.py', idx, idx, 'message\n%d' % idx)
+        for idx in range(3)
+    ]
+    for records in (log_records, []):
+      record = htf_test_record.TestRecord(
+          dut_id='dut', station_id='station', log_records=records)
+      streamed = json_factory.convert_test_record_to_json(
+          record, stream_log_records=True)
+      expected = json_factory.convert_test_record_to_json(record)
+      # Streamed log records are written last.
+      expected['log_records'] = expected.pop('log_records')
+      for json_kwargs in ({}, {'indent': 2}, {'indent': '\t'},
+                          {'separators': (',', ':')}, {'ensure_ascii': False}):
+        with self.subTest(records=len(records), json_kwargs=json_kwargs):
+          self.assertEqual(
+              json.dumps(expected, **json_kwargs),
+              ''.join(json_factory.stream_json(streamed, **json_kwargs)))
+
+  @test.patch_plugs(user_mock='openhtf.plugs.user_input.UserInput')
+  def test_json_to_file(self, user_mock):
+    user_mock.prompt.return_value = 'SomeWidget'
+    record = yield self._test
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    filename_pattern = os.path.join(directory, '{dut_id}.json')
+    json_factory.OutputToJSON(filename_pattern)(record)
+    filename = os.path.join(directory, '%s.json' % record.dut_id)
+    with open(filename) as f:
+      self.assertEqual(record.dut_id, json.load(f)['dut_id'])
+
+    class FailingOutput(callbacks.OutputToFile):
+
+      @staticmethod
+      def serialize_test_record(test_rec):
+        yield b'partial'
+        raise RuntimeError()
+
+    # A failed serialization leaves the previous file in place.
+    with self.assertRaises(RuntimeError):
+      FailingOutput(filename_pattern)(record)
+    with open(filename) as f:
+      self.assertEqual(record.dut_id, json.load(f)['dut_id'])
+    self.assertEqual([os.path.basename(filename)], os.listdir(directory))
+
   @test.patch_plugs(user_mock='openhtf.plugs.user_input.UserInput')
   def test_test_run_from_test_record(self, user_mock):
     user_mock.prompt.return_value = 'SomeWidget'
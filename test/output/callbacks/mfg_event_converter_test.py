@@ -20,6 +20,7 @@ import json
 import logging
 import os
 import unittest
+from unittest import mock
 
 from openhtf.core import measurements
 from openhtf.core import test_record
@@ -207,6 +208,83 @@ class MfgEventConverterTest(unittest.TestCase):
     self.assertTrue(mfg_event.attachment[0].value_binary)  # Assert truthy.
     self.assertEqual(mfg_event.attachment[0].type, test_runs_pb2.TEXT_UTF8)
 
+  def _create_record_with_logs_and_config(self):
+    record = test_record.TestRecord(
+        dut_id='mock-dut-id',
+        station_id='mock-station-id',
+        start_time_millis=100,
+        end_time_millis=500,
+        outcome=test_record.Outcome.PASS,
+        metadata={'config': {'key': 'value'}, 'test_name': 'mock-test-name'},
+    )
+    for idx, level in enumerate((logging.DEBUG, logging.INFO, 25)):
+      record.add_log_record(
+          test_logs.LogRecord(
+              level=level,
+              logger_name='mock-logger-name',
+              source='mock-source',
+              lineno=idx,
+              timestamp_millis=300 + idx,
+              message='mock-message-%d' % idx,
+          ))
+    return record
+
+  def test_test_record_from_mfg_event_record_json_modes(self):
+    expected = mfg_event_converter.test_record_from_mfg_event(
+        mfg_event_converter.mfg_event_from_test_record(
+            self._create_record_with_logs_and_config()))
+    self.assertEqual(3, len(expected['log_records']))
+    self.assertEqual({'key': 'value'}, expected['metadata']['config'])
+
+    for mode in mfg_event_converter.RecordJsonMode:
+      with self.subTest(mode=mode):
+        store = {}
+        mfg_event = mfg_event_converter.mfg_event_from_test_record(
+            self._create_record_with_logs_and_config(),
+            record_json_mode=mode,
+            record_json_store=store)
+        self.assertEqual(
+            expected,
+            mfg_event_converter.test_record_from_mfg_event(
+                mfg_event, record_json_store=store))
+
+  def test_record_json_modes_shrink_attachment(self):
+    sizes = {}
+    for mode in mfg_event_converter.RecordJsonMode:
+      mfg_event = mfg_event_pb2.MfgEvent()
+      mfg_event_converter._attach_record_as_json(
+          mfg_event, self._create_record_with_logs_and_config(), mode, {})
+      sizes[mode] = len(mfg_event.attachment[0].value_binary)
+
+    self.assertLess(sizes[mfg_event_converter.RecordJsonMode.SLIM],
+                    sizes[mfg_event_converter.RecordJsonMode.FULL])
+    self.assertLess(sizes[mfg_event_converter.RecordJsonMode.REFERENCE],
+                    sizes[mfg_event_converter.RecordJsonMode.SLIM])
+
+  def test_test_record_from_mfg_event_missing_reference(self):
+    mfg_event = mfg_event_converter.mfg_event_from_test_record(
+        self._create_record_with_logs_and_config(),
+        record_json_mode=mfg_event_converter.RecordJsonMode.REFERENCE,
+        record_json_store={})
+
+    with self.assertRaises(ValueError):
+      mfg_event_converter.test_record_from_mfg_event(mfg_event)
+
+  def test_reference_record_json_requires_store(self):
+    with self.assertRaises(ValueError):
+      mfg_event_converter.mfg_event_from_test_record(
+          self._create_record_with_logs_and_config(),
+          record_json_mode=mfg_event_converter.RecordJsonMode.REFERENCE)
+
+  def test_slim_record_json_skips_log_records(self):
+    record = self._create_record_with_logs_and_config()
+    with mock.patch.object(
+        type(record.log_records), 'as_base_types') as as_base_types:
+      mfg_event_converter._attach_record_as_json(
+          mfg_event_pb2.MfgEvent(), record,
+          mfg_event_converter.RecordJsonMode.SLIM)
+    as_base_types.assert_not_called()
+
   def test_convert_object_to_json_with_bytes(self):
     input_object = {'foo': b'bar'}
     output_json = mfg_event_converter._convert_object_to_json(input_object)
@@ -522,6 +600,87 @@ class MultiDimConversionTest(unittest.TestCase):
 
     self.assert_same_mdim(mdim, reversed_mdim)
 
+  def test_packed_reversible(self):
+    mdim = self.create_multi_dim_measurement()
+
+    for compress in (True, False):
+      with self.subTest(compress=compress):
+        attachment = mfg_event_converter.multidim_measurement_to_attachment(
+            name='test_measurement_multidim', measurement=mdim, packed=True,
+            compress=compress)
+
+        self.assertEqual(mfg_event_converter.MULTIDIM_PACKED_MIMETYPE,
+                         attachment.mimetype)
+        self.assertTrue(
+            mfg_event_converter.is_packed_multidim(attachment.data))
+        reversed_mdim = mfg_event_converter.attachment_to_multidim_measurement(
+            attachment)
+
+        self.assertEqual('test_measurement_multidim', reversed_mdim.name)
+        self.assert_same_mdim(mdim, reversed_mdim)
+
+  def test_packed_numeric_columns(self):
+    mdim = measurements.Measurement('trace').with_dimensions('ms')
+    for t in range(1000):
+      mdim.measured_value[t * 10 - 5000] = t / 3.0
+    mdim.outcome = measurements.Outcome.FAIL
+
+    json_attachment = mfg_event_converter.multidim_measurement_to_attachment(
+        name='trace', measurement=mdim)
+    attachment = mfg_event_converter.multidim_measurement_to_attachment(
+        name='trace', measurement=mdim, packed=True)
+    reversed_mdim = mfg_event_converter.attachment_to_multidim_measurement(
+        attachment)
+
+    self.assertLess(attachment.size, json_attachment.size / 4)
+    self.assert_same_mdim(mdim, reversed_mdim)
+    self.assertEqual(mdim.measured_value.value,
+                     reversed_mdim.measured_value.value)
+
+  def test_packed_unset(self):
+    mdim = measurements.Measurement('unset').with_dimensions('V')
+
+    attachment = mfg_event_converter.multidim_measurement_to_attachment(
+        name='unset', measurement=mdim, packed=True)
+    reversed_mdim = mfg_event_converter.attachment_to_multidim_measurement(
+        attachment)
+
+    self.assertFalse(reversed_mdim.measured_value.is_value_set)
+    self.assertEqual(measurements.Outcome.UNSET, reversed_mdim.outcome)
+
+  def test_mfg_event_from_test_record_packed_multidim(self):
+    record = test_record.TestRecord(
+        dut_id='dut_serial',
+        start_time_millis=1,
+        end_time_millis=1,
+        station_id='localhost',
+        outcome=test_record.Outcome.PASS,
+        marginal=False,
+    )
+    mdim = self.create_multi_dim_measurement()
+    record.phases = [
+        test_record.PhaseRecord(
+            name='phase-1',
+            descriptor_id=1,
+            codeinfo=test_record.CodeInfo.uncaptured(),
+            measurements={'test_measurement': mdim},
+            start_time_millis=1,
+            end_time_millis=1,
+        )
+    ]
+
+    mfg_event = mfg_event_converter.mfg_event_from_test_record(
+        record, packed_multidim=True)
+
+    attachments = {a.name: a for a in mfg_event.attachment}
+    multidim = attachments['multidim_test_measurement']
+    self.assertEqual(test_runs_pb2.BINARY, multidim.type)
+    reversed_mdim = mfg_event_converter.attachment_to_multidim_measurement(
+        test_record.Attachment(
+            multidim.value_binary,
+            mfg_event_converter.MULTIDIM_PACKED_MIMETYPE))
+    self.assert_same_mdim(mdim, reversed_mdim)
+
   def test_mfg_event_from_test_record_with_skipped_phase(self):
     """Tests conversion of skipped measurements to MfgEvent SKIPPED status."""
     record = test_record.TestRecord(
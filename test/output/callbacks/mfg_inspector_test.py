@@ -18,6 +18,7 @@ is sane. It might be worth expanding the tests to also check for things we
 actually care for.
 """
 import collections
+from concurrent import futures
 import io
 from typing import Any, Dict, Optional
 from unittest import mock
@@ -26,12 +27,14 @@ import openhtf as htf
 from openhtf import util
 from examples import all_the_things
 from openhtf.output.callbacks import mfg_inspector
+from openhtf.output.proto import mfg_event_converter
 from openhtf.output.proto import test_runs_converter
 from openhtf.util import test
 import requests
 
 from openhtf.output.proto import test_runs_pb2
 from openhtf.output.proto import guzzle_pb2
+from openhtf.output.proto import mfg_event_pb2
 from openhtf.output.proto import test_runs_pb2
 
 MOCK_TEST_RUN_PROTO = test_runs_pb2.TestRun(  # pytype: disable=module-attr  # gen-stub-imports
@@ -111,6 +114,29 @@ class TestMfgInspector(test.TestCase):
 
     self.assertFalse(self.mock_send_mfg_inspector_data.called)
 
+  @test.patch_plugs(user_mock='openhtf.plugs.user_input.UserInput')
+  def test_save_with_process_pool(self, user_mock):
+    user_mock.prompt.return_value = 'SomeWidget'
+    record = yield self._test
+
+    testrun_output = io.BytesIO()
+    with futures.ProcessPoolExecutor(max_workers=1) as executor:
+      callback = mfg_inspector.MfgInspector().set_converter(
+          mfg_event_converter.mfg_event_from_test_record, executor=executor)
+      callback.save_to_disk(filename_pattern=testrun_output)(record)
+
+    # Converting the snapshot in the worker must not mutate the record.
+    self.assertTrue(
+        any(measurement.dimensions
+            for phase in record.phases
+            for measurement in phase.measurements.values()))
+
+    testrun_output.seek(0)
+    mfg_event = mfg_event_pb2.MfgEvent()
+    mfg_event.ParseFromString(testrun_output.read())
+    expected_mfg_event = mfg_event_converter.mfg_event_from_test_record(record)
+    self.assertEqual(expected_mfg_event, mfg_event)
+
   def test_upload_only(self):
     mock_converter = mock.MagicMock(return_value=MOCK_TEST_RUN_PROTO)
     callback = mfg_inspector.MfgInspector(
@@ -0,0 +1,189 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark of the compression of station state updates.
+
+The state updates of a long test are recorded, then replayed through a
+StationPubSub-like PubSub to a websocket client, with and without
+permessage-deflate, and through the deflate of the SockJS fallback transports.
+The unit tests check how much each transport shrinks the updates; run this
+module directly to print the bytes on the wire and CPU time per update.  The CPU
+time is that of the whole process, which includes encoding the updates and the
+websocket client.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import unittest
+
+import openhtf as htf
+from openhtf.output.servers import pub_sub
+from openhtf.output.servers import station_server
+from sockjs.tornado import proto
+import tornado.httpserver
+import tornado.testing
+import tornado.web
+import tornado.websocket
+
+# Phases of the recorded test, each of which is an update.
+PHASES = 60
+MEASUREMENTS_PER_PHASE = 5
+LOGS_PER_PHASE = 10
+
+
+def _record_updates():
+  """Execute a long test, and return the state updates sent to clients."""
+  updates = []
+
+  def make_phase(index):
+
+    @htf.PhaseOptions(name='phase%d' % index)
+    @htf.measures(*[
+        htf.Measurement('phase%d_value%d' % (index, idx)).in_range(0, 100)
+        for idx in range(MEASUREMENTS_PER_PHASE)
+    ])
+    def phase(test):
+      for idx in range(MEASUREMENTS_PER_PHASE):
+        test.measurements['phase%d_value%d' % (index, idx)] = idx * 1.5
+      for idx in range(LOGS_PER_PHASE):
+        test.logger.info('Phase %d step %d done.', index, idx)
+      _, test_state = station_server._get_executing_test()
+      state, _ = station_server.StationWatcher._to_dict_with_event(test_state)
+      updates.append({
+          'state': state,
+          'test_uid': state['execution_uid'],
+          'type': 'update',
+      })
+
+    return phase
+
+  test = htf.Test(*[make_phase(index) for index in range(PHASES)])
+  test.execute(test_start=lambda: 'dut')
+  return updates
+
+
+class _BenchmarkPubSub(pub_sub.PubSub):
+  _lock = threading.Lock()
+  subscribers = set()
+
+
+def _make_app():
+  router = pub_sub.SockJSRouter(_BenchmarkPubSub, '/sub/benchmark')
+  return tornado.web.Application(router.urls)
+
+
+def _message_bytes(updates):
+  return sum(len(proto.json_encode(update)) for update in updates)
+
+
+async def _replay_websocket(port, updates, compression_options):
+  """Replay the updates to a websocket client.
+
+  Returns:
+    Tuple of the bytes received on the wire, the CPU time taken and the number
+    of SockJS message frames received.
+  """
+  client = await tornado.websocket.websocket_connect(
+      'ws://127.0.0.1:%d/sub/benchmark/0/%s/websocket' %
+      (port, id(compression_options)),
+      compression_options=compression_options)
+  await client.read_message()  # The SockJS open frame.
+  frames = 0
+  start_time = time.process_time()
+  for update in updates:
+    _BenchmarkPubSub.publish(update)
+    if (await client.read_message()).startswith('a['):
+      frames += 1
+  cpu_s = time.process_time() - start_time
+  wire_bytes = client.protocol._wire_bytes_in  # pylint: disable=protected-access
+  client.close()
+  return wire_bytes, cpu_s, frames
+
+
+def _fallback_deflate(updates):
+  """Return the bytes and CPU time of deflating the updates for fallbacks."""
+  wire_bytes = 0
+  start_time = time.process_time()
+  for update in updates:
+    # The SockJS frame of the message, without the HTTP chunk framing.
+    wire_bytes += len('a[%s]' % pub_sub.deflate_message(
+        proto.json_encode(update)))
+  return wire_bytes, time.process_time() - start_time
+
+
+async def _measure(updates):
+  """Return the name, wire bytes and CPU time of replaying each transport."""
+  sock, port = tornado.testing.bind_unused_port()
+  server = tornado.httpserver.HTTPServer(_make_app())
+  server.add_sockets([sock])
+  try:
+    results = []
+    for name, compression_options in (('websocket', None),
+                                      ('permessage-deflate', {})):
+      wire_bytes, cpu_s, _ = await _replay_websocket(port, updates,
+                                                     compression_options)
+      results.append((name, wire_bytes, cpu_s))
+  finally:
+    server.stop()
+  results.append(('fallback deflate',) + _fallback_deflate(updates))
+  return results
+
+
+def run_benchmarks(output=sys.stdout):
+  """Replay the recorded updates and print the cost of each transport."""
+  updates = _record_updates()
+  output.write(
+      'Station update compression (%d updates, %.1f KB each on average):\n' %
+      (len(updates), _message_bytes(updates) / len(updates) / 1e3))
+  for name, wire_bytes, cpu_s in asyncio.run(_measure(updates)):
+    output.write('  %-22s %9.1f KB/update %6.2f ms CPU/update\n' %
+                 (name, wire_bytes / len(updates) / 1e3,
+                  cpu_s / len(updates) * 1e3))
+
+
+class CompressionBenchmarkTest(tornado.testing.AsyncHTTPTestCase):
+
+  updates = None
+
+  @classmethod
+  def setUpClass(cls):
+    super(CompressionBenchmarkTest, cls).setUpClass()
+    cls.updates = _record_updates()
+    cls.message_bytes = _message_bytes(cls.updates)
+
+  def get_app(self):
+    return _make_app()
+
+  async def _check_websocket(self, compression_options, max_fraction):
+    wire_bytes, _, frames = await _replay_websocket(
+        self.get_http_port(), self.updates, compression_options)
+    self.assertEqual(len(self.updates), frames)
+    self.assertLess(wire_bytes, max_fraction * self.message_bytes)
+
+  @tornado.testing.gen_test(timeout=60)
+  async def test_websocket(self):
+    await self._check_websocket(None, 1.1)
+
+  @tornado.testing.gen_test(timeout=60)
+  async def test_websocket_permessage_deflate(self):
+    await self._check_websocket({}, .1)
+
+  def test_fallback_deflate(self):
+    wire_bytes, _ = _fallback_deflate(self.updates)
+    self.assertLess(wire_bytes, .3 * self.message_bytes)
+
+
+if __name__ == '__main__':
+  run_benchmarks()
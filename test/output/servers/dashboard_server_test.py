@@ -0,0 +1,219 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the dashboard server station list publishing."""
+
+import json
+import unittest
+from unittest import mock
+
+from openhtf.output.servers import dashboard_server
+from openhtf.output.servers import pub_sub
+from openhtf.output.servers import station_server
+
+
+def _station(port, status='ONLINE', test_name='test'):
+  return dashboard_server.StationInfo('cell', 'host', port, 'station', status,
+                                      None, test_name)
+
+
+class DashboardPubSubTest(unittest.TestCase):
+
+  def setUp(self):
+    super(DashboardPubSubTest, self).setUp()
+    for attr, value in (('sequence', 0), ('station_map', {}),
+                        ('_published_stations', {}),
+                        ('_dirty_host_ports', set()),
+                        ('_unreachable_since', {})):
+      patcher = mock.patch.object(dashboard_server.DashboardPubSub, attr, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    patcher = mock.patch.object(pub_sub.PubSub, 'publish')
+    self.publish = patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def _update(self, *stations):
+    for station in stations:
+      dashboard_server.DashboardPubSub.update_station(station)
+    dashboard_server.DashboardPubSub.publish_if_new()
+
+  def _published(self, deltas=True):
+    """Returns the messages published to subscribers with or without deltas."""
+    client = mock.Mock(deltas=deltas)
+    return [
+        call[0][0] for call in self.publish.call_args_list
+        if call[1]['client_filter'](client)
+    ]
+
+  def _last_message(self):
+    return self._published()[-1]
+
+  def _subscribe(self, deltas):
+    # Skip the SockJS connection setup, only send() is needed.
+    subscriber = object.__new__(dashboard_server.DashboardPubSub)
+    subscriber.send = mock.Mock()
+    subscriber.on_subscribe(
+        mock.Mock(**{'get_argument.return_value': '1' if deltas else None}))
+    return subscriber.send.call_args[0][0]
+
+  def test_publishes_deltas(self):
+    self._update(_station(1), _station(2))
+    message = self._last_message()
+    self.assertEqual(('delta', 1), (message['type'], message['sequence']))
+    self.assertEqual(['host:1', 'host:2'], sorted(message['added']))
+    self.assertEqual('ONLINE', message['added']['host:1']['status'])
+    self.assertEqual(({}, []), (message['changed'], message['removed']))
+
+    # Nothing is published when nothing changed.
+    self._update(_station(1), _station(2))
+    self.assertEqual(1, len(self._published()))
+
+    self._update(_station(1, test_name='other'),
+                 _station(2, status='UNREACHABLE'))
+    message = self._last_message()
+    self.assertEqual(2, message['sequence'])
+    self.assertEqual({}, message['added'])
+    self.assertEqual(['host:1', 'host:2'], sorted(message['changed']))
+    self.assertEqual('other', message['changed']['host:1']['test_name'])
+    self.assertEqual('UNREACHABLE', message['changed']['host:2']['status'])
+
+    self._update(_station(2, status='UNREACHABLE'))
+    self.assertEqual(2, len(self._published()))
+
+    dashboard_server.DashboardPubSub.remove_stations(['host:2', 'host:3'])
+    dashboard_server.DashboardPubSub.publish_if_new()
+    message = self._last_message()
+    self.assertEqual(3, message['sequence'])
+    self.assertEqual(({}, {}, ['host:2']),
+                     (message['added'], message['changed'], message['removed']))
+
+  def test_publishes_station_map_without_deltas(self):
+    self._update(_station(1), _station(2))
+    self._update(_station(2, status='UNREACHABLE'))
+    messages = self._published(deltas=False)
+    self.assertEqual(2, len(messages))
+    self.assertEqual(['host:1', 'host:2'], sorted(messages[-1]))
+    self.assertEqual('UNREACHABLE', messages[-1]['host:2']['status'])
+    self.assertEqual(messages[-1], self._subscribe(deltas=False))
+
+  def test_on_subscribe_sends_snapshot(self):
+    self._update(_station(1), _station(2))
+    self._update(_station(2, status='UNREACHABLE'))
+    message = self._subscribe(deltas=True)
+    self.assertEqual(('snapshot', 2), (message['type'], message['sequence']))
+    self.assertEqual(['host:1', 'host:2'], sorted(message['stations']))
+    self.assertEqual('UNREACHABLE', message['stations']['host:2']['status'])
+
+  def test_removes_unreachable_stations(self):
+    self._update(_station(1), _station(2))
+    self._update(_station(2, status='UNREACHABLE'))
+    dashboard_server.DashboardPubSub.remove_unreachable_stations(ttl_s=60)
+    self.assertEqual(['host:1', 'host:2'],
+                     sorted(dashboard_server.DashboardPubSub.station_map))
+    dashboard_server.DashboardPubSub.remove_unreachable_stations(ttl_s=0)
+    dashboard_server.DashboardPubSub.publish_if_new()
+    self.assertEqual(['host:2'], self._last_message()['removed'])
+    # Stations are only removed once.
+    self._update(_station(1))
+    self.assertEqual(['host:1'],
+                     sorted(dashboard_server.DashboardPubSub.station_map))
+
+
+class StationDiscoveryTest(unittest.TestCase):
+
+  def setUp(self):
+    super(StationDiscoveryTest, self).setUp()
+    self.updates = []
+    self.discovery = dashboard_server.StationDiscovery(self.updates.append)
+
+  def _announce(self, online=True, heartbeat_interval_s=1.0):
+    announcer = station_server.StationAnnouncer(8888)
+    announcer.heartbeat_interval_s = heartbeat_interval_s
+    with mock.patch.object(announcer, '_sender') as sender, \
+        mock.patch.object(station_server, '_get_executing_test',
+                          return_value=(None, None)):
+      announcer._announce(station_server._station_info(8888), online)
+    self.discovery._handle_message(sender.send.call_args[0][0], 'host')
+
+  def test_announcements(self):
+    self._announce()
+    self.assertEqual([('host', 8888, 'ONLINE')],
+                     [(s.host, s.port, s.status) for s in self.updates])
+    # Announced stations expire after a few missed heartbeats.
+    self.assertGreater(self.discovery.expire(0), 0)
+    self.assertIsNone(self.discovery.expire(float('inf')))
+    self.assertEqual('UNREACHABLE', self.updates[-1].status)
+
+    self._announce()
+    self._announce(online=False)
+    self.assertEqual(['ONLINE', 'UNREACHABLE'],
+                     [s.status for s in self.updates[-2:]])
+    # Stations going offline are not tracked anymore.
+    self.assertIsNone(self.discovery.expire(0))
+    self.assertEqual(4, len(self.updates))
+
+  def test_ignores_other_messages(self):
+    self.discovery._handle_message(station_server.MULTICAST_QUERY, 'host')
+    self.discovery._handle_message(
+        station_server.MULTICAST_ANNOUNCEMENT + json.dumps({'port': 1}), 'host')
+    self.assertEqual([], self.updates)
+
+  def test_queried_stations_expire(self):
+    with mock.patch.object(
+        dashboard_server, '_discover', return_value=[_station(1)]):
+      self.discovery._query()
+    # Until a few queries went unanswered.
+    self.assertIsNotNone(
+        self.discovery.expire(dashboard_server.time.monotonic()))
+    self.assertIsNone(
+        self.discovery.expire(dashboard_server.time.monotonic() + 1e6))
+    self.assertEqual(['ONLINE', 'UNREACHABLE'],
+                     [s.status for s in self.updates])
+
+  def test_stations_queried_once_never_expire(self):
+    discovery = dashboard_server.StationDiscovery(
+        self.updates.append, query_interval_s=0)
+    with mock.patch.object(
+        dashboard_server, '_discover', return_value=[_station(1)]):
+      discovery._query()
+    self.assertEqual(float('inf'),
+                     discovery.expire(dashboard_server.time.monotonic() + 1e6))
+    self.assertEqual(['ONLINE'], [s.status for s in self.updates])
+
+  def test_query_keeps_heartbeat_expiration(self):
+    self._announce(heartbeat_interval_s=1.0)
+    with mock.patch.object(
+        dashboard_server, '_discover',
+        return_value=[_station(8888, test_name=None)]):
+      self.discovery._query()
+    self.assertEqual(['ONLINE', 'ONLINE'], [s.status for s in self.updates])
+    # The station stops responding: it expires after a few missed heartbeats,
+    # not a few missed queries.
+    self.assertIsNone(
+        self.discovery.expire(dashboard_server.time.monotonic() +
+                              dashboard_server.MISSED_HEARTBEATS + 1))
+    self.assertEqual('UNREACHABLE', self.updates[-1].status)
+
+  def test_expires_in_order(self):
+    self.discovery.update(_station(1), 10)
+    self.discovery.update(_station(2), 20)
+    self.discovery.update(_station(3, status='UNREACHABLE'), 0)
+    now = dashboard_server.time.monotonic()
+    next_expiration = self.discovery.expire(now + 15)
+    self.assertGreater(next_expiration, now + 15)
+    self.assertEqual([('host', 1, 'UNREACHABLE')],
+                     [(s.host, s.port, s.status) for s in self.updates[3:]])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,185 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the station server history index."""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from openhtf.core import measurements
+from openhtf.core import test_record
+from openhtf.output.proto import mfg_event_converter
+from openhtf.output.servers import history_index
+
+
+def _create_record(dut_id, start_time_millis, outcome=test_record.Outcome.PASS,
+                   phase_name='phase'):
+  record = test_record.TestRecord(
+      dut_id=dut_id,
+      station_id='station',
+      start_time_millis=start_time_millis,
+      end_time_millis=start_time_millis + 10,
+      outcome=outcome)
+  phase = test_record.PhaseRecord(
+      name=phase_name,
+      descriptor_id=1,
+      codeinfo=test_record.CodeInfo.uncaptured(),
+      start_time_millis=start_time_millis,
+      end_time_millis=start_time_millis + 10,
+  )
+  measurement = measurements.Measurement('%s_measurement' % phase_name)
+  measurement.measured_value.set(1)
+  measurement.outcome = measurements.Outcome.PASS
+  phase.measurements = {measurement.name: measurement}
+  phase.attachments = {
+      'log.txt': test_record.Attachment(b'log data', 'text/plain'),
+  }
+  record.add_phase_record(phase)
+  return record
+
+
+class HistoryIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    super(HistoryIndexTest, self).setUp()
+    self.history_path = tempfile.mkdtemp()
+    self.index = history_index.HistoryIndex(self.history_path)
+
+  def tearDown(self):
+    self.index.close()
+    shutil.rmtree(self.history_path)
+    super(HistoryIndexTest, self).tearDown()
+
+  def _save(self, record):
+    file_name = 'mfg_event_%s_%d.pb' % (record.dut_id,
+                                         record.start_time_millis)
+    mfg_event = mfg_event_converter.mfg_event_from_test_record(record)
+    with open(os.path.join(self.history_path, file_name), 'wb') as f:
+      f.write(mfg_event.SerializeToString())
+    return file_name
+
+  def _file_names(self, **kwargs):
+    return [item['file_name'] for item in self.index.query(**kwargs)]
+
+  def test_callback_indexes_record(self):
+    record = _create_record('dut', 100, outcome=test_record.Outcome.FAIL)
+    self.index(record)
+    self.assertEqual([{
+        'file_name': 'mfg_event_dut_100.pb',
+        'dut_id': 'dut',
+        'station_id': 'station',
+        'start_time_millis': 100,
+        'end_time_millis': 110,
+        'outcome': 'FAIL',
+    }], self.index.query())
+
+  def test_sync_indexes_and_removes_files(self):
+    first = self._save(_create_record('dut1', 100))
+    second = self._save(_create_record('dut2', 200))
+    with open(os.path.join(self.history_path, 'mfg_event_dut3_300.pb'),
+              'wb') as f:
+      f.write(b'not a proto')
+
+    self.index.sync()
+    self.assertEqual(['mfg_event_dut3_300.pb', second, first],
+                     self._file_names())
+    self.assertEqual('PASS', self.index.query(dut_ids=['dut1'])[0]['outcome'])
+    self.assertIsNone(self.index.query(dut_ids=['dut3'])[0]['outcome'])
+
+    os.remove(os.path.join(self.history_path, first))
+    self.index.sync()
+    self.assertEqual(['mfg_event_dut3_300.pb', second], self._file_names())
+
+  def test_sync_if_changed(self):
+    self.assertFalse(self.index.synced)
+    first = self._save(_create_record('dut1', 100))
+    self.index.sync_if_changed()
+    self.assertTrue(self.index.synced)
+    self.assertEqual([first], self._file_names())
+
+    # Folders modified very recently are synced regardless of their mtime.
+    os.utime(self.history_path, (0, 0))
+    self.index.sync()
+    with mock.patch.object(self.index, '_sync') as sync:
+      self.index.sync_if_changed()
+    sync.assert_not_called()
+
+    second = self._save(_create_record('dut2', 200))
+    self.index.sync_if_changed()
+    self.assertEqual([second, first], self._file_names())
+
+  def test_index_persists(self):
+    file_name = self._save(_create_record('dut', 100))
+    self.index.sync()
+    self.index.close()
+    self.index = history_index.HistoryIndex(self.history_path)
+    self.assertEqual([file_name], self._file_names())
+
+  def test_query_filters(self):
+    for idx, dut_id in enumerate(('dut1', 'dut2', 'dut1', 'dut2')):
+      self.index(
+          _create_record(
+              dut_id, (idx + 1) * 100,
+              outcome=(test_record.Outcome.PASS
+                       if idx % 2 else test_record.Outcome.FAIL),
+              phase_name='phase%d' % idx))
+
+    self.assertEqual(['mfg_event_dut1_300.pb', 'mfg_event_dut1_100.pb'],
+                     self._file_names(dut_ids=['dut1']))
+    self.assertEqual(['mfg_event_dut2_200.pb'],
+                     self._file_names(start_times_millis=[200]))
+    self.assertEqual(['mfg_event_dut1_300.pb', 'mfg_event_dut2_200.pb'],
+                     self._file_names(
+                         min_start_time_millis=200, max_start_time_millis=300))
+    self.assertEqual(['mfg_event_dut2_400.pb', 'mfg_event_dut2_200.pb'],
+                     self._file_names(outcomes=['PASS']))
+    self.assertEqual(['mfg_event_dut1_300.pb'],
+                     self._file_names(phase_names=['phase2']))
+    self.assertEqual(['mfg_event_dut2_200.pb'],
+                     self._file_names(measurement_names=['phase1_measurement']))
+    self.assertEqual(['mfg_event_dut1_300.pb', 'mfg_event_dut2_200.pb'],
+                     self._file_names(limit=2, offset=1))
+
+  def test_get_record(self):
+    file_name = self._save(_create_record('dut', 100))
+    record = self.index.get_record(file_name)
+    self.assertEqual('dut', record['dut_id'])
+    self.assertEqual(['phase'], [phase['name'] for phase in record['phases']])
+    # Decoded records are cached until the file changes.
+    self.assertIs(record, self.index.get_record(file_name))
+
+    with self.assertRaises(history_index.HistoryItemNotFoundError):
+      self.index.get_record('mfg_event_unknown_1.pb')
+    with self.assertRaises(history_index.HistoryItemNotFoundError):
+      self.index.get_record(os.path.join('..', file_name))
+
+  def test_get_attachment(self):
+    file_name = self._save(_create_record('dut', 100))
+    self.assertEqual(b'log data',
+                     self.index.get_attachment(file_name,
+                                               'log.txt').value_binary)
+    self.assertEqual(
+        b'log data',
+        self.index.get_attachment(
+            file_name, 'renamed.txt',
+            hashlib.sha1(b'log data').hexdigest()).value_binary)
+    with self.assertRaises(history_index.HistoryItemNotFoundError):
+      self.index.get_attachment(file_name, 'renamed.txt')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,241 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the SockJS pub/sub fan-out."""
+
+import base64
+import json
+import threading
+import unittest
+from unittest import mock
+import zlib
+
+from openhtf.output.servers import pub_sub
+from sockjs.tornado.transports import websocket
+import tornado.ioloop
+import tornado.testing
+import tornado.web
+
+
+class _TestPubSub(pub_sub.PubSub):
+  _lock = threading.Lock()
+  subscribers = set()
+  max_outbox_messages = 3
+
+  def on_subscribe(self, info):
+    self.subscribed = True
+
+  def on_messages_dropped(self):
+    self.send('resync')
+
+
+class _FakeSession(object):
+  """Fake SockJS session recording the messages sent."""
+
+  def __init__(self):
+    self.is_closed = False
+    self.handler = None
+    self.send_queue = ''
+    self.send_expects_json = True
+    self.sent = []
+
+  def send_jsonified(self, message, stats=True):
+    del stats  # Unused.
+    self.sent.append(message)
+
+  def send_message(self, message, stats=True, binary=False):
+    del stats, binary  # Unused.
+    self.sent.append(('direct', message))
+
+
+class _FakeIOLoop(object):
+  """Fake IOLoop running callbacks when run() is called."""
+
+  def __init__(self):
+    self.callbacks = []
+
+  def add_callback(self, callback):
+    self.callbacks.append(callback)
+
+  def call_later(self, unused_delay, callback):
+    self.callbacks.append(callback)
+
+  def run(self):
+    callbacks, self.callbacks = self.callbacks, []
+    for callback in callbacks:
+      callback()
+
+
+class PubSubTest(unittest.TestCase):
+
+  def setUp(self):
+    super(PubSubTest, self).setUp()
+    self.addCleanup(_TestPubSub.subscribers.clear)
+    self.io_loop = _FakeIOLoop()
+    patcher = mock.patch.object(
+        tornado.ioloop.IOLoop, 'current', return_value=self.io_loop)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def _subscribe(self, ip='1.2.3.4', compression=None, handler=None):
+    session = _FakeSession()
+    session.handler = handler
+    client = _TestPubSub(session)
+    client.on_open(
+        mock.Mock(ip=ip, get_argument={'compression': compression}.get))
+    return client
+
+  def test_publish_encodes_once_and_sends_from_io_loop(self):
+    clients = [self._subscribe(), self._subscribe()]
+    self.assertTrue(clients[0].subscribed)
+    with mock.patch.object(
+        pub_sub.proto, 'json_encode', return_value='"encoded"') as json_encode:
+      _TestPubSub.publish({'a': 1})
+      _TestPubSub.publish({'a': 2}, client_filter=lambda c: c is clients[0])
+    self.assertEqual(2, json_encode.call_count)
+    self.assertEqual([[], []], [client.session.sent for client in clients])
+
+    self.io_loop.run()
+    self.assertEqual(['"encoded"', '"encoded"'], clients[0].session.sent)
+    self.assertEqual(['"encoded"'], clients[1].session.sent)
+
+  def test_slow_client_coalesces_messages(self):
+    client = self._subscribe()
+    client.session.send_queue = 'unsent'
+    for idx in range(10):
+      _TestPubSub.publish({'state': idx}, coalesce_key='state')
+    _TestPubSub.publish('other')
+    # The transport is still busy, so nothing is sent.
+    self.io_loop.run()
+    self.assertEqual([], client.session.sent)
+
+    client.session.send_queue = ''
+    self.io_loop.run()
+    self.assertEqual(['{"state":9}', '"other"'], client.session.sent)
+    self.assertEqual([{
+        'remote_ip': '1.2.3.4',
+        'deflate': False,
+        'queued': 0,
+        'sent': 2,
+        'coalesced': 9,
+        'dropped': 0,
+    }], _TestPubSub.client_stats())
+
+  def test_slow_client_skips_ahead_when_outbox_overflows(self):
+    client = self._subscribe()
+    client.session.send_queue = 'unsent'
+    for idx in range(5):
+      _TestPubSub.publish(idx)
+    client.session.send_queue = ''
+    self.io_loop.run()
+    # The first 4 messages overflowed the outbox of 3.
+    self.assertEqual([('direct', 'resync'), '4'], client.session.sent)
+    self.assertEqual(4, client.messages_dropped)
+
+  def test_closed_client(self):
+    client = self._subscribe()
+    _TestPubSub.publish('message')
+    client.session.is_closed = True
+    client.on_close()
+    self.io_loop.run()
+    self.assertEqual([], client.session.sent)
+    self.assertEqual([], _TestPubSub.client_stats())
+
+  def test_deflate(self):
+    plain, deflated, deflated_too = (
+        self._subscribe(), self._subscribe(compression='deflate'),
+        self._subscribe(compression='deflate'))
+    # Websockets are compressed with permessage-deflate instead.
+    websocket_client = self._subscribe(
+        compression='deflate',
+        handler=mock.Mock(spec=websocket.WebSocketTransport))
+    self.assertEqual([False, True, True, False], [
+        client.deflate
+        for client in (plain, deflated, deflated_too, websocket_client)
+    ])
+
+    message = {'data': 'x' * pub_sub.DEFLATE_MIN_BYTES}
+    with mock.patch.object(
+        pub_sub, 'deflate_message', wraps=pub_sub.deflate_message) as deflate:
+      _TestPubSub.publish(message)
+      _TestPubSub.publish('small')
+      self.io_loop.run()
+    # Each message is only compressed once.
+    self.assertEqual(2, deflate.call_count)
+
+    self.assertEqual([json.dumps(message, separators=(',', ':')), '"small"'],
+                     plain.session.sent)
+    self.assertEqual(plain.session.sent, websocket_client.session.sent)
+    self.assertEqual(deflated.session.sent, deflated_too.session.sent)
+    wrapper = json.loads(deflated.session.sent[0])
+    self.assertEqual('deflate', wrapper['encoding'])
+    self.assertEqual(
+        message,
+        json.loads(zlib.decompress(base64.b64decode(wrapper['data']))))
+    self.assertEqual('"small"', deflated.session.sent[1])
+
+    # Messages sent directly are compressed too.
+    deflated.send(message)
+    self.assertEqual(deflated.session.sent[0], deflated.session.sent[2])
+
+
+class SockJSRouterTest(unittest.TestCase):
+
+  def test_router_compresses_websockets(self):
+    router = pub_sub.SockJSRouter(_TestPubSub, '/sub/test')
+    handlers = [handler for _, handler, _ in router.urls]
+    self.assertIn(pub_sub.CompressedWebSocketTransport, handlers)
+    self.assertNotIn(websocket.WebSocketTransport, handlers)
+    self.assertEqual({'compression_level': pub_sub.COMPRESSION_LEVEL},
+                     pub_sub.CompressedWebSocketTransport.get_compression_options(
+                         mock.Mock()))
+
+
+
+class ClientStatsHandlerTest(tornado.testing.AsyncHTTPTestCase):
+
+  def get_app(self):
+    return tornado.web.Application([
+        ('/subscribers', pub_sub.ClientStatsHandler, {
+            'pub_subs': {
+                'test': _TestPubSub
+            }
+        }),
+    ])
+
+  def test_get(self):
+    client = mock.Mock(
+        remote_ip='1.2.3.4',
+        deflate=True,
+        _outbox={'key': 'message'},
+        messages_sent=5,
+        messages_coalesced=2,
+        messages_dropped=1)
+    _TestPubSub.subscribers.add(client)
+    self.addCleanup(_TestPubSub.subscribers.clear)
+    response = self.fetch('/subscribers')
+    self.assertEqual(200, response.code)
+    self.assertEqual({
+        'test': [{
+            'remote_ip': '1.2.3.4',
+            'deflate': True,
+            'queued': 1,
+            'sent': 5,
+            'coalesced': 2,
+            'dropped': 1,
+        }]
+    }, json.loads(response.body))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,213 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the station server REST endpoints."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import openhtf
+from openhtf.core import test_record
+from openhtf.output.servers import history_index
+from openhtf.output.servers import station_server
+import tornado.testing
+import tornado.web
+
+
+def first_phase():
+  pass
+
+
+def second_phase():
+  pass
+
+
+class StationServerHandlersTest(tornado.testing.AsyncHTTPTestCase):
+
+  def setUp(self):
+    super(StationServerHandlersTest, self).setUp()
+    self.test = openhtf.Test(first_phase, second_phase)
+    self.phase_record = test_record.PhaseRecord(
+        descriptor_id=1,
+        name='first_phase',
+        codeinfo=test_record.CodeInfo.uncaptured())
+    self.data = os.urandom(200 * 1024)
+    self.phase_record.attachments['file'] = test_record.Attachment(
+        self.data, 'application/octet-stream')
+    self.test_state = mock.Mock(running_phase_state=None)
+    self.test_state.test_record.phases = [self.phase_record]
+    patcher = mock.patch.object(
+        station_server,
+        '_get_executing_test',
+        return_value=(self.test, self.test_state))
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    patcher = mock.patch.object(
+        type(self.test), 'uid', new_callable=mock.PropertyMock,
+        return_value='uid')
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    station_server.BaseTestHandler._test_caches.clear()
+
+  def get_app(self):
+    return tornado.web.Application([
+        (r'/tests/(?P<test_uid>[\w\d:]+)/phases',
+         station_server.PhasesHandler),
+        (r'/tests/(?P<test_uid>[\w\d:]+)/phases/(?P<phase_descriptor_id>\d+)/'
+         'attachments/(?P<attachment_name>.+)',
+         station_server.AttachmentsHandler),
+    ])
+
+  def test_phases_etag(self):
+    with mock.patch.object(
+        station_server, '_TestCache',
+        wraps=station_server._TestCache) as test_cache:
+      response = self.fetch('/tests/uid/phases')
+      self.assertEqual(200, response.code)
+      self.assertEqual(['first_phase', 'second_phase'], [
+          phase['name'] for phase in json.loads(response.body)['data']
+      ])
+      etag = response.headers['Etag']
+
+      response = self.fetch('/tests/uid/phases',
+                            headers={'If-None-Match': etag})
+      self.assertEqual(304, response.code)
+      response = self.fetch('/tests/uid/phases')
+      self.assertEqual(200, response.code)
+      self.assertEqual(etag, response.headers['Etag'])
+    # The phases were only converted once.
+    test_cache.assert_called_once_with(self.test)
+
+    self.assertEqual(404, self.fetch('/tests/other/phases').code)
+
+  def test_attachment(self):
+    response = self.fetch('/tests/uid/phases/1/attachments/file')
+    self.assertEqual(200, response.code)
+    self.assertEqual(self.data, response.body)
+    self.assertEqual(str(len(self.data)), response.headers['Content-Length'])
+    self.assertEqual('bytes', response.headers['Accept-Ranges'])
+
+    response = self.fetch(
+        '/tests/uid/phases/1/attachments/file',
+        headers={'If-None-Match': response.headers['Etag']})
+    self.assertEqual(304, response.code)
+
+    self.assertEqual(
+        404, self.fetch('/tests/uid/phases/2/attachments/file').code)
+    self.assertEqual(
+        404, self.fetch('/tests/uid/phases/1/attachments/other').code)
+
+  def test_attachment_range(self):
+    url = '/tests/uid/phases/1/attachments/file'
+    response = self.fetch(url, headers={'Range': 'bytes=100-199'})
+    self.assertEqual(206, response.code)
+    self.assertEqual(self.data[100:200], response.body)
+    self.assertEqual('bytes 100-199/%d' % len(self.data),
+                     response.headers['Content-Range'])
+
+    response = self.fetch(url, headers={'Range': 'bytes=-10'})
+    self.assertEqual(206, response.code)
+    self.assertEqual(self.data[-10:], response.body)
+
+    response = self.fetch(url, headers={'Range': 'bytes=0-'})
+    self.assertEqual(200, response.code)
+    self.assertEqual(self.data, response.body)
+
+    response = self.fetch(
+        url, headers={'Range': 'bytes=%d-' % len(self.data)})
+    self.assertEqual(416, response.code)
+    self.assertEqual('bytes */%d' % len(self.data),
+                     response.headers['Content-Range'])
+
+  def test_parse_byte_range(self):
+    for range_header, expected in (
+        (None, (0, 100)),
+        ('bytes=10-19', (10, 20)),
+        ('bytes=10-1000', (10, 100)),
+        ('bytes=10-', (10, 100)),
+        ('bytes=-10', (90, 100)),
+        ('bytes=-1000', (0, 100)),
+        ('bytes=100-', None),
+        ('bytes=-0', None),
+        # Invalid or multiple ranges are ignored.
+        ('bytes=20-10', (0, 100)),
+        ('bytes=-', (0, 100)),
+        ('bytes=0-9,20-29', (0, 100)),
+        ('lines=1-2', (0, 100)),
+    ):
+      with self.subTest(range_header=range_header):
+        self.assertEqual(expected,
+                         station_server._parse_byte_range(range_header, 100))
+
+  def test_attachment_of_running_phase(self):
+    running_phase_record = test_record.PhaseRecord(
+        descriptor_id=2,
+        name='second_phase',
+        codeinfo=test_record.CodeInfo.uncaptured())
+    running_phase_record.attachments['file'] = test_record.Attachment(
+        b'running', 'text/plain')
+    self.assertEqual(
+        404, self.fetch('/tests/uid/phases/2/attachments/file').code)
+    self.test_state.running_phase_state = mock.Mock(
+        phase_record=running_phase_record)
+    response = self.fetch('/tests/uid/phases/2/attachments/file')
+    self.assertEqual(b'running', response.body)
+    self.assertEqual('text/plain', response.headers['Content-Type'])
+
+
+class HistoryListHandlerTest(tornado.testing.AsyncHTTPTestCase):
+
+  def setUp(self):
+    self.history_path = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.history_path)
+    self.index = history_index.HistoryIndex(self.history_path)
+    self.addCleanup(self.index.close)
+    super(HistoryListHandlerTest, self).setUp()
+
+  def get_app(self):
+    return tornado.web.Application([
+        (r'/history', station_server.HistoryListHandler, {
+            'history_path': self.history_path,
+            'history_index': self.index,
+        }),
+    ])
+
+  def _add_file(self, file_name):
+    with open(os.path.join(self.history_path, file_name), 'wb'):
+      pass
+
+  def _list(self):
+    response = self.fetch('/history')
+    self.assertEqual(200, response.code)
+    return sorted(
+        item['file_name'] for item in json.loads(response.body)['data'])
+
+  def test_lists_folder_until_synced(self):
+    self._add_file('mfg_event_dut1_100.pb')
+    self.assertEqual(['mfg_event_dut1_100.pb'], self._list())
+    self.assertFalse(self.index.synced)
+
+  def test_indexes_new_files(self):
+    self._add_file('mfg_event_dut1_100.pb')
+    self.index.sync()
+    self._add_file('mfg_event_dut2_200.pb')
+    self.assertEqual(['mfg_event_dut1_100.pb', 'mfg_event_dut2_200.pb'],
+                     self._list())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,116 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the serial collection plug, using a pty as the serial port."""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from openhtf.core import test_state
+from openhtf.plugs.generic import serial_collection
+
+_LOG = logging.getLogger(__name__)
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), 'Requires pseudo-terminals.')
+class SerialCollectionPlugTest(unittest.TestCase):
+
+  def setUp(self):
+    super(SerialCollectionPlugTest, self).setUp()
+    self.directory = tempfile.mkdtemp()
+    self.dest = os.path.join(self.directory, 'serial.log')
+    self.master, self.slave = os.openpty()
+    self.plug = serial_collection.SerialCollectionPlug(
+        serial_collection_port=os.ttyname(self.slave),
+        serial_collection_baud=115200)
+
+  def tearDown(self):
+    if self.plug.is_collecting:
+      self.plug.stop_collection()
+    os.close(self.master)
+    os.close(self.slave)
+    shutil.rmtree(self.directory)
+    super(SerialCollectionPlugTest, self).tearDown()
+
+  def _write(self, data):
+    view = memoryview(data)
+    while view:
+      view = view[os.write(self.master, view):]
+
+  def _wait_for_bytes(self, count, timeout_s=10):
+    deadline = time.monotonic() + timeout_s
+    while self.plug.bytes_collected < count:
+      self.assertLess(time.monotonic(), deadline, 'Serial data not collected.')
+      time.sleep(0.001)
+
+  def _read_dest(self):
+    with open(self.dest, 'rb') as f:
+      return f.read()
+
+  def test_collects_raw_bytes_with_timestamps(self):
+    timestamps_dest = os.path.join(self.directory, 'timestamps.csv')
+    chunks = [b'boot\r\n\xe2\x82', b'\xac invalid \xff\n']
+    self.plug.start_collection(self.dest, timestamps_dest=timestamps_dest)
+    start_time = time.time()
+    for idx, chunk in enumerate(chunks):
+      self._write(chunk)
+      self._wait_for_bytes(sum(len(c) for c in chunks[:idx + 1]))
+    self.plug.stop_collection()
+
+    self.assertEqual(b''.join(chunks), self._read_dest())
+    with open(timestamps_dest) as f:
+      timestamps = [line.split(',') for line in f.read().splitlines()]
+    self.assertEqual('0', timestamps[0][0])
+    self.assertIn([str(len(chunks[0]))], [[ts[0]] for ts in timestamps])
+    for _, timestamp in timestamps:
+      self.assertGreaterEqual(float(timestamp), start_time - 1)
+
+  def test_attach_capture(self):
+    data = b'some data\n' * 100
+    self.plug.start_collection(self.dest)
+    self._write(data)
+    self._wait_for_bytes(len(data))
+    test_api = mock.Mock()
+    self.plug.attach_capture(test_api, name='serial.txt')
+    self.assertFalse(self.plug.is_collecting)
+    test_api.attach_from_file.assert_called_once_with(
+        self.dest,
+        name='serial.txt',
+        mimetype=test_state.INFER_MIMETYPE,
+        sha1=hashlib.sha1(data).hexdigest())
+
+  def test_throughput(self):
+    # Bytes covering every value, in lines, as console output would be.
+    data = bytes(range(256)) * 4 * 1024 * 16
+    self.plug.start_collection(self.dest)
+    start_time = time.monotonic()
+    writer = threading.Thread(target=self._write, args=(data,))
+    writer.start()
+    self._wait_for_bytes(len(data), timeout_s=60)
+    elapsed_s = time.monotonic() - start_time
+    writer.join()
+    self.plug.stop_collection()
+    _LOG.info('Collected %d bytes in %.3fs (%.1f MB/s).', len(data), elapsed_s,
+              len(data) / elapsed_s / 1e6)
+    self.assertEqual(data, self._read_dest())
+
+
+if __name__ == '__main__':
+  unittest.main()
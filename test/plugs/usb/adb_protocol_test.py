@@ -0,0 +1,360 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the ADB protocol, against a stub USB handle."""
+
+import logging
+import queue
+import struct
+import threading
+import time
+import unittest
+from unittest import mock
+
+try:
+  # pylint: disable=g-import-not-at-top
+  from openhtf.plugs.usb import adb_message
+  from openhtf.plugs.usb import adb_protocol
+  from openhtf.plugs.usb import usb_exceptions
+  from openhtf.plugs.usb import usb_handle_stub
+  from openhtf.util import timeouts
+  # pylint: enable=g-import-not-at-top
+except (ImportError, OSError):
+  # The USB plugs need the usb_plugs extra and the libusb library.
+  raise unittest.SkipTest('USB plugs are not available.')
+
+_LOG = logging.getLogger(__name__)
+
+
+class AdbMessageTest(unittest.TestCase):
+
+  def test_data_checksum(self):
+    data = bytes(range(256)) * 16
+    self.assertEqual(sum(range(256)) * 16,
+                     adb_message.AdbMessage('WRTE', data=data).data_crc32)
+    self.assertEqual(
+        adb_message.AdbMessage('WRTE', data=bytearray(b'text')).header,
+        adb_message.AdbMessage('WRTE', data='text').header)
+
+  def test_read_message(self):
+    handle = usb_handle_stub.StubUsbHandle(ignore_writes=True)
+    message = adb_message.AdbMessage('WRTE', 1, 2, b'\x00\xffdata')
+    handle.expect_read(message.header)
+    # The payload may arrive in more than one transfer.
+    handle.expect_read(message.data[:3])
+    handle.expect_read(message.data[3:])
+    read = adb_message.AdbTransportAdapter(handle).read_message(
+        timeouts.PolledTimeout.from_millis(1000))
+    self.assertEqual(('WRTE', 1, 2, b'\x00\xffdata'),
+                     (read.command, read.arg0, read.arg1, read.data))
+
+  def test_corrupt_data_raises(self):
+    handle = usb_handle_stub.StubUsbHandle(ignore_writes=True)
+    message = adb_message.AdbMessage('WRTE', 1, 2, b'data')
+    handle.expect_read(message.header)
+    handle.expect_read(b'date')
+    with self.assertRaises(usb_exceptions.AdbDataIntegrityError):
+      adb_message.AdbTransportAdapter(handle).read_message(
+          timeouts.PolledTimeout.from_millis(1000))
+
+
+class _ScriptedDevice(usb_handle_stub.StubUsbHandle):
+  """Stub device that accepts every OPEN and ACKs every WRTE after a delay.
+
+  The delay simulates the USB round trip between the device receiving a WRTE
+  and the host receiving its OKAY.
+  """
+
+  def __init__(self, latency_s, window=None):
+    super(_ScriptedDevice, self).__init__(ignore_writes=True)
+    self.received = bytearray()
+    self._latency_s = latency_s
+    # Receive window for delayed ACKs, or None for legacy ACKs.
+    self._window = window
+    self._header = None
+    self._replies = queue.Queue()
+    self._replier = threading.Thread(target=self._send_replies)
+    self._replier.daemon = True
+    self._replier.start()
+
+  def _reply(self, local_id, acked_bytes):
+    data = b''
+    if self._window is not None:
+      data = struct.pack(adb_protocol.DELAYED_ACK_STRUCT_FORMAT, acked_bytes)
+    self._replies.put((time.monotonic() + self._latency_s,
+                       adb_message.AdbMessage('OKAY', local_id + 100, local_id,
+                                              data)))
+
+  def _send_replies(self):
+    while True:
+      reply = self._replies.get()
+      if reply is None:
+        return
+      time.sleep(max(0, reply[0] - time.monotonic()))
+      with self._read_data_added:
+        self.expected_read_data.append(reply[1].header)
+        if reply[1].data:
+          self.expected_read_data.append(reply[1].data)
+        self._read_data_added.notify_all()
+
+  def write(self, data, dummy=None):
+    # Messages are written as a header followed by (possibly empty) data.
+    if self._header is None:
+      self._header = adb_message.RawAdbMessage(
+          *struct.unpack(adb_message.AdbMessage.HEADER_STRUCT_FORMAT, data))
+      return
+    header, self._header = self._header, None
+    command = adb_message.AdbMessage.WIRE_TO_CMD[header.cmd]
+    if command == 'OPEN':
+      self._reply(header.arg0, self._window)
+    elif command == 'WRTE':
+      self.received += data
+      self._reply(header.arg0, len(data))
+
+  def close(self):
+    self._replies.put(None)
+    super(_ScriptedDevice, self).close()
+
+
+class AdbConnectionTest(unittest.TestCase):
+
+  def setUp(self):
+    super(AdbConnectionTest, self).setUp()
+    self.handle = usb_handle_stub.StubUsbHandle(ignore_writes=True)
+    self.connection = adb_protocol.AdbConnection(
+        adb_message.AdbTransportAdapter(self.handle),
+        adb_protocol.MAX_ADB_DATA_V1, 'device::stub')
+
+  def tearDown(self):
+    self.connection.close()
+    super(AdbConnectionTest, self).tearDown()
+
+  def _device_sends(self, command, local_id, data=b'', remote_id=None):
+    message = adb_message.AdbMessage(
+        command, local_id + 100 if remote_id is None else remote_id, local_id,
+        data)
+    self.handle.expect_read(message.header)
+    if data:
+      self.handle.expect_read(message.data)
+
+  def _open_stream(self, local_id):
+    self._device_sends('OKAY', local_id)
+    stream = self.connection.open_stream('shell:', timeout_ms=1000)
+    self.assertEqual(local_id, stream._transport.local_id)
+    return stream
+
+  def test_messages_are_routed_to_their_stream(self):
+    stream1 = self._open_stream(1)
+    stream2 = self._open_stream(2)
+    self._device_sends('WRTE', 2, b'two')
+    self._device_sends('WRTE', 1, b'one')
+    self._device_sends('CLSE', 1)
+    # Stream 1 doesn't wait for stream 2 to read its message.
+    self.assertEqual(b'one', stream1.read(timeout_ms=1000))
+    self.assertEqual([], list(stream1.read_until_close(1000)))
+    self.assertTrue(stream1.is_closed())
+    self.assertEqual(b'two', stream2.read(timeout_ms=1000))
+    with self.assertRaises(usb_exceptions.AdbTimeoutError):
+      stream2.read(timeout_ms=10)
+
+  def test_read_consumes_buffer(self):
+    stream = self._open_stream(1)
+    self._device_sends('WRTE', 1, b'abc')
+    self._device_sends('WRTE', 1, b'defgh')
+    self.assertEqual(b'abcd', stream.read(4, timeout_ms=1000))
+    self.assertEqual(b'ef', stream.read(2, timeout_ms=1000))
+    self.assertEqual(b'gh', stream.read(timeout_ms=1000))
+
+  def test_wrte_is_acked_once_consumed(self):
+    stream = self._open_stream(1)
+    self._device_sends('WRTE', 1, b'abcd')
+    with mock.patch.object(
+        self.connection.transport, 'write_message',
+        wraps=self.connection.transport.write_message) as write_message:
+      self.assertEqual(b'ab', stream.read(2, timeout_ms=1000))
+      write_message.assert_not_called()
+      self.assertEqual(b'cd', stream.read(timeout_ms=1000))
+    self.assertEqual(['OKAY'], [
+        call[0][0].command for call in write_message.call_args_list
+    ])
+
+  def test_write_splits_data_into_maxdata_messages(self):
+    stream = self._open_stream(1)
+    for _ in range(3):
+      self._device_sends('OKAY', 1)
+    data = bytes(range(256)) * 40
+    with mock.patch.object(
+        self.connection.transport, 'write_message',
+        wraps=self.connection.transport.write_message) as write_message:
+      stream.write(data, timeout_ms=1000)
+    messages = [call[0][0] for call in write_message.call_args_list]
+    self.assertEqual(['WRTE'] * 3, [message.command for message in messages])
+    self.assertEqual([4096, 4096, 2048],
+                     [len(message.data) for message in messages])
+    self.assertEqual(data, b''.join(bytes(m.data) for m in messages))
+
+  def test_close_wakes_readers(self):
+    stream = self._open_stream(1)
+    errors = []
+
+    def read():
+      try:
+        stream.read()
+      except usb_exceptions.AdbStreamClosedError as exception:
+        errors.append(exception)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    self.connection.close()
+    reader.join(1)
+    self.assertFalse(reader.is_alive())
+    self.assertEqual(1, len(errors))
+
+  def test_reader_error_is_raised_by_streams(self):
+    stream = self._open_stream(1)
+    self._device_sends('SYNC', 1)
+    with self.assertRaises(usb_exceptions.AdbProtocolError):
+      stream.read(timeout_ms=1000)
+    with self.assertRaises(usb_exceptions.AdbProtocolError):
+      self.connection.open_stream('shell:', timeout_ms=1000)
+
+  def test_concurrent_streams_throughput(self):
+    stream_count = 3
+    message_count = 1000
+    data = b'x' * 1024
+    streams = [self._open_stream(local_id)
+               for local_id in range(1, stream_count + 1)]
+    received = [0] * stream_count
+
+    def read(idx):
+      for read_data in streams[idx].read_until_close(10000):
+        received[idx] += len(read_data)
+
+    readers = [
+        threading.Thread(target=read, args=(idx,))
+        for idx in range(stream_count)
+    ]
+    start_time = time.monotonic()
+    for reader in readers:
+      reader.start()
+    for _ in range(message_count):
+      for local_id in range(1, stream_count + 1):
+        self._device_sends('WRTE', local_id, data)
+    for local_id in range(1, stream_count + 1):
+      self._device_sends('CLSE', local_id)
+    for reader in readers:
+      reader.join()
+    elapsed_s = time.monotonic() - start_time
+
+    _LOG.info('Read %d messages on %d streams in %.3fs (%.0f messages/s).',
+              message_count * stream_count, stream_count, elapsed_s,
+              message_count * stream_count / elapsed_s)
+    self.assertEqual([message_count * len(data)] * stream_count, received)
+
+
+class DelayedAckTest(unittest.TestCase):
+
+  def _connect(self, handle, arg1, banner, delayed_ack=True):
+    message = adb_message.AdbMessage('CNXN', adb_protocol.ADB_VERSION, arg1,
+                                     banner)
+    handle.expect_read(message.header)
+    handle.expect_read(message.data)
+    return adb_protocol.AdbConnection.connect(
+        handle, timeout_ms=1000, delayed_ack=delayed_ack)
+
+  def test_negotiation(self):
+    handle = usb_handle_stub.StubUsbHandle(ignore_writes=True)
+    self.addCleanup(handle.close)
+    connection = self._connect(handle, 1024 * 1024,
+                               'device::ro.serialno=x;features=cmd,delayed_ack')
+    self.assertEqual(adb_protocol.MAX_ADB_DATA, connection.maxdata)
+    self.assertEqual({'cmd', 'delayed_ack'}, connection.features)
+    self.assertTrue(connection.delayed_ack)
+
+    connection = self._connect(handle, 1024 * 1024,
+                               'device::features=delayed_ack', False)
+    self.assertFalse(connection.delayed_ack)
+
+    # Legacy devices support neither delayed ACKs nor large packets.
+    connection = self._connect(handle, adb_protocol.MAX_ADB_DATA_V1, 'device::')
+    self.assertEqual(adb_protocol.MAX_ADB_DATA_V1, connection.maxdata)
+    self.assertFalse(connection.delayed_ack)
+
+  def test_window_is_granted_back_once_read(self):
+    handle = usb_handle_stub.StubUsbHandle(ignore_writes=True)
+    connection = adb_protocol.AdbConnection(
+        adb_message.AdbTransportAdapter(handle), 4096,
+        'device::features=delayed_ack', delayed_ack=True)
+    self.addCleanup(connection.close)
+
+    def device_sends(command, data):
+      message = adb_message.AdbMessage(command, 101, 1, data)
+      handle.expect_read(message.header)
+      handle.expect_read(message.data)
+
+    device_sends('OKAY', struct.pack(adb_protocol.DELAYED_ACK_STRUCT_FORMAT,
+                                     4096))
+    stream = connection.open_stream('shell:', timeout_ms=1000)
+    device_sends('WRTE', b'x' * 3000)
+    device_sends('WRTE', b'y' * 3000)
+    with mock.patch.object(
+        connection.transport, 'write_message',
+        wraps=connection.transport.write_message) as write_message:
+      self.assertEqual(b'x' * 1000, stream.read(1000, timeout_ms=1000))
+      write_message.assert_not_called()
+      self.assertEqual(b'x' * 2000 + b'y' * 3000,
+                       stream.read(5000, timeout_ms=1000))
+    self.assertEqual([3000, 3000], [
+        struct.unpack(adb_protocol.DELAYED_ACK_STRUCT_FORMAT,
+                      call[0][0].data)[0]
+        for call in write_message.call_args_list
+    ])
+
+  def _push(self, device, maxdata, banner, data):
+    connection = adb_protocol.AdbConnection(
+        adb_message.AdbTransportAdapter(device), maxdata, banner,
+        delayed_ack=True)
+    try:
+      stream = connection.open_stream('sync:', timeout_ms=1000)
+      start_time = time.monotonic()
+      stream.write(data, timeout_ms=10000)
+      elapsed_s = time.monotonic() - start_time
+    finally:
+      connection.close()
+    self.assertEqual(data, device.received)
+    return elapsed_s
+
+  def test_writes_are_limited_by_window(self):
+    device = _ScriptedDevice(latency_s=0.01, window=4096)
+    data = b'x' * 4096 * 3
+    elapsed_s = self._push(device, 4096, 'device::features=delayed_ack', data)
+    # Each WRTE uses up the window, so the last two wait for an OKAY.
+    self.assertGreaterEqual(elapsed_s, 0.02)
+
+  def test_push_throughput(self):
+    data = bytes(range(256)) * 4096 * 2
+    legacy_s = self._push(
+        _ScriptedDevice(latency_s=0.001), adb_protocol.MAX_ADB_DATA_V1,
+        'device::', data)
+    delayed_ack_s = self._push(
+        _ScriptedDevice(latency_s=0.001, window=1024 * 1024),
+        adb_protocol.MAX_ADB_DATA, 'device::features=delayed_ack', data)
+    _LOG.info('Pushed %d bytes in %.3fs with legacy ACKs (%.1f MB/s), %.3fs '
+              'with delayed ACKs (%.1f MB/s).', len(data), legacy_s,
+              len(data) / legacy_s / 1e6, delayed_ack_s,
+              len(data) / delayed_ack_s / 1e6)
+    self.assertLess(delayed_ack_s, legacy_s)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,205 @@
+# Copyright 2026 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import threading
+import time
+import unittest
+
+import openhtf as htf
+from openhtf.util import test as htf_test
+
+try:
+  # pylint: disable=g-import-not-at-top
+  from openhtf.plugs.usb import device_pool
+  from openhtf.plugs.usb import usb_exceptions
+  # pylint: enable=g-import-not-at-top
+except (ImportError, OSError):
+  # The USB plugs need the usb_plugs extra and the libusb library.
+  raise unittest.SkipTest('USB plugs are not available.')
+
+
+class _FakeBootloader(object):
+  """Fake fastboot USB handle that accepts downloads and flashes.
+
+  Each write of download data takes write_s seconds, and is appended to the
+  shared writes list along with the device's serial.
+  """
+
+  def __init__(self, serial, writes, write_s=0.0, fail_flash=False):
+    self.serial = serial
+    self.downloaded = 0
+    self.flashed = []
+    self.closed = False
+    self._writes = writes
+    self._write_s = write_s
+    self._fail_flash = fail_flash
+    self._remaining = 0
+    self._responses = []
+
+  def close(self):
+    self.closed = True
+
+  def read(self, length, timeout_ms=None):
+    del length, timeout_ms  # Unused.
+    return self._responses.pop(0)
+
+  def write(self, data, timeout_ms=None):
+    del timeout_ms  # Unused.
+    if self._remaining:
+      time.sleep(self._write_s)
+      self._writes.append(self.serial)
+      self._remaining -= len(data)
+      self.downloaded += len(data)
+      if not self._remaining:
+        self._responses.append(b'OKAY')
+      return
+    command, _, arg = bytes(data).decode().partition(':')
+    if command == 'download':
+      self._remaining = int(arg, 16)
+      self._responses.append(b'DATA' + arg.encode())
+    elif command == 'flash' and not self._fail_flash:
+      self.flashed.append(arg)
+      self._responses.append(b'OKAY')
+    else:
+      self._responses.append(b'FAILno')
+
+
+class TransferArbiterTest(unittest.TestCase):
+
+  def test_limits_concurrent_transfers(self):
+    arbiter = device_pool.TransferArbiter(2)
+    active = []
+    max_active = []
+    lock = threading.Lock()
+
+    def transfer():
+      with arbiter.transfer():
+        with lock:
+          active.append(1)
+          max_active.append(len(active))
+        time.sleep(.01)
+        with lock:
+          active.pop()
+
+    threads = [threading.Thread(target=transfer) for _ in range(6)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(2, max(max_active))
+
+  def test_invalid_max_concurrent(self):
+    with self.assertRaises(ValueError):
+      device_pool.TransferArbiter(0)
+
+
+class DevicePoolTest(unittest.TestCase):
+
+  def setUp(self):
+    super(DevicePoolTest, self).setUp()
+    self.writes = []
+    self.devices = {
+        serial: _FakeBootloader(serial, self.writes, write_s=.002)
+        for serial in ('a', 'b', 'c')
+    }
+
+  def test_flash(self):
+    verified = []
+
+    def verify(serial, unused_commands):
+      verified.append(serial)
+      return self.devices[serial].flashed == ['boot', 'system']
+
+    with device_pool.DevicePool(
+        self.devices, max_concurrent_transfers=1) as pool:
+      results = pool.flash([('boot', b'b' * 10000), ('system', b's' * 20000)],
+                           verify=verify,
+                           max_download_size=0)
+    self.assertEqual([('a', 'flash:boot'), ('a', 'flash:system'),
+                      ('a', 'verify'), ('b', 'flash:boot'),
+                      ('b', 'flash:system'), ('b', 'verify'),
+                      ('c', 'flash:boot'), ('c', 'flash:system'),
+                      ('c', 'verify')],
+                     [(result.serial, result.step) for result in results])
+    self.assertTrue(all(result.passed for result in results))
+    self.assertEqual(['a', 'b', 'c'], sorted(verified))
+    self.assertTrue(all(device.closed for device in self.devices.values()))
+
+  def test_flash_file_object(self):
+    pool = device_pool.DevicePool(self.devices)
+    results = pool.flash({'boot': io.BytesIO(b'b' * 10000)},
+                         max_download_size=0)
+    self.assertTrue(all(result.passed for result in results))
+    # Every device got the whole image, not what the others left of it.
+    self.assertEqual([10000] * 3,
+                     [device.downloaded for device in self.devices.values()])
+
+  def test_failed_step_stops_device(self):
+    self.devices['b'] = _FakeBootloader('b', self.writes, fail_flash=True)
+    pool = device_pool.DevicePool(self.devices)
+    results = pool.flash({'boot': b'b' * 100}, verify=lambda *args: False,
+                         max_download_size=0)
+    self.assertEqual(
+        [('a', 'flash:boot', True), ('a', 'verify', False),
+         ('b', 'flash:boot', False), ('c', 'flash:boot', True),
+         ('c', 'verify', False)],
+        [(result.serial, result.step, result.passed) for result in results])
+    self.assertIsInstance(results[2].error,
+                          usb_exceptions.FastbootRemoteFailureError)
+
+  def test_writes_are_fair(self):
+    pool = device_pool.DevicePool(self.devices, max_concurrent_transfers=1)
+    pool.flash({'boot': b'b' * 4 * 1024 * 1024}, max_download_size=0)
+    # The devices take turns writing their 1 MiB chunks, so none of them gets
+    # far ahead of the others.
+    self.assertEqual(12, len(self.writes))
+    for idx in range(len(self.writes)):
+      counts = [self.writes[:idx].count(serial) for serial in 'abc']
+      self.assertLessEqual(max(counts) - min(counts), 2)
+
+
+class DevicePoolMeasurementTest(htf_test.TestCase):
+
+  def _flash(self, fail_serial=None):
+    devices = {
+        serial: _FakeBootloader(serial, [], fail_flash=serial == fail_serial)
+        for serial in ('a', 'b')
+    }
+    pool = device_pool.DevicePool(devices)
+
+    @htf.measures(device_pool.results_measurement('flash_results'))
+    def flash_phase(test):
+      device_pool.record_results(
+          test.measurements.flash_results,
+          pool.flash({'boot': b'b' * 100}, max_download_size=0))
+
+    return flash_phase
+
+  @htf_test.yields_phases
+  def test_results_measurement(self):
+    phase_record = yield self._flash()
+    self.assertPhaseContinue(phase_record)
+    self.assertMeasurementPass(phase_record, 'flash_results')
+    self.assertEqual(
+        [('a', 'flash:boot', 'PASS'), ('b', 'flash:boot', 'PASS')],
+        [row[:3] for row in
+         phase_record.measurements['flash_results'].measured_value.value])
+
+    phase_record = yield self._flash(fail_serial='b')
+    self.assertMeasurementFail(phase_record, 'flash_results')
+
+
+if __name__ == '__main__':
+  unittest.main()
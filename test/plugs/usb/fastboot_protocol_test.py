@@ -0,0 +1,173 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import struct
+import tempfile
+import unittest
+
+try:
+  # pylint: disable=g-import-not-at-top
+  from openhtf.plugs.usb import fastboot_protocol
+  from openhtf.plugs.usb import usb_exceptions
+  # pylint: enable=g-import-not-at-top
+except (ImportError, OSError):
+  # The USB plugs need the usb_plugs extra and the libusb library.
+  raise unittest.SkipTest('USB plugs are not available.')
+
+
+class _FakeBootloader(object):
+  """Fake fastboot USB handle that accepts downloads and flashes.
+
+  Attributes:
+    downloads: Data of each completed download.
+    flashed: Partitions flashed, in order.
+    max_download_size: Value of the max-download-size variable, if not None.
+    chunk_sizes: Size of each write of download data.
+  """
+
+  def __init__(self, max_download_size=None):
+    self.downloads = []
+    self.flashed = []
+    self.max_download_size = max_download_size
+    self.chunk_sizes = []
+    self._download = None
+    self._remaining = 0
+    self._responses = []
+
+  def read(self, length, timeout_ms=None):
+    del length, timeout_ms  # Unused.
+    return self._responses.pop(0)
+
+  def write(self, data, timeout_ms=None):
+    del timeout_ms  # Unused.
+    if self._remaining:
+      self.chunk_sizes.append(len(data))
+      self._download += data
+      self._remaining -= len(data)
+      if not self._remaining:
+        self.downloads.append(bytes(self._download))
+        self._responses.append(b'OKAY')
+      return
+    command, _, arg = bytes(data).decode().partition(':')
+    if command == 'download':
+      self._download = bytearray()
+      self._remaining = int(arg, 16)
+      self._responses.append(b'DATA' + arg.encode())
+    elif command == 'flash':
+      self.flashed.append(arg)
+      self._responses.append(b'OKAY')
+    elif command == 'getvar' and self.max_download_size is not None:
+      self._responses.append(b'OKAY%#x' % self.max_download_size)
+    else:
+      self._responses.append(b'FAILunknown command')
+
+
+def _unsparse(images, block_size=fastboot_protocol.SPARSE_BLOCK_SIZE):
+  """Apply sparse images to a blank image, return its data."""
+  header_size = struct.calcsize(fastboot_protocol.SPARSE_HEADER_FORMAT)
+  chunk_header_size = struct.calcsize(
+      fastboot_protocol.SPARSE_CHUNK_HEADER_FORMAT)
+  result = None
+  for image in images:
+    (magic, _, _, _, _, image_block_size, total_blocks, total_chunks,
+     _) = struct.unpack_from(fastboot_protocol.SPARSE_HEADER_FORMAT, image)
+    assert magic == fastboot_protocol.SPARSE_HEADER_MAGIC
+    assert image_block_size == block_size
+    if result is None:
+      result = bytearray(total_blocks * block_size)
+    offset, block = header_size, 0
+    for _ in range(total_chunks):
+      chunk_type, _, blocks, total_size = struct.unpack_from(
+          fastboot_protocol.SPARSE_CHUNK_HEADER_FORMAT, image, offset)
+      if chunk_type == fastboot_protocol.SPARSE_CHUNK_TYPE_RAW:
+        result[block * block_size:(block + blocks) * block_size] = (
+            image[offset + chunk_header_size:offset + total_size])
+      offset += total_size
+      block += blocks
+    assert offset == len(image) and block == total_blocks
+  return bytes(result)
+
+
+class FastbootCommandsTest(unittest.TestCase):
+
+  def setUp(self):
+    super(FastbootCommandsTest, self).setUp()
+    self.usb = _FakeBootloader()
+    self.commands = fastboot_protocol.FastbootCommands(self.usb)
+    self.data = os.urandom(fastboot_protocol.SPARSE_BLOCK_SIZE * 10 + 100)
+    with tempfile.NamedTemporaryFile(delete=False) as image_file:
+      image_file.write(self.data)
+    self.filename = image_file.name
+    self.addCleanup(os.remove, self.filename)
+
+  def test_download_sources(self):
+    progress = []
+    self.commands.download(
+        self.filename, progress_callback=lambda *args: progress.append(args))
+    with open(self.filename, 'rb') as image_file:
+      self.commands.download(image_file)
+    self.commands.download(self.data)
+    # Unknown lengths of unmappable files are read up front.
+    self.commands.download(io.BytesIO(self.data))
+    self.commands.download(io.BytesIO(self.data), source_len=len(self.data))
+    self.assertEqual([self.data] * 5, self.usb.downloads)
+    self.assertEqual((len(self.data), len(self.data)), progress[-1])
+
+  def test_download_chunks(self):
+    self.commands.download(b'x' * (3 * 1024 * 1024 + 1))
+    chunk_size = fastboot_protocol.FASTBOOT_DOWNLOAD_CHUNK_SIZE_KB * 1024
+    self.assertEqual([chunk_size] * 3 + [1], self.usb.chunk_sizes)
+
+  def test_download_short_source(self):
+    with self.assertRaises(usb_exceptions.FastbootTransferError):
+      self.commands.download(io.BytesIO(b'short'), source_len=10)
+
+  def test_flash_from_file(self):
+    self.usb.max_download_size = len(self.data)
+    self.commands.flash_from_file('system', self.filename)
+    self.assertEqual([self.data], self.usb.downloads)
+    self.assertEqual(['system'], self.usb.flashed)
+
+  def test_flash_from_file_splits_sparse_images(self):
+    self.usb.max_download_size = fastboot_protocol.SPARSE_BLOCK_SIZE * 3 + 64
+    self.commands.flash_from_file('system', self.filename)
+    self.assertEqual(4, len(self.usb.downloads))
+    self.assertEqual(['system'] * 4, self.usb.flashed)
+    for download in self.usb.downloads:
+      self.assertLessEqual(len(download), self.usb.max_download_size)
+    unsparsed = _unsparse(self.usb.downloads)
+    self.assertEqual(self.data, unsparsed[:len(self.data)])
+    self.assertFalse(any(unsparsed[len(self.data):]))
+
+  def test_flash_from_file_without_max_download_size(self):
+    self.commands.flash_from_file('system', self.filename)
+    self.assertEqual([self.data], self.usb.downloads)
+    # Splitting can also be disabled explicitly.
+    self.usb.max_download_size = 1000
+    self.commands.flash_from_file(
+        'system', self.filename, max_download_size=0)
+    self.assertEqual([self.data] * 2, self.usb.downloads)
+
+  def test_sparse_image_too_large(self):
+    self.usb.max_download_size = 1000
+    with self.assertRaises(usb_exceptions.FastbootTransferError):
+      self.commands.flash_from_file(
+          'system',
+          struct.pack('<I', fastboot_protocol.SPARSE_HEADER_MAGIC) * 1000)
+
+
+if __name__ == '__main__':
+  unittest.main()
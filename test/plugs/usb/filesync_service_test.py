@@ -0,0 +1,241 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import shutil
+import stat
+import struct
+import tempfile
+import threading
+import unittest
+
+try:
+  # pylint: disable=g-import-not-at-top
+  from openhtf.plugs.usb import adb_device
+  from openhtf.plugs.usb import filesync_service
+  from openhtf.plugs.usb import usb_exceptions
+  # pylint: enable=g-import-not-at-top
+except (ImportError, OSError):
+  # The USB plugs need the usb_plugs extra and the libusb library.
+  raise unittest.SkipTest('USB plugs are not available.')
+
+_CMD_TO_WIRE = filesync_service.AbstractFilesyncTransport.CMD_TO_WIRE
+_WIRE_TO_CMD = filesync_service.AbstractFilesyncTransport.WIRE_TO_CMD
+
+
+class _FakeSyncStream(object):
+  """Fake AdbStream to the sync: service of a device with the given files.
+
+  Requests are handled as soon as they are completely written, and their
+  responses are buffered for the following reads.
+
+  Attributes:
+    files: Dict of device filename to (mode, data, mtime) tuples.
+    data_writes: Sizes of the writes containing DATA packets.
+  """
+
+  def __init__(self, files):
+    self.files = files
+    self.data_writes = []
+    self._lock = threading.Lock()
+    self._request = bytearray()
+    self._response = bytearray()
+    self._sending = None
+
+  def close(self):
+    pass
+
+  def read(self, length=0, timeout_ms=None):
+    del timeout_ms  # Unused.
+    with self._lock:
+      assert len(self._response) >= length, 'Read without a response!'
+      length = length or len(self._response)
+      data = bytes(self._response[:length])
+      del self._response[:length]
+    return data
+
+  def write(self, data, timeout_ms=None):
+    del timeout_ms  # Unused.
+    with self._lock:
+      self._request += data
+      if b'DATA' in bytes(data[:4]):
+        self.data_writes.append(len(data))
+      while self._handle_request():
+        pass
+
+  def _respond(self, command, *args):
+    data = b''
+    if args and isinstance(args[-1], bytes):
+      data = args[-1]
+      args = args[:-1] + (len(data),)
+    self._response += struct.pack('<%dI' % (len(args) + 1),
+                                  _CMD_TO_WIRE[command], *args) + data
+
+  def _handle_request(self):
+    """Handle one request if it was completely written, return True if so."""
+    if len(self._request) < 8:
+      return False
+    wire_cmd, arg = struct.unpack('<2I', self._request[:8])
+    command = _WIRE_TO_CMD[wire_cmd]
+    if command == 'DONE':
+      del self._request[:8]
+      filename, mode, data = self._sending
+      self.files[filename] = (mode, bytes(data), arg)
+      self._sending = None
+      self._respond('OKAY', b'')
+      return True
+    if len(self._request) < 8 + arg:
+      return False
+    data = bytes(self._request[8:8 + arg])
+    del self._request[:8 + arg]
+    if command == 'DATA':
+      self._sending[2].extend(data)
+    elif command == 'SEND':
+      filename, mode = data.decode().rsplit(',', 1)
+      self._sending = (filename, int(mode), bytearray())
+    elif command == 'STAT':
+      mode, file_data, mtime = self.files.get(data.decode(), (0, b'', 0))
+      self._respond('STAT', mode, len(file_data), mtime)
+    elif command == 'RECV':
+      file_data = self.files[data.decode()][1]
+      for offset in range(0, len(file_data),
+                          filesync_service.MAX_PUSH_DATA_BYTES):
+        self._respond(
+            'DATA', file_data[offset:offset +
+                              filesync_service.MAX_PUSH_DATA_BYTES])
+      self._respond('DONE', b'')
+    return True
+
+
+class _FakeConnection(object):
+  """Fake AdbConnection opening _FakeSyncStreams to the same files."""
+
+  def __init__(self):
+    self.files = {}
+    self.streams = []
+
+  def open_stream(self, destination, timeout=None):
+    del timeout  # Unused.
+    assert destination == 'sync:'
+    self.streams.append(_FakeSyncStream(self.files))
+    return self.streams[-1]
+
+
+class FilesyncServiceTest(unittest.TestCase):
+
+  def setUp(self):
+    super(FilesyncServiceTest, self).setUp()
+    self.stream = _FakeSyncStream({})
+    self.service = filesync_service.FilesyncService(self.stream)
+
+  def test_send_and_recv(self):
+    data = os.urandom(filesync_service.MAX_PUSH_DATA_BYTES * 5 + 10)
+    self.service.send(io.BytesIO(data), '/data/file', mtime=1234)
+    self.assertEqual((filesync_service.DEFAULT_PUSH_MODE, data, 1234),
+                     self.stream.files['/data/file'])
+    # Each DATA packet is written along with its header.
+    self.assertEqual(
+        [filesync_service.MAX_PUSH_DATA_BYTES + 8] * 5 + [18],
+        self.stream.data_writes)
+
+    dest_file = io.BytesIO()
+    self.service.recv('/data/file', dest_file)
+    self.assertEqual(data, dest_file.getvalue())
+
+  def test_send_raises_read_error(self):
+
+    class FailingFile(object):
+
+      def __init__(self):
+        self.reads = 0
+
+      def read(self, size):
+        self.reads += 1
+        if self.reads > 2:
+          raise IOError('Read failed')
+        return b'x' * size
+
+    with self.assertRaisesRegex(IOError, 'Read failed'):
+      self.service.send(FailingFile(), '/data/file')
+
+  def test_send_stops_reading_on_write_error(self):
+    write = self.stream.write
+
+    def failing_write(data, timeout_ms=None):
+      if self.stream.data_writes:
+        raise usb_exceptions.AdbProtocolError('Write failed')
+      write(data, timeout_ms)
+
+    self.stream.write = failing_write
+    src_file = io.BytesIO(b'x' * filesync_service.MAX_PUSH_DATA_BYTES * 100)
+    with self.assertRaises(usb_exceptions.AdbProtocolError):
+      self.service.send(src_file, '/data/file')
+    # Reading stopped after at most one pipeline depth of read-ahead.
+    self.assertLess(src_file.tell(),
+                    filesync_service.MAX_PUSH_DATA_BYTES *
+                    (filesync_service.PIPELINE_DEPTH + 3))
+
+  def test_recv_raises_write_error(self):
+    self.stream.files['/data/file'] = (stat.S_IFREG, b'x' * 1000000, 0)
+
+    class FailingFile(object):
+
+      def write(self, data):
+        raise IOError('Write failed')
+
+    with self.assertRaisesRegex(IOError, 'Write failed'):
+      self.service.recv('/data/file', FailingFile())
+
+
+class SyncDirectoryTest(unittest.TestCase):
+
+  def setUp(self):
+    super(SyncDirectoryTest, self).setUp()
+    self.local_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.local_dir)
+    self.connection = _FakeConnection()
+    self.device = adb_device.AdbDevice(self.connection)
+
+  def _write(self, relpath, data):
+    path = os.path.join(self.local_dir, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+      f.write(data)
+
+  def test_sync_directory(self):
+    for idx in range(10):
+      self._write(os.path.join('dir%d' % (idx % 3), 'file%d' % idx),
+                  b'x' * idx * 1000)
+    pushed = self.device.sync_directory(
+        self.local_dir, '/data/sync', concurrency=4)
+    self.assertEqual(10, len(pushed))
+    self.assertEqual(sorted(pushed), sorted(self.connection.files))
+    self.assertEqual(b'x' * 4000,
+                     self.connection.files['/data/sync/dir1/file4'][1])
+    # One stream is the device's own, the others were opened for the sync.
+    self.assertEqual(4, len(self.connection.streams))
+
+    self.assertEqual([],
+                     self.device.sync_directory(self.local_dir, '/data/sync'))
+    self._write(os.path.join('dir1', 'file4'), b'changed')
+    self._write('new', b'new')
+    self.assertEqual(['/data/sync/dir1/file4', '/data/sync/new'],
+                     self.device.sync_directory(self.local_dir, '/data/sync'))
+    self.assertEqual(b'changed',
+                     self.connection.files['/data/sync/dir1/file4'][1])
+
+
+if __name__ == '__main__':
+  unittest.main()
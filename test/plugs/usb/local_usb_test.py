@@ -0,0 +1,113 @@
+# Copyright 2026 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest import mock
+
+try:
+  # pylint: disable=g-import-not-at-top
+  from openhtf.plugs.usb import local_usb
+  from openhtf.plugs.usb import usb_exceptions
+  from openhtf.plugs.usb import usb_handle_stub
+  # pylint: enable=g-import-not-at-top
+except (ImportError, OSError):
+  # The USB plugs need the usb_plugs extra and the libusb library.
+  raise unittest.SkipTest('USB plugs are not available.')
+
+_ADB_SETTING = (0xff, 0x42, 0x1)
+_FASTBOOT_SETTING = (0xff, 0x42, 0x3)
+
+
+def _device(serial_number, port_path, *settings):
+  return usb_handle_stub.StubUsbDevice(
+      serial_number, port_path,
+      [usb_handle_stub.StubUsbSetting(*setting) for setting in settings])
+
+
+class LibUsbHandleTest(unittest.TestCase):
+
+  def setUp(self):
+    super(LibUsbHandleTest, self).setUp()
+    self.devices = [
+        _device('serial%d' % idx, '1-%d.1' % idx, _ADB_SETTING)
+        for idx in range(60)
+    ]
+    self.devices.append(_device('fastboot', '2-1', _FASTBOOT_SETTING))
+    self.context = usb_handle_stub.StubUsbContext(self.devices)
+    self._use_context(self.context)
+
+  def _use_context(self, context):
+    patcher = mock.patch.object(local_usb, '_DEVICE_INDEX',
+                                local_usb.DeviceIndex(context))
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def _open(self, **kwargs):
+    handle = local_usb.LibUsbHandle.open(**kwargs)
+    handle.close()
+    return handle
+
+  def test_open_enumerates_once(self):
+    for idx in range(10):
+      handle = self._open(serial_number='serial%d' % idx)
+      self.assertEqual('serial%d' % idx, handle.serial_number)
+      self.assertEqual('1-%d.1' % idx, handle.port_path)
+    self.assertEqual(1, self.context.enumerations)
+    # Serial numbers were read once, when enumerating.
+    self.assertEqual([1] * 61,
+                     [device.serial_number_reads for device in self.devices])
+
+  def test_open_by_port_path_and_setting(self):
+    self.assertEqual('serial3', self._open(port_path='1-3.1').serial_number)
+    self.assertEqual(
+        'fastboot',
+        self._open(
+            interface_class=_FASTBOOT_SETTING[0],
+            interface_subclass=_FASTBOOT_SETTING[1],
+            interface_protocol=_FASTBOOT_SETTING[2]).serial_number)
+    with self.assertRaises(usb_exceptions.MultipleInterfacesFoundError):
+      self._open(interface_protocol=_ADB_SETTING[2])
+    self.assertEqual(1, self.context.enumerations)
+    # Looking for a device that is not in the index enumerates again.
+    with self.assertRaises(usb_exceptions.DeviceNotFoundError):
+      self._open(serial_number='serial3', port_path='1-4.1')
+    self.assertEqual(2, self.context.enumerations)
+
+  def test_hotplug_refreshes_index(self):
+    self._open(serial_number='serial0')
+    self.context.unplug(self.devices[0])
+    with self.assertRaises(usb_exceptions.DeviceNotFoundError):
+      self._open(serial_number='serial0')
+    self.assertEqual(2, self.context.enumerations)
+
+    self.context.plug(_device('new', '3-1', _ADB_SETTING))
+    self.assertEqual('new', self._open(serial_number='new').serial_number)
+    self.assertEqual(3, self.context.enumerations)
+
+  def test_missing_device_refreshes_index(self):
+    context = usb_handle_stub.StubUsbContext(self.devices, hotplug=False)
+    self._use_context(context)
+    self._open(serial_number='serial0')
+    # Without hotplug events, a device is looked for again when not found.
+    context.devices.append(_device('new', '3-1', _ADB_SETTING))
+    self.assertEqual('new', self._open(serial_number='new').serial_number)
+    self.assertEqual(2, context.enumerations)
+
+    with mock.patch.object(local_usb, 'DEVICE_INDEX_MAX_AGE_S', 0):
+      self._open(serial_number='new')
+    self.assertEqual(3, context.enumerations)
+
+
+if __name__ == '__main__':
+  unittest.main()
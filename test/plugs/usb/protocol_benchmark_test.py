@@ -0,0 +1,180 @@
+# Copyright 2026 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks of the ADB and fastboot protocols against simulated devices.
+
+Each benchmark transfers data or runs commands over a simulated link, which the
+unit tests use to check that everything arrives intact.  Wall-clock timings
+depend on the machine and its load, so they are not checked by the tests: run
+this module directly to print the throughput and latency of each benchmark.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+import unittest
+
+try:
+  # pylint: disable=g-import-not-at-top
+  from openhtf.plugs.usb import adb_device
+  from openhtf.plugs.usb import fastboot_protocol
+  from openhtf.plugs.usb import simulated_device
+  # pylint: enable=g-import-not-at-top
+except (ImportError, OSError):
+  # The USB plugs need the usb_plugs extra and the libusb library.
+  raise unittest.SkipTest('USB plugs are not available.')
+
+# The simulated link, roughly a USB 2.0 high speed bulk endpoint.
+LATENCY_S = .0005
+BANDWIDTH = 30e6
+# Size of the files/images transferred.
+TRANSFER_SIZE = 8 * 1024 * 1024
+# Number of round trips to average latency over.
+ROUND_TRIPS = 50
+
+
+@contextlib.contextmanager
+def _connect(**kwargs):
+  """Yields a simulated ADB device and an AdbDevice connected to it."""
+  device = simulated_device.SimulatedAdbDevice(
+      latency_s=LATENCY_S, bandwidth=BANDWIDTH, **kwargs)
+  adb = adb_device.AdbDevice.connect(device)
+  try:
+    yield device, adb
+  finally:
+    adb.close()
+
+
+def _fastboot_device():
+  return simulated_device.SimulatedFastbootDevice(
+      latency_s=LATENCY_S, bandwidth=BANDWIDTH)
+
+
+# Each benchmark returns the seconds it took, then the expected and actual
+# results of what it transferred.
+
+
+def adb_push(delayed_ack=True):
+  """Push a TRANSFER_SIZE file."""
+  data = os.urandom(TRANSFER_SIZE)
+  with _connect(delayed_ack=delayed_ack) as (device, adb):
+    start_time = time.monotonic()
+    adb.push(io.BytesIO(data), '/data/file')
+    return time.monotonic() - start_time, data, device.files['/data/file'][1]
+
+
+def adb_pull():
+  """Pull a TRANSFER_SIZE file."""
+  data = os.urandom(TRANSFER_SIZE)
+  with _connect(files={'/data/file': (0o100644, data, 0)}) as (_, adb):
+    start_time = time.monotonic()
+    pulled = adb.pull('/data/file')
+    return time.monotonic() - start_time, data, pulled
+
+
+def adb_shell_command():
+  """Run ROUND_TRIPS shell commands, each of which takes a few round trips."""
+  with _connect() as (_, adb):
+    start_time = time.monotonic()
+    outputs = [adb.command('echo %d' % idx) for idx in range(ROUND_TRIPS)]
+    return (time.monotonic() - start_time,
+            [b'%d\r\n' % idx for idx in range(ROUND_TRIPS)], outputs)
+
+
+def adb_sync_message():
+  """Stat a file ROUND_TRIPS times through the sync service."""
+  with _connect(files={'/data/file': (0o100644, b'data', 1234)}) as (_, adb):
+    start_time = time.monotonic()
+    mtimes = [
+        adb.filesync_service.stat('/data/file').mtime
+        for _ in range(ROUND_TRIPS)
+    ]
+    return time.monotonic() - start_time, [1234] * ROUND_TRIPS, mtimes
+
+
+def fastboot_flash():
+  """Flash a TRANSFER_SIZE image."""
+  device = _fastboot_device()
+  commands = fastboot_protocol.FastbootCommands(device)
+  data = os.urandom(TRANSFER_SIZE)
+  start_time = time.monotonic()
+  commands.flash_from_file('boot', data, info_cb=lambda _: None)
+  return time.monotonic() - start_time, data, device.partitions['boot']
+
+
+def fastboot_command():
+  """Get a variable ROUND_TRIPS times."""
+  commands = fastboot_protocol.FastbootCommands(_fastboot_device())
+  start_time = time.monotonic()
+  products = [commands.get_var('product') for _ in range(ROUND_TRIPS)]
+  return time.monotonic() - start_time, ['simulated'] * ROUND_TRIPS, products
+
+
+# Name, function and whether each benchmark measures throughput or latency.
+BENCHMARKS = [
+    ('adb push', adb_push, 'throughput'),
+    ('adb push (legacy ACKs)', lambda: adb_push(delayed_ack=False),
+     'throughput'),
+    ('adb pull', adb_pull, 'throughput'),
+    ('adb shell command', adb_shell_command, 'latency'),
+    ('adb sync message', adb_sync_message, 'latency'),
+    ('fastboot flash', fastboot_flash, 'throughput'),
+    ('fastboot command', fastboot_command, 'latency'),
+]
+
+
+def run_benchmarks(output=sys.stdout):
+  """Run the benchmarks and print their throughput or latency to output."""
+  output.write('Protocol benchmarks (%.1f MB/s link, %.1f ms latency):\n' %
+               (BANDWIDTH / 1e6, LATENCY_S * 1e3))
+  for name, benchmark, kind in BENCHMARKS:
+    elapsed_s, _, _ = benchmark()
+    if kind == 'throughput':
+      value, unit = TRANSFER_SIZE / elapsed_s / 1e6, 'MB/s'
+    else:
+      value, unit = elapsed_s / ROUND_TRIPS * 1e3, 'ms'
+    output.write('  %-30s %8.2f %s\n' % (name, value, unit))
+
+
+class ProtocolBenchmarkTest(unittest.TestCase):
+
+  def _check(self, benchmark, *args, **kwargs):
+    _, expected, actual = benchmark(*args, **kwargs)
+    self.assertEqual(expected, actual)
+
+  def test_adb_push(self):
+    self._check(adb_push)
+
+  def test_adb_push_without_delayed_ack(self):
+    self._check(adb_push, delayed_ack=False)
+
+  def test_adb_pull(self):
+    self._check(adb_pull)
+
+  def test_adb_shell_command(self):
+    self._check(adb_shell_command)
+
+  def test_adb_sync_message(self):
+    self._check(adb_sync_message)
+
+  def test_fastboot_flash(self):
+    self._check(fastboot_flash)
+
+  def test_fastboot_command(self):
+    self._check(fastboot_command)
+
+
+if __name__ == '__main__':
+  run_benchmarks()
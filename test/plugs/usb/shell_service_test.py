@@ -0,0 +1,132 @@
+# Copyright 2026 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import struct
+import threading
+import unittest
+
+try:
+  # pylint: disable=g-import-not-at-top
+  from openhtf.plugs.usb import adb_message
+  from openhtf.plugs.usb import adb_protocol
+  from openhtf.plugs.usb import shell_service
+  from openhtf.plugs.usb import usb_exceptions
+  from openhtf.plugs.usb import usb_handle_stub
+  # pylint: enable=g-import-not-at-top
+except (ImportError, OSError):
+  # The USB plugs need the usb_plugs extra and the libusb library.
+  raise unittest.SkipTest('USB plugs are not available.')
+
+
+class _ShellDevice(usb_handle_stub.StubUsbHandle):
+  """Stub device running shell commands with canned output.
+
+  Commands in outputs reply with their output and exit, 'cat' echoes its input
+  back and exits, and other commands never output anything.  Services other than
+  shell: are refused.
+  """
+
+  def __init__(self, outputs):
+    super(_ShellDevice, self).__init__(ignore_writes=True)
+    self._outputs = outputs
+    self._header = None
+
+  def _send(self, command, local_id, data=b''):
+    message = adb_message.AdbMessage(command, local_id + 100, local_id, data)
+    with self._read_data_added:
+      self.expected_read_data.append(message.header)
+      if data:
+        self.expected_read_data.append(message.data)
+      self._read_data_added.notify_all()
+
+  def write(self, data, dummy=None):
+    # Messages are written as a header followed by (possibly empty) data.
+    if self._header is None:
+      self._header = adb_message.RawAdbMessage(
+          *struct.unpack(adb_message.AdbMessage.HEADER_STRUCT_FORMAT, data))
+      return
+    header, self._header = self._header, None
+    command = adb_message.AdbMessage.WIRE_TO_CMD[header.cmd]
+    local_id = header.arg0
+    if command == 'OPEN':
+      service, _, shell_command = bytes(data).rstrip(b'\0').decode().partition(
+          ':')
+      if service != 'shell':
+        self._send('CLSE', local_id)
+        return
+      self._send('OKAY', local_id)
+      if shell_command in self._outputs:
+        for chunk in self._outputs[shell_command]:
+          self._send('WRTE', local_id, chunk)
+        self._send('CLSE', local_id)
+    elif command == 'WRTE':
+      self._send('OKAY', local_id)
+      self._send('WRTE', local_id, bytes(data))
+      self._send('CLSE', local_id)
+
+
+class AsyncioShellServiceTest(unittest.TestCase):
+
+  def setUp(self):
+    super(AsyncioShellServiceTest, self).setUp()
+    self.outputs = {
+        'getprop %d' % idx: [b'prop', b'erty %d' % idx] for idx in range(50)
+    }
+    self.connection = adb_protocol.AdbConnection(
+        adb_message.AdbTransportAdapter(_ShellDevice(self.outputs)),
+        adb_protocol.MAX_ADB_DATA_V1, 'device::stub')
+    self.addCleanup(self.connection.close)
+    self.shell = shell_service.AsyncioShellService(self.connection)
+
+  def test_run_concurrently(self):
+    threads = threading.active_count()
+
+    async def run_all():
+      return await asyncio.gather(
+          *[self.shell.run(command, timeout_ms=5000)
+            for command in self.outputs])
+
+    self.assertEqual([b'property %d' % idx for idx in range(50)],
+                     asyncio.run(run_all()))
+    # Only the connection's reader and writer threads were started.
+    self.assertLessEqual(threading.active_count(), threads + 2)
+
+  def test_stream(self):
+
+    async def stream():
+      return [data async for data in self.shell.stream('getprop 1')]
+
+    # Data is yielded as received, chunks read at once are yielded together.
+    self.assertEqual(b'property 1', b''.join(asyncio.run(stream())))
+
+  def test_run_with_stdin(self):
+    self.assertEqual(
+        b'input', asyncio.run(self.shell.run('cat', stdin=b'input',
+                                             timeout_ms=5000)))
+
+  def test_run_timeout(self):
+    with self.assertRaises(usb_exceptions.AdbTimeoutError):
+      asyncio.run(self.shell.run('sleep 10', timeout_ms=100))
+
+  def test_unavailable_service(self):
+
+    async def open_stream():
+      return await self.connection.open_async_stream('bad:', timeout_ms=5000)
+
+    self.assertIsNone(asyncio.run(open_stream()))
+
+
+if __name__ == '__main__':
+  unittest.main()
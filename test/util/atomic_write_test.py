@@ -0,0 +1,124 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from openhtf.util import atomic_write
+
+
+class AtomicWriteTest(unittest.TestCase):
+
+  def setUp(self):
+    super(AtomicWriteTest, self).setUp()
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'output.txt')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    super(AtomicWriteTest, self).tearDown()
+
+  def _read(self):
+    with open(self.filename, 'rb') as f:
+      return f.read()
+
+  def test_atomic_write(self):
+    with atomic_write.atomic_write(self.filename, filesync=True) as f:
+      f.write('text ')
+      f.write(b'bytes')
+      # The temporary file lives next to the destination.
+      self.assertEqual(self.directory, os.path.dirname(f.temp_name))
+      self.assertFalse(os.path.exists(self.filename))
+    self.assertEqual(b'text bytes', self._read())
+    self.assertEqual(['output.txt'], os.listdir(self.directory))
+
+  def test_exception_leaves_destination_untouched(self):
+    with open(self.filename, 'wb') as f:
+      f.write(b'previous')
+    with self.assertRaises(RuntimeError):
+      with atomic_write.atomic_write(self.filename) as f:
+        f.write(b'partial')
+        raise RuntimeError()
+    self.assertEqual(b'previous', self._read())
+    self.assertEqual(['output.txt'], os.listdir(self.directory))
+
+  def test_buffered_writes(self):
+    chunks = [bytes([idx % 256]) * 100 for idx in range(2000)]
+    with mock.patch.object(
+        atomic_write, '_IOV_MAX', 7), atomic_write.AtomicFileWriter(
+            self.filename, fsync=False, buffer_size=1000) as f:
+      f.writelines(chunks)
+    self.assertEqual(b''.join(chunks), self._read())
+
+  def test_partial_writev(self):
+    real_writev = os.writev
+
+    def short_writev(fd, buffers):
+      # Write at most 3 bytes per call.
+      return real_writev(fd, [bytes(buffers[0][:3])])
+
+    with mock.patch.object(os, 'writev', short_writev):
+      with atomic_write.AtomicFileWriter(self.filename, fsync=False) as f:
+        f.write(b'abcdefgh')
+        f.write(b'')
+        f.write(b'ijk')
+    self.assertEqual(b'abcdefghijk', self._read())
+
+  def test_fsync_batch(self):
+    batch = atomic_write.FsyncBatch(max_pending=3, max_delay_s=60)
+    with mock.patch.object(
+        os, 'fsync', wraps=os.fsync) as fsync, mock.patch.object(
+            atomic_write, '_fsync_directory') as fsync_directory:
+      for idx in range(2):
+        with atomic_write.AtomicFileWriter(
+            os.path.join(self.directory, str(idx)), fsync_batch=batch) as f:
+          f.write(b'data')
+      # The data of every file is synced, the directory isn't yet.
+      self.assertEqual(2, fsync.call_count)
+      fsync_directory.assert_not_called()
+      with atomic_write.AtomicFileWriter(
+          os.path.join(self.directory, '2'), fsync_batch=batch) as f:
+        f.write(b'data')
+      # The shared directory is synced once for the three files.
+      self.assertEqual(3, fsync.call_count)
+      fsync_directory.assert_called_once_with(self.directory)
+      batch.sync()
+      fsync_directory.assert_called_once_with(self.directory)
+
+  def test_data_synced_before_rename(self):
+    calls = []
+    real_fsync = os.fsync
+    real_replace = os.replace
+
+    def fsync(fd):
+      calls.append('fsync')
+      real_fsync(fd)
+
+    def replace(src, dst):
+      calls.append('replace')
+      real_replace(src, dst)
+
+    batch = atomic_write.FsyncBatch(max_pending=10, max_delay_s=60)
+    with mock.patch.object(os, 'fsync', fsync), mock.patch.object(
+        os, 'replace', replace):
+      with atomic_write.AtomicFileWriter(self.filename, fsync_batch=batch) as f:
+        f.write(b'data')
+    self.assertEqual(['fsync', 'replace'], calls)
+    self.assertEqual(b'data', self._read())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -13,6 +13,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import logging
+import os
+import pickle
+import queue
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 from unittest import mock
 
@@ -34,3 +42,198 @@ class TestLogs(unittest.TestCase):
       logs.log_once(mock_log, u'状态是', 'arg1')
 
     assert mock_log.call_count == 1
+
+  def test_log_record_store(self):
+    store = logs.LogRecordStore(max_records=3)
+    for idx in range(5):
+      store.append(
+          logs.LogRecord(10, 'openhtf.%s' % 'logger', 'source.py', idx, idx,
+                         'message %d' % idx))
+      if idx == 1:
+        self.assertEqual([0, 1],
+                         [record['lineno'] for record in store.as_base_types()])
+
+    self.assertEqual(2, store.dropped_count)
+    self.assertEqual([2, 3, 4], [record.lineno for record in store])
+    self.assertEqual([2, 3, 4],
+                     [record['lineno'] for record in store.as_base_types()])
+    self.assertEqual('message 4', store[-1].message)
+    self.assertIs(store[0].logger_name, store[1].logger_name)
+    self.assertEqual(logs.LogRecordStore(list(store)), store)
+
+  def test_record_handler_coalesces_notifications(self):
+    test_record = mock.Mock()
+    notify_update = mock.Mock()
+    handler = logs.RecordHandler(
+        'uid', test_record, notify_update, notify_interval_s=60)
+    logger = logs.get_record_logger_for('uid')
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    self.addCleanup(logger.removeHandler, handler)
+
+    for idx in range(10):
+      logger.info('Line %d', idx)
+    self.assertEqual(10, test_record.add_log_record.call_count)
+    self.assertEqual(1, notify_update.call_count)
+
+    # Closing the handler sends the pending notification.
+    handler.close()
+    self.assertEqual(2, notify_update.call_count)
+
+  def test_record_handler_notifies_after_interval(self):
+    notify_update = mock.Mock()
+    handler = logs.RecordHandler(
+        'uid', mock.Mock(), notify_update, notify_interval_s=0.2)
+    logger = logs.get_record_logger_for('uid')
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    self.addCleanup(logger.removeHandler, handler)
+
+    logger.info('First line')
+    logger.info('Second line')
+    logger.info('Third line')
+    self.assertEqual(1, notify_update.call_count)
+    notify_thread = handler._notify_thread
+    time.sleep(0.3)
+    self.assertEqual(2, notify_update.call_count)
+
+    # The same thread sends the notifications of later intervals.
+    logger.info('Fourth line')
+    logger.info('Fifth line')
+    self.assertIs(notify_thread, handler._notify_thread)
+    handler.close()
+    self.assertEqual(3, notify_update.call_count)
+    notify_thread.join(1)
+    self.assertFalse(notify_thread.is_alive())
+
+  def test_log_record_store_recent_records(self):
+    store = logs.LogRecordStore(max_records=100, recent_records=10)
+    records = [
+        logs.LogRecord(10, 'logger', 'source.py', idx, idx, 'message %d' % idx)
+        for idx in range(200)
+    ]
+    store.extend(records)
+
+    self.assertEqual(100, store.dropped_count)
+    self.assertEqual(records[100:], list(store))
+    self.assertEqual([record._asdict() for record in records[190:]],
+                     store.recent_as_base_types())
+    self.assertEqual([record._asdict() for record in records[100:]],
+                     store.as_base_types())
+    self.assertEqual(10, pickle.loads(pickle.dumps(store)).recent_records)
+
+  def test_spilling_log_record_store(self):
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    store = logs.SpillingLogRecordStore(memory_records=10, directory=directory)
+    records = [
+        logs.LogRecord(10, 'logger', 'source.py', idx, idx, 'message %d' % idx)
+        for idx in range(1000)
+    ]
+    store.extend(records)
+
+    self.assertEqual(1000, len(store))
+    self.assertEqual(990, store.spilled_count)
+    self.assertEqual(records, list(store))
+    self.assertEqual(records[300:310], store.page(300, 10))
+    self.assertEqual(records[985:995], store.page(985, 10))
+    self.assertEqual(records[995:], store.page(995))
+    self.assertEqual(records[-1], store[-1])
+    self.assertEqual(records[257], store[257])
+    # Live views only see the records kept in memory.
+    self.assertEqual([record._asdict() for record in records[990:]],
+                     store.recent_as_base_types())
+    self.assertEqual([record._asdict() for record in records],
+                     store.as_base_types())
+    self.assertEqual(store, pickle.loads(pickle.dumps(store)))
+
+    store.close()
+    self.assertEqual([], os.listdir(directory))
+
+  def test_cli_formatter_terse_names(self):
+    formatter = logs.CliFormatter()
+    for logger_name, terse_name in (
+        ('openhtf.core.test_executor', 'test_executor'),
+        ('openhtf.test_record.abcdefgh', '<test defgh>'),
+        ('openhtf.test_record.abcdefgh.phase.my_phase', '<phase: my_phase>'),
+        ('openhtf.test_record.abcdefgh.plug.MyPlug', '<plug: MyPlug>'),
+    ):
+      record = logging.makeLogRecord({
+          'name': logger_name,
+          'levelname': 'INFO',
+          'msg': 'Hello %s',
+          'args': ('world',),
+      })
+      self.assertTrue(
+          formatter.format(record).endswith(' %s - Hello world' % terse_name))
+
+  def test_cli_queue_handler_drops_when_full(self):
+    record_queue = queue.Queue(maxsize=2)
+    handler = logs.CliQueueHandler(record_queue)
+    logger = logging.getLogger('openhtf.test.cli_queue')
+    logger.propagate = False
+    logger.addHandler(handler)
+    self.addCleanup(logger.removeHandler, handler)
+
+    for idx in range(5):
+      logger.warning('Line %d', idx)
+    self.assertEqual(3, handler.dropped_count)
+    self.assertEqual(['Line 0', 'Line 1'],
+                     [record_queue.get_nowait().msg for _ in range(2)])
+
+    # Once there is room, the number of dropped records is reported first.
+    logger.warning('Line 5')
+    self.assertEqual('Dropped 3 log records printed to the CLI.',
+                     record_queue.get_nowait().msg)
+    self.assertEqual('Line 5', record_queue.get_nowait().msg)
+
+  def test_cli_queue_listener_stop_with_full_queue(self):
+    record_queue = queue.Queue(maxsize=1)
+    unblock = threading.Event()
+    self.addCleanup(unblock.set)
+    cli_handler = logging.Handler()
+    cli_handler.emit = lambda record: unblock.wait()
+    listener = logs.CliQueueListener(record_queue, cli_handler)
+    listener.stop_timeout_s = 0.1
+    listener.start()
+    # The first record blocks the terminal, the second one fills the queue.
+    record_queue.put(logging.makeLogRecord({'msg': 'first'}))
+    record_queue.put(logging.makeLogRecord({'msg': 'second'}), timeout=5)
+
+    start_time = time.monotonic()
+    listener.stop()
+    self.assertLess(time.monotonic() - start_time, 5)
+
+  def test_flush_cli_logs_waits_for_earlier_records_only(self):
+    record_queue = queue.Queue()
+    printed = []
+    cli_handler = logging.Handler()
+    cli_handler.emit = lambda record: printed.append(record.msg)
+    listener = logs.CliQueueListener(record_queue, cli_handler)
+    listener.start()
+    self.addCleanup(listener.stop)
+    patcher = mock.patch.object(logs, '_cli_queue', record_queue)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    def make_record(msg):
+      return logging.makeLogRecord({'msg': msg, 'levelno': logging.INFO})
+
+    record_queue.put(make_record('before'))
+    logs.flush_cli_logs()
+    self.assertEqual(['before'], printed)
+
+    # Records that other threads keep logging don't delay the flush.
+    stop_flooding = threading.Event()
+
+    def flood():
+      while not stop_flooding.is_set():
+        record_queue.put(make_record('flood'))
+
+    flood_thread = threading.Thread(target=flood)
+    flood_thread.start()
+    self.addCleanup(flood_thread.join)
+    self.addCleanup(stop_flooding.set)
+    start_time = time.monotonic()
+    logs.flush_cli_logs(timeout_s=5)
+    self.assertLess(time.monotonic() - start_time, 5)
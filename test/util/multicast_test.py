@@ -80,3 +80,23 @@ class MulticastTest(unittest.TestCase):
         ],
         any_order=True,
     )
+
+  def test_multicast_sender_reuses_socket(self):
+    with mock.patch.object(
+        socket, socket.socket.__name__, autospec=True, spec_set=True
+    ) as mock_sock:
+      mock_sock_instance = mock_sock.return_value
+      sender = multicast.MulticastSender(port=1234, local_only=True)
+      self.assertTrue(sender.send('first'))
+      mock_sock_instance.sendto.side_effect = OSError(errno.ENETUNREACH,
+                                                      'Network unreachable')
+      self.assertFalse(sender.send('second'))
+      sender.close()
+    mock_sock.assert_called_once()
+    mock_sock_instance.sendto.assert_has_calls([
+        mock.call(b'first', (multicast.DEFAULT_ADDRESS, 1234)),
+        mock.call(b'second', (multicast.DEFAULT_ADDRESS, 1234)),
+    ])
+    mock_sock_instance.setsockopt.assert_any_call(
+        socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+        struct.pack('!L', multicast.LOCALHOST_ADDRESS))